@@ -0,0 +1,339 @@
+"""
+Streaming per-device alert state shared by HTTP and MQTT ingest.
+
+Every sample of both ingest paths goes through `AlertStateStore.evaluate`
+in the writer thread, in arrival order per device:
+
+- baseline: `alerts.evaluate_alert` (in-memory window of baseline.py)
+- delta: compared with the last sample kept in memory, instead of
+  `get_previous_measurement` (one query per sample)
+- test ranges: `evaluate_test_ranges` with the hysteresis state kept in
+  memory (NORMAL / HIGH)
+
+so all three rules are O(1) per sample. Rows of HTTP ingest are scored with
+the result; rows that arrive already scored by the gateway (MQTT, binary
+frames) keep their values and are raised to the server's verdict when it is
+worse (ALERT_EVALUATE_GATEWAY).
+
+Dirty states are written to `alert_state` every ALERT_STATE_PERSIST_S
+seconds and at shutdown (together with the anomaly detector's, anomaly.py). At startup the snapshot is loaded and refreshed
+from the latest-measurement store, so rows committed after the last
+snapshot still count as the previous sample.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import SessionLocal
+from .models import AlertState
+from .alerts import AlertResult, DELTA_COLUMNS, delta_triggered, evaluate_alert, evaluate_test_ranges
+from .episodes import STATUS_RANK
+from .latest_cache import latest_store
+from .anomaly import anomaly_detector
+
+logger = logging.getLogger(__name__)
+
+# alert = False olan durumlar (production: OK, test modu / gateway: NORMAL)
+QUIET_STATUSES = ("OK", "NORMAL")
+
+
+def _naive(ts: datetime) -> datetime:
+    return ts.replace(tzinfo=None)
+
+
+def is_alert(status: Optional[str]) -> bool:
+    return status not in QUIET_STATUSES
+
+
+class DeviceAlertState:
+    """Last sample and rule state of one device"""
+
+    __slots__ = ("ts", "values", "status", "test_status", "delta_alert", "dirty")
+
+    def __init__(self):
+        self.ts: Optional[datetime] = None            # naive UTC
+        self.values: tuple = (None,) * len(DELTA_COLUMNS)
+        self.status: Optional[str] = None
+        self.test_status = "NORMAL"
+        self.delta_alert = False
+        self.dirty = False
+
+    def copy(self) -> "DeviceAlertState":
+        st = DeviceAlertState()
+        st.ts, st.values, st.status = self.ts, self.values, self.status
+        st.test_status, st.delta_alert, st.dirty = self.test_status, self.delta_alert, self.dirty
+        return st
+
+    def as_dict(self) -> dict:
+        return {
+            "ts": self.ts,
+            **dict(zip(DELTA_COLUMNS, self.values)),
+            "status": self.status,
+            "test_status": self.test_status,
+            "delta_alert": self.delta_alert,
+        }
+
+
+class AlertStateStore:
+    """device_id -> DeviceAlertState"""
+
+    def __init__(self):
+        self.loaded = False
+        self._states: dict[str, DeviceAlertState] = {}
+        self._lock = threading.Lock()
+
+        # metrics
+        self.evaluated = 0
+        self.late = 0
+        self.persisted = 0
+        self.last_persist_ms = 0.0
+
+    # ==================== LOAD / PERSIST ====================
+
+    def load(self, db: Session):
+        """Persisted snapshot, refreshed with rows committed after it (latest store)"""
+        states = self._read(db)
+        with self._lock:
+            self._states = states
+            self.loaded = True
+
+    def reload(self, db: Session, device_ids):
+        """Same as `load`, for these devices only (e.g. after their rows were re-scored)"""
+        if not self.loaded:
+            return      # ilk kullanımda zaten hepsi yüklenir
+        states = self._read(db, set(device_ids))
+        with self._lock:
+            for device_id in device_ids:
+                st = states.get(device_id)
+                if st is None:
+                    self._states.pop(device_id, None)
+                else:
+                    self._states[device_id] = st
+
+    def _read(self, db: Session, device_ids: Optional[set[str]] = None) -> dict[str, DeviceAlertState]:
+        if not latest_store.loaded:
+            latest_store.backfill(db)
+
+        stmt = select(AlertState)
+        if device_ids is not None:
+            stmt = stmt.where(AlertState.device_id.in_(device_ids))
+        states: dict[str, DeviceAlertState] = {}
+        for r in db.execute(stmt).scalars():
+            st = states[r.device_id] = DeviceAlertState()
+            st.ts = _naive(r.ts)
+            st.values = tuple(getattr(r, c) for c in DELTA_COLUMNS)
+            st.status = r.status
+            st.test_status = r.test_status or "NORMAL"
+            st.delta_alert = bool(r.delta_alert)
+
+        if device_ids is None:
+            latest = latest_store.snapshot()
+        else:
+            latest = {d: row for d in device_ids if (row := latest_store.get_row(d)) is not None}
+        for device_id, row in latest.items():
+            st = states.get(device_id)
+            if st is not None and st.ts is not None and st.ts >= row["ts"]:
+                continue
+            if st is None:
+                # Snapshot'ta yok: hysteresis durumu son satırın durumundan
+                st = states[device_id] = DeviceAlertState()
+                st.test_status = "HIGH" if row.get("status") == "HIGH" else "NORMAL"
+            st.ts = row["ts"]
+            st.values = tuple(row.get(c) for c in DELTA_COLUMNS)
+            st.status = row.get("status")
+            st.dirty = True
+        return states
+
+    def invalidate(self):
+        """Drop all state (e.g. after a failed commit); next use reloads"""
+        with self._lock:
+            self._states = {}
+            self.loaded = False
+
+    def snapshot(self, device_ids) -> tuple:
+        """Copies of these devices' states, for `restore` after a failed commit"""
+        with self._lock:
+            return self.loaded, {d: (st.copy() if (st := self._states.get(d)) else None) for d in device_ids}
+
+    def restore(self, snapshot: tuple):
+        """Put back the states of a snapshot (other devices are untouched)"""
+        loaded, states = snapshot
+        if not loaded:
+            self.invalidate()
+            return
+        with self._lock:
+            for device_id, st in states.items():
+                if st is None:
+                    self._states.pop(device_id, None)
+                else:
+                    self._states[device_id] = st
+
+    def persist(self, db: Session) -> int:
+        """Upsert states changed since the last call (one executemany). Returns rows written."""
+        started = time.perf_counter()
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            dirty = [(device_id, st) for device_id, st in self._states.items() if st.dirty]
+            rows = [
+                {
+                    "device_id": device_id,
+                    "ts": st.ts,
+                    **dict(zip(DELTA_COLUMNS, st.values)),
+                    "status": st.status,
+                    "test_status": st.test_status,
+                    "delta_alert": st.delta_alert,
+                    "updated_at": now,
+                }
+                for device_id, st in dirty
+            ]
+            for _, st in dirty:
+                st.dirty = False
+        if not rows:
+            return 0
+
+        stmt = sqlite_insert(AlertState)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["device_id"],
+            set_={c: stmt.excluded[c] for c in rows[0] if c != "device_id"},
+        )
+        try:
+            db.execute(stmt, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                for _, st in dirty:
+                    st.dirty = True
+            raise
+
+        with self._lock:
+            self.persisted += len(rows)
+            self.last_persist_ms = (time.perf_counter() - started) * 1000.0
+        return len(rows)
+
+    # ==================== EVALUATION ====================
+
+    def evaluate(
+        self,
+        db: Session,
+        device_id: str,
+        ts: datetime,
+        tvoc_ppb: Optional[float],
+        eco2_ppm: Optional[float],
+        temp_c: Optional[float] = None,
+        hum_rh: Optional[float] = None,
+        pressure_hpa: Optional[float] = None,
+    ) -> AlertResult:
+        """
+        Baseline + delta + test-range rules for one sample, then advance the
+        device's state. With ALERT_TEST_MODE the test-range status is the
+        result's status, otherwise the baseline status (OK / WARN / HIGH).
+        """
+        if not self.loaded:
+            self.load(db)
+
+        result = evaluate_alert(db, device_id, ts, tvoc_ppb, eco2_ppm)
+        values = (eco2_ppm, tvoc_ppb, temp_c, hum_rh, pressure_hpa)
+        key = _naive(ts)
+
+        with self._lock:
+            self.evaluated += 1
+            st = self._states.get(device_id)
+            if st is None:
+                st = self._states[device_id] = DeviceAlertState()
+
+            delta = st.ts is not None and delta_triggered(values, st.values)
+            test_status, violations = st.test_status, []
+            if delta or (eco2_ppm is not None and tvoc_ppb is not None):
+                test = evaluate_test_ranges(eco2_ppm, tvoc_ppb, st.test_status, delta)
+                test_status, violations = test.status, test.violations
+
+            if settings.ALERT_TEST_MODE:
+                result.status = test_status
+
+            if st.ts is not None and key < st.ts:
+                # Geç gelen örnek: değerlendirilir ama durum ilerlemez
+                self.late += 1
+            else:
+                st.ts = key
+                st.values = values
+                st.status = result.status
+                st.test_status = test_status
+                st.delta_alert = delta
+                st.dirty = True
+
+        result.delta_alert = delta
+        result.test_status = test_status
+        result.violations = violations
+        return result
+
+    def apply_gateway_rows(self, db: Session, rows: list[dict]):
+        """
+        Evaluate rows that were scored by the gateway (MQTT / binary frames),
+        in order. The gateway's status and alert are kept unless the server's
+        verdict is worse; a missing aq_score is filled in.
+        """
+        for row in rows:
+            result = self.evaluate(
+                db, row["device_id"], row["ts"], row.get("tvoc_ppb"), row.get("eco2_ppm"),
+                row.get("temp_c"), row.get("hum_rh"), row.get("pressure_hpa"),
+            )
+            if not settings.ALERT_EVALUATE_GATEWAY:
+                continue
+            if STATUS_RANK.get(result.status, 0) > STATUS_RANK.get(row.get("status") or "", 0):
+                row["status"] = result.status
+            row["alert"] = bool(row.get("alert")) or is_alert(result.status)
+            if row.get("aq_score") is None:
+                row["aq_score"] = round(result.score)
+
+    # ==================== METRICS ====================
+
+    def get(self, device_id: str) -> Optional[dict]:
+        with self._lock:
+            st = self._states.get(device_id)
+            return st.as_dict() if st is not None else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "devices": len(self._states),
+                "dirty": sum(1 for st in self._states.values() if st.dirty),
+                "evaluated": self.evaluated,
+                "late": self.late,
+                "persisted": self.persisted,
+                "last_persist_ms": round(self.last_persist_ms, 3),
+                "test_mode": settings.ALERT_TEST_MODE,
+            }
+
+
+# Global store (loaded in main.py lifespan, or lazily by the ingest writer)
+alert_states = AlertStateStore()
+
+
+def persist_states():
+    """Alert states + anomaly detector states"""
+    db = SessionLocal()
+    try:
+        return alert_states.persist(db) + anomaly_detector.persist(db)
+    finally:
+        db.close()
+
+
+async def persist_loop():
+    """Background task: snapshot dirty states every ALERT_STATE_PERSIST_S"""
+    while True:
+        await asyncio.sleep(settings.ALERT_STATE_PERSIST_S)
+        try:
+            await asyncio.to_thread(persist_states)
+        except Exception as e:
+            logger.error(f"❌ Alert state persist failed: {e}")
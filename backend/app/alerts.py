@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
 from typing import Optional, List
 
@@ -9,6 +9,8 @@ from sqlalchemy import select
 
 from .models import Measurement
 from .config import settings
+from .baseline import baseline_store
+from . import partitions
 
 
 # =========================================================
@@ -21,6 +23,9 @@ class AlertResult:
     status: str                     # OK / WARN / HIGH
     tvoc_increase_pct: Optional[float]
     eco2_increase_pct: Optional[float]
+    delta_alert: bool = False       # ani değişim (streaming state ile)
+    test_status: Optional[str] = None   # NORMAL / HIGH (test aralıkları, hysteresis)
+    violations: List[str] = field(default_factory=list)
 
 
 @dataclass
@@ -41,15 +46,19 @@ def get_previous_measurement(
     """
     Son ölçümü döndür (delta hesabı için).
     """
-    stmt = (
-        select(Measurement)
-        .where(Measurement.device_id == device_id)
-        .where(Measurement.ts < before_ts)
-        .order_by(Measurement.ts.desc())
-        .limit(1)
-    )
-    result = db.execute(stmt).scalar_one_or_none()
-    return result
+    # En yeni partition'dan geriye: genelde ilk tabloda bulunur
+    for M in partitions.entities_newest_first(db, before_ts):
+        stmt = (
+            select(M)
+            .where(M.device_id == device_id)
+            .where(M.ts < before_ts)
+            .order_by(M.ts.desc())
+            .limit(1)
+        )
+        result = db.execute(stmt).scalar_one_or_none()
+        if result is not None:
+            return result
+    return None
 
 
 def check_delta_change(
@@ -65,6 +74,31 @@ def check_delta_change(
     return abs(current - previous) >= threshold
 
 
+# Delta kontrolü yapılan kolonlar (eşikler settings'ten, aynı sırayla)
+DELTA_COLUMNS = ("eco2_ppm", "tvoc_ppb", "temp_c", "hum_rh", "pressure_hpa")
+
+
+def _delta_thresholds() -> tuple[float, ...]:
+    return (
+        settings.ECO2_DELTA_PPM,
+        settings.TVOC_DELTA_PPB,
+        settings.TEMP_DELTA_C,
+        settings.HUM_DELTA_RH,
+        settings.PRESS_DELTA_HPA,
+    )
+
+
+def delta_triggered(current: tuple, previous: tuple) -> bool:
+    """
+    Values in DELTA_COLUMNS order vs the previous sample's values.
+    True if any sensor changed by at least its threshold.
+    """
+    for cur, prev, threshold in zip(current, previous, _delta_thresholds()):
+        if check_delta_change(cur, prev, threshold):
+            return True
+    return False
+
+
 def evaluate_delta_alert(
     db: Session,
     device_id: str,
@@ -78,28 +112,17 @@ def evaluate_delta_alert(
     """
     Herhangi bir sensörde ani değişim var mı?
     Returns: True if delta alert triggered
+
+    One query per call; ingest uses the in-memory state in alert_state.py.
     """
     prev = get_previous_measurement(db, device_id, ts)
     if prev is None:
         return False  # İlk ölçüm, karşılaştırma yok
 
-    # Her sensör için delta kontrolü
-    if check_delta_change(eco2_ppm, prev.eco2_ppm, settings.ECO2_DELTA_PPM):
-        return True
-
-    if check_delta_change(tvoc_ppb, prev.tvoc_ppb, settings.TVOC_DELTA_PPB):
-        return True
-
-    if check_delta_change(temp_c, prev.temp_c, settings.TEMP_DELTA_C):
-        return True
-
-    if check_delta_change(humidity_rh, prev.humidity_rh, settings.HUM_DELTA_RH):
-        return True
-
-    if check_delta_change(pressure_hpa, prev.pressure_hpa, settings.PRESS_DELTA_HPA):
-        return True
-
-    return False
+    return delta_triggered(
+        (eco2_ppm, tvoc_ppb, temp_c, humidity_rh, pressure_hpa),
+        tuple(getattr(prev, c) for c in DELTA_COLUMNS),
+    )
 
 
 # =========================================================
@@ -129,11 +152,12 @@ def compute_baseline(
     """
     start = now_ts - timedelta(seconds=window_seconds)
 
+    M = partitions.entity(db, start, now_ts, device_id)
     stmt = (
-        select(Measurement)
-        .where(Measurement.device_id == device_id)
-        .where(Measurement.ts >= start)
-        .where(Measurement.ts <= now_ts)
+        select(M)
+        .where(M.device_id == device_id)
+        .where(M.ts >= start)
+        .where(M.ts <= now_ts)
     )
 
     rows = db.execute(stmt).scalars().all()
@@ -196,13 +220,21 @@ def evaluate_alert(
     """
     PRODUCTION MODE:
     Baseline + percentage increase based alerting.
+
+    The baseline comes from the in-memory streaming window (O(1)); the SQL
+    path is only used when the window no longer holds the needed samples.
+    The sample is then added to the window, so callers must persist it.
     """
     if ts.tzinfo is None:
         ts = ts.replace(tzinfo=timezone.utc)
 
-    tvoc_base, eco2_base = compute_baseline(
-        db, device_id, ts, settings.BASELINE_SECONDS
-    )
+    if not baseline_store.hydrated:
+        baseline_store.hydrate(db)
+
+    baseline = baseline_store.baseline(device_id, ts)
+    if baseline is None:
+        baseline = compute_baseline(db, device_id, ts, settings.BASELINE_SECONDS)
+    tvoc_base, eco2_base = baseline
 
     tvoc_pct = _pct_increase(tvoc_ppb, tvoc_base)
     eco2_pct = _pct_increase(eco2_ppm, eco2_base)
@@ -210,6 +242,8 @@ def evaluate_alert(
     status = decide_status(tvoc_pct, eco2_pct)
     score = compute_score(tvoc_pct, eco2_pct)
 
+    baseline_store.observe(device_id, ts, tvoc_ppb, eco2_ppm)
+
     return AlertResult(
         score=score,
         status=status,
@@ -218,6 +252,22 @@ def evaluate_alert(
     )
 
 
+def evaluate_alert_batch(
+    db: Session,
+    items: List[tuple[str, datetime, Optional[float], Optional[float]]]
+) -> List[AlertResult]:
+    """
+    BATCH MODE:
+    Same rules as `evaluate_alert` for many (device_id, ts, tvoc, eco2)
+    samples. Earlier samples of the batch count towards later ones, exactly
+    as if they had been ingested one by one.
+    """
+    return [
+        evaluate_alert(db, device_id, ts, tvoc_ppb, eco2_ppm)
+        for device_id, ts, tvoc_ppb, eco2_ppm in items
+    ]
+
+
 # =========================================================
 # TEST MODE – DAR ARALIK, HYSTERESIS'Lİ HIGH / NORMAL
 # =========================================================
@@ -0,0 +1,412 @@
+"""
+Server-side streaming anomaly detection for eco2_ppm / tvoc_ppb.
+
+Gateways fill `anom_eco2` / `anom_tvoc` from the node's TinyML model; HTTP
+rows never had them. Every ingested sample now also goes through an EWMA
+of the mean and variance per device and metric (half-life ANOMALY_HALFLIFE
+samples, a = 1 - 0.5 ** (1 / half-life)):
+
+    d = x - mean;  mean += a * d;  var = (1 - a) * (var + a * d^2)
+
+A sample is anomalous when |d| > ANOMALY_Z * max(std, ANOMALY_MIN_STD_*),
+measured against the state before the sample, once the device has
+ANOMALY_WARMUP earlier samples of that metric. That is O(1) time and three
+numbers per device and metric. A NULL value leaves its flag NULL and does
+not move the state; late samples are scored but do not move it either.
+
+HTTP rows store the server's flags. Gateway rows keep theirs, OR'ed with the
+server's (ANOMALY_EVALUATE_GATEWAY).
+
+Both recursions are linear in the state, so `backfill_device` computes the
+same flags for stored history with NumPy (a blocked scan of
+y_t = b * y_{t-1} + u_t) and rewrites the rows whose flags changed.
+
+Dirty states are written to `anomaly_state` together with the alert state
+snapshots (ALERT_STATE_PERSIST_S) and loaded at startup; samples committed
+after the last snapshot are not replayed.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import AnomalyState
+from .latest_cache import latest_store
+from .versions import data_versions
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_METRICS = ("eco2_ppm", "tvoc_ppb")
+ANOM_COLUMNS = ("anom_eco2", "anom_tvoc")      # ANOMALY_METRICS sırasıyla
+_STATE_PREFIX = ("eco2", "tvoc")               # anomaly_state kolonları
+
+_US = 1_000_000
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _naive(ts: datetime) -> datetime:
+    return ts.replace(tzinfo=None)
+
+
+def _alpha() -> float:
+    return 1.0 - 0.5 ** (1.0 / max(settings.ANOMALY_HALFLIFE, 1))
+
+
+def _min_std() -> tuple[float, float]:
+    return (settings.ANOMALY_MIN_STD_ECO2, settings.ANOMALY_MIN_STD_TVOC)
+
+
+class DeviceAnomalyState:
+    """EWMA mean / variance and sample count per metric of one device"""
+
+    __slots__ = ("ts", "n", "mean", "var", "dirty")
+
+    def __init__(self):
+        self.ts: Optional[datetime] = None            # naive UTC
+        self.n = [0] * len(ANOMALY_METRICS)
+        self.mean = [0.0] * len(ANOMALY_METRICS)
+        self.var = [0.0] * len(ANOMALY_METRICS)
+        self.dirty = False
+
+    def copy(self) -> "DeviceAnomalyState":
+        st = DeviceAnomalyState()
+        st.ts, st.n, st.mean, st.var, st.dirty = self.ts, list(self.n), list(self.mean), list(self.var), self.dirty
+        return st
+
+    def as_row(self) -> dict:
+        row = {"ts": self.ts}
+        for i, p in enumerate(_STATE_PREFIX):
+            row[f"{p}_n"] = self.n[i]
+            row[f"{p}_mean"] = self.mean[i] if self.n[i] else None
+            row[f"{p}_var"] = self.var[i] if self.n[i] else None
+        return row
+
+    def as_dict(self) -> dict:
+        out = {"ts": self.ts}
+        for i, metric in enumerate(ANOMALY_METRICS):
+            out[metric] = {
+                "samples": self.n[i],
+                "mean": round(self.mean[i], 3) if self.n[i] else None,
+                "std": round(math.sqrt(self.var[i]), 3) if self.n[i] else None,
+            }
+        return out
+
+
+def _state_from_row(r) -> DeviceAnomalyState:
+    st = DeviceAnomalyState()
+    st.ts = _naive(r.ts) if r.ts is not None else None
+    for i, p in enumerate(_STATE_PREFIX):
+        st.n[i] = getattr(r, f"{p}_n") or 0
+        st.mean[i] = getattr(r, f"{p}_mean") or 0.0
+        st.var[i] = getattr(r, f"{p}_var") or 0.0
+    return st
+
+
+def _upsert_states(db: Session, rows: list[dict]):
+    stmt = sqlite_insert(AnomalyState)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["device_id"],
+        set_={c: stmt.excluded[c] for c in rows[0] if c != "device_id"},
+    ), rows)
+
+
+# ==================== STREAMING ====================
+
+class AnomalyDetector:
+    """device_id -> DeviceAnomalyState"""
+
+    def __init__(self):
+        self.loaded = False
+        self._states: dict[str, DeviceAnomalyState] = {}
+        self._lock = threading.Lock()
+
+        # metrics
+        self.evaluated = 0
+        self.flagged = 0
+        self.late = 0
+        self.persisted = 0
+
+    def load(self, db: Session):
+        states = {r.device_id: _state_from_row(r) for r in db.execute(select(AnomalyState)).scalars()}
+        with self._lock:
+            self._states = states
+            self.loaded = True
+
+    def invalidate(self):
+        """Drop all state (e.g. after a failed commit); next use reloads the snapshot"""
+        with self._lock:
+            self._states = {}
+            self.loaded = False
+
+    def snapshot(self, device_ids) -> tuple:
+        """Copies of these devices' states, for `restore` after a failed commit"""
+        with self._lock:
+            return self.loaded, {d: (st.copy() if (st := self._states.get(d)) else None) for d in device_ids}
+
+    def restore(self, snapshot: tuple):
+        """Put back the states of a snapshot (other devices are untouched)"""
+        loaded, states = snapshot
+        if not loaded:
+            self.invalidate()
+            return
+        with self._lock:
+            for device_id, st in states.items():
+                if st is None:
+                    self._states.pop(device_id, None)
+                else:
+                    self._states[device_id] = st
+
+    def persist(self, db: Session) -> int:
+        """Upsert states changed since the last call (one executemany). Returns rows written."""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            dirty = [(device_id, st) for device_id, st in self._states.items() if st.dirty]
+            rows = [{"device_id": device_id, **st.as_row(), "updated_at": now} for device_id, st in dirty]
+            for _, st in dirty:
+                st.dirty = False
+        if not rows:
+            return 0
+        try:
+            _upsert_states(db, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                for _, st in dirty:
+                    st.dirty = True
+            raise
+        with self._lock:
+            self.persisted += len(rows)
+        return len(rows)
+
+    def score(self, device_id: str, ts: datetime, *values) -> list[Optional[bool]]:
+        """Flags for one sample (ANOMALY_METRICS order, None = NULL value), then advance the state"""
+        a = _alpha()
+        floors = _min_std()
+        warmup = max(settings.ANOMALY_WARMUP, 1)
+        key = _naive(ts)
+        flags: list[Optional[bool]] = []
+
+        with self._lock:
+            self.evaluated += 1
+            st = self._states.get(device_id)
+            if st is None:
+                st = self._states[device_id] = DeviceAnomalyState()
+            late = st.ts is not None and key < st.ts
+            if late:
+                self.late += 1
+
+            for i, x in enumerate(values):
+                if x is None:
+                    flags.append(None)
+                    continue
+                n, mean, var = st.n[i], st.mean[i], st.var[i]
+                d = x - mean
+                flag = n >= warmup and abs(d) > settings.ANOMALY_Z * max(math.sqrt(var), floors[i])
+                flags.append(flag)
+                self.flagged += flag
+                if late:
+                    continue
+                if n == 0:
+                    st.mean[i], st.var[i] = float(x), 0.0
+                else:
+                    st.mean[i] = mean + a * d
+                    st.var[i] = (1.0 - a) * (var + a * d * d)
+                st.n[i] = n + 1
+
+            if not late:
+                st.ts = key
+                st.dirty = True
+        return flags
+
+    def apply(self, db: Session, rows: list[dict]):
+        """
+        Fill anom_eco2 / anom_tvoc of rows in order (before insert): the
+        server's flags where the row has none, OR'ed into gateway flags.
+        """
+        if not settings.ANOMALY_ENABLED or not rows:
+            return
+        if not self.loaded:
+            self.load(db)
+        for row in rows:
+            flags = self.score(row["device_id"], row["ts"], *(row.get(m) for m in ANOMALY_METRICS))
+            for col, flag in zip(ANOM_COLUMNS, flags):
+                if row.get(col) is None:
+                    row[col] = flag
+                elif flag and settings.ANOMALY_EVALUATE_GATEWAY:
+                    row[col] = True
+
+    def get(self, device_id: str) -> Optional[dict]:
+        with self._lock:
+            st = self._states.get(device_id)
+            return st.as_dict() if st is not None else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": settings.ANOMALY_ENABLED,
+                "devices": len(self._states),
+                "dirty": sum(1 for st in self._states.values() if st.dirty),
+                "evaluated": self.evaluated,
+                "flagged": self.flagged,
+                "late": self.late,
+                "persisted": self.persisted,
+            }
+
+
+# Global detector (loaded in main.py lifespan, or lazily by the ingest writer)
+anomaly_detector = AnomalyDetector()
+
+
+# ==================== BATCH (BACKFILL) ====================
+
+def _linear_scan(u: np.ndarray, b: float, y0: float) -> np.ndarray:
+    """
+    y_t = b * y_{t-1} + u_t for every t: y_t = b^t * (y0 + sum u_k / b^k),
+    in blocks of 8 half-lives so that 1 / b^k stays below 2^8.
+    """
+    out = np.empty(len(u))
+    block = 8 * max(settings.ANOMALY_HALFLIFE, 1)
+    powers = b ** np.arange(1, block + 1)
+    for s in range(0, len(u), block):
+        seg = u[s:s + block]
+        p = powers[:len(seg)]
+        y = p * (y0 + np.cumsum(seg / p))
+        out[s:s + len(seg)] = y
+        y0 = y[-1]
+    return out
+
+
+def scan_metric(x: np.ndarray, state: tuple[int, float, float], floor: float) -> tuple[np.ndarray, tuple]:
+    """
+    Flags (1.0 / 0.0, nan where x is nan) for consecutive samples of one
+    metric, starting from `state` = (n, mean, var); returns the new state.
+    Same recursion as `AnomalyDetector.score`.
+    """
+    n, mean, var = state
+    flags = np.full(len(x), np.nan)
+    present = ~np.isnan(x)
+    v = x[present]
+    if not len(v):
+        return flags, state
+
+    a = _alpha()
+    b = 1.0 - a
+    if n == 0:
+        mean, var = float(v[0]), 0.0
+    m = _linear_scan(a * v, b, mean)
+    d = v - np.concatenate([[mean], m[:-1]])
+    s2 = _linear_scan(b * a * d * d, b, var)
+    var_before = np.concatenate([[var], s2[:-1]])
+
+    seen = n + np.arange(len(v))
+    std = np.maximum(np.sqrt(np.maximum(var_before, 0.0)), floor)
+    flags[present] = (seen >= max(settings.ANOMALY_WARMUP, 1)) & (np.abs(d) > settings.ANOMALY_Z * std)
+    return flags, (n + len(v), float(m[-1]), float(s2[-1]))
+
+
+def _update_flags(db: Session, t, ids, flags: list[np.ndarray], server: np.ndarray):
+    def opt(v):
+        return None if np.isnan(v) else int(v)
+
+    db.connection().exec_driver_sql(
+        f"UPDATE {t.name} SET anom_eco2 = ?, anom_tvoc = ?, server_scored = coalesce(server_scored, ?) WHERE id = ?",
+        [
+            (opt(e), opt(v), 1 if s else None, i)
+            for e, v, s, i in zip(flags[0].tolist(), flags[1].tolist(), server.tolist(), ids.tolist())
+        ],
+    )
+
+
+def backfill_device(db: Session, device_id: str, chunk_rows: int = 100_000) -> dict:
+    """
+    Recompute the anomaly flags of one device's history under the current
+    settings (commit per chunk) and store the detector state it ends with.
+    Server-scored rows get the server's flags, gateway rows keep theirs
+    (OR'ed with the server's when ANOMALY_EVALUATE_GATEWAY).
+    """
+    from .rescore import device_chunks   # rescore -> rules -> ... döngüsel import olmasın
+
+    started = time.perf_counter()
+    floors = _min_std()
+    state = [(0, 0.0, 0.0)] * len(ANOMALY_METRICS)
+    rows = archived = changed = flagged = 0
+    last_ts = None
+    last_row: Optional[tuple] = None     # (id, anom_eco2, anom_tvoc) son canlı satır
+
+    for chunk in device_chunks(db, device_id, chunk_rows):
+        flags = []
+        for i, metric in enumerate(ANOMALY_METRICS):
+            f, state[i] = scan_metric(chunk.values[metric], state[i], floors[i])
+            flags.append(f)
+        rows += len(chunk)
+        last_ts = int(chunk.ts[-1])
+        if chunk.ids is None:
+            archived += len(chunk)
+            continue
+
+        new, diff = [], np.zeros(len(chunk), dtype=bool)
+        for col, f in zip(ANOM_COLUMNS, flags):
+            stored = chunk.anom[col]
+            if settings.ANOMALY_EVALUATE_GATEWAY:
+                gateway = np.where(np.isnan(stored), f, np.maximum(stored, np.nan_to_num(f)))
+            else:
+                gateway = stored
+            value = np.where(chunk.server, f, gateway)
+            diff |= ~((value == stored) | (np.isnan(value) & np.isnan(stored)))
+            new.append(value)
+            flagged += int(np.nansum(value))
+
+        idx = np.flatnonzero(diff)
+        if len(idx):
+            _update_flags(db, chunk.table, chunk.ids[idx], [v[idx] for v in new], chunk.server[idx])
+            changed += len(idx)
+        last_row = (int(chunk.ids[-1]), *(None if np.isnan(v[-1]) else bool(v[-1]) for v in new))
+        db.commit()
+
+    if rows:
+        row = {"device_id": device_id, "ts": _EPOCH + timedelta(microseconds=last_ts), "updated_at": datetime.now(timezone.utc)}
+        for (n, mean, var), p in zip(state, _STATE_PREFIX):
+            row.update({f"{p}_n": n, f"{p}_mean": mean if n else None, f"{p}_var": var if n else None})
+        _upsert_states(db, [row])
+    db.commit()
+
+    if changed:
+        latest = latest_store.get_row(device_id)
+        if latest is not None and last_row is not None and latest.get("id") == last_row[0]:
+            latest_store.update([dict(latest, **dict(zip(ANOM_COLUMNS, last_row[1:])))])
+        data_versions.bump_devices([device_id])
+
+    return {
+        "device_id": device_id,
+        "rows": rows,
+        "archived_rows": archived,
+        "updated": changed,
+        "anomalies": flagged,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000.0, 1),
+    }
+
+
+def backfill(db: Session, device_id: Optional[str] = None, chunk_rows: int = 100_000) -> list[dict]:
+    """Backfill one device, or every device with stored measurements"""
+    if not latest_store.loaded:
+        latest_store.backfill(db)
+    device_ids = [device_id] if device_id else sorted(latest_store.snapshot())
+    # Diğer cihazların kaydedilmemiş durumu yeniden yüklemede kaybolmasın
+    anomaly_detector.persist(db)
+    try:
+        results = [backfill_device(db, d, chunk_rows) for d in device_ids]
+    finally:
+        anomaly_detector.load(db)
+    logger.info("🔎 Anomaly backfill: %d devices, %d rows updated", len(results), sum(r["updated"] for r in results))
+    return results
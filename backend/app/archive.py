@@ -0,0 +1,472 @@
+"""
+Compressed cold-tier archive for closed measurement partitions.
+
+A monthly partition that ended more than ARCHIVE_AFTER_MONTHS ago is turned
+into one `measurement_blocks` row per device and day, and the partition
+table is dropped. A block stores every column separately (columnar), with
+an encoding chosen for that kind of data:
+
+- ts:     microseconds, delta-of-delta (regular sampling -> tiny values)
+- int:    delta from the previous value
+- float:  scaled to integers when a fixed number of decimals reproduces
+          every value exactly (the usual case for sensor readings), else
+          XOR with the previous value's bits (Gorilla idea) with the byte
+          planes shuffled so the many zero bytes line up
+- bool:   bit-packed; str: small dictionary + codes
+- nulls:  per-column bitmap, only when the column has some
+
+Integer streams are zigzag-encoded and stored with the smallest byte width that
+fits; the whole block is then zlib-compressed. Everything is vectorized
+with NumPy, so decoding a day is a few array operations.
+
+Readers (`crud.get_*history*_rows`, downsampling, export, rollup/episode rebuilds,
+latest backfill) merge archived rows with the live partitions by (ts, id).
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Iterator, Optional
+
+import numpy as np
+from sqlalchemy import Boolean, DateTime, Float, Integer, select, func, text
+from sqlalchemy.orm import Session
+
+from .models import Measurement, MeasurementBlock
+from .database import SessionLocal
+from .config import settings
+from . import partitions
+
+logger = logging.getLogger(__name__)
+
+
+CODEC_VERSION = 1
+_MAGIC = b"MB"
+_MAX_DIGITS = 6     # float -> scaled int denemesi için en çok ondalık
+
+MEASUREMENT_FIELDS = [c.name for c in Measurement.__table__.columns]
+
+
+def _kind(column) -> str:
+    if column.name == "ts":
+        return "ts"
+    if isinstance(column.type, Boolean):
+        return "bool"
+    if isinstance(column.type, Integer):
+        return "int"
+    if isinstance(column.type, Float):
+        return "float"
+    if isinstance(column.type, DateTime):
+        return "ts"
+    return "str"
+
+
+# device_id blok başına bir kez saklanır; server_scored yalnızca canlı satırlar için (blok formatı sabit)
+ARCHIVE_COLUMNS = [
+    (c.name, _kind(c)) for c in Measurement.__table__.columns if c.name not in ("device_id", "server_scored")
+]
+
+
+# ==================== CODEC ====================
+
+def _zigzag(a: np.ndarray) -> np.ndarray:
+    a = a.astype(np.int64)
+    return ((a << 1) ^ (a >> 63)).view(np.uint64)
+
+
+def _unzigzag(u: np.ndarray) -> np.ndarray:
+    u = u.astype(np.uint64)
+    return ((u >> np.uint64(1)).view(np.int64)) ^ -((u & np.uint64(1)).view(np.int64))
+
+
+def _pack_uint(u: np.ndarray) -> bytes:
+    """Unsigned ints with the smallest width (1/2/4/8 bytes) that fits"""
+    top = int(u.max()) if len(u) else 0
+    width = 1 if top < 1 << 8 else 2 if top < 1 << 16 else 4 if top < 1 << 32 else 8
+    return bytes([width]) + u.astype(f"<u{width}").tobytes()
+
+
+def _unpack_uint(buf: bytes, count: int) -> np.ndarray:
+    width = buf[0]
+    return np.frombuffer(buf, dtype=f"<u{width}", count=count, offset=1).astype(np.uint64)
+
+
+def _encode_values(kind: str, values: list) -> bytes:
+    if kind == "ts":
+        us = np.array(values, dtype="datetime64[us]").astype(np.int64)
+        d1 = np.diff(us, prepend=0)
+        return _pack_uint(_zigzag(np.diff(d1, prepend=0)))
+    if kind == "int":
+        return _pack_uint(_zigzag(np.diff(np.array(values, dtype=np.int64), prepend=0)))
+    if kind == "float":
+        v = np.array(values, dtype="<f8")
+        # Sensörler çoğunlukla sabit ondalıkla yazar: tam geri dönüyorsa tamsayı gibi sakla
+        if np.all(np.isfinite(v)) and np.abs(v).max() < 1e9:
+            for digits in range(_MAX_DIGITS + 1):
+                scaled = np.rint(v * 10.0 ** digits).astype(np.int64)
+                if np.array_equal((scaled / 10.0 ** digits).view("<u8"), v.view("<u8")):
+                    return bytes([digits + 1]) + _pack_uint(_zigzag(np.diff(scaled, prepend=0)))
+        bits = v.view("<u8")
+        x = bits ^ np.concatenate((np.zeros(1, dtype="<u8"), bits[:-1]))
+        return b"\x00" + x.view(np.uint8).reshape(-1, 8).T.tobytes()
+    if kind == "bool":
+        return np.packbits(np.array(values, dtype=bool)).tobytes()
+    # str: sözlük + kodlar
+    vocab = sorted(set(values))
+    index = {v: i for i, v in enumerate(vocab)}
+    head = json.dumps(vocab).encode()
+    return struct.pack("<I", len(head)) + head + _pack_uint(np.array([index[v] for v in values], dtype=np.uint64))
+
+
+def _decode_values(kind: str, buf: bytes, count: int) -> list:
+    if kind == "ts":
+        us = np.cumsum(np.cumsum(_unzigzag(_unpack_uint(buf, count))))
+        return us.astype("datetime64[us]").tolist()
+    if kind == "int":
+        return np.cumsum(_unzigzag(_unpack_uint(buf, count))).tolist()
+    if kind == "float":
+        if buf[0]:
+            return (np.cumsum(_unzigzag(_unpack_uint(buf[1:], count))) / 10.0 ** (buf[0] - 1)).tolist()
+        x = np.frombuffer(buf, dtype=np.uint8, offset=1).reshape(8, count).T.copy().view("<u8").ravel()
+        return np.bitwise_xor.accumulate(x).view("<f8").tolist()
+    if kind == "bool":
+        return np.unpackbits(np.frombuffer(buf, dtype=np.uint8), count=count).astype(bool).tolist()
+    (size,) = struct.unpack_from("<I", buf)
+    vocab = json.loads(buf[4:4 + size])
+    return [vocab[i] for i in _unpack_uint(buf[4 + size:], count).tolist()]
+
+
+def encode_block(rows: list[dict]) -> bytes:
+    """Rows of one device (sorted by ts, id) -> compressed block"""
+    n = len(rows)
+    out = [_MAGIC, struct.pack("<BI", CODEC_VERSION, n)]
+    for name, kind in ARCHIVE_COLUMNS:
+        values = [r.get(name) for r in rows]
+        present = [v is not None for v in values]
+        if not any(present):
+            out.append(b"\x00")
+            continue
+        if all(present):
+            out.append(b"\x01")
+        else:
+            out.append(b"\x02" + np.packbits(np.array(present, dtype=bool)).tobytes())
+        payload = _encode_values(kind, [v for v in values if v is not None])
+        out.append(struct.pack("<I", len(payload)) + payload)
+    return zlib.compress(b"".join(out), settings.ARCHIVE_ZLIB_LEVEL)
+
+
+def decode_block(data: bytes, device_id: str) -> list[dict]:
+    """Compressed block -> rows (dicts with all measurement columns), in (ts, id) order"""
+    buf = zlib.decompress(data)
+    if buf[:2] != _MAGIC:
+        raise ValueError("not a measurement block")
+    version, n = struct.unpack_from("<BI", buf, 2)
+    if version != CODEC_VERSION:
+        raise ValueError(f"unsupported block codec {version}")
+
+    pos = 7
+    columns: dict[str, list] = {}
+    mask_len = (n + 7) // 8
+    for name, kind in ARCHIVE_COLUMNS:
+        flag = buf[pos]
+        pos += 1
+        if flag == 0:
+            columns[name] = [None] * n
+            continue
+        present = None
+        if flag == 2:
+            present = np.unpackbits(np.frombuffer(buf, dtype=np.uint8, count=mask_len, offset=pos), count=n)
+            pos += mask_len
+        (size,) = struct.unpack_from("<I", buf, pos)
+        pos += 4
+        count = n if present is None else int(present.sum())
+        values = _decode_values(kind, buf[pos:pos + size], count)
+        pos += size
+        if present is not None:
+            it = iter(values)
+            values = [next(it) if p else None for p in present.tolist()]
+        columns[name] = values
+
+    names = [name for name, _ in ARCHIVE_COLUMNS]
+    return [
+        dict(zip(names, vals), device_id=device_id, server_scored=None)
+        for vals in zip(*(columns[name] for name in names))
+    ]
+
+
+# ==================== REGISTRY ====================
+
+class ArchiveRegistry:
+    """Newest archived timestamp (cached) so that recent queries skip the block table"""
+
+    def __init__(self):
+        self._max_ts: Optional[datetime] = None
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def refresh(self, db):
+        max_ts = db.execute(select(func.max(MeasurementBlock.last_ts))).scalar()
+        with self._lock:
+            self._max_ts = max_ts.replace(tzinfo=None) if max_ts is not None else None
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def may_cover(self, db, start: Optional[datetime]) -> bool:
+        """Can any archived row have ts >= start?"""
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > settings.PARTITION_REFRESH_S:
+            self.refresh(db)
+        with self._lock:
+            max_ts = self._max_ts
+        if max_ts is None:
+            return False
+        return start is None or start.replace(tzinfo=None) <= max_ts
+
+
+# ==================== READ PATH ====================
+
+def _naive(ts: Optional[datetime]) -> Optional[datetime]:
+    return ts.replace(tzinfo=None) if ts is not None else None
+
+
+def archived_rows(
+    db,
+    device_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    after: Optional[tuple[datetime, int]] = None,
+    limit: Optional[int] = None,
+    descending: bool = False,
+    alerts_only: bool = False,
+) -> list[dict]:
+    """
+    Archived rows of a device in [start, end], sorted by (ts, id), optionally
+    only those after the keyset `after` or with alert set. Blocks are
+    decoded one day at a time and decoding stops as soon as `limit` rows
+    are collected.
+    """
+    start, end = _naive(start), _naive(end)
+    lower = start
+    if after is not None and (lower is None or after[0] > lower):
+        lower = after[0]
+    if not archive_registry.may_cover(db, lower):
+        return []
+
+    B = MeasurementBlock
+    stmt = select(B.data).where(B.device_id == device_id)
+    if lower is not None:
+        stmt = stmt.where(B.last_ts >= lower)
+    if end is not None:
+        stmt = stmt.where(B.first_ts <= end)
+    stmt = stmt.order_by(B.day.desc() if descending else B.day.asc())
+
+    out: list[dict] = []
+    for (data,) in db.execute(stmt):
+        rows = decode_block(data, device_id)
+        if descending:
+            rows.reverse()
+        for r in rows:
+            ts = r["ts"]
+            if (start is not None and ts < start) or (end is not None and ts > end):
+                continue
+            if after is not None and (ts, r["id"]) <= after:
+                continue
+            if alerts_only and not r["alert"]:
+                continue
+            out.append(r)
+        if limit is not None and len(out) >= limit:
+            break
+    return out[:limit] if limit is not None else out
+
+
+def archived_blocks(db, device_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Iterator[list[dict]]:
+    """Archived rows of a device in [start, end], one decoded block (day) at a time, oldest first"""
+    start, end = _naive(start), _naive(end)
+    if not archive_registry.may_cover(db, start):
+        return
+
+    B = MeasurementBlock
+    stmt = select(B.data).where(B.device_id == device_id)
+    if start is not None:
+        stmt = stmt.where(B.last_ts >= start)
+    if end is not None:
+        stmt = stmt.where(B.first_ts <= end)
+    for (data,) in db.execute(stmt.order_by(B.day.asc())):
+        rows = decode_block(data, device_id)
+        yield [r for r in rows if (start is None or r["ts"] >= start) and (end is None or r["ts"] <= end)]
+
+
+def archived_extent(
+    db, device_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None
+) -> tuple[int, Optional[datetime], Optional[datetime]]:
+    """(rows, first ts, last ts) of the archived days overlapping [start, end], from block headers"""
+    start, end = _naive(start), _naive(end)
+    if not archive_registry.may_cover(db, start):
+        return 0, None, None
+    B = MeasurementBlock
+    stmt = select(func.sum(B.n), func.min(B.first_ts), func.max(B.last_ts)).where(B.device_id == device_id)
+    if start is not None:
+        stmt = stmt.where(B.last_ts >= start)
+    if end is not None:
+        stmt = stmt.where(B.first_ts <= end)
+    n, first, last = db.execute(stmt).one()
+    return n or 0, _naive(first), _naive(last)
+
+
+def merge_rows(live: list, archived: list, key, limit: Optional[int] = None, descending: bool = False) -> list:
+    """Merge live and archived rows (each already sorted) on `key`, then cut to `limit`"""
+    if archived:
+        live = sorted(live + archived, key=key, reverse=descending)
+    return live[:limit] if limit is not None else live
+
+
+def latest_archived_rows(db, exclude: set[str]) -> dict[str, dict]:
+    """Newest archived row of every device not in `exclude` (for latest backfill)"""
+    B = MeasurementBlock
+    newest = select(B.device_id, func.max(B.day).label("day")).group_by(B.device_id).subquery()
+    stmt = select(B.device_id, B.data).join(newest, (newest.c.device_id == B.device_id) & (newest.c.day == B.day))
+    out = {}
+    for device_id, data in db.execute(stmt):
+        if device_id not in exclude:
+            out[device_id] = decode_block(data, device_id)[-1]
+    return out
+
+
+def iter_archived(db, device_id: Optional[str] = None, by_device: bool = False) -> Iterator[list[dict]]:
+    """All archived rows block by block (for rebuilds); per device or per day order"""
+    B = MeasurementBlock
+    stmt = select(B.device_id, B.data)
+    if device_id:
+        stmt = stmt.where(B.device_id == device_id)
+    stmt = stmt.order_by(*((B.device_id, B.day) if by_device else (B.day, B.device_id)))
+    for dev, data in db.execute(stmt.execution_options(yield_per=64)):
+        yield decode_block(data, dev)
+
+
+# ==================== ARCHIVER ====================
+
+def _day(ts: datetime) -> datetime:
+    return datetime(ts.year, ts.month, ts.day)
+
+
+def _store_block(db: Session, device_id: str, day: datetime, rows: list[dict]):
+    """Write (or merge into) the block of (device, day)"""
+    B = MeasurementBlock
+    existing = db.execute(select(B).where(B.device_id == device_id, B.day == day)).scalar_one_or_none()
+    if existing is not None:
+        # Arşivlenmiş aya sonradan gelen veri: mevcut blokla birleştir
+        by_id = {r["id"]: r for r in decode_block(existing.data, device_id)}
+        by_id.update({r["id"]: r for r in rows})
+        rows = sorted(by_id.values(), key=lambda r: (r["ts"], r["id"]))
+        db.delete(existing)
+        db.flush()
+    db.add(B(
+        device_id=device_id,
+        day=day,
+        first_ts=rows[0]["ts"],
+        last_ts=rows[-1]["ts"],
+        n=len(rows),
+        codec=CODEC_VERSION,
+        data=encode_block(rows),
+    ))
+
+
+def archive_partition(db: Session, key: int) -> int:
+    """
+    Convert one monthly partition into blocks and drop it, in a single
+    transaction. Returns rows archived.
+    """
+    t = partitions.partition_table(key)
+    stmt = select(t).order_by(t.c.device_id, t.c.ts, t.c.id)
+
+    total = 0
+    current: Optional[tuple[str, datetime]] = None
+    rows: list[dict] = []
+    for r in db.execute(stmt.execution_options(yield_per=20_000)).mappings():
+        row = dict(r)
+        row["ts"] = _naive(row["ts"])
+        group = (row["device_id"], _day(row["ts"]))
+        if group != current:
+            if rows:
+                _store_block(db, current[0], current[1], rows)
+            current, rows = group, []
+        rows.append(row)
+        total += 1
+    if rows:
+        _store_block(db, current[0], current[1], rows)
+
+    # DROP, sqlite_sequence satırını da siler; geri yazılır ki bu aya geç
+    # gelen veri için yeniden açılan tablo arşivdeki id'leri tekrar kullanmasın
+    seq = db.execute(
+        text("SELECT seq FROM sqlite_sequence WHERE name = :name"), {"name": t.name}
+    ).scalar()
+    partitions.partition_registry.discard(key)
+    t.drop(db.connection(), checkfirst=True)
+    if seq is not None:
+        db.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"), {"name": t.name, "seq": seq})
+    db.commit()
+    archive_registry.invalidate()
+    logger.info(f"🧊 Archived {partitions.partition_name(key)}: {total} rows")
+    return total
+
+
+def archive_closed(db: Session, now: Optional[datetime] = None, months: Optional[int] = None) -> dict[int, int]:
+    """Archive partitions that ended more than `months` (ARCHIVE_AFTER_MONTHS) ago"""
+    months = settings.ARCHIVE_AFTER_MONTHS if months is None else months
+    if months <= 0:
+        return {}
+
+    now = _naive(now) or datetime.utcnow()
+    total = now.year * 12 + now.month - 1 - months
+    cutoff = datetime(total // 12, total % 12 + 1, 1)
+
+    done = {}
+    for key in partitions.partition_registry.keys(db):
+        if partitions.month_bounds(key)[1] <= cutoff:
+            done[key] = archive_partition(db, key)
+    return done
+
+
+async def archive_loop():
+    """Background task: archive closed partitions every ARCHIVE_CHECK_S"""
+    def run():
+        db = SessionLocal()
+        try:
+            return archive_closed(db)
+        finally:
+            db.close()
+
+    while True:
+        try:
+            await asyncio.to_thread(run)
+        except Exception as e:
+            logger.error(f"❌ Archiving failed: {e}")
+        await asyncio.sleep(settings.ARCHIVE_CHECK_S)
+
+
+def archive_stats(db) -> dict:
+    B = MeasurementBlock
+    blocks, rows, size, first, last = db.execute(
+        select(func.count(), func.sum(B.n), func.sum(func.length(B.data)), func.min(B.first_ts), func.max(B.last_ts))
+    ).one()
+    return {
+        "blocks": blocks,
+        "rows": rows or 0,
+        "bytes": size or 0,
+        "bytes_per_row": round(size / rows, 2) if rows else None,
+        "first_ts": first,
+        "last_ts": last,
+    }
+
+
+# Global registry (cached newest archived ts)
+archive_registry = ArchiveRegistry()
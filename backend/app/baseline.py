@@ -0,0 +1,190 @@
+"""
+Streaming per-device baseline windows.
+
+`alerts.compute_baseline` averages TVOC/eCO2 over the last BASELINE_SECONDS
+with a DB query per sample. This module keeps the same window in memory as a
+deque with running sums, so a baseline lookup + update is O(1) amortized.
+The store is hydrated from the DB with one query at startup.
+"""
+from __future__ import annotations
+
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .compact import shifted
+from . import partitions
+
+
+def _key(ts: datetime) -> datetime:
+    # SQLite DateTime'ı naive wall-clock text olarak saklar; karşılaştırmalar aynı temsili kullanmalı
+    return ts.replace(tzinfo=None)
+
+
+class BaselineWindow:
+    """Samples of one device in ts order, with running sums of non-null values"""
+
+    __slots__ = ("samples", "cutoff", "tvoc_sum", "tvoc_n", "eco2_sum", "eco2_n")
+
+    def __init__(self, cutoff: Optional[datetime] = None):
+        self.samples: deque = deque()          # (ts, tvoc, eco2)
+        self.cutoff = cutoff                   # samples older than this are not in memory
+        self.tvoc_sum = 0
+        self.tvoc_n = 0
+        self.eco2_sum = 0
+        self.eco2_n = 0
+
+    def copy(self) -> "BaselineWindow":
+        w = BaselineWindow(self.cutoff)
+        w.samples = deque(self.samples)
+        w.tvoc_sum, w.tvoc_n, w.eco2_sum, w.eco2_n = self.tvoc_sum, self.tvoc_n, self.eco2_sum, self.eco2_n
+        return w
+
+    def _account(self, tvoc, eco2, sign: int):
+        if tvoc is not None:
+            self.tvoc_sum += sign * tvoc
+            self.tvoc_n += sign
+        if eco2 is not None:
+            self.eco2_sum += sign * eco2
+            self.eco2_n += sign
+
+    def add(self, ts: datetime, tvoc, eco2):
+        if not self.samples or ts >= self.samples[-1][0]:
+            self.samples.append((ts, tvoc, eco2))
+        else:
+            # Out-of-order sample: rare, keep the deque sorted
+            idx = len(self.samples)
+            while idx > 0 and self.samples[idx - 1][0] > ts:
+                idx -= 1
+            self.samples.insert(idx, (ts, tvoc, eco2))
+        self._account(tvoc, eco2, +1)
+
+    def baseline(self, now: datetime, window: timedelta) -> Optional[tuple[Optional[float], Optional[float]]]:
+        """
+        Mean (tvoc, eco2) over samples with ts in [now - window, now].
+        Returns None when the answer needs samples that were already evicted.
+        """
+        start = now - window
+        if self.cutoff is not None and start < self.cutoff:
+            return None
+
+        if self.samples and now < self.samples[-1][0]:
+            # Out-of-order lookup: scan instead of evicting
+            tvocs = [s[1] for s in self.samples if start <= s[0] <= now and s[1] is not None]
+            eco2s = [s[2] for s in self.samples if start <= s[0] <= now and s[2] is not None]
+            return (
+                (sum(tvocs) / len(tvocs)) if tvocs else None,
+                (sum(eco2s) / len(eco2s)) if eco2s else None,
+            )
+
+        while self.samples and self.samples[0][0] < start:
+            _, tvoc, eco2 = self.samples.popleft()
+            self._account(tvoc, eco2, -1)
+        if self.cutoff is None or start > self.cutoff:
+            self.cutoff = start
+
+        return (
+            (self.tvoc_sum / self.tvoc_n) if self.tvoc_n else None,
+            (self.eco2_sum / self.eco2_n) if self.eco2_n else None,
+        )
+
+
+class BaselineStore:
+    """device_id -> BaselineWindow, shared by all ingest paths"""
+
+    def __init__(self, window_seconds: int = settings.BASELINE_SECONDS):
+        self.window = timedelta(seconds=window_seconds)
+        self.hydrated = False
+        self._windows: dict[str, BaselineWindow] = {}
+        self._lock = threading.Lock()
+
+    def hydrate(self, db: Session):
+        """Load the last window of every device (one query per partition)"""
+        per_table = []
+        last_seen: dict[str, datetime] = {}
+        for t in partitions.tables_chronological(db):
+            last = select(t.c.device_id, func.max(t.c.ts).label("last_ts")).group_by(t.c.device_id).subquery()
+            stmt = (
+                select(t.c.device_id, t.c.ts, t.c.tvoc_ppb, t.c.eco2_ppm)
+                .join(last, last.c.device_id == t.c.device_id)
+                .where(t.c.ts >= shifted(last.c.last_ts, -int(self.window.total_seconds())))
+            )
+            rows = db.execute(stmt).all()
+            per_table.append(rows)
+            for r in rows:
+                ts = _key(r.ts)
+                if r.device_id not in last_seen or ts > last_seen[r.device_id]:
+                    last_seen[r.device_id] = ts
+
+        # Pencere partition sınırını aşabilir: her tablodan yalnızca global son ölçüme göre pencerede kalanlar
+        samples: dict[str, list] = {}
+        for rows in per_table:
+            for r in rows:
+                ts = _key(r.ts)
+                if ts >= last_seen[r.device_id] - self.window:
+                    samples.setdefault(r.device_id, []).append((ts, r.tvoc_ppb, r.eco2_ppm))
+
+        windows: dict[str, BaselineWindow] = {}
+        for device_id, device_samples in samples.items():
+            w = windows[device_id] = BaselineWindow()
+            for ts, tvoc, eco2 in sorted(device_samples, key=lambda s: s[0]):
+                w.add(ts, tvoc, eco2)
+
+        for device_id, w in windows.items():
+            w.cutoff = last_seen[device_id] - self.window
+
+        with self._lock:
+            self._windows = windows
+            self.hydrated = True
+
+    def invalidate(self):
+        """Drop all state (e.g. after a failed commit); next use re-hydrates"""
+        with self._lock:
+            self._windows = {}
+            self.hydrated = False
+
+    def snapshot(self, device_ids) -> tuple:
+        """Copies of these devices' windows, for `restore` after a failed commit"""
+        with self._lock:
+            return self.hydrated, {d: (w.copy() if (w := self._windows.get(d)) else None) for d in device_ids}
+
+    def restore(self, snapshot: tuple):
+        """Put back the windows of a snapshot (other devices are untouched)"""
+        hydrated, windows = snapshot
+        if not hydrated:
+            self.invalidate()
+            return
+        with self._lock:
+            for device_id, w in windows.items():
+                if w is None:
+                    self._windows.pop(device_id, None)
+                else:
+                    self._windows[device_id] = w
+
+    def baseline(self, device_id: str, ts: datetime) -> Optional[tuple[Optional[float], Optional[float]]]:
+        with self._lock:
+            w = self._windows.get(device_id)
+            if w is None:
+                # Hydrate sırasında görülmeyen cihaz: DB'de hiç ölçümü yok
+                return (None, None)
+            return w.baseline(_key(ts), self.window)
+
+    def observe(self, device_id: str, ts: datetime, tvoc, eco2):
+        with self._lock:
+            w = self._windows.get(device_id)
+            if w is None:
+                w = self._windows[device_id] = BaselineWindow()
+            w.add(_key(ts), tvoc, eco2)
+
+    def observe_rows(self, rows: list[dict]):
+        for r in rows:
+            self.observe(r["device_id"], r["ts"], r.get("tvoc_ppb"), r.get("eco2_ppm"))
+
+
+# Global store (hydrated in main.py lifespan, or lazily on first use)
+baseline_store = BaselineStore()
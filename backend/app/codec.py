@@ -0,0 +1,247 @@
+"""
+Measurement frame codecs for MQTT and HTTP ingest.
+
+Both decoders are driven by field tables instead of hand-written mapping code:
+
+- JSON (`.../data` topics): JSON_FIELDS lists, per column, the keys the
+  node (short: `t`, `h`, `v`, ...) and the gateway (long: `temp_c`, ...)
+  use; the first key present wins.
+- Binary (`.../bin` topics, `application/octet-stream` on
+  /api/ingest/frames): a versioned, little-endian layout, one header per
+  device followed by fixed-size records decoded in one pass with
+  `struct.iter_unpack`.
+
+Binary message = one or more sections:
+
+    magic "AQ" | version u8 | id_len u8 | device_id (utf-8) | count u16 | count x record
+
+An empty device_id (id_len 0) takes the device from the MQTT topic.
+Record layout v1 (32 bytes) is BIN_FIELDS[1]; integer fields carry scaled
+values (÷ divisor) and a reserved value for "missing".
+
+Frames without a device timestamp (`ts_ms` missing / 0, binary `ts_s` 0)
+get the server time and SERVER_TS = True, so the ingest writer can spot
+re-published copies by frame counter (their ts differs per copy). The
+writer removes the key before the row is cached or streamed.
+"""
+from __future__ import annotations
+
+import struct
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from .models import Measurement
+
+MAGIC = b"AQ"
+FRAME_VERSION = 1
+
+_HEADER = struct.Struct("<2sBB")
+_COUNT = struct.Struct("<H")
+
+# measurements kolonları (id hariç), satır sözlüklerinin anahtar sırası
+ROW_COLUMNS = tuple(c.name for c in Measurement.__table__.columns if c.name != "id")
+
+# Durum kodu (flags bit 4-6) <-> status
+STATUS_CODES = (None, "NORMAL", "OK", "WARN", "HIGH")
+_STATUS_CODE = {s: i for i, s in enumerate(STATUS_CODES) if s}
+
+# flags bitleri
+FLAG_BITS = (("anom_eco2", 0x01), ("anom_tvoc", 0x02), ("alert", 0x04))
+STATUS_SHIFT, STATUS_MASK = 4, 0x07
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Sunucu saatiyle damgalanmış satırların geçici işareti (kolon değil)
+SERVER_TS = "_server_ts"
+
+
+class FrameError(ValueError):
+    """Malformed or unsupported binary frame"""
+
+
+# ==================== JSON ====================
+
+# kolon -> (anahtar, bölen) adayları; ilk None olmayan kullanılır
+JSON_FIELDS: tuple[tuple[str, tuple[tuple[str, Optional[int]], ...]], ...] = (
+    ("temp_c", (("t", 10), ("temp_c", None))),
+    ("hum_rh", (("h", 10), ("hum_rh", None))),
+    ("pressure_hpa", (("p", None), ("pressure_hpa", None), ("press_hpa", None))),
+    ("tvoc_ppb", (("v", None), ("tvoc_ppb", None))),
+    ("eco2_ppm", (("e", None), ("eco2_ppm", None))),
+    ("rssi", (("rssi", None),)),
+    ("snr", (("snr", None),)),
+    ("aq_score", (("s", None), ("aq_score", None))),
+    ("pred_eco2_60m", (("pe", None), ("pred_eco2_60m", None))),
+    ("pred_tvoc_60m", (("pv", None), ("pred_tvoc_60m", None))),
+    ("sample_ms", (("sample_ms", None), ("sm", None))),
+    ("frame_counter", (("fc", None), ("frame_counter", None))),
+)
+
+# kolon -> anahtarlar; herhangi biri true ise true
+JSON_FLAGS: tuple[tuple[str, tuple[str, ...]], ...] = (
+    ("anom_eco2", ("ae", "anom_eco2")),
+    ("anom_tvoc", ("av", "anom_tvoc")),
+    ("alert", ("da", "alert", "delta_alert")),
+)
+
+
+def decode_json(payload: dict, now: Optional[datetime] = None) -> dict:
+    """Gateway / node JSON -> measurements row"""
+    row = dict.fromkeys(ROW_COLUMNS)
+    row["device_id"] = payload.get("id") or payload.get("device_id", "unknown")
+
+    # ts_ms = 0: gateway saati senkron değil, sunucu zamanı kullanılır
+    ts_ms = payload.get("ts_ms")
+    if ts_ms:
+        row["ts"] = _EPOCH + timedelta(milliseconds=ts_ms)
+    else:
+        row["ts"] = now or datetime.now(timezone.utc)
+        row[SERVER_TS] = True
+
+    get = payload.get
+    for column, candidates in JSON_FIELDS:
+        for key, div in candidates:
+            v = get(key)
+            if v is not None:
+                row[column] = v / div if div else v
+                break
+    for column, keys in JSON_FLAGS:
+        row[column] = any(get(k) for k in keys)
+    row["status"] = get("st") or get("status") or "NORMAL"
+    return row
+
+
+# ==================== BINARY ====================
+
+# kolon, struct kodu, bölen, "yok" değeri (None = her değer geçerli)
+BIN_FIELDS: dict[int, tuple[tuple[str, str, Optional[int], Optional[int]], ...]] = {
+    1: (
+        ("ts_s", "I", None, None),           # epoch saniye, 0 = sunucu zamanı
+        ("ts_msec", "H", None, None),        # milisaniye kısmı
+        ("frame_counter", "I", None, None),
+        ("temp_c", "h", 10, -0x8000),
+        ("hum_rh", "H", 10, 0xFFFF),
+        ("pressure_hpa", "H", 10, 0xFFFF),
+        ("tvoc_ppb", "H", None, 0xFFFF),
+        ("eco2_ppm", "H", None, 0xFFFF),
+        ("pred_tvoc_60m", "H", None, 0xFFFF),
+        ("pred_eco2_60m", "H", None, 0xFFFF),
+        ("aq_score", "B", None, 0xFF),
+        ("rssi", "b", None, -0x80),
+        ("snr", "b", 4, -0x80),
+        ("flags", "B", None, None),
+        ("sample_ms", "I", None, 0),
+    ),
+}
+
+_RECORDS = {v: struct.Struct("<" + "".join(f[1] for f in fields)) for v, fields in BIN_FIELDS.items()}
+_SPECIAL = ("ts_s", "ts_msec", "flags")
+
+
+def _plan(fields) -> tuple:
+    """Decode plan of a layout: indexes of ts/flags + (column, index, divisor, null) of the rest"""
+    index = {f[0]: i for i, f in enumerate(fields)}
+    plain = tuple((name, i, div, null) for i, (name, _, div, null) in enumerate(fields) if name not in _SPECIAL)
+    return (*(index[n] for n in _SPECIAL), plain)
+
+
+_PLANS = {v: _plan(fields) for v, fields in BIN_FIELDS.items()}
+
+
+def _device_from_topic(topic: Optional[str]) -> Optional[str]:
+    parts = (topic or "").rsplit("/", 2)
+    return parts[-2] if len(parts) == 3 else None
+
+
+def decode_frames(data: bytes, topic: Optional[str] = None, now: Optional[datetime] = None) -> list[dict]:
+    """Binary message (one or more sections) -> measurements rows, in order"""
+    view = memoryview(data)
+    rows: list[dict] = []
+    pos = 0
+    while pos < len(view):
+        if len(view) - pos < _HEADER.size:
+            raise FrameError(f"truncated header at byte {pos}")
+        magic, version, id_len = _HEADER.unpack_from(view, pos)
+        if magic != MAGIC:
+            raise FrameError(f"bad magic at byte {pos}")
+        record = _RECORDS.get(version)
+        if record is None:
+            raise FrameError(f"unsupported frame version {version}")
+        pos += _HEADER.size
+        device_id = bytes(view[pos:pos + id_len]).decode("utf-8") or _device_from_topic(topic)
+        pos += id_len
+        if not device_id:
+            raise FrameError("frame without device_id")
+        if len(view) - pos < _COUNT.size:
+            raise FrameError(f"truncated header at byte {pos}")
+        (count,) = _COUNT.unpack_from(view, pos)
+        pos += _COUNT.size
+        end = pos + count * record.size
+        if end > len(view):
+            raise FrameError(f"{device_id}: {count} records need {end - pos} bytes, {len(view) - pos} left")
+        rows.extend(_decode_records(_PLANS[version], device_id, record.iter_unpack(view[pos:end]), now))
+        pos = end
+    return rows
+
+
+def _decode_records(plan: tuple, device_id: str, records, now: Optional[datetime]) -> list[dict]:
+    i_s, i_ms, i_flags, plain = plan
+    server_now = None
+
+    out = []
+    for rec in records:
+        row = dict.fromkeys(ROW_COLUMNS)
+        row["device_id"] = device_id
+        secs = rec[i_s]
+        if secs:
+            row["ts"] = _EPOCH + timedelta(0, secs, 0, rec[i_ms])
+        else:
+            if server_now is None:
+                server_now = now or datetime.now(timezone.utc)
+            row["ts"] = server_now
+            row[SERVER_TS] = True
+        for name, i, div, null in plain:
+            v = rec[i]
+            if v != null:
+                row[name] = v / div if div else v
+        flags = rec[i_flags]
+        for name, bit in FLAG_BITS:
+            row[name] = bool(flags & bit)
+        code = (flags >> STATUS_SHIFT) & STATUS_MASK
+        row["status"] = (STATUS_CODES[code] if code < len(STATUS_CODES) else None) or "NORMAL"
+        out.append(row)
+    return out
+
+
+def encode_frames(device_id: str, rows: list[dict], version: int = FRAME_VERSION) -> bytes:
+    """Rows of one device -> one binary section (reference for the gateway, tests, benchmarks)"""
+    fields = BIN_FIELDS[version]
+    record = _RECORDS[version]
+    name = device_id.encode("utf-8")
+    parts = [_HEADER.pack(MAGIC, version, len(name)), name, _COUNT.pack(len(rows))]
+    for row in rows:
+        values = []
+        for column, _, div, null in fields:
+            if column in ("ts_s", "ts_msec"):
+                ts = row.get("ts")
+                if ts is None:
+                    values.append(0)
+                else:
+                    if ts.tzinfo is None:
+                        ts = ts.replace(tzinfo=timezone.utc)
+                    ms = (ts - _EPOCH) // timedelta(milliseconds=1)
+                    values.append(ms // 1000 if column == "ts_s" else ms % 1000)
+            elif column == "flags":
+                flags = _STATUS_CODE.get(row.get("status"), 0) << STATUS_SHIFT
+                for flag, bit in FLAG_BITS:
+                    if row.get(flag):
+                        flags |= bit
+                values.append(flags)
+            else:
+                v = row.get(column)
+                if v is None:
+                    values.append(0 if null is None else null)
+                else:
+                    values.append(round(v * div) if div else int(v))
+        parts.append(record.pack(*values))
+    return b"".join(parts)
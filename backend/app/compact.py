@@ -0,0 +1,225 @@
+"""
+Compact column encoding for measurement partitions.
+
+- device_id: small integer key from `device_keys`, interned once per device
+  instead of a String(64) repeated in every row and index entry
+- ts: INTEGER epoch milliseconds (same wall-clock as the text timestamps),
+  so range filters compare integers instead of ISO strings
+
+Both are TypeDecorators: queries keep writing `t.c.device_id == "node-1"`
+and `t.c.ts >= datetime(...)`, and rows still come back as str / datetime.
+New device keys are created inside the writer's transaction and only
+published to the in-memory map after the commit (same life cycle as new
+partitions, see partitions.publish_new_partitions).
+"""
+from __future__ import annotations
+
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import Integer, cast, func, insert, select, type_coerce
+from sqlalchemy.types import TypeDecorator
+
+from .database import engine
+from .models import DeviceKey
+
+EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+
+
+# ==================== TIMESTAMPS ====================
+
+def to_epoch_ms(ts: datetime) -> int:
+    """Wall-clock datetime -> epoch ms, rounded half up like SQLite's julianday()"""
+    us = (ts.replace(tzinfo=None) - EPOCH) // _US
+    return (us + 500) // 1000
+
+
+def from_epoch_ms(value: int) -> datetime:
+    return EPOCH + timedelta(milliseconds=value)
+
+
+def round_ms(ts: datetime) -> datetime:
+    """ts rounded to the stored precision (tzinfo kept)"""
+    return from_epoch_ms(to_epoch_ms(ts)).replace(tzinfo=ts.tzinfo)
+
+
+class EpochMs(TypeDecorator):
+    """DateTime stored as INTEGER epoch milliseconds"""
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        return to_epoch_ms(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):   # text partition satırı
+            return datetime.fromisoformat(value)
+        return from_epoch_ms(int(value))
+
+    def bind_processor(self, dialect):
+        def process(value, epoch=EPOCH, us=_US):
+            if value.__class__ is datetime and value.tzinfo is None:
+                return ((value - epoch) // us + 500) // 1000
+            return self.process_bind_param(value, dialect)
+        return process
+
+    def result_processor(self, dialect, coltype):
+        # Satır başına TypeDecorator sarmalayıcısı olmadan (history yanıtları binlerce satır)
+        def process(value, epoch=EPOCH, ms=timedelta(milliseconds=1)):
+            if value.__class__ is int:
+                return epoch + value * ms
+            return self.process_result_value(value, dialect)
+        return process
+
+
+def is_compact(col) -> bool:
+    return isinstance(col.type, EpochMs)
+
+
+def epoch_seconds(col):
+    """SQL expression: ts column (either layout) -> float epoch seconds"""
+    if is_compact(col):
+        return type_coerce(col, Integer) / 1000.0
+    return (func.julianday(col) - 2440587.5) * 86400.0
+
+
+def epoch_bucket(col, secs: int):
+    """SQL expression: ts column (either layout) -> integer epoch seconds // secs"""
+    if is_compact(col):
+        return type_coerce(col, Integer) // (secs * 1000)
+    return cast(func.strftime("%s", col), Integer) // secs
+
+
+def epoch_ms_expr(col):
+    """Text ts column -> INTEGER epoch ms in SQL (same rounding as to_epoch_ms)"""
+    return cast(func.round((func.julianday(col) - 2440587.5) * 86400000), Integer)
+
+
+def shifted(col, seconds: int):
+    """SQL expression: ts column moved by `seconds` (same layout as `col`)"""
+    if is_compact(col):
+        return type_coerce(col, Integer) + seconds * 1000
+    return func.datetime(col, f"{seconds:+d} seconds")
+
+
+_TEXT_TS = re.compile(r"\bts\s+DATETIME", re.IGNORECASE)
+
+
+def sql_is_compact(create_sql: str) -> bool:
+    """CREATE TABLE statement from sqlite_master -> compact layout?"""
+    return not _TEXT_TS.search(create_sql or "")
+
+
+# ==================== DEVICE KEYS ====================
+
+class DeviceKeys:
+    """device_id <-> integer key, cached from `device_keys`"""
+
+    def __init__(self):
+        self._by_name: dict[str, int] = {}
+        self._by_key: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def load(self, db):
+        rows = db.execute(select(DeviceKey.id, DeviceKey.device_id)).all()
+        with self._lock:
+            self._by_name = {name: key for key, name in rows}
+            self._by_key = {key: name for key, name in rows}
+
+    def key(self, device_id: str) -> Optional[int]:
+        return self._by_name.get(device_id)
+
+    def name(self, key: int) -> str:
+        name = self._by_key.get(key)
+        if name is None:
+            # Başka bir process'in yeni cihazı: tek satırlık okuma
+            with engine.connect() as conn:
+                name = conn.execute(select(DeviceKey.device_id).where(DeviceKey.id == key)).scalar()
+            if name is None:
+                raise LookupError(f"unknown device key {key}")
+            with self._lock:
+                self._by_key[key] = name
+                self._by_name[name] = key
+        return name
+
+    def intern(self, db, device_ids: Iterable[str]) -> dict[str, int]:
+        """
+        Keys for `device_ids`, creating missing ones in the caller's
+        transaction. New keys are published by `publish` after the commit.
+        """
+        pending: dict[str, int] = db.info.setdefault("new_device_keys", {})
+        out, missing = {}, set()
+        for device_id in set(device_ids):
+            key = self._by_name.get(device_id, pending.get(device_id))
+            if key is None:
+                missing.add(device_id)
+            else:
+                out[device_id] = key
+        if missing:
+            db.execute(
+                insert(DeviceKey).prefix_with("OR IGNORE"),
+                [{"device_id": d} for d in sorted(missing)],
+            )
+            rows = db.execute(
+                select(DeviceKey.device_id, DeviceKey.id).where(DeviceKey.device_id.in_(missing))
+            ).all()
+            for device_id, key in rows:
+                out[device_id] = pending[device_id] = key
+        return out
+
+    def publish(self, db):
+        created = db.info.pop("new_device_keys", None)
+        if created:
+            with self._lock:
+                self._by_name.update(created)
+                self._by_key.update({key: name for name, key in created.items()})
+
+    def discard(self, db):
+        db.info.pop("new_device_keys", None)
+
+
+UNKNOWN_KEY = -1      # anahtarı olmayan cihaz adının bind değeri (key'ler 1'den başlar)
+
+
+class DeviceKeyType(TypeDecorator):
+    """device_id stored as its integer key; unknown names are bound as UNKNOWN_KEY (match nothing)"""
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        key = device_keys.key(value)
+        # Ham string bağlanmaz: INTEGER affinity "42"yi 42 numaralı cihazla eşler
+        return UNKNOWN_KEY if key is None else key
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        return device_keys.name(int(value))
+
+    def bind_processor(self, dialect):
+        def process(value):
+            if value.__class__ is int:
+                return value
+            return self.process_bind_param(value, dialect)
+        return process
+
+    def result_processor(self, dialect, coltype):
+        def process(value, keys=device_keys):
+            name = keys._by_key.get(value)
+            return name if name is not None else self.process_result_value(value, dialect)
+        return process
+
+
+# Global device key map (loaded with the partition registry)
+device_keys = DeviceKeys()
@@ -9,12 +9,100 @@ class Settings(BaseSettings):
     APP_NAME: str = "Know The Air Backend"
     API_KEY: str = "know-the-air-you-breaathe-in"
     DB_PATH: str = "./data/air_quality.db"
+    DB_WAL: bool = True                    # journal_mode=WAL: okuyucular yazarı beklemez
+    DB_BUSY_TIMEOUT_MS: int = 5000         # kilitli veritabanında SQLITE_BUSY'den önce bekleme
     CORS_ORIGINS: str = "http://localhost:5173,http://127.0.0.1:5173,http://localhost:5500,http://127.0.0.1:5500"
 
     # ================== MQTT SETTINGS ==================
     MQTT_BROKER: str = "broker.emqx.io"
     MQTT_PORT: int = 1883
     MQTT_TOPIC_PREFIX: str = "kayseri/air_quality/"
+    MQTT_BATCH_ROWS: int = 500             # client kuyruğunda bekleyenler tek submit'te (en fazla)
+    MQTT_MAX_INFLIGHT: int = 5000          # commit bekleyen satır sınırı; aşılınca consumer bekler
+
+    # ================== MQTT SCALE-OUT ==================
+    # Okuma tarafı durumu (latest, ETag, stream, alert) process başına: API'yi sunan tek process'te boş bırakın
+
+    # ================== INGEST ==================
+    INGEST_BATCH_MAX: int = 5000
+    INGEST_QUEUE_MAX: int = 10000          # bekleyen batch sayısı (backpressure sınırı)
+    INGEST_FLUSH_ROWS: int = 500           # bu kadar satır birikince commit
+    INGEST_FLUSH_MS: int = 50              # ya da bu kadar süre geçince commit
+    INGEST_SUBMIT_TIMEOUT_S: float = 2.0   # kuyruk doluysa HTTP ingest bekleme süresi
+
+    # ================== FRAME DEDUP ==================
+    DEDUP_ENABLED: bool = True
+    DEDUP_WINDOW: int = 256                # cihaz başına hatırlanan son frame_counter sayısı
+    DEDUP_TTL_S: float = 300.0             # bu süre içinde tekrar gelen sayaç = duplicate
+    DEDUP_MAX_GAP: int = 10000             # daha büyük ileri sıçrama kayıp değil resync sayılır
+    DEDUP_MAX_DEVICES: int = 100000
+    FRAME_COUNTER_BITS: int = 32           # node'daki sayaç uint32
+
+    # ================== PARTITIONING ==================
+    PARTITIONING_ENABLED: bool = True      # yeni ölçümler aylık measurements_YYYYMM tablolarına
+    PARTITION_RETENTION_MONTHS: int = 0    # 0 = sınırsız; N = N aydan eski partition'ları DROP et
+    PARTITION_RETENTION_CHECK_S: int = 3600
+    PARTITION_REFRESH_S: float = 30.0      # başka process'lerin açtığı partition'ları görme gecikmesi
+    COMPACT_SCHEMA: bool = True            # yeni partition'lar: integer device key + epoch ms ts
+
+    # ================== ARCHIVE ==================
+    ARCHIVE_AFTER_MONTHS: int = 0          # 0 = kapalı; N = N aydan eski partition'ları sıkıştırılmış bloklara çevir
+    ARCHIVE_CHECK_S: int = 3600
+    ARCHIVE_ZLIB_LEVEL: int = 6
+
+    # ================== ROLLUPS ==================
+    ROLLUPS_ENABLED: bool = True           # 1m/1h/1d rollup'ları ingest sırasında güncelle
+
+    # ================== HISTORY ==================
+    HISTORY_DOWNSAMPLE_MAX_ROWS: int = 1_000_000   # points=N: bundan uzun aralıklar önce zaman dilimi başına min/max'a indirgenir
+
+    # ================== ALERT EPISODES ==================
+    ALERT_EPISODE_GAP_S: int = 300         # bu süreden uzun boşluk yeni bölüm başlatır
+
+    # ================== LIVE STREAM ==================
+    STREAM_BUFFER: int = 256               # bağlantı başına bekleyen olay sınırı
+    STREAM_MAX_DROPS: int = 1024           # arka arkaya bu kadar olay düşerse bağlantıyı kapat
+    STREAM_HEARTBEAT_S: float = 15.0
+
+    # ================== MAP ==================
+    MAP_GRID_CELL_DEG: float = 0.25        # spatial index hücre boyutu
+    MAP_CLUSTER_MAX_ZOOM: int = 10         # bu zoom'un altında cluster döner
+    MAP_CLUSTER_PX: int = 60               # cluster hücresi (piksel)
+
+    # ================== STREAMING ALERT STATE ==================
+    ALERT_TEST_MODE: bool = False          # True: status = test aralıkları (NORMAL/HIGH, hysteresis + delta)
+    ALERT_EVALUATE_GATEWAY: bool = True    # MQTT / binary satırlarında sunucu kararı daha kötüyse onu yaz
+    ALERT_STATE_PERSIST_S: float = 30.0    # cihaz durumlarının alert_state tablosuna yazılma aralığı
+
+    # ================== ANOMALY DETECTION ==================
+    ANOMALY_ENABLED: bool = True           # sunucu tarafı EWMA z-score -> anom_eco2 / anom_tvoc
+    ANOMALY_HALFLIFE: int = 60             # EWMA yarı ömrü (örnek sayısı)
+    ANOMALY_Z: float = 4.0                 # |x - ortalama| / std bu değeri aşarsa anomali
+    ANOMALY_WARMUP: int = 30               # cihazın bu kadar örneği olmadan anomali işaretlenmez
+    ANOMALY_MIN_STD_ECO2: float = 10.0     # std alt sınırı (ppm): sabit sinyalde küçük oynamalar anomali sayılmasın
+    ANOMALY_MIN_STD_TVOC: float = 5.0      # std alt sınırı (ppb)
+    ANOMALY_EVALUATE_GATEWAY: bool = True  # MQTT / binary satırlarında sunucu anomalisi de işaretlenir (OR)
+
+    # ================== FORECAST ==================
+    FORECAST_ENABLED: bool = True          # TinyML tahmini olmayan satırlara sunucu tahmini (pred_*_60m)
+    FORECAST_INTERVAL_S: float = 60.0      # tahmin turu aralığı (kapanan 1m rollup'lar okunur)
+    FORECAST_ALPHA: float = 0.3            # Holt seviye katsayısı
+    FORECAST_BETA: float = 0.05            # Holt eğim katsayısı
+    FORECAST_HORIZON_MIN: int = 60         # tahmin ufku (dakika)
+    FORECAST_WARMUP_MIN: int = 120         # ilk turda modeller bu kadar dakikalık rollup ile ısınır
+    FORECAST_MAX_AGE_MIN: int = 30         # son bucket'ı bundan eski modelin tahmini yazılmaz
+
+    # ================== NOTIFICATIONS ==================
+    NOTIFY_WEBHOOK_URLS: str = ""          # virgülle ayrılmış webhook URL'leri (boş: webhook yok)
+    NOTIFY_MQTT_ENABLED: bool = False      # durum geçişlerini MQTT'ye de yayınla
+    NOTIFY_MQTT_TOPIC: str = "kayseri/alerts"    # + /<city>/<district>
+    NOTIFY_DEBOUNCE_S: float = 10.0        # pencere içindeki geçişler cihaz başına tek olayda birleşir
+    NOTIFY_BATCH_MAX: int = 500            # tek teslimattaki en fazla olay
+    NOTIFY_QUEUE_MAX: int = 100            # sink başına bekleyen batch sınırı; dolunca en eskisi düşer
+    NOTIFY_RETRIES: int = 3                # başarısız teslimat bu kadar tekrar denenir
+    NOTIFY_RETRY_BASE_S: float = 1.0       # üstel bekleme: 1, 2, 4 ... saniye
+    NOTIFY_TIMEOUT_S: float = 5.0          # webhook isteği zaman aşımı
+    NOTIFY_POOL_SIZE: int = 4              # webhook başına keep-alive bağlantı
 
     # ================== BASELINE / TREND ==================
     BASELINE_SECONDS: int = 60
@@ -43,5 +131,8 @@ class Settings(BaseSettings):
     def cors_list(self) -> List[str]:
         return [x.strip() for x in self.CORS_ORIGINS.split(",") if x.strip()]
 
+    def webhook_urls(self) -> List[str]:
+        return [x.strip() for x in self.NOTIFY_WEBHOOK_URLS.split(",") if x.strip()]
+
 
 settings = Settings()
\ No newline at end of file
@@ -1,14 +1,29 @@
+import numpy as np
 from sqlalchemy.orm import Session
-from sqlalchemy import select, desc
-from datetime import datetime, timezone
-from .models import Measurement, Device
-from .schemas import IngestPayload, DeviceCreate
-from .alerts import evaluate_alert
+from sqlalchemy import select, func, cast, Integer
+from datetime import datetime, timedelta, timezone
+from .models import Measurement, Device, AlertRule
+from .schemas import IngestPayload, DeviceCreate, AlertRuleIn
+from .alerts import AlertResult
+from .alert_state import alert_states, is_alert
+from .rules import rule_engine
+from .latest_cache import latest_store
+from .geo_index import device_grid
+from .versions import data_versions
+from .rollups import bucket_start, rollup_coverage, ROLLUP_METRICS, ROLLUP_TABLES
+from .config import settings
+from .downsample import downsample_indices, group_extremes
+from .serialize import MEASUREMENT_OUT_FIELDS
+from .compact import epoch_seconds, epoch_bucket
+from . import partitions, archive
 
+# measurements tablosunun id dışındaki tüm kolonları
+MEASUREMENT_COLUMNS = [c.name for c in Measurement.__table__.columns if c.name != "id"]
 
-def create_measurement(db: Session, payload: IngestPayload) -> Measurement:
-    ts = payload.ts or datetime.now(timezone.utc)
-    m = Measurement(
+
+def _measurement_row(payload: IngestPayload, ts: datetime, alert: AlertResult) -> dict:
+    """IngestPayload + alert sonucu -> measurements tablosu satırı"""
+    return dict(
         device_id=payload.device_id,
         ts=ts,
         temp_c=payload.temp_c,
@@ -18,29 +33,369 @@ def create_measurement(db: Session, payload: IngestPayload) -> Measurement:
         eco2_ppm=payload.eco2_ppm,
         rssi=payload.rssi,
         snr=payload.snr,
-        
+        aq_score=round(alert.score),
+        status=alert.status,
+        alert=is_alert(alert.status),
+        frame_counter=payload.frame_counter,
+        server_scored=True,
     )
-    alert = evaluate_alert(db, payload.device_id, ts, payload.tvoc_ppb, payload.eco2_ppm)
-    m.score = alert.score
-    m.status = alert.status
 
-    db.add(m)
-    db.commit()
-    db.refresh(m)
-    return m
+
+def _evaluate(db: Session, payload: IngestPayload, ts: datetime) -> AlertResult:
+    """Baseline, delta and test-range rules on the shared streaming state"""
+    return alert_states.evaluate(
+        db, payload.device_id, ts, payload.tvoc_ppb, payload.eco2_ppm,
+        payload.temp_c, payload.hum_rh, payload.pressure_hpa,
+    )
+
+
+def build_measurement_rows(db: Session, payloads: list[IngestPayload]) -> list[dict]:
+    """
+    Evaluate alerts for the whole batch and build the rows to insert.
+    Earlier payloads of the batch count towards the baseline (and the
+    previous sample) of later ones.
+    """
+    now = datetime.now(timezone.utc)
+    rows = []
+    for p in payloads:
+        ts = p.ts or now
+        rows.append(_measurement_row(p, ts, _evaluate(db, p, ts)))
+    return rows
+
+
+def insert_measurement_rows(db: Session, rows: list[dict]) -> list[dict]:
+    """
+    Insert rows with a single executemany INSERT ... RETURNING (no commit).
+    Missing columns are filled with their defaults so that rows from
+    different ingest paths can share one statement. Sets `id` on each row
+    (None for a frame that is already stored) and returns the inserted rows.
+    """
+    if not rows:
+        return rows
+
+    for row in rows:
+        for col in MEASUREMENT_COLUMNS:
+            row.setdefault(col, None)
+        if row["alert"] is None:
+            row["alert"] = False
+
+    # Aylık partition'lara dağıtılır (PARTITIONING_ENABLED)
+    ids = partitions.insert_rows(db, rows)
+
+    for row, row_id in zip(rows, ids):
+        row["id"] = row_id
+    return [row for row in rows if row["id"] is not None]
+
 
 def get_latest(db: Session, device_id: str) -> Measurement | None:
-    stmt = select(Measurement).where(Measurement.device_id == device_id).order_by(desc(Measurement.ts)).limit(1)
-    return db.execute(stmt).scalars().first()
+    """Newest measurement from the in-memory latest store (no SQL once loaded)"""
+    if not latest_store.loaded:
+        latest_store.backfill(db)
+    return latest_store.get(device_id)
+
+
+def get_latest_row(db: Session, device_id: str) -> dict | None:
+    """Newest measurement as a column dict (no ORM object, fast JSON path)"""
+    if not latest_store.loaded:
+        latest_store.backfill(db)
+    return latest_store.get_row(device_id)
+
 
-def get_history(db: Session, device_id: str, start, end, limit: int) -> list[Measurement]:
-    stmt = select(Measurement).where(Measurement.device_id == device_id)
+def get_latest_many(db: Session, device_ids: list[str]) -> dict[str, Measurement]:
+    """device_id -> newest measurement, for devices that have any"""
+    if not latest_store.loaded:
+        latest_store.backfill(db)
+    return latest_store.get_many(device_ids)
+
+
+def _history_stmt(db: Session, device_id: str, start, end, limit: int, fields=None):
+    """Ascending history over the partitions overlapping [start, end]; ORM rows or `fields` tuples"""
+    M = partitions.entity(db, start, end, device_id)
+    stmt = select(*([M] if fields is None else [getattr(M, f) for f in fields]))
+    stmt = stmt.where(M.device_id == device_id)
     if start:
-        stmt = stmt.where(Measurement.ts >= start)
+        stmt = stmt.where(M.ts >= start)
     if end:
-        stmt = stmt.where(Measurement.ts <= end)
-    stmt = stmt.order_by(Measurement.ts.asc()).limit(limit)
-    return list(db.execute(stmt).scalars().all())
+        stmt = stmt.where(M.ts <= end)
+    return stmt.order_by(M.ts.asc(), M.id.asc()).limit(limit)
+
+
+# Canlı ve arşiv satırları (ts, id) sırasıyla birleştirilir; id sonda taşınıp çıktıdan atılır
+_KEYED_FIELDS = MEASUREMENT_OUT_FIELDS + ("id",)
+_TS = MEASUREMENT_OUT_FIELDS.index("ts")
+
+
+def _row_key(r):
+    return r[_TS], r[-1]
+
+
+def _merge_keyed(live: list, cold: list[dict], limit=None, descending: bool = False) -> list[tuple]:
+    """Keyed live tuples + archived dicts -> MeasurementOut tuples in (ts, id) order"""
+    rows = archive.merge_rows(live, _as_tuples(cold), _row_key, limit, descending)
+    return [r[:-1] for r in rows]
+
+
+def get_history_rows(db: Session, device_id: str, start, end, limit: int) -> list[tuple]:
+    """Ascending history as Core tuples in MeasurementOut field order (fast JSON path)"""
+    stmt = _history_stmt(db, device_id, start, end, limit, _KEYED_FIELDS)
+    items = [tuple(r) for r in db.execute(stmt)]
+    cold = archive.archived_rows(db, device_id, start, end, limit=limit)
+    return _merge_keyed(items, cold, limit)
+
+
+def _as_tuples(rows: list[dict]) -> list[tuple]:
+    return [tuple(r[f] for f in _KEYED_FIELDS) for r in rows]
+
+
+def _alert_history_stmt(db: Session, device_id: str, start, end, limit: int, fields=None):
+    M = partitions.entity(db, start, end, device_id, alerts_only=True)
+    return (
+        select(*([M] if fields is None else [getattr(M, f) for f in fields]))
+        .where(M.device_id == device_id)
+        .where(M.alert == True)  # noqa: E712 (partial index koşuluyla birebir aynı olmalı)
+        .where(M.ts >= start)
+        .where(M.ts <= end)
+        .order_by(M.ts.desc(), M.id.desc())
+        .limit(limit)
+    )
+
+
+def get_alert_history_rows(db: Session, device_id: str, start, end, limit: int) -> list[tuple]:
+    stmt = _alert_history_stmt(db, device_id, start, end, limit, _KEYED_FIELDS)
+    items = [tuple(r) for r in db.execute(stmt)]
+    cold = archive.archived_rows(db, device_id, start, end, limit=limit, descending=True, alerts_only=True)
+    return _merge_keyed(items, cold, limit, descending=True)
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _epoch(ts) -> float:
+    return (ts.replace(tzinfo=None) - _EPOCH).total_seconds()
+
+
+def _downsample_ids(
+    db: Session, M, device_id: str, start, end, points: int, mode: str, metric: str
+) -> tuple[list[int], dict[int, dict]]:
+    """
+    Ids chosen from the live tables, plus chosen archived rows by id.
+    Ranges with more than HISTORY_DOWNSAMPLE_MAX_ROWS rows are first reduced
+    to the min and max row of equal time slices (see _slice_extremes), so
+    the whole range is downsampled, newest rows included.
+    """
+    col = getattr(M, metric)
+    where = [M.device_id == device_id]
+    if start:
+        where.append(M.ts >= start)
+    if end:
+        where.append(M.ts <= end)
+
+    # Sayım (device_id, ts) indeksinden, NULL metrikler dahil: üst sınır
+    live_n = db.execute(select(func.count()).select_from(M).where(*where)).scalar()
+    cold_n, cold_first, cold_last = archive.archived_extent(db, device_id, start, end)
+    if live_n + cold_n > settings.HISTORY_DOWNSAMPLE_MAX_ROWS:
+        rows, cold = _slice_extremes(db, M, col, where, device_id, start, end, metric, (cold_first, cold_last))
+    else:
+        stmt = select(M.id, epoch_seconds(M.ts), col).where(*where, col.is_not(None)).order_by(M.ts.asc())
+        rows = db.execute(stmt).all()
+        cold = {
+            r["id"]: r
+            for block in archive.archived_blocks(db, device_id, start, end)
+            for r in block
+            if r[metric] is not None
+        }
+        if cold:
+            # Arşiv satırları aynı (id, x, y) biçiminde; ts'e göre birleştirilir
+            rows = sorted(rows + [(i, _epoch(r["ts"]), r[metric]) for i, r in cold.items()], key=lambda r: r[1])
+    if not rows:
+        return [], {}
+
+    ids, x, y = (np.asarray(c) for c in zip(*rows))
+    picked = downsample_indices(x.astype(np.float64), y.astype(np.float64), points, mode)
+    chosen = [int(i) for i in ids[picked]]
+    return [i for i in chosen if i not in cold], {i: cold[i] for i in chosen if i in cold}
+
+
+def _slice_extremes(db: Session, M, col, where: list, device_id: str, start, end, metric: str, cold_span):
+    """
+    (id, x, y) of the min and max row of each of HISTORY_DOWNSAMPLE_MAX_ROWS / 2
+    equal time slices of [start, end] (live rows with one GROUP BY per
+    extreme, archived rows block by block), sorted by x; plus the archived
+    rows among them by id.
+    """
+    x_expr = epoch_seconds(M.ts)
+    lo, hi = db.execute(select(func.min(x_expr), func.max(x_expr)).where(*where)).one()
+    xs = [v for v in (lo, hi) if v is not None] + [_epoch(t) for t in cold_span if t is not None]
+    x0 = _epoch(start) if start else min(xs)
+    x1 = _epoch(end) if end else max(xs)
+    slices = max(settings.HISTORY_DOWNSAMPLE_MAX_ROWS // 2 - 1, 1)
+    scale = slices / max(x1 - x0, 1e-3)
+
+    # SQLite: min()/max() ile seçilen satırın "bare" kolonları (id, x) döner
+    grp = cast((x_expr - x0) * scale, Integer).label("grp")
+    rows = []
+    for extreme in (func.min, func.max):
+        stmt = select(M.id, x_expr, extreme(col), grp).where(*where, col.is_not(None)).group_by(grp)
+        rows += [tuple(r) for r in db.execute(stmt)]
+
+    cold = {}
+    for block in archive.archived_blocks(db, device_id, start, end):
+        block = [r for r in block if r[metric] is not None]
+        if not block:
+            continue
+        x = np.array([_epoch(r["ts"]) for r in block])
+        y = np.array([r[metric] for r in block], dtype=np.float64)
+        g = ((x - x0) * scale).astype(np.int64)
+        for i in group_extremes(g, y).tolist():
+            r = block[i]
+            cold[r["id"]] = r
+            rows.append((r["id"], x[i], r[metric], int(g[i])))
+
+    # Aynı dilime düşen canlı / arşiv adaylarından yine yalnızca min ve max kalır
+    g = np.array([r[3] for r in rows], dtype=np.int64)
+    y = np.array([r[2] for r in rows], dtype=np.float64)
+    rows = sorted((rows[i][:3] for i in group_extremes(g, y).tolist()), key=lambda r: r[1])
+    kept = {r[0] for r in rows}
+    return rows, {i: r for i, r in cold.items() if i in kept}
+
+
+def get_history_downsampled_rows(
+    db: Session,
+    device_id: str,
+    start,
+    end,
+    points: int,
+    mode: str = "lttb",
+    metric: str = "tvoc_ppb",
+) -> list[tuple]:
+    M = partitions.entity(db, start, end, device_id)
+    chosen, cold = _downsample_ids(db, M, device_id, start, end, points, mode, metric)
+    items = []
+    if chosen:
+        stmt = (
+            select(*[getattr(M, f) for f in _KEYED_FIELDS])
+            .where(M.id.in_(chosen))
+            .order_by(M.ts.asc(), M.id.asc())
+        )
+        items = [tuple(r) for r in db.execute(stmt)]
+    return _merge_keyed(items, list(cold.values()))
+
+
+# Bucketed history
+
+HISTORY_BUCKETS = {"1m": 60, "5m": 300, "1h": 3600, "1d": 86400}
+HISTORY_AGGS = ("avg", "min", "max", "last")
+
+# Bucket -> bu bucket'ı tam bölen en kaba rollup tablosu
+_BUCKET_ROLLUP = {"1m": "1m", "5m": "1m", "1h": "1h", "1d": "1d"}
+
+_INT_METRICS = {"tvoc_ppb", "eco2_ppm", "aq_score"}
+
+
+def get_history_buckets(
+    db: Session,
+    device_id: str,
+    start,
+    end,
+    bucket: str,
+    agg: str,
+    limit: int,
+) -> list[dict]:
+    """
+    Aggregated history: one row per time bucket, computed in SQL.
+    Served from the rollup tables where they cover the device's history
+    (see rollups.RollupCoverage), otherwise GROUP BY over raw measurements.
+    Returns dicts with `ts` (bucket start), `n` (raw samples in bucket) and
+    one value per rollup metric.
+    """
+    if not settings.ROLLUPS_ENABLED:
+        return _bucket_rows(db, device_id, start, end, bucket, agg, limit)
+
+    # Rollup'ların kapsamadığı eski aralık ham satırlardan (since gece yarısı: bucket'lar bölünmez)
+    since = rollup_coverage.since(db, device_id)
+    start_n, end_n = _naive(start), _naive(end)
+    items = []
+    split = since > datetime.min and (start_n is None or start_n < since)
+    if split:
+        raw_end = since - timedelta(microseconds=1)
+        if end_n is not None and end_n < raw_end:
+            raw_end = end
+        items = _bucket_rows(db, device_id, start, raw_end, bucket, agg, limit)
+    if since < datetime.max and (end_n is None or end_n >= since) and len(items) < limit:
+        items += _bucket_rows(
+            db, device_id, since if split else start, end, bucket, agg, limit - len(items), res=_BUCKET_ROLLUP[bucket]
+        )
+    return items
+
+
+def _naive(ts):
+    return ts.replace(tzinfo=None) if ts is not None else None
+
+
+def _bucket_rows(db: Session, device_id: str, start, end, bucket: str, agg: str, limit: int, res=None) -> list[dict]:
+    """GROUP BY over the `res` rollup table, or over raw measurements when res is None"""
+    secs = HISTORY_BUCKETS[bucket]
+
+    if res is not None:
+        t = ROLLUP_TABLES[res][0].__table__
+        ts_col, last_col = t.c.bucket, t.c.last_ts
+        n_expr = func.sum(t.c.n)
+        if start:
+            start = bucket_start(start, res)
+
+        def metric_expr(m: str):
+            if agg == "avg":
+                return func.sum(t.c[f"{m}_sum"]) / func.nullif(func.sum(t.c[f"{m}_n"]), 0)
+            if agg == "min":
+                return func.min(t.c[f"{m}_min"])
+            if agg == "max":
+                return func.max(t.c[f"{m}_max"])
+            return t.c[f"{m}_last"]
+    else:
+        t = partitions.source(db, start, end, device_id)
+        ts_col = last_col = t.c.ts
+        n_expr = func.count()
+
+        def metric_expr(m: str):
+            if agg == "avg":
+                return func.avg(t.c[m])
+            if agg == "min":
+                return func.min(t.c[m])
+            if agg == "max":
+                return func.max(t.c[m])
+            return t.c[m]
+
+    # agg=last: SQLite, max() ile seçilen satırın "bare" kolonlarını döndürür
+    group = epoch_bucket(ts_col, secs).label("grp")
+    stmt = (
+        select(
+            group,
+            n_expr.label("n"),
+            func.max(last_col).label("last_ts"),
+            *[metric_expr(m).label(m) for m in ROLLUP_METRICS],
+        )
+        .where(t.c.device_id == device_id)
+        .group_by(group)
+        .order_by(group.asc())
+        .limit(limit)
+    )
+    if start:
+        stmt = stmt.where(ts_col >= start)
+    if end:
+        stmt = stmt.where(ts_col <= end)
+
+    items = []
+    for r in db.execute(stmt).mappings():
+        item = {
+            "device_id": device_id,
+            "ts": datetime.fromtimestamp(r["grp"] * secs, tz=timezone.utc).replace(tzinfo=None),
+            "n": r["n"],
+        }
+        for m in ROLLUP_METRICS:
+            v = r[m]
+            item[m] = round(v) if v is not None and m in _INT_METRICS else v
+        items.append(item)
+    return items
 
 
 # Device CRUD fonksiyonları
@@ -58,6 +413,8 @@ def create_device(db: Session, device: DeviceCreate) -> Device:
     db.add(db_device)
     db.commit()
     db.refresh(db_device)
+    device_grid.add(db_device)
+    data_versions.bump_devices([db_device.device_id])
     return db_device
 
 
@@ -96,4 +453,41 @@ def get_districts_by_city(db: Session, city: str) -> list[str]:
     """Belirli bir ilin ilçelerini getir"""
     stmt = select(Device.district).where(Device.city == city).distinct()
     districts = db.execute(stmt).scalars().all()
-    return sorted([d for d in districts if d])
\ No newline at end of file
+    return sorted([d for d in districts if d])
+
+
+# Alert rule CRUD fonksiyonları (her değişiklikten sonra kurallar yeniden derlenir)
+
+def get_rules(db: Session) -> list[AlertRule]:
+    return list(db.execute(select(AlertRule).order_by(AlertRule.id)).scalars().all())
+
+
+def create_rule(db: Session, rule: AlertRuleIn) -> AlertRule:
+    db_rule = AlertRule(**rule.model_dump())
+    db.add(db_rule)
+    db.commit()
+    db.refresh(db_rule)
+    rule_engine.load(db)
+    return db_rule
+
+
+def update_rule(db: Session, rule_id: int, rule: AlertRuleIn) -> AlertRule | None:
+    db_rule = db.get(AlertRule, rule_id)
+    if db_rule is None:
+        return None
+    for key, value in rule.model_dump().items():
+        setattr(db_rule, key, value)
+    db.commit()
+    db.refresh(db_rule)
+    rule_engine.load(db)
+    return db_rule
+
+
+def delete_rule(db: Session, rule_id: int) -> bool:
+    db_rule = db.get(AlertRule, rule_id)
+    if db_rule is None:
+        return False
+    db.delete(db_rule)
+    db.commit()
+    rule_engine.load(db)
+    return True
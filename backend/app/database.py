@@ -1,14 +1,16 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 # ✅ Config import'unu DÜZELTTİK
 try:
     from .config import settings
     db_path = settings.DB_PATH
+    wal, busy_timeout_ms = settings.DB_WAL, settings.DB_BUSY_TIMEOUT_MS
 except AttributeError:
     # Fallback if settings not loaded properly
     db_path = "./data/air_quality.db"
+    wal, busy_timeout_ms = True, 5000
 
 # ✅ Directory oluşturma
 db_dir = os.path.dirname(db_path)
@@ -21,6 +23,19 @@ engine = create_engine(
     future=True,
 )
 
+
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _record):
+    cursor = dbapi_conn.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        if wal:
+            # Ingest yazarken API okumaları bloklanmaz (ayar veritabanı dosyasında kalıcı)
+            cursor.execute("PRAGMA journal_mode = WAL")
+    finally:
+        cursor.close()
+
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
 class Base(DeclarativeBase):
@@ -31,4 +46,27 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def create_missing_indexes():
+    """
+    create_all() skips tables that already exist, so indexes added later
+    (e.g. partial indexes) are created here for existing databases.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def begin_write(db):
+    """
+    Take SQLite's write lock now (BEGIN IMMEDIATE) so that everything the
+    transaction reads afterwards stays valid until it commits. pysqlite only
+    opens a transaction before the first INSERT/UPDATE/DELETE, so reads done
+    before that run outside any lock. No-op when the transaction has already
+    written (it holds the lock).
+    """
+    conn = db.connection().connection.driver_connection
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
@@ -0,0 +1,277 @@
+"""
+Frame-counter deduplication for ingest (HTTP + MQTT).
+
+The gateway re-publishes one LoRa frame to several topics and radio retries
+resend frames, so the same `(device_id, frame_counter)` can arrive more
+than once. Every device keeps an LRU of its recently seen counters (with
+arrival time); a counter seen again within DEDUP_TTL_S is a duplicate and
+is dropped before it reaches the ingest queue. Behind it, the ingest
+writer looks the batch's frames up in the partitions before any stateful
+stage (`partitions.stored_frames`), which catches copies the LRU cannot see
+(e.g. right after a restart): frames with a device ts by
+(device_id, ts, frame_counter), also enforced by a UNIQUE index, and
+server-stamped frames by (device_id, frame_counter) within DEDUP_TTL_S.
+
+The LRU is updated when a frame arrives; the sequence bookkeeping below
+runs in the ingest writer for the rows a commit inserts (`advance`) and is
+snapshotted / restored with the other per-device state, so a failed
+commit leaves no trace in the loss counters and its retry is scored as
+if it were the first attempt (`forget` drops the LRU entries).
+
+Counters are uint32 on the node and restart at 0 when it reboots:
+- forward step (mod 2^FRAME_COUNTER_BITS) up to DEDUP_MAX_GAP: normal,
+  skipped counters are counted as lost (wrap-around is just a small step)
+- backward, not seen recently: late frame from a counted gap (lost - 1)
+- back to a small counter, or a counter whose LRU entry has expired:
+  reboot, the sequence restarts
+- any other jump: resync without counting losses
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import select
+
+from .config import settings
+from . import partitions
+
+
+class FrameSequence:
+    """Sequence state of one device, advanced by the ingest writer for inserted frames"""
+    __slots__ = ("seen", "last", "lost", "late", "reboots", "wraps", "resyncs")
+
+    def __init__(self):
+        self.seen: OrderedDict[int, None] = OrderedDict()    # son yazılan sayaçlar (reboot tespiti)
+        self.last: Optional[int] = None
+        self.lost = 0
+        self.late = 0
+        self.reboots = 0
+        self.wraps = 0
+        self.resyncs = 0
+
+    def copy(self) -> "FrameSequence":
+        seq = FrameSequence()
+        seq.seen = OrderedDict(self.seen)
+        seq.last, seq.lost, seq.late = self.last, self.lost, self.late
+        seq.reboots, seq.wraps, seq.resyncs = self.reboots, self.wraps, self.resyncs
+        return seq
+
+
+class DeviceFrames:
+    """Recently arrived counters and counters of one device"""
+    __slots__ = ("recent", "arrived", "accepted", "duplicates", "seq")
+
+    def __init__(self):
+        self.recent: OrderedDict[int, float] = OrderedDict()   # frame_counter -> arrival (monotonic)
+        self.arrived: Optional[int] = None                       # son gelen sayaç (LRU sıfırlama)
+        self.accepted = 0
+        self.duplicates = 0
+        self.seq = FrameSequence()
+
+    def as_dict(self) -> dict:
+        seq = self.seq
+        seen = self.accepted + seq.lost
+        return {
+            "last_frame_counter": seq.last,
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "lost": seq.lost,
+            "loss_pct": round(100.0 * seq.lost / seen, 3) if seen else 0.0,
+            "late": seq.late,
+            "reboots": seq.reboots,
+            "wraps": seq.wraps,
+            "resyncs": seq.resyncs,
+        }
+
+
+class FrameDeduper:
+    def __init__(
+        self,
+        window: int = settings.DEDUP_WINDOW,
+        ttl_s: float = settings.DEDUP_TTL_S,
+        max_gap: int = settings.DEDUP_MAX_GAP,
+        bits: int = settings.FRAME_COUNTER_BITS,
+        max_devices: int = settings.DEDUP_MAX_DEVICES,
+    ):
+        self.window = window
+        self.ttl_s = ttl_s
+        self.max_gap = max_gap
+        self.modulo = 1 << bits
+        self.max_devices = max_devices
+        self._devices: OrderedDict[str, DeviceFrames] = OrderedDict()
+        self._lock = threading.Lock()
+        self.index_duplicates = 0   # LRU'yu geçip UNIQUE index'e takılanlar
+
+    def _state(self, device_id: str) -> DeviceFrames:
+        st = self._devices.get(device_id)
+        if st is None:
+            st = self._devices[device_id] = DeviceFrames()
+            if len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+        else:
+            self._devices.move_to_end(device_id)
+        return st
+
+    def _remember(self, recent: OrderedDict, fc: int, value):
+        recent[fc] = value
+        recent.move_to_end(fc)
+        while len(recent) > self.window:
+            recent.popitem(last=False)
+
+    def _classify(self, last: Optional[int], fc: int, seen) -> str:
+        """Step from `last` to `fc`: first / step / late / reboot / resync"""
+        if last is None:
+            return "first"
+        if fc in seen:
+            return "reboot"     # aynı sayaç daha önce görülmüş (TTL dışında geldi)
+        if 0 < (fc - last) % self.modulo <= self.max_gap:
+            return "step"
+        if (last - fc) % self.modulo <= self.window:
+            return "late"       # sayılmış bir boşluktan geç gelen frame
+        if fc < self.window:
+            return "reboot"     # sayaç başa döndü
+        return "resync"
+
+    def _advance(self, seq: FrameSequence, fc: int, count: bool = True):
+        """Sequence bookkeeping for an inserted (not duplicate) frame"""
+        kind = self._classify(seq.last, fc, seq.seen)
+        if count:
+            if kind == "step":
+                seq.lost += (fc - seq.last) % self.modulo - 1
+                seq.wraps += fc < seq.last
+            elif kind == "late":
+                seq.late += 1
+                seq.lost = max(0, seq.lost - 1)
+            elif kind == "reboot":
+                seq.reboots += 1
+            elif kind == "resync":
+                seq.resyncs += 1
+        if kind in ("reboot", "resync"):
+            seq.seen.clear()
+        if kind != "late":
+            seq.last = fc
+        self._remember(seq.seen, fc, None)
+
+    def _arrive(self, st: DeviceFrames, fc: int, now: float):
+        """LRU side of a new frame: a reboot / resync forgets the old counters"""
+        kind = self._classify(st.arrived, fc, st.recent)
+        if kind in ("reboot", "resync"):
+            st.recent.clear()
+        if kind != "late":
+            st.arrived = fc
+        self._remember(st.recent, fc, now)
+
+    def accept(self, device_id: str, frame_counter: Optional[int], now: Optional[float] = None) -> bool:
+        """False if this frame was already seen within DEDUP_TTL_S (drop it)"""
+        if frame_counter is None or not settings.DEDUP_ENABLED:
+            return True
+        fc = int(frame_counter) % self.modulo
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            st = self._state(device_id)
+            seen_at = st.recent.get(fc)
+            if seen_at is not None and now - seen_at <= self.ttl_s:
+                st.duplicates += 1
+                return False
+            self._arrive(st, fc, now)
+            st.accepted += 1
+            return True
+
+    def filter_rows(self, rows: Iterable[dict]) -> list[dict]:
+        return [r for r in rows if self.accept(r["device_id"], r.get("frame_counter"))]
+
+    def advance(self, rows: Iterable[dict]):
+        """Sequence bookkeeping for the rows a commit inserts, in order (ingest writer)"""
+        if not settings.DEDUP_ENABLED:
+            return
+        with self._lock:
+            for r in rows:
+                fc = r.get("frame_counter")
+                if fc is not None:
+                    self._advance(self._state(r["device_id"]).seq, int(fc) % self.modulo)
+
+    def snapshot(self, device_ids) -> dict:
+        """Copies of these devices' sequence state, for `restore` after a failed commit"""
+        with self._lock:
+            return {d: (st.seq.copy() if (st := self._devices.get(d)) else None) for d in device_ids}
+
+    def restore(self, snapshot: dict):
+        """Put back the sequence state of a snapshot (arrival LRUs are untouched, see `forget`)"""
+        with self._lock:
+            for device_id, seq in snapshot.items():
+                st = self._devices.get(device_id)
+                if st is not None:
+                    st.seq = seq if seq is not None else FrameSequence()
+
+    def forget(self, keys: Iterable[tuple[str, Optional[int]]]):
+        """Frames whose write failed: a retry must not look like a duplicate"""
+        if not settings.DEDUP_ENABLED:
+            return
+        with self._lock:
+            for device_id, fc in keys:
+                st = self._devices.get(device_id)
+                if st is not None and fc is not None:
+                    # Ticket'taki her frame accept'ten geçmişti (LRU girdisi reboot ile silinmiş olabilir)
+                    st.recent.pop(int(fc) % self.modulo, None)
+                    st.accepted -= 1
+
+    def record_index_duplicates(self, rows: Iterable[dict]):
+        """Rows the UNIQUE index ignored (copies the LRU did not know about)"""
+        with self._lock:
+            for r in rows:
+                self.index_duplicates += 1
+                st = self._devices.get(r["device_id"])
+                if st is not None:
+                    st.duplicates += 1
+                    st.accepted -= 1
+
+    def hydrate(self, db, now: Optional[datetime] = None):
+        """Seed the LRUs from frames stored in the last DEDUP_TTL_S (after a restart)"""
+        now = now or datetime.now(timezone.utc)
+        start = (now - timedelta(seconds=self.ttl_s)).replace(tzinfo=None)
+        mono = time.monotonic()
+        t = partitions.source(db, start, None)
+        stmt = (
+            select(t.c.device_id, t.c.ts, t.c.frame_counter)
+            .where(t.c.ts >= start)
+            .where(t.c.frame_counter.is_not(None))
+            .order_by(t.c.ts.asc())
+        )
+        with self._lock:
+            for device_id, ts, fc in db.execute(stmt):
+                age = (now.replace(tzinfo=None) - ts.replace(tzinfo=None)).total_seconds()
+                st, fc = self._state(device_id), int(fc) % self.modulo
+                self._arrive(st, fc, mono - max(age, 0.0))
+                self._advance(st.seq, fc, count=False)
+
+    # ==================== METRICS ====================
+
+    def device_stats(self, device_id: str) -> Optional[dict]:
+        with self._lock:
+            st = self._devices.get(device_id)
+            return st.as_dict() if st is not None else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            states = list(self._devices.values())
+            return {
+                "enabled": settings.DEDUP_ENABLED,
+                "devices": len(states),
+                "accepted": sum(s.accepted for s in states),
+                "duplicates": sum(s.duplicates for s in states),
+                "index_duplicates": self.index_duplicates,
+                "lost": sum(s.seq.lost for s in states),
+                "reboots": sum(s.seq.reboots for s in states),
+            }
+
+    def all_device_stats(self) -> dict[str, dict]:
+        with self._lock:
+            return {device_id: st.as_dict() for device_id, st in self._devices.items()}
+
+
+# Global deduper (MQTT consumer, HTTP ingest routes, ingest writer)
+frame_dedup = FrameDeduper()
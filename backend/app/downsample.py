@@ -0,0 +1,98 @@
+"""
+Visual downsampling for chart history.
+
+Picks N representative rows out of a (possibly huge) time range so that a
+chart drawn from them looks like the full-resolution chart: short spikes
+(e.g. a cologne spray) survive while the payload stays small.
+
+- lttb:   Largest-Triangle-Three-Buckets, exactly N points
+- minmax: min and max of every pixel column, at most N points
+"""
+from __future__ import annotations
+
+import numpy as np
+
+
+DOWNSAMPLE_MODES = ("lttb", "minmax")
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Indices of the `n_out` points chosen by LTTB. `x` must be ascending.
+    The first and last points are always kept; every bucket in between
+    contributes the point forming the largest triangle with the previously
+    selected point and the mean of the next bucket.
+    """
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out <= 2:
+        return np.array([0, n - 1][:n_out], dtype=np.int64)
+
+    x = x - x[0]   # prefix sum hassasiyeti için epoch ofsetini at
+
+    # Bucket sınırları: ilk ve son nokta hariç n_out - 2 eşit bucket
+    # (tam sayı aritmetiği: linspace tam sınırları 4.999.. gibi bulup bir aşağı yuvarlayabilir)
+    edges = 1 + np.arange(n_out - 1, dtype=np.int64) * (n - 2) // (n_out - 2)
+
+    # Her bucket'ın ortalaması (bir sonraki bucket için "C" noktası), prefix sum ile tek geçişte
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    starts, ends = edges[:-1], edges[1:]
+    counts = np.maximum(ends - starts, 1)
+    mean_x = (cx[ends] - cx[starts]) / counts
+    mean_y = (cy[ends] - cy[starts]) / counts
+    # Son bucket'tan sonraki "C" noktası son veri noktasıdır
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = starts[i], max(ends[i], starts[i] + 1)
+        bx, by = x[lo:hi], y[lo:hi]
+        # Üçgen alanının 2 katı (mutlak değer): |(Ax - Cx)(By - Ay) - (Ax - Bx)(Cy - Ay)|
+        area = np.abs((x[a] - next_x[i]) * (by - y[a]) - (x[a] - bx) * (next_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Indices of the min and max point of each of n_out // 2 equal-width
+    columns, computed in one vectorized pass (ascending, de-duplicated).
+    """
+    n = len(y)
+    n_cols = max(n_out // 2, 1)
+    if n <= n_out:
+        return np.arange(n)
+
+    return group_extremes((np.arange(n) * n_cols) // n, y)
+
+
+def group_extremes(groups: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Indices of the first minimum and last maximum of every group label
+    (ascending, de-duplicated). Also used to pre-aggregate ranges too long
+    to downsample row by row.
+    """
+    if not len(y):
+        return np.arange(0)
+    # Grup içi min/max için (grup, değer) sırasına göre lexsort (kararlı)
+    order = np.lexsort((y, groups))
+    g = groups[order]
+    first = np.flatnonzero(np.r_[True, g[1:] != g[:-1]])
+    last = np.r_[first[1:] - 1, len(g) - 1]
+
+    picked = np.concatenate((order[first], order[last]))
+    return np.unique(picked)
+
+
+def downsample_indices(x: np.ndarray, y: np.ndarray, n_out: int, mode: str = "lttb") -> np.ndarray:
+    if mode == "lttb":
+        return lttb_indices(x, y, n_out)
+    if mode == "minmax":
+        return minmax_indices(y, n_out)
+    raise ValueError(f"Unknown downsample mode: {mode}")
@@ -0,0 +1,223 @@
+"""
+Alert episodes maintained incrementally at ingest time.
+
+Consecutive alert samples of a device form one episode (start, end, peak
+status, peak score). A non-alert sample, or a gap longer than
+ALERT_EPISODE_GAP_S, closes it. Open episodes are cached in memory so the
+writer only touches rows that actually change.
+
+The writer sees a gap only when the device's next sample arrives, so a
+device that goes silent during an alert leaves its episode `open` in the
+table; readers use `episode_open`, which treats an episode that has not
+been extended for ALERT_EPISODE_GAP_S as closed.
+"""
+from __future__ import annotations
+
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, update, delete, insert
+from sqlalchemy.orm import Session
+
+from .models import AlertEpisode
+from .config import settings
+from . import partitions, archive
+
+
+STATUS_RANK = {"OK": 0, "NORMAL": 0, "WARN": 1, "HIGH": 2}
+
+
+def _rank(status: Optional[str]) -> int:
+    return STATUS_RANK.get(status or "", 0)
+
+
+def episode_open(ep: AlertEpisode, now: datetime) -> bool:
+    """Open, and extended within ALERT_EPISODE_GAP_S of `now` (naive UTC)"""
+    if not ep.open:
+        return False
+    return now - ep.end_ts.replace(tzinfo=None) <= timedelta(seconds=settings.ALERT_EPISODE_GAP_S)
+
+
+class EpisodeTracker:
+    def __init__(self):
+        self.loaded = False
+        self._open: dict[str, dict] = {}       # device_id -> open episode (column dict)
+        self._lock = threading.Lock()
+
+    def load(self, db: Session):
+        """Cache all open episodes (one query via the partial index)"""
+        episodes = db.execute(select(AlertEpisode).where(AlertEpisode.open == True)).scalars()  # noqa: E712
+        self._open = {
+            e.device_id: {c.name: getattr(e, c.name) for c in AlertEpisode.__table__.columns}
+            for e in episodes
+        }
+        self.loaded = True
+
+    def invalidate(self):
+        with self._lock:
+            self._open = {}
+            self.loaded = False
+
+    def reload(self, db: Session, device_ids):
+        """Re-read the open episodes of these devices (e.g. after their episodes were rewritten)"""
+        stmt = select(AlertEpisode).where(AlertEpisode.open == True, AlertEpisode.device_id.in_(list(device_ids)))  # noqa: E712
+        with self._lock:
+            if not self.loaded:
+                return
+            for device_id in device_ids:
+                self._open.pop(device_id, None)
+            for e in db.execute(stmt).scalars():
+                self._open[e.device_id] = {c.name: getattr(e, c.name) for c in AlertEpisode.__table__.columns}
+
+    def snapshot(self, device_ids) -> tuple:
+        """Copies of these devices' open episodes, for `restore` after a failed commit"""
+        with self._lock:
+            return self.loaded, {d: (dict(ep) if (ep := self._open.get(d)) else None) for d in device_ids}
+
+    def restore(self, snapshot: tuple):
+        """Put back the open episodes of a snapshot (other devices are untouched)"""
+        loaded, episodes = snapshot
+        if not loaded:
+            self.invalidate()
+            return
+        with self._lock:
+            for device_id, ep in episodes.items():
+                if ep is None:
+                    self._open.pop(device_id, None)
+                else:
+                    self._open[device_id] = ep
+
+    def apply(self, db: Session, rows: list[dict]):
+        """
+        Fold freshly inserted measurement rows into alert_episodes (no commit).
+        Rows are processed per device in ts order.
+        """
+        gap = timedelta(seconds=settings.ALERT_EPISODE_GAP_S)
+        with self._lock:
+            if not self.loaded:
+                self.load(db)
+
+            touched: dict[int, dict] = {}     # episode id -> changed episode
+            created: list[dict] = []          # bu çağrıda açılan bölümler
+            for row in sorted(rows, key=lambda r: (r["device_id"], r["ts"].replace(tzinfo=None))):
+                device_id = row["device_id"]
+                ts = row["ts"].replace(tzinfo=None)
+                ep = self._open.get(device_id)
+
+                if ep is not None and ts < ep["end_ts"]:
+                    continue  # geç gelen örnek: kapanmış/açık bölümü yeniden yazma
+
+                if ep is not None and (not row.get("alert") or ts - ep["end_ts"] > gap):
+                    ep["open"] = False
+                    if "id" in ep:
+                        touched[ep["id"]] = ep
+                    del self._open[device_id]
+                    ep = None
+
+                if not row.get("alert"):
+                    continue
+
+                if ep is None:
+                    ep = {
+                        "device_id": device_id,
+                        "start_ts": ts,
+                        "end_ts": ts,
+                        "peak_status": row.get("status"),
+                        "peak_score": row.get("aq_score"),
+                        "samples": 1,
+                        "open": True,
+                    }
+                    # id'si yok: sonda tek executemany INSERT ile son haliyle yazılır
+                    created.append(ep)
+                    self._open[device_id] = ep
+                    continue
+
+                ep["end_ts"] = ts
+                ep["samples"] += 1
+                if _rank(row.get("status")) > _rank(ep["peak_status"]):
+                    ep["peak_status"] = row.get("status")
+                score = row.get("aq_score")
+                if score is not None and (ep["peak_score"] is None or score > ep["peak_score"]):
+                    ep["peak_score"] = score
+                if "id" in ep:
+                    touched[ep["id"]] = ep
+
+            if created:
+                t = AlertEpisode.__table__
+                ids = db.execute(
+                    insert(t).returning(t.c.id, sort_by_parameter_order=True),
+                    [dict(ep) for ep in created],
+                ).scalars().all()
+                for ep, episode_id in zip(created, ids):
+                    ep["id"] = episode_id
+
+            if touched:
+                db.execute(
+                    update(AlertEpisode),
+                    [
+                        {k: ep[k] for k in ("id", "end_ts", "peak_status", "peak_score", "samples", "open")}
+                        for ep in touched.values()
+                    ],
+                )
+
+
+def rebuild_episodes(db: Session, device_id: Optional[str] = None, chunk_rows: int = 50_000) -> int:
+    """Recompute alert_episodes from raw measurements. Returns rows scanned."""
+    stmt = delete(AlertEpisode)
+    if device_id:
+        stmt = stmt.where(AlertEpisode.device_id == device_id)
+    db.execute(stmt)
+
+    tracker = EpisodeTracker()
+    tracker.loaded = True   # tablo temizlendi, açık bölüm yok
+
+    total = 0
+    chunk: list[dict] = []
+    # Önce arşiv blokları (gün sırasıyla)
+    for rows in archive.iter_archived(db, device_id):
+        chunk.extend(rows)
+        if len(chunk) >= chunk_rows:
+            tracker.apply(db, chunk)
+            total += len(chunk)
+            chunk = []
+    tracker.apply(db, chunk)
+    total += len(chunk)
+    chunk = []
+
+    # Partition'lar zaman sırasıyla: cihaz başına ts sırası korunur
+    for t in partitions.tables_chronological(db):
+        cols = [t.c.device_id, t.c.ts, t.c.alert, t.c.status, t.c.aq_score]
+        stmt = select(*cols).order_by(t.c.device_id, t.c.ts)
+        if device_id:
+            stmt = stmt.where(t.c.device_id == device_id)
+
+        for row in db.execute(stmt.execution_options(yield_per=chunk_rows)).mappings():
+            chunk.append(dict(row))
+            if len(chunk) >= chunk_rows:
+                tracker.apply(db, chunk)
+                total += len(chunk)
+                chunk = []
+        # Sonraki tablo daha yeni: kalan satırları önce işle
+        tracker.apply(db, chunk)
+        total += len(chunk)
+        chunk = []
+
+    db.commit()
+    return total
+
+
+def get_episodes(db: Session, device_id: str, start: datetime, limit: int) -> list[AlertEpisode]:
+    """Episodes that ended after `start`, newest first"""
+    stmt = (
+        select(AlertEpisode)
+        .where(AlertEpisode.device_id == device_id)
+        .where(AlertEpisode.end_ts >= start)
+        .order_by(AlertEpisode.end_ts.desc())
+        .limit(limit)
+    )
+    return list(db.execute(stmt).scalars().all())
+
+
+# Global tracker (used by the ingest writer)
+episode_tracker = EpisodeTracker()
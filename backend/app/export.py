@@ -0,0 +1,110 @@
+"""
+Streaming history export (NDJSON / CSV).
+
+Rows are read with SQLAlchemy Core in keyset-paginated chunks ordered by
+(ts, id) and encoded chunk by chunk, so memory stays constant no matter how
+long the range is. Each chunk uses its own short read transaction, which
+keeps SQLite writers unblocked during long exports.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator, Optional
+
+from sqlalchemy import select, tuple_
+
+from .database import engine
+from .models import Measurement
+from . import partitions, archive
+
+
+EXPORT_FORMATS = ("ndjson", "csv")
+
+# server_scored: iç işaret (arşiv bloklarında yok)
+EXPORT_COLUMNS = [c.name for c in Measurement.__table__.columns if c.name != "server_scored"]
+
+
+def parse_cursor(value: str) -> tuple[datetime, int]:
+    """'<iso ts>,<id>' -> (ts, id). Raises ValueError on bad input."""
+    ts_raw, _, id_raw = value.rpartition(",")
+    if not ts_raw:
+        raise ValueError("cursor must be '<ts>,<id>'")
+    return datetime.fromisoformat(ts_raw).replace(tzinfo=None), int(id_raw)
+
+
+def format_cursor(ts: datetime, row_id: int) -> str:
+    return f"{ts.isoformat()},{row_id}"
+
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+_TS, _ID = EXPORT_COLUMNS.index("ts"), EXPORT_COLUMNS.index("id")
+
+
+def _key(row):
+    return row[_TS], row[_ID]
+
+
+def iter_rows(
+    device_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cursor: Optional[tuple[datetime, int]] = None,
+    chunk_rows: int = 5000,
+) -> Iterator[list]:
+    """Yield lists of row tuples (EXPORT_COLUMNS order), resuming after `cursor`"""
+    while True:
+        # Yalnızca cursor'dan sonraki partition'lar okunur
+        lower = start
+        if cursor is not None and (lower is None or cursor[0] > lower.replace(tzinfo=None)):
+            lower = cursor[0]
+
+        with engine.connect() as conn:
+            t = partitions.source(conn, lower, end, device_id)
+            stmt = select(*[t.c[c] for c in EXPORT_COLUMNS]).where(t.c.device_id == device_id)
+            if start:
+                stmt = stmt.where(t.c.ts >= start)
+            if end:
+                stmt = stmt.where(t.c.ts <= end)
+            if cursor is not None:
+                stmt = stmt.where(tuple_(t.c.ts, t.c.id) > tuple(cursor))
+            stmt = stmt.order_by(t.c.ts.asc(), t.c.id.asc()).limit(chunk_rows)
+            rows = [tuple(r) for r in conn.execute(stmt)]
+            # Arşivlenmiş günler aynı keyset ile araya karıştırılır
+            cold = archive.archived_rows(conn, device_id, start, end, after=cursor, limit=chunk_rows)
+            rows = archive.merge_rows(rows, [tuple(r[c] for c in EXPORT_COLUMNS) for r in cold], _key, chunk_rows)
+        if not rows:
+            return
+
+        yield rows
+        if len(rows) < chunk_rows:
+            return
+        last = rows[-1]
+        cursor = (last[_TS], last[_ID])
+
+
+def iter_ndjson(chunks: Iterator[list]) -> Iterator[bytes]:
+    dumps = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+    for rows in chunks:
+        yield "".join(
+            dumps({c: _encode(v) for c, v in zip(EXPORT_COLUMNS, r)}) + "\n" for r in rows
+        ).encode()
+
+
+def iter_csv(chunks: Iterator[list], header: bool = True) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows([_encode(v) for v in r] for r in rows)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue().encode()
@@ -0,0 +1,250 @@
+"""
+Server-side 60-minute forecasts (pred_eco2_60m / pred_tvoc_60m).
+
+Only nodes running TinyML send predictions. For everyone else a periodic
+tick (FORECAST_INTERVAL_S) reads the 1-minute rollup buckets closed since
+the previous tick, in one indexed range query over `rollup_1m` covering all
+devices, and advances a Holt linear-trend model per device and metric on
+the bucket means:
+
+    prior  = level + trend * dt          (dt: minutes since the model's previous bucket)
+    level' = a * mean + (1 - a) * prior
+    trend' = b * (level' - level) / dt + (1 - b) * trend
+    pred   = max(level' + trend' * FORECAST_HORIZON_MIN, 0)
+
+The models are rows of NumPy arrays indexed by device, so a tick runs a few
+vectorized operations per closed minute (normally one) over every device
+that reported in it. Nothing is refit. The first tick warms the models up
+from the last FORECAST_WARMUP_MIN minutes of rollups.
+
+Forecasts are served from memory (`forecaster.get`) and written into the
+pred_* columns of ingested rows that arrive without them. Rows carrying
+the node's own predictions keep them, and models with no bucket in the last
+FORECAST_MAX_AGE_MIN minutes are not written. Needs ROLLUPS_ENABLED.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import SessionLocal
+from .models import Rollup1m
+from .rollups import bucket_start
+
+logger = logging.getLogger(__name__)
+
+FORECAST_METRICS = ("eco2_ppm", "tvoc_ppb")
+PRED_COLUMNS = ("pred_eco2_60m", "pred_tvoc_60m")    # FORECAST_METRICS sırasıyla
+
+_SETTLE_S = 5          # writer gecikmesi: dakika kapandıktan bu kadar sonra bucket tamam sayılır
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _minute(ts: datetime) -> int:
+    """Minutes since the epoch (naive timestamps are UTC)"""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return int((ts - _EPOCH).total_seconds() // 60)
+
+
+def _db_ts(ts: datetime) -> str:
+    """DateTime as SQLAlchemy stores it in SQLite (for raw DBAPI parameters)"""
+    return f"{ts:%Y-%m-%d %H:%M:%S.%f}"
+
+
+class Forecaster:
+    """Holt models of every device as (devices x metrics) arrays + cached forecasts"""
+
+    def __init__(self):
+        self._index: dict[str, int] = {}
+        self._names: list[str] = []
+        self._lock = threading.Lock()
+        self._alloc(0)
+        self._since: Optional[datetime] = None       # bir sonraki turun ilk bucket'ı
+
+        # metrics
+        self.ticks = 0
+        self.buckets = 0
+        self.last_tick_ms = 0.0
+        self.last_buckets = 0
+        self.as_of: Optional[datetime] = None
+
+    def _alloc(self, capacity: int):
+        k = len(FORECAST_METRICS)
+        old = getattr(self, "level", None)
+        level, trend = np.zeros((capacity, k)), np.zeros((capacity, k))
+        last, count = np.full((capacity, k), -1, dtype=np.int64), np.zeros((capacity, k), dtype=np.int64)
+        pred = np.full((capacity, k), np.nan)
+        if old is not None:
+            n = len(old)
+            level[:n], trend[:n], last[:n], count[:n], pred[:n] = (
+                self.level[:n], self.trend[:n], self.last[:n], self.count[:n], self.pred[:n])
+        self.level, self.trend, self.last, self.count, self.pred = level, trend, last, count, pred
+
+    def _indexes(self, device_ids: np.ndarray) -> np.ndarray:
+        """Model row of each device (new devices get a row)"""
+        uniq, inv = np.unique(device_ids, return_inverse=True)
+        rows = np.empty(len(uniq), dtype=np.int64)
+        for i, d in enumerate(uniq):
+            idx = self._index.get(d)
+            if idx is None:
+                idx = self._index[d] = len(self._names)
+                self._names.append(d)
+            rows[i] = idx
+        if len(self._names) > len(self.level):
+            self._alloc(max(1024, 2 * len(self._names)))
+        return rows[inv]
+
+    # ==================== TICK ====================
+
+    def _read(self, db: Session, start: datetime, end: datetime):
+        """Closed 1m buckets of all devices in [start, end): device ids, minutes, means (rows x metrics)"""
+        cols = ", ".join(["device_id", "bucket", *(f"{m}_n, {m}_sum" for m in FORECAST_METRICS)])
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.execute(
+                f"SELECT {cols} FROM {Rollup1m.__tablename__} WHERE bucket >= ? AND bucket < ? ORDER BY bucket",
+                (_db_ts(start), _db_ts(end)),
+            )
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        if not rows:
+            return None
+        columns = list(zip(*rows))
+        minutes = np.array(columns[1], dtype="datetime64[us]").astype("datetime64[m]").astype(np.int64)
+        means = np.empty((len(rows), len(FORECAST_METRICS)))
+        for j in range(len(FORECAST_METRICS)):
+            n = np.array(columns[2 + 2 * j], dtype=np.float64)
+            s = np.array(columns[3 + 2 * j], dtype=np.float64)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means[:, j] = np.where(n > 0, s / n, np.nan)
+        return np.array(columns[0], dtype=object), minutes, means
+
+    def _advance(self, idx: np.ndarray, minutes: np.ndarray, means: np.ndarray):
+        """Holt update, one closed minute at a time (rows are in bucket order)"""
+        a, b = settings.FORECAST_ALPHA, settings.FORECAST_BETA
+        horizon = settings.FORECAST_HORIZON_MIN
+        bounds = np.flatnonzero(np.concatenate([[True], minutes[1:] != minutes[:-1], [True]]))
+        for s, e in zip(bounds[:-1], bounds[1:]):
+            t = minutes[s]
+            for j in range(len(FORECAST_METRICS)):
+                x = means[s:e, j]
+                i = idx[s:e]
+                ok = ~np.isnan(x) & (self.last[i, j] < t)
+                i, x = i[ok], x[ok]
+                if not len(i):
+                    continue
+                first = self.count[i, j] == 0
+                level, trend = self.level[i, j], self.trend[i, j]
+                dt = np.maximum(t - self.last[i, j], 1)
+                new_level = a * x + (1.0 - a) * (level + trend * dt)
+                new_trend = b * (new_level - level) / dt + (1.0 - b) * trend
+                self.level[i, j] = np.where(first, x, new_level)
+                self.trend[i, j] = np.where(first, 0.0, new_trend)
+                self.last[i, j] = t
+                self.count[i, j] += 1
+                self.pred[i, j] = np.maximum(self.level[i, j] + self.trend[i, j] * horizon, 0.0)
+
+    def tick(self, db: Session, now: Optional[datetime] = None) -> dict:
+        """Fold the buckets closed since the last tick into the models"""
+        started = time.perf_counter()
+        now = (now or datetime.now(timezone.utc)).replace(tzinfo=None)
+        end = bucket_start(now - timedelta(seconds=_SETTLE_S), "1m")
+        start = self._since or end - timedelta(minutes=settings.FORECAST_WARMUP_MIN)
+        if end <= start:
+            return {"buckets": 0, "elapsed_ms": 0.0}
+
+        data = self._read(db, start, end)
+        with self._lock:
+            n = 0
+            if data is not None:
+                device_ids, minutes, means = data
+                self._advance(self._indexes(device_ids), minutes, means)
+                n = len(minutes)
+            self._since = end
+            self.as_of = end
+            self.ticks += 1
+            self.buckets += n
+            self.last_buckets = n
+            self.last_tick_ms = (time.perf_counter() - started) * 1000.0
+            return {"buckets": n, "elapsed_ms": round(self.last_tick_ms, 1)}
+
+    # ==================== SERVING ====================
+
+    def fill(self, rows: list[dict]):
+        """Write cached forecasts into rows without predictions (before insert)"""
+        if not settings.FORECAST_ENABLED or not self._names:
+            return
+        max_age = settings.FORECAST_MAX_AGE_MIN
+        with self._lock:
+            for row in rows:
+                idx = self._index.get(row["device_id"])
+                if idx is None:
+                    continue
+                minute = None
+                for j, col in enumerate(PRED_COLUMNS):
+                    if row.get(col) is not None or np.isnan(self.pred[idx, j]):
+                        continue
+                    if minute is None:
+                        minute = _minute(row["ts"])
+                    if minute - self.last[idx, j] <= max_age:
+                        row[col] = int(round(self.pred[idx, j]))
+
+    def get(self, device_id: str) -> Optional[dict]:
+        with self._lock:
+            idx = self._index.get(device_id)
+            if idx is None:
+                return None
+            out = {"as_of": _EPOCH + timedelta(minutes=int(self.last[idx].max()) + 1)}
+            for j, (metric, col) in enumerate(zip(FORECAST_METRICS, PRED_COLUMNS)):
+                has = self.count[idx, j] > 0
+                out[col] = int(round(self.pred[idx, j])) if has else None
+                out[metric] = {
+                    "level": round(float(self.level[idx, j]), 2) if has else None,
+                    "trend_per_min": round(float(self.trend[idx, j]), 3) if has else None,
+                    "buckets": int(self.count[idx, j]),
+                }
+            return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": settings.FORECAST_ENABLED,
+                "devices": len(self._names),
+                "ticks": self.ticks,
+                "buckets": self.buckets,
+                "last_buckets": self.last_buckets,
+                "last_tick_ms": round(self.last_tick_ms, 3),
+                "as_of": self.as_of,
+            }
+
+
+# Global forecaster (ticked by forecast_loop, read by the ingest writer)
+forecaster = Forecaster()
+
+
+def run_tick() -> dict:
+    db = SessionLocal()
+    try:
+        return forecaster.tick(db)
+    finally:
+        db.close()
+
+
+async def forecast_loop():
+    """Background task: advance the models every FORECAST_INTERVAL_S"""
+    while True:
+        try:
+            await asyncio.to_thread(run_tick)
+        except Exception as e:
+            logger.error(f"❌ Forecast tick failed: {e}")
+        await asyncio.sleep(settings.FORECAST_INTERVAL_S)
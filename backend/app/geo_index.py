@@ -0,0 +1,172 @@
+"""
+In-memory spatial grid over device locations for /map/points.
+
+Devices are bucketed into fixed-size lat/lon cells so that a viewport
+(bounding box) query only touches the cells it overlaps. At low zoom levels
+the visible devices are aggregated into clusters on a zoom-dependent grid.
+"""
+from __future__ import annotations
+
+import math
+import threading
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import Device
+from .config import settings
+
+
+# Harita durum önceliği (cluster'ın "en kötü" durumu için)
+STATUS_RANK = {"NO_DATA": 0, "OK": 1, "NORMAL": 1, "WARN": 2, "HIGH": 3}
+
+
+@dataclass(frozen=True)
+class DeviceInfo:
+    device_id: str
+    name: str
+    lat: float
+    lon: float
+    city: str
+    district: str
+
+
+@dataclass(frozen=True)
+class BBox:
+    min_lon: float
+    min_lat: float
+    max_lon: float
+    max_lat: float
+
+    @classmethod
+    def parse(cls, value: str) -> "BBox":
+        """'min_lon,min_lat,max_lon,max_lat' (Leaflet toBBoxString format)"""
+        parts = [float(x) for x in value.split(",")]
+        if len(parts) != 4:
+            raise ValueError("bbox must be 'min_lon,min_lat,max_lon,max_lat'")
+        min_lon, min_lat, max_lon, max_lat = parts
+        if min_lat > max_lat or min_lon > max_lon:
+            raise ValueError("bbox min values must be <= max values")
+        return cls(min_lon, min_lat, max_lon, max_lat)
+
+    def contains(self, lat: float, lon: float) -> bool:
+        return self.min_lat <= lat <= self.max_lat and self.min_lon <= lon <= self.max_lon
+
+
+class DeviceGrid:
+    """Uniform grid index: (cell_y, cell_x) -> devices in that cell"""
+
+    def __init__(self, cell_deg: float = settings.MAP_GRID_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.loaded = False
+        self._cells: dict[tuple[int, int], dict[str, DeviceInfo]] = {}
+        self._devices: dict[str, DeviceInfo] = {}
+        self._lock = threading.Lock()
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def load(self, db: Session):
+        """Index every registered device (one query)"""
+        devices = db.execute(select(Device)).scalars().all()
+        with self._lock:
+            self._cells = {}
+            self._devices = {}
+            for d in devices:
+                self._add(d)
+            self.loaded = True
+
+    def _add(self, device: Device):
+        info = DeviceInfo(
+            device_id=device.device_id,
+            name=device.name,
+            lat=device.lat,
+            lon=device.lon,
+            city=device.city,
+            district=device.district,
+        )
+        old = self._devices.get(info.device_id)
+        if old is not None:
+            self._cells.get(self._cell(old.lat, old.lon), {}).pop(old.device_id, None)
+        self._devices[info.device_id] = info
+        self._cells.setdefault(self._cell(info.lat, info.lon), {})[info.device_id] = info
+
+    def add(self, device: Device):
+        with self._lock:
+            self._add(device)
+
+    def get(self, device_id: str) -> Optional[DeviceInfo]:
+        with self._lock:
+            return self._devices.get(device_id)
+
+    def query(
+        self,
+        bbox: Optional[BBox] = None,
+        city: Optional[str] = None,
+        district: Optional[str] = None,
+    ) -> list[DeviceInfo]:
+        """Devices inside `bbox` (all if None), optionally filtered by city/district"""
+        with self._lock:
+            if bbox is None:
+                candidates: Iterable[DeviceInfo] = list(self._devices.values())
+            else:
+                y0, x0 = self._cell(bbox.min_lat, bbox.min_lon)
+                y1, x1 = self._cell(bbox.max_lat, bbox.max_lon)
+                if (y1 - y0 + 1) * (x1 - x0 + 1) > len(self._cells):
+                    # Geniş viewport: hücre taramak yerine tüm cihazları filtrele
+                    candidates = [d for d in self._devices.values() if bbox.contains(d.lat, d.lon)]
+                else:
+                    candidates = [
+                        d
+                        for y in range(y0, y1 + 1)
+                        for x in range(x0, x1 + 1)
+                        for d in self._cells.get((y, x), {}).values()
+                        if bbox.contains(d.lat, d.lon)
+                    ]
+
+        return [
+            d for d in candidates
+            if (city is None or d.city == city) and (district is None or d.district == district)
+        ]
+
+
+def cluster_cell_deg(zoom: int) -> float:
+    """Cluster grid size in degrees: about MAP_CLUSTER_PX pixels at this zoom"""
+    return 360.0 / (256 * 2 ** zoom) * settings.MAP_CLUSTER_PX
+
+
+def cluster_points(points: list[dict], zoom: int) -> list[dict]:
+    """
+    Aggregate map points (dicts with lat/lon/status/score) into grid clusters:
+    count, centroid, bounds, worst status and mean score.
+    """
+    size = cluster_cell_deg(zoom)
+    groups: dict[tuple[int, int], list[dict]] = {}
+    for p in points:
+        key = (math.floor(p["lat"] / size), math.floor(p["lon"] / size))
+        groups.setdefault(key, []).append(p)
+
+    clusters = []
+    for members in groups.values():
+        scores = [p["score"] for p in members if p.get("score") is not None]
+        worst = max(members, key=lambda p: STATUS_RANK.get(p.get("status") or "NO_DATA", 0))
+        clusters.append({
+            "lat": sum(p["lat"] for p in members) / len(members),
+            "lon": sum(p["lon"] for p in members) / len(members),
+            "count": len(members),
+            "status": worst.get("status") or "NO_DATA",
+            "mean_score": (sum(scores) / len(scores)) if scores else None,
+            "bbox": [
+                min(p["lon"] for p in members),
+                min(p["lat"] for p in members),
+                max(p["lon"] for p in members),
+                max(p["lat"] for p in members),
+            ],
+        })
+    return clusters
+
+
+# Global index (loaded in main.py lifespan, or lazily on first map query)
+device_grid = DeviceGrid()
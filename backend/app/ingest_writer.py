@@ -0,0 +1,385 @@
+"""
+Write-behind ingest pipeline shared by HTTP and MQTT ingest.
+
+Both ingest paths put work on one bounded in-process queue. A dedicated
+writer thread drains it and group-commits: every INGEST_FLUSH_ROWS rows or
+every INGEST_FLUSH_MS milliseconds, whichever comes first, all pending rows
+are written with one executemany INSERT and one COMMIT.
+
+Frames that are already stored (the LRU in dedup.py can miss copies,
+e.g. after a restart or for server-stamped frames) are dropped under the
+write lock, before any stateful stage sees them, and come back with
+id None.
+
+If the group commit fails, the in-memory state of the batch's devices
+(baseline windows, alert / anomaly / rule state, open episodes) is put
+back as it was before the batch and every ticket is retried in its own
+transaction. Only the ticket that fails again gets the error.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+from .config import settings
+from .database import SessionLocal, begin_write
+from .schemas import IngestPayload
+from .baseline import baseline_store
+from .alert_state import alert_states
+from .latest_cache import latest_store
+from .rollups import apply_rollups
+from .episodes import episode_tracker
+from .versions import data_versions
+from .stream import stream_hub
+from .notify import notifier
+from .dedup import frame_dedup
+from .codec import SERVER_TS
+from .rules import rule_engine
+from .anomaly import anomaly_detector
+from .forecast import forecaster
+from . import partitions
+from . import crud
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueueFull(Exception):
+    """Raised when the ingest queue stays full for longer than the submit timeout"""
+
+
+@dataclass
+class _Ticket:
+    payloads: list[IngestPayload] = field(default_factory=list)  # alert evaluation needed
+    rows: list[dict] = field(default_factory=list)               # ready-made rows (MQTT)
+    future: Future = field(default_factory=Future)
+
+    def size(self) -> int:
+        return len(self.payloads) + len(self.rows)
+
+
+_STOP = object()
+
+# Ingest sırasında ilerleyen cihaz durumları (başarısız commit'te cihaz bazında geri alınır)
+_STATEFUL = (baseline_store, alert_states, anomaly_detector, rule_engine, episode_tracker, frame_dedup)
+
+
+def _snapshot_state(device_ids: set[str]) -> list[tuple]:
+    return [(store, store.snapshot(device_ids)) for store in _STATEFUL]
+
+
+def _restore_state(snapshot: list[tuple]):
+    for store, state in snapshot:
+        store.restore(state)
+
+
+def _stored_frames(db, batch: list["_Ticket"]) -> set[int]:
+    """Positions (payloads, then rows, ticket by ticket) of frames already stored"""
+    now = datetime.now(timezone.utc)
+    frames = []
+    for t in batch:
+        frames.extend((p.device_id, p.ts or now, p.frame_counter, p.ts is None) for p in t.payloads)
+        frames.extend((r["device_id"], r["ts"], r.get("frame_counter"), bool(r.get(SERVER_TS))) for r in t.rows)
+    return partitions.stored_frames(db, frames)
+
+
+def _stored_row(p: IngestPayload) -> dict:
+    """Result of a payload whose frame is already stored"""
+    return {"device_id": p.device_id, "ts": p.ts, "frame_counter": p.frame_counter, "id": None, "status": None, "aq_score": None}
+
+
+class IngestWriter:
+    def __init__(
+        self,
+        max_queue: int = settings.INGEST_QUEUE_MAX,
+        flush_rows: int = settings.INGEST_FLUSH_ROWS,
+        flush_ms: int = settings.INGEST_FLUSH_MS,
+    ):
+        self.flush_rows = flush_rows
+        self.flush_ms = flush_ms
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Group commit + yayın boyunca tutulur; paused() ile yazıcı iki flush arasında bekletilir
+        self._write_lock = threading.Lock()
+
+        # metrics
+        self.rows_written = 0
+        self.flushes = 0
+        self.rejected = 0
+        self.errors = 0
+        self.last_flush_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.avg_flush_ms = 0.0
+
+    # ==================== LIFECYCLE ====================
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"✅ Ingest writer started (flush every {self.flush_rows} rows / {self.flush_ms} ms)"
+        )
+
+    def stop(self, timeout: float = 10.0):
+        """Flush everything that is queued, then stop the writer thread"""
+        if not self.running:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        logger.info("✅ Ingest writer stopped")
+
+    # ==================== SUBMIT ====================
+
+    def _put(self, ticket: _Ticket, timeout: Optional[float]) -> Future:
+        if not self.running:
+            raise RuntimeError("Ingest writer is not running")
+        try:
+            self._queue.put(ticket, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += ticket.size()
+            raise IngestQueueFull(f"Ingest queue full ({self._queue.maxsize} batches)")
+        return ticket.future
+
+    def submit(
+        self,
+        payloads: list[IngestPayload],
+        timeout: Optional[float] = settings.INGEST_SUBMIT_TIMEOUT_S,
+    ) -> Future:
+        """
+        Queue HTTP payloads. The returned future resolves to the inserted rows
+        (with `id`, `status`, `aq_score`) once their group commit is done.
+        Blocks up to `timeout` seconds when the queue is full.
+        """
+        return self._put(_Ticket(payloads=list(payloads)), timeout)
+
+    def submit_frames(
+        self,
+        rows: list[dict],
+        timeout: Optional[float] = settings.INGEST_SUBMIT_TIMEOUT_S,
+    ) -> Future:
+        """
+        Queue ready-made rows from a worker thread (binary HTTP frames; the
+        gateway already scored them). Same blocking and result as `submit`.
+        """
+        return self._put(_Ticket(rows=list(rows)), timeout)
+
+    async def submit_rows(self, rows: list[dict]) -> Future:
+        """
+        Queue ready-made rows from the asyncio loop without blocking it.
+        While the queue is full this coroutine waits, which in turn stops the
+        MQTT consumer from pulling more messages (backpressure).
+        """
+        ticket = _Ticket(rows=list(rows))
+        if not self.running:
+            raise RuntimeError("Ingest writer is not running")
+        while True:
+            try:
+                self._queue.put_nowait(ticket)
+                return ticket.future
+            except queue.Full:
+                await asyncio.sleep(self.flush_ms / 1000.0)
+
+    # ==================== WRITER THREAD ====================
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+
+            batch = [first]
+            pending = first.size()
+            deadline = time.monotonic() + self.flush_ms / 1000.0
+
+            while pending < self.flush_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                pending += item.size()
+
+            with self._write_lock:
+                self._flush(batch)
+
+        # Kapanışta kuyrukta kalanları da yaz
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        if leftover:
+            with self._write_lock:
+                self._flush(leftover)
+
+    @contextmanager
+    def paused(self):
+        """
+        Keep the writer between two group commits for the duration of the
+        block, so that other writers of per-device state (re-scoring) see
+        no batch half-applied. Ingest keeps queueing meanwhile.
+        """
+        with self._write_lock:
+            yield
+
+    def _write(self, batch: list[_Ticket]) -> tuple[list[dict], list[list[dict]]]:
+        """
+        One transaction for the batch. Returns (inserted rows, rows per
+        ticket). On error the transaction is rolled back, the in-memory
+        state of the batch's devices is restored and the error re-raised.
+        """
+        db = SessionLocal()
+        snapshot = None
+        try:
+            if not baseline_store.hydrated:
+                baseline_store.hydrate(db)
+            # Yazma kilidi en başta: batch'in okudukları commit'e kadar geçerli kalır
+            begin_write(db)
+            snapshot = _snapshot_state(
+                {p.device_id for t in batch for p in t.payloads} | {r["device_id"] for t in batch for r in t.rows}
+            )
+
+            # Zaten kayıtlı frame'ler durum tutan aşamalara hiç girmez
+            stored = _stored_frames(db, batch)
+
+            # Ticket sırasıyla: her örnek, sonrakilerin baseline penceresine ve cihaz durumuna girer
+            per_ticket, all_rows, pos = [], [], 0
+            for t in batch:
+                fresh = [i not in stored for i in range(pos, pos + len(t.payloads))]
+                pos += len(t.payloads)
+                built = iter(crud.build_measurement_rows(db, [p for p, ok in zip(t.payloads, fresh) if ok]))
+                rows = [next(built) if ok else _stored_row(p) for p, ok in zip(t.payloads, fresh)]
+                all_rows.extend(r for r, ok in zip(rows, fresh) if ok)
+
+                gateway_rows = []
+                for r in t.rows:
+                    if pos in stored:
+                        r["id"] = None
+                    else:
+                        gateway_rows.append(r)
+                    pos += 1
+                alert_states.apply_gateway_rows(db, gateway_rows)
+                all_rows.extend(gateway_rows)
+                per_ticket.append(rows + t.rows)
+
+            anomaly_detector.apply(db, all_rows)
+            # TinyML tahmini olmayan satırlara sunucu tahmini
+            forecaster.fill(all_rows)
+            # Tanımlı kurallar: tüm batch tek seferde, satırlar yazılmadan önce
+            rule_engine.apply(db, all_rows)
+            all_rows = crud.insert_measurement_rows(db, all_rows)
+            # Sayaç dizisi (kayıp / geç / reboot) yalnızca yazılan frame'lerle ilerler
+            frame_dedup.advance(all_rows)
+            if settings.ROLLUPS_ENABLED:
+                apply_rollups(db, all_rows)
+            episode_tracker.apply(db, all_rows)
+            db.commit()
+            partitions.publish_new_partitions(db)
+            # Geçici işaret yalnızca yeniden denemeler için tutuldu
+            for t in batch:
+                for r in t.rows:
+                    r.pop(SERVER_TS, None)
+            return all_rows, per_ticket
+        except Exception:
+            db.rollback()
+            partitions.discard_new_partitions(db)
+            # Pencereler / açık bölümler commit edilmemiş örnekleri içeriyor: yalnızca bu cihazlar geri alınır
+            if snapshot is not None:
+                _restore_state(snapshot)
+            raise
+        finally:
+            db.close()
+
+    def _flush(self, batch: list[_Ticket]):
+        started = time.perf_counter()
+        try:
+            all_rows, per_ticket = self._write(batch)
+        except Exception as e:
+            if len(batch) > 1:
+                # Tek bir bozuk istek tüm grubu düşürmesin: ticket'lar ayrı ayrı yeniden denenir
+                logger.warning(f"⚠️ Ingest flush failed ({len(batch)} batches), retrying one by one: {e}")
+                for t in batch:
+                    self._flush([t])
+                return
+            t = batch[0]
+            with self._lock:
+                self.errors += 1
+            logger.error(f"❌ Ingest flush failed ({t.size()} rows): {e}", exc_info=True)
+            # Yazılamayan frame'ler tekrar gönderildiğinde duplicate sayılmasın
+            frame_dedup.forget(
+                [(p.device_id, p.frame_counter) for p in t.payloads]
+                + [(r["device_id"], r.get("frame_counter")) for r in t.rows]
+            )
+            notifier.resync({p.device_id for p in t.payloads} | {r["device_id"] for r in t.rows})
+            t.future.set_exception(e)
+            return
+
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        n_rows = len(all_rows)
+        if n_rows < sum(len(rows) for rows in per_ticket):
+            # LRU'yu geçip kayıtlı bulunan frame'ler (id=None)
+            frame_dedup.record_index_duplicates(r for rows in per_ticket for r in rows if r["id"] is None)
+        with self._lock:
+            self.flushes += 1
+            self.rows_written += n_rows
+            self.last_flush_rows = n_rows
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.avg_flush_ms = (
+                elapsed_ms if self.flushes == 1 else 0.9 * self.avg_flush_ms + 0.1 * elapsed_ms
+            )
+
+        latest_store.update(all_rows)
+        data_versions.bump_rows(all_rows)
+        stream_hub.publish(all_rows)
+        notifier.observe(all_rows)
+
+        for t, rows in zip(batch, per_ticket):
+            t.future.set_result(rows)
+
+    # ==================== METRICS ====================
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self.running,
+                "queue_depth": self._queue.qsize(),
+                "queue_max": self._queue.maxsize,
+                "rows_written": self.rows_written,
+                "flushes": self.flushes,
+                "rejected": self.rejected,
+                "errors": self.errors,
+                "last_flush_rows": self.last_flush_rows,
+                "last_flush_ms": round(self.last_flush_ms, 3),
+                "avg_flush_ms": round(self.avg_flush_ms, 3),
+                "max_flush_ms": round(self.max_flush_ms, 3),
+            }
+
+
+# Global writer instance (started/stopped in main.py lifespan)
+ingest_writer = IngestWriter()
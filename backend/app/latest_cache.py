@@ -0,0 +1,101 @@
+"""
+In-process latest-measurement store.
+
+Keeps the newest measurement of every device in memory so that /latest,
+/alerts/latest and /map/points are served without touching SQLite. The
+ingest writer updates it after each commit, and it is backfilled with a
+single query at startup.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from .models import Measurement
+from . import partitions, archive
+
+
+def _naive(ts):
+    return ts.replace(tzinfo=None) if ts is not None else None
+
+
+def _newer(a: dict, b: Optional[dict]) -> bool:
+    """Is row `a` newer than row `b`? (ts, then id as tie-breaker)"""
+    if b is None:
+        return True
+    ta, tb = a["ts"].replace(tzinfo=None), b["ts"].replace(tzinfo=None)
+    if ta != tb:
+        return ta > tb
+    return (a.get("id") or 0) >= (b.get("id") or 0)
+
+
+class LatestStore:
+    """device_id -> column dict of the newest measurement"""
+
+    def __init__(self):
+        self.loaded = False
+        self._rows: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def backfill(self, db: Session):
+        """Load the newest row of every device (one query per partition)"""
+        columns = [c.name for c in Measurement.__table__.columns]
+        rows = {}
+        for t in partitions.tables_chronological(db):
+            ranked = select(
+                t,
+                func.row_number()
+                .over(partition_by=t.c.device_id, order_by=(t.c.ts.desc(), t.c.id.desc()))
+                .label("rn"),
+            ).subquery()
+            stmt = select(ranked).where(ranked.c.rn == 1)
+
+            for r in db.execute(stmt).mappings():
+                row = {c: _naive(r[c]) if c == "ts" else r[c] for c in columns}
+                if _newer(row, rows.get(row["device_id"])):
+                    rows[row["device_id"]] = row
+
+        # Yalnızca arşivde verisi kalan cihazlar
+        rows.update(archive.latest_archived_rows(db, exclude=set(rows)))
+
+        with self._lock:
+            self._rows = rows
+            self.loaded = True
+
+    def update(self, rows: list[dict]):
+        """Called after a commit with the inserted rows"""
+        with self._lock:
+            for row in rows:
+                device_id = row["device_id"]
+                if _newer(row, self._rows.get(device_id)):
+                    # DB'den okunan satırlarla aynı temsil: naive ts
+                    self._rows[device_id] = dict(row, ts=row["ts"].replace(tzinfo=None))
+
+    def get(self, device_id: str) -> Optional[Measurement]:
+        """Detached Measurement (not bound to any session) or None"""
+        with self._lock:
+            row = self._rows.get(device_id)
+        return Measurement(**row) if row is not None else None
+
+    def get_row(self, device_id: str) -> Optional[dict]:
+        """Copy of the newest row's column dict, or None"""
+        with self._lock:
+            row = self._rows.get(device_id)
+        return dict(row) if row is not None else None
+
+    def snapshot(self) -> dict[str, dict]:
+        """device_id -> newest row (rows are shared: do not modify them)"""
+        with self._lock:
+            return dict(self._rows)
+
+    def get_many(self, device_ids: list[str]) -> dict[str, Measurement]:
+        with self._lock:
+            rows = {d: self._rows[d] for d in device_ids if d in self._rows}
+        return {d: Measurement(**row) for d, row in rows.items()}
+
+
+# Global store (backfilled in main.py lifespan, or lazily on first read)
+latest_store = LatestStore()
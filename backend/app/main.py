@@ -14,9 +14,21 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from .config import settings
-from .database import engine, Base
+from .database import engine, Base, SessionLocal, create_missing_indexes
 from .routes import router
-from .mqtt_client import start_mqtt_subscriber 
+from .mqtt_client import start_mqtt_subscriber, mqtt_subscriber
+from .ingest_writer import ingest_writer
+from .baseline import baseline_store
+from .latest_cache import latest_store
+from .geo_index import device_grid
+from .stream import stream_hub
+from .notify import notifier
+from .dedup import frame_dedup
+from .alert_state import alert_states, persist_loop, persist_states
+from .rules import rule_engine
+from .anomaly import anomaly_detector
+from .forecast import forecast_loop
+from . import partitions, archive
 
 # Configure logging
 logging.basicConfig(
@@ -37,10 +49,62 @@ async def lifespan(app: FastAPI):
     # Create database tables
     try:
         Base.metadata.create_all(bind=engine)
+        create_missing_indexes()
+        db = SessionLocal()
+        try:
+            partitions.add_missing_columns(db)
+        finally:
+            db.close()
         logger.info("✅ Database tables created")
     except Exception as e:
         logger.error(f"❌ Database initialization error: {e}")
     
+    # Hydrate streaming baseline windows + latest-measurement store (one query each)
+    try:
+        db = SessionLocal()
+        try:
+            baseline_store.hydrate(db)
+            latest_store.backfill(db)
+            device_grid.load(db)
+            frame_dedup.hydrate(db)
+            alert_states.load(db)
+            rule_engine.load(db)
+            anomaly_detector.load(db)
+        finally:
+            db.close()
+        logger.info("✅ Baseline windows, latest store, device grid, frame counters, alert state, alert rules and anomaly state loaded")
+    except Exception as e:
+        logger.error(f"❌ In-memory state load error: {e}")
+
+    # Live stream fan-out runs on this loop
+    stream_hub.attach_loop(asyncio.get_running_loop())
+    # Durum geçişi bildirimleri (webhook / MQTT), sink tanımlı değilse kapalı
+    notifier.start(asyncio.get_running_loop())
+
+    # Start write-behind ingest writer (HTTP + MQTT)
+    ingest_writer.start()
+
+    # Cihaz alert durumlarını periyodik olarak kaydet (hızlı yeniden başlatma)
+    persist_task = asyncio.create_task(persist_loop())
+
+    # Retention: eski aylık partition'ları DROP et
+    retention_task = None
+    if settings.PARTITIONING_ENABLED and settings.PARTITION_RETENTION_MONTHS > 0:
+        retention_task = asyncio.create_task(partitions.retention_loop())
+        logger.info(f"✅ Partition retention: {settings.PARTITION_RETENTION_MONTHS} months")
+
+    # Kapanmış eski ayları sıkıştırılmış bloklara çevir
+    archive_task = None
+    if settings.PARTITIONING_ENABLED and settings.ARCHIVE_AFTER_MONTHS > 0:
+        archive_task = asyncio.create_task(archive.archive_loop())
+        logger.info(f"✅ Cold archive: partitions older than {settings.ARCHIVE_AFTER_MONTHS} months")
+
+    # TinyML'siz cihazlar için periyodik tahmin (1m rollup'lar üzerinde)
+    forecast_task = None
+    if settings.FORECAST_ENABLED and settings.ROLLUPS_ENABLED:
+        forecast_task = asyncio.create_task(forecast_loop())
+        logger.info(f"✅ Forecasting every {settings.FORECAST_INTERVAL_S:g}s")
+
     # Start MQTT subscriber
     mqtt_task = None
     try:
@@ -62,6 +126,24 @@ async def lifespan(app: FastAPI):
         except asyncio.CancelledError:
             logger.info("✅ MQTT subscriber stopped")
 
+    if retention_task:
+        retention_task.cancel()
+    if archive_task:
+        archive_task.cancel()
+    if forecast_task:
+        forecast_task.cancel()
+
+    # Flush whatever is still queued
+    ingest_writer.stop()
+    await notifier.stop()
+
+    persist_task.cancel()
+    try:
+        persist_states()
+        logger.info("✅ Alert state saved")
+    except Exception as e:
+        logger.error(f"❌ Alert state save error: {e}")
+
 # Create FastAPI app
 app = FastAPI(
     title=settings.APP_NAME,
@@ -102,5 +184,5 @@ async def health():
     return {
         "status": "healthy",
         "database": "connected",
-        "mqtt": "connected"
+        "mqtt": "connected" if mqtt_subscriber.connected else "disconnected"
     }
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, Float, String, DateTime, Boolean, Index
+from sqlalchemy import Integer, Float, String, DateTime, Boolean, Index, LargeBinary
 from sqlalchemy.orm import Mapped, mapped_column
 from datetime import datetime, timezone
 from .database import Base
@@ -26,9 +26,9 @@ class Device(Base):
 class Measurement(Base):
     __tablename__ = "measurements"
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    device_id: Mapped[str] = mapped_column(String(64), index=True)
-    ts: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True, default=utc_now)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    device_id: Mapped[str] = mapped_column(String(64))
+    ts: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
 
     # ==================== SENSOR DATA ====================
     temp_c: Mapped[float | None] = mapped_column(Float, nullable=True)
@@ -60,7 +60,208 @@ class Measurement(Base):
     # ==================== METADATA ====================
     sample_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
     frame_counter: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    server_scored: Mapped[bool | None] = mapped_column(Boolean, nullable=True)   # status / anom sunucuda hesaplandı (HTTP)
+
+
+# Composite index for efficient queries (also serves device_id-only lookups;
+# the old single-column id/device_id/ts indexes are dropped by `init_db.py compact`)
+Index("ix_device_ts", Measurement.device_id, Measurement.ts)
+
+# Partial index: only alert rows (alert history stays a tiny indexed read)
+Index(
+    "ix_alert_device_ts",
+    Measurement.device_id,
+    Measurement.ts,
+    sqlite_where=Measurement.alert == True,  # noqa: E712
+)
+
+
+class DeviceKey(Base):
+    """
+    Interned device ids: compact measurement partitions store this integer
+    key instead of the device_id string (see compact.py). Any device that
+    sends data gets a key, registered in `devices` or not.
+    """
+    __tablename__ = "device_keys"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    device_id: Mapped[str] = mapped_column(String(64), unique=True)
+
+
+class AlertEpisode(Base):
+    """Consecutive alert samples of a device merged into one episode"""
+    __tablename__ = "alert_episodes"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    device_id: Mapped[str] = mapped_column(String(64))
+    start_ts: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    end_ts: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+
+    peak_status: Mapped[str | None] = mapped_column(String(16), nullable=True)
+    peak_score: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    samples: Mapped[int] = mapped_column(Integer, default=0)
+
+    open: Mapped[bool] = mapped_column(Boolean, default=True)   # still receiving alert samples
+
+
+Index("ix_episode_device_end", AlertEpisode.device_id, AlertEpisode.end_ts)
+Index("ix_episode_open", AlertEpisode.open, sqlite_where=AlertEpisode.open == True)  # noqa: E712
+
+
+class AlertState(Base):
+    """
+    Periodic snapshot of the streaming per-device alert state (alert_state.py):
+    last sample values for delta detection and the test-range hysteresis state.
+    """
+    __tablename__ = "alert_state"
+
+    device_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    ts: Mapped[datetime] = mapped_column(DateTime(timezone=True))      # son örneğin zamanı
+
+    eco2_ppm: Mapped[float | None] = mapped_column(Float, nullable=True)
+    tvoc_ppb: Mapped[float | None] = mapped_column(Float, nullable=True)
+    temp_c: Mapped[float | None] = mapped_column(Float, nullable=True)
+    hum_rh: Mapped[float | None] = mapped_column(Float, nullable=True)
+    pressure_hpa: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    status: Mapped[str | None] = mapped_column(String(16), nullable=True)        # son karar
+    test_status: Mapped[str | None] = mapped_column(String(16), nullable=True)   # NORMAL / HIGH (hysteresis)
+    delta_alert: Mapped[bool] = mapped_column(Boolean, default=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
+
+
+class AnomalyState(Base):
+    """Periodic snapshot of the streaming anomaly detector (anomaly.py): EWMA mean / variance per metric"""
+    __tablename__ = "anomaly_state"
+
+    device_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    ts: Mapped[datetime] = mapped_column(DateTime(timezone=True))      # son örneğin zamanı
+
+    eco2_n: Mapped[int] = mapped_column(Integer, default=0)
+    eco2_mean: Mapped[float | None] = mapped_column(Float, nullable=True)
+    eco2_var: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    tvoc_n: Mapped[int] = mapped_column(Integer, default=0)
+    tvoc_mean: Mapped[float | None] = mapped_column(Float, nullable=True)
+    tvoc_var: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
+
+
+class AlertRule(Base):
+    """
+    Declarative alert rule (rules.py). Scope: device_id, or city + district,
+    or city, or every device when all three are empty.
+    """
+    __tablename__ = "alert_rules"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(128))
+
+    device_id: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    city: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    district: Mapped[str | None] = mapped_column(String(128), nullable=True)
+
+    kind: Mapped[str] = mapped_column(String(16))          # threshold / baseline_pct / rate
+    metric: Mapped[str] = mapped_column(String(32))        # eco2_ppm, tvoc_ppb, temp_c, hum_rh, pressure_hpa
+    op: Mapped[str] = mapped_column(String(8), default="above")   # above / below
+    value: Mapped[float] = mapped_column(Float)
+
+    window_s: Mapped[int] = mapped_column(Integer, default=0)       # baseline_pct penceresi (0 = BASELINE_SECONDS)
+    hysteresis: Mapped[float] = mapped_column(Float, default=0.0)   # temizlenmek için eşiğin bu kadar gerisi
+    sustain_s: Mapped[int] = mapped_column(Integer, default=0)      # koşul en az bu kadar sürmeli
+    severity: Mapped[str] = mapped_column(String(16), default="WARN")   # WARN / HIGH
+
+    enabled: Mapped[bool] = mapped_column(Boolean, default=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
+
+
+class RollupMixin:
+    """
+    Per-device time bucket aggregates (continuous rollups).
+    For every sensor column: number of non-null samples, min, max, sum and
+    the value of the newest sample in the bucket.
+    """
+    device_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)  # bucket start
+
+    n: Mapped[int] = mapped_column(Integer, default=0)          # rows in bucket
+    last_ts: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+
+    # ==================== TEMPERATURE ====================
+    temp_c_n: Mapped[int] = mapped_column(Integer, default=0)
+    temp_c_min: Mapped[float | None] = mapped_column(Float, nullable=True)
+    temp_c_max: Mapped[float | None] = mapped_column(Float, nullable=True)
+    temp_c_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    temp_c_last: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    # ==================== HUMIDITY ====================
+    hum_rh_n: Mapped[int] = mapped_column(Integer, default=0)
+    hum_rh_min: Mapped[float | None] = mapped_column(Float, nullable=True)
+    hum_rh_max: Mapped[float | None] = mapped_column(Float, nullable=True)
+    hum_rh_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    hum_rh_last: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    # ==================== PRESSURE ====================
+    pressure_hpa_n: Mapped[int] = mapped_column(Integer, default=0)
+    pressure_hpa_min: Mapped[float | None] = mapped_column(Float, nullable=True)
+    pressure_hpa_max: Mapped[float | None] = mapped_column(Float, nullable=True)
+    pressure_hpa_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    pressure_hpa_last: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    # ==================== TVOC ====================
+    tvoc_ppb_n: Mapped[int] = mapped_column(Integer, default=0)
+    tvoc_ppb_min: Mapped[float | None] = mapped_column(Float, nullable=True)
+    tvoc_ppb_max: Mapped[float | None] = mapped_column(Float, nullable=True)
+    tvoc_ppb_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    tvoc_ppb_last: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    # ==================== ECO2 ====================
+    eco2_ppm_n: Mapped[int] = mapped_column(Integer, default=0)
+    eco2_ppm_min: Mapped[float | None] = mapped_column(Float, nullable=True)
+    eco2_ppm_max: Mapped[float | None] = mapped_column(Float, nullable=True)
+    eco2_ppm_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    eco2_ppm_last: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    # ==================== AIR QUALITY SCORE ====================
+    aq_score_n: Mapped[int] = mapped_column(Integer, default=0)
+    aq_score_min: Mapped[float | None] = mapped_column(Float, nullable=True)
+    aq_score_max: Mapped[float | None] = mapped_column(Float, nullable=True)
+    aq_score_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    aq_score_last: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+
+class Rollup1m(RollupMixin, Base):
+    __tablename__ = "rollup_1m"
+
+
+# forecast.py: tüm cihazların kapanan dakikaları tek aralık sorgusuyla okunur
+Index("ix_rollup_1m_bucket", Rollup1m.bucket)
+
+
+class Rollup1h(RollupMixin, Base):
+    __tablename__ = "rollup_1h"
+
+
+class Rollup1d(RollupMixin, Base):
+    __tablename__ = "rollup_1d"
+
+
+class MeasurementBlock(Base):
+    """
+    Cold tier: compressed columnar block with one device's measurements of
+    one day (see archive.py for the encoding).
+    """
+    __tablename__ = "measurement_blocks"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    device_id: Mapped[str] = mapped_column(String(64))
+    day: Mapped[datetime] = mapped_column(DateTime(timezone=True))       # gün başlangıcı
+    first_ts: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    last_ts: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    n: Mapped[int] = mapped_column(Integer)                              # satır sayısı
+    codec: Mapped[int] = mapped_column(Integer, default=1)
+    data: Mapped[bytes] = mapped_column(LargeBinary)
 
 
-# Composite index for efficient queries
-Index("ix_device_ts", Measurement.device_id, Measurement.ts)
\ No newline at end of file
+Index("ix_block_device_day", MeasurementBlock.device_id, MeasurementBlock.day, unique=True)
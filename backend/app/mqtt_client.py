@@ -5,136 +5,218 @@ Windows-compatible async implementation using aiomqtt
 import asyncio
 import json
 import logging
-from datetime import datetime, timezone
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
 from typing import Optional
 
 import aiomqtt  # type: ignore
-from sqlalchemy.orm import Session
 
-from .database import SessionLocal
-from .models import Measurement
 from .config import settings
+from .ingest_writer import ingest_writer
+from .dedup import frame_dedup
+from .codec import decode_json, decode_frames, FrameError
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # pragma: no cover - stdlib fallback
+    _loads = json.loads
 
 logger = logging.getLogger(__name__)
 
 
 class MQTTSubscriber:
+    """
+    Decodes messages on the event loop and hands them to the ingest writer
+    in batches: every message already waiting in the client queue (up to
+    MQTT_BATCH_ROWS) goes in one submit. At most MQTT_MAX_INFLIGHT rows may
+    be queued but not yet committed; beyond that the consumer waits for the
+    oldest batch, so a slow commit throttles MQTT instead of growing memory.
+
+    The consumer runs in the process that serves the API: the read-side
+    state (latest store, ETags, stream hub, alert and anomaly state) is per
+    process, so there is one subscription in one process (see docs, "One
+    process: ingest and reads together").
+    """
+
     def __init__(self):
         self.broker = settings.MQTT_BROKER
         self.port = settings.MQTT_PORT
-        self.topic = f"{settings.MQTT_TOPIC_PREFIX}+/data"  # Wildcard: tüm device'lar
+        self.prefix = settings.MQTT_TOPIC_PREFIX
+        self.topic = f"{self.prefix}+/data"  # Wildcard: tüm device'lar
+        self.bin_topic = f"{self.prefix}+/bin"  # binary frame'ler (codec.py)
         self.client: Optional[aiomqtt.Client] = None
         self.running = False
+        self.connected = False
         self._reconnect_interval = 5
 
-    async def process_message(self, message: aiomqtt.Message):
-        """Process incoming MQTT message and save to database"""
+        self._pending: deque[Future] = deque()   # commit bekleyen batch'ler (sırayla)
+        self._lock = threading.Lock()            # sayaçlar writer thread'inden de güncellenir
+        self._backlog = lambda: 0
+
+        # metrics
+        self.received = 0
+        self.decode_errors = 0
+        self.duplicates = 0
+        self.submitted = 0
+        self.committed = 0
+        self.failed = 0
+        self.inflight_rows = 0
+        self.last_commit_lag_ms = 0.0
+        self.avg_commit_lag_ms = 0.0
+        self.msgs_per_s = 0.0
+        self._rate_started = time.monotonic()
+        self._rate_count = 0
+
+    # ==================== DECODE ====================
+
+    def _decode_message(self, message: aiomqtt.Message) -> list[dict]:
+        """Message -> rows (a binary message may carry many frames); malformed and repeated frames are dropped"""
+        topic = str(message.topic)
         try:
-            # Parse JSON payload
-            payload = json.loads(message.payload.decode())
-            logger.info(f"📥 MQTT Message: {payload}")
-
-            # ✅ Gateway JSON mapping - support both formats
-            device_id = payload.get("id") or payload.get("device_id", "unknown")
-            
-            # Timestamp
-            ts_raw = payload.get("ts")  # Gateway ts (seconds since boot)
-            ts_ms = payload.get("ts_ms")
-            
-            # Convert timestamp
-            if ts_ms:
-                ts = datetime.fromtimestamp(ts_ms / 1000.0, tz=timezone.utc)
-            elif ts_raw:
-                # Gateway timestamp - use current time instead
-                ts = datetime.now(timezone.utc)
+            if topic.endswith("/bin"):
+                rows = decode_frames(message.payload, topic)
             else:
-                ts = datetime.now(timezone.utc)
-
-            # ✅ Gateway field mapping - support both formats
-            # Temperature: Gateway sends "t" as x10 (234 = 23.4°C)
-            temp_c = None
-            if payload.get("t") is not None:
-                temp_c = payload.get("t") / 10.0
-            elif payload.get("temp_c") is not None:
-                temp_c = payload.get("temp_c")
-            
-            # Humidity: Gateway sends "h" as x10 (291 = 29.1%)
-            hum_rh = None
-            if payload.get("h") is not None:
-                hum_rh = payload.get("h") / 10.0
-            elif payload.get("hum_rh") is not None:
-                hum_rh = payload.get("hum_rh")
-            
-            # Pressure: Gateway sends "p" directly
-            pressure_hpa = payload.get("p") or payload.get("pressure_hpa") or payload.get("press_hpa")
-            
-            # TVOC: Gateway sends "v"
-            tvoc_ppb = payload.get("v") if payload.get("v") is not None else payload.get("tvoc_ppb")
-            
-            # eCO2: Gateway sends "e"
-            eco2_ppm = payload.get("e") if payload.get("e") is not None else payload.get("eco2_ppm")
-            
-            # Score: Gateway sends "s"
-            aq_score = payload.get("s") if payload.get("s") is not None else payload.get("aq_score")
-            
-            # Predictions: Gateway sends "pe" and "pv"
-            pred_eco2_60m = payload.get("pe") if payload.get("pe") is not None else payload.get("pred_eco2_60m")
-            pred_tvoc_60m = payload.get("pv") if payload.get("pv") is not None else payload.get("pred_tvoc_60m")
-            
-            # Anomalies: Gateway sends "ae" and "av"
-            anom_eco2 = payload.get("ae", False) or payload.get("anom_eco2", False)
-            anom_tvoc = payload.get("av", False) or payload.get("anom_tvoc", False)
-            
-            # Delta alert: Gateway sends "da"
-            alert = payload.get("da", False) or payload.get("alert", False) or payload.get("delta_alert", False)
-            
-            # ✅ CRITICAL: Status - Gateway sends "st"
-            status = payload.get("st") or payload.get("status", "NORMAL")
-            
-            # Frame counter: Gateway sends "fc"
-            frame_counter = payload.get("fc")
-
-            # Create measurement
-            measurement = Measurement(
-                device_id=device_id,
-                ts=ts,
-                temp_c=temp_c,
-                hum_rh=hum_rh,
-                pressure_hpa=pressure_hpa,
-                tvoc_ppb=tvoc_ppb,
-                eco2_ppm=eco2_ppm,
-                rssi=payload.get("rssi"),
-                snr=payload.get("snr"),
-                aq_score=aq_score,
-                pred_eco2_60m=pred_eco2_60m,
-                pred_tvoc_60m=pred_tvoc_60m,
-                anom_eco2=anom_eco2,
-                anom_tvoc=anom_tvoc,
-                alert=alert,
-                status=status,
-                sample_ms=payload.get("sample_ms"),
-                frame_counter=frame_counter
-            )
-
-            # Save to database
-            db = SessionLocal()
-            try:
-                db.add(measurement)
-                db.commit()
-                db.refresh(measurement)
-                logger.info(f"✅ Saved to DB: device={device_id} status={measurement.status} eco2={measurement.eco2_ppm} tvoc={measurement.tvoc_ppb}")
-            finally:
-                db.close()
-
-        except json.JSONDecodeError as e:
+                payload = _loads(message.payload)
+                logger.debug("📥 MQTT Message: %s", payload)
+                rows = [decode_json(payload)]
+            fresh = [frame_dedup.accept(r["device_id"], r["frame_counter"]) for r in rows]
+        except FrameError as e:
+            self.decode_errors += 1
+            logger.error(f"❌ Binary frame error on {topic}: {e}")
+            return []
+        except ValueError as e:
+            self.decode_errors += 1
             logger.error(f"❌ JSON decode error: {e}")
+            return []
         except Exception as e:
+            self.decode_errors += 1
             logger.error(f"❌ Error processing message: {e}", exc_info=True)
+            return []
+
+        # Aynı frame başka topic'ten / LoRa tekrarından geldiyse kuyruğa girmeden düşer
+        if not all(fresh):
+            self.duplicates += fresh.count(False)
+            logger.debug("🔁 Duplicate frames dropped on %s: %d", topic, fresh.count(False))
+            rows = [r for r, ok in zip(rows, fresh) if ok]
+        return rows
+
+    async def process_message(self, message: aiomqtt.Message):
+        """Decode one message and queue it for the database writer"""
+        self._count(1)
+        rows = self._decode_message(message)
+        if rows:
+            await self._submit(rows)
+
+    # ==================== PERSIST ====================
+
+    async def _submit(self, rows: list[dict]):
+        """Queue a batch on the write-behind writer (commit happens in its thread)"""
+        # In-flight penceresi: en eski batch commit edilene kadar bekle
+        while self._pending and (self._pending[0].done() or self.inflight_rows >= settings.MQTT_MAX_INFLIGHT):
+            oldest = self._pending.popleft()
+            if not oldest.done():
+                await asyncio.wait([asyncio.wrap_future(oldest)])
+
+        received_at = time.monotonic()
+        with self._lock:
+            self.inflight_rows += len(rows)
+            self.submitted += len(rows)
+        try:
+            future = await ingest_writer.submit_rows(rows)
+        except Exception:
+            with self._lock:
+                self.inflight_rows -= len(rows)
+            raise
+        future.add_done_callback(partial(self._on_commit, len(rows), received_at))
+        self._pending.append(future)
+
+    def _on_commit(self, n: int, received_at: float, future: Future):
+        lag_ms = (time.monotonic() - received_at) * 1000.0
+        with self._lock:
+            self.inflight_rows -= n
+            if future.exception() is not None:
+                self.failed += n
+                return
+            self.committed += n
+            self.last_commit_lag_ms = lag_ms
+            self.avg_commit_lag_ms = lag_ms if self.committed == n else 0.9 * self.avg_commit_lag_ms + 0.1 * lag_ms
+
+    async def consume(self, messages):
+        """
+        Consume an async iterator of messages. Messages already waiting in
+        the client queue are decoded into one batch; the batch is submitted
+        when the queue is empty or MQTT_BATCH_ROWS is reached.
+        """
+        backlog = getattr(messages, "__len__", None)
+        self._backlog = backlog or (lambda: 0)
+        batch: list[dict] = []
+        try:
+            async for message in messages:
+                if not self.running:
+                    logger.info("🛑 Stopping MQTT message loop...")
+                    break
+                self._count(1)
+                batch.extend(self._decode_message(message))
+                if batch and (len(batch) >= settings.MQTT_BATCH_ROWS or self._backlog() == 0):
+                    await self._submit(batch)
+                    batch = []
+                    # Kuyruk hiç boşalmasa da HTTP istekleri sıra bulsun
+                    await asyncio.sleep(0)
+        finally:
+            if batch:
+                await self._submit(batch)
+            self._backlog = lambda: 0
+
+    async def drain(self):
+        """Wait until every submitted batch is committed (or failed)"""
+        while self._pending:
+            oldest = self._pending.popleft()
+            if not oldest.done():
+                await asyncio.wait([asyncio.wrap_future(oldest)])
+
+    # ==================== METRICS ====================
+
+    def _count(self, n: int):
+        self.received += n
+        self._rate_count += n
+        self._tick()
+
+    def _tick(self):
+        now = time.monotonic()
+        elapsed = now - self._rate_started
+        if elapsed >= 1.0:
+            self.msgs_per_s = self._rate_count / elapsed
+            self._rate_started = now
+            self._rate_count = 0
+
+    def stats(self) -> dict:
+        self._tick()
+        with self._lock:
+            return {
+                "connected": self.connected,
+                "topics": [self.topic, self.bin_topic],
+                "received": self.received,
+                "msgs_per_s": round(self.msgs_per_s, 1),
+                "decode_errors": self.decode_errors,
+                "duplicates": self.duplicates,
+                "submitted": self.submitted,
+                "committed": self.committed,
+                "failed": self.failed,
+                # lag: client kuyruğunda bekleyen mesaj + commit bekleyen satır + alım->commit süresi
+                "backlog": self._backlog(),
+                "inflight_rows": self.inflight_rows,
+                "last_commit_lag_ms": round(self.last_commit_lag_ms, 3),
+                "avg_commit_lag_ms": round(self.avg_commit_lag_ms, 3),
+            }
 
     async def run(self):
         """Main MQTT subscriber loop with graceful shutdown"""
         logger.info(f"🔄 Starting MQTT subscriber: {self.broker}:{self.port}")
-        logger.info(f"📡 Subscribing to: {self.topic}")
+        logger.info(f"📡 Subscribing to: {self.topic}, {self.bin_topic}")
         
         self.running = True
 
@@ -143,16 +225,12 @@ class MQTTSubscriber:
                 async with aiomqtt.Client(
                     hostname=self.broker,
                     port=self.port,
-                    keepalive=60
+                    keepalive=60,
                 ) as client:
-                    await client.subscribe(self.topic)
-                    logger.info(f"✅ MQTT connected and subscribed to {self.topic}")
-
-                    async for message in client.messages:
-                        if not self.running:
-                            logger.info("🛑 Stopping MQTT message loop...")
-                            break
-                        await self.process_message(message)
+                    await client.subscribe([(self.topic, 0), (self.bin_topic, 0)])
+                    self.connected = True
+                    logger.info(f"✅ MQTT connected and subscribed to {self.topic}, {self.bin_topic}")
+                    await self.consume(client.messages)
 
             except asyncio.CancelledError:
                 logger.info("🛑 MQTT task cancelled")
@@ -171,6 +249,8 @@ class MQTTSubscriber:
                     await asyncio.sleep(self._reconnect_interval)
                 else:
                     break
+            finally:
+                self.connected = False
 
         logger.info("✅ MQTT subscriber stopped gracefully")
 
@@ -0,0 +1,402 @@
+"""
+Alert notifications: status transitions pushed to webhooks and MQTT.
+
+The ingest writer hands the rows each commit inserted to `notifier.observe`,
+which only compares each row's status with the device's previous one and
+records the transition in a pending dict. No I/O happens on the ingest
+path. Rows that were not inserted (duplicates, failed batches) never reach
+it, and after a failed write `resync` resets the previous status of the
+devices involved to their last committed row.
+
+On the asyncio loop the first pending transition opens a debounce window of
+NOTIFY_DEBOUNCE_S. Everything that arrives inside the window is coalesced
+per device (first `from`, last `to`, worst status in between, number of
+transitions). When the window closes the events are grouped per city and
+district and handed to every sink as batches of at most NOTIFY_BATCH_MAX
+events. A city-wide event therefore becomes a few deliveries per sink,
+not one call per device.
+
+Each sink has its own bounded queue (NOTIFY_QUEUE_MAX batches; when it is
+full the oldest batch is dropped) and one worker:
+- webhook: JSON POST per batch through a pooled keep-alive client
+  (NOTIFY_POOL_SIZE connections per URL)
+- MQTT: one message per district on `<NOTIFY_MQTT_TOPIC>/<city>/<district>`
+  over a persistent connection
+Failed deliveries are retried NOTIFY_RETRIES times with exponential backoff
+and then dropped. A slow sink never holds up the others.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+import aiomqtt  # type: ignore
+import httpx
+
+from .config import settings
+from .episodes import STATUS_RANK
+from .geo_index import device_grid
+from .latest_cache import latest_store
+
+logger = logging.getLogger(__name__)
+
+
+def _rank(status: Optional[str]) -> int:
+    return STATUS_RANK.get(status or "", 0)
+
+
+def _iso(ts) -> Optional[str]:
+    if isinstance(ts, datetime):
+        return ts.replace(tzinfo=None).isoformat()
+    return ts
+
+
+def _topic_part(value: Optional[str]) -> str:
+    """City / district as one MQTT topic level (no separators or wildcards)"""
+    value = (value or "unknown").strip()
+    for ch in "/+#":
+        value = value.replace(ch, "_")
+    return value or "unknown"
+
+
+class PermanentDeliveryError(Exception):
+    """Delivery rejected by the receiver (4xx): retrying will not help"""
+
+
+# ==================== SINKS ====================
+
+class Sink:
+    """Bounded batch queue + one delivery worker with retries"""
+
+    name = "sink"
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.NOTIFY_QUEUE_MAX)
+        self.task: Optional[asyncio.Task] = None
+
+        # metrics
+        self.batches = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+        self.last_error: Optional[str] = None
+
+    def enqueue(self, batch: list[dict]):
+        """Called on the loop; never waits"""
+        if self.queue.full():
+            old = self.queue.get_nowait()
+            self.queue.task_done()
+            self.dropped += len(old)
+        self.queue.put_nowait(batch)
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            batch = await self.queue.get()
+            try:
+                await self._deliver_with_retry(batch)
+            finally:
+                self.queue.task_done()
+
+    async def _deliver_with_retry(self, batch: list[dict]):
+        for attempt in range(settings.NOTIFY_RETRIES + 1):
+            try:
+                await self.deliver(batch)
+                self.batches += 1
+                self.sent += len(batch)
+                return
+            except asyncio.CancelledError:
+                raise
+            except PermanentDeliveryError as e:
+                self.last_error = str(e)
+                break
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                if attempt == settings.NOTIFY_RETRIES:
+                    break
+                self.retries += 1
+                await asyncio.sleep(settings.NOTIFY_RETRY_BASE_S * 2 ** attempt)
+        self.failed += len(batch)
+        logger.warning(f"⚠️ Notification delivery to {self.name} failed ({len(batch)} events): {self.last_error}")
+
+    async def deliver(self, batch: list[dict]):
+        raise NotImplementedError
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "sink": self.name,
+            "queued": self.queue.qsize(),
+            "batches": self.batches,
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "retries": self.retries,
+            "last_error": self.last_error,
+        }
+
+
+class WebhookSink(Sink):
+    """POST {"events": [...]} per batch; connections are pooled and kept alive"""
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.url = url
+        self.name = f"webhook:{url}"
+        self.client = httpx.AsyncClient(
+            timeout=settings.NOTIFY_TIMEOUT_S,
+            limits=httpx.Limits(
+                max_connections=settings.NOTIFY_POOL_SIZE,
+                max_keepalive_connections=settings.NOTIFY_POOL_SIZE,
+            ),
+        )
+
+    async def deliver(self, batch: list[dict]):
+        body = {"sent_at": _iso(datetime.now(timezone.utc)), "count": len(batch), "events": batch}
+        response = await self.client.post(self.url, json=body)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        if response.status_code >= 400:
+            raise PermanentDeliveryError(f"HTTP {response.status_code}")
+
+    async def close(self):
+        await super().close()
+        await self.client.aclose()
+
+
+class MqttSink(Sink):
+    """One message per district of the batch, over a persistent connection"""
+
+    def __init__(self, topic: str):
+        super().__init__()
+        self.topic = topic.rstrip("/")
+        self.name = f"mqtt:{self.topic}"
+        self._client: Optional[aiomqtt.Client] = None
+
+    async def _connect(self) -> aiomqtt.Client:
+        if self._client is None:
+            client = aiomqtt.Client(hostname=settings.MQTT_BROKER, port=settings.MQTT_PORT, keepalive=60)
+            await client.__aenter__()
+            self._client = client
+        return self._client
+
+    async def _disconnect(self):
+        client, self._client = self._client, None
+        if client is not None:
+            try:
+                await client.__aexit__(None, None, None)
+            except Exception:
+                pass
+
+    async def deliver(self, batch: list[dict]):
+        groups: dict[tuple, list[dict]] = {}
+        for event in batch:
+            groups.setdefault((event["city"], event["district"]), []).append(event)
+        try:
+            client = await self._connect()
+            for (city, district), events in groups.items():
+                topic = f"{self.topic}/{_topic_part(city)}/{_topic_part(district)}"
+                await client.publish(topic, json.dumps({"count": len(events), "events": events}), qos=1)
+        except aiomqtt.MqttError:
+            # Bağlantı koptu: yeniden denemede yeni bağlantı açılır
+            await self._disconnect()
+            raise
+
+    async def close(self):
+        await super().close()
+        await self._disconnect()
+
+
+# ==================== DISPATCHER ====================
+
+class NotificationDispatcher:
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sinks: list[Sink] = []
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_status: dict[str, Optional[str]] = {}
+        self._pending: dict[str, dict] = {}      # device_id -> coalesced transition
+        self._lock = threading.Lock()
+
+        # metrics
+        self.transitions = 0
+        self.coalesced = 0          # başka bir geçişle birleştirilen geçişler
+        self.suppressed = 0         # pencere içinde başladığı yere dönen cihazlar
+        self.events = 0
+        self.windows = 0
+        self.last_window_events = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._sinks)
+
+    # ==================== LIFECYCLE ====================
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Create the configured sinks and the debounce task (no-op without sinks)"""
+        self._loop = loop
+        self._sinks = [WebhookSink(url) for url in settings.webhook_urls()]
+        if settings.NOTIFY_MQTT_ENABLED:
+            self._sinks.append(MqttSink(settings.NOTIFY_MQTT_TOPIC))
+        if not self._sinks:
+            return
+        with self._lock:
+            if latest_store.loaded:
+                self._last_status = {d: r.get("status") for d, r in latest_store.snapshot().items()}
+        self._wakeup = asyncio.Event()
+        for sink in self._sinks:
+            sink.start()
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"✅ Notifications: {', '.join(s.name for s in self._sinks)} "
+            f"(debounce {settings.NOTIFY_DEBOUNCE_S:g}s)"
+        )
+
+    async def stop(self, timeout: float = 5.0):
+        """Send what is pending, wait up to `timeout` for the queues, close the sinks"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if not self._sinks:
+            return
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(s.queue.join() for s in self._sinks)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ Notification queues not drained at shutdown")
+        for sink in self._sinks:
+            await sink.close()
+        self._sinks = []
+
+    # ==================== INGEST SIDE ====================
+
+    def observe(self, rows: list[dict]):
+        """Called from the writer thread with the rows a commit inserted; never blocks"""
+        if not self._sinks:
+            return
+        with self._lock:
+            was_empty = not self._pending
+            for row in rows:
+                if row.get("id") is None:
+                    continue    # yazılmamış satır: geçiş sayılmaz
+                device_id = row["device_id"]
+                status = row.get("status")
+                prev = self._last_status.get(device_id)
+                self._last_status[device_id] = status
+                if prev is None or _rank(prev) == _rank(status):
+                    continue
+                self.transitions += 1
+                event = self._pending.get(device_id)
+                if event is None:
+                    self._pending[device_id] = {
+                        "device_id": device_id,
+                        "from": prev,
+                        "to": status,
+                        "peak": status if _rank(status) > _rank(prev) else prev,
+                        "transitions": 1,
+                        "first_ts": _iso(row["ts"]),
+                        "ts": _iso(row["ts"]),
+                        "aq_score": row.get("aq_score"),
+                    }
+                    continue
+                self.coalesced += 1
+                event["to"] = status
+                event["ts"] = _iso(row["ts"])
+                event["aq_score"] = row.get("aq_score")
+                event["transitions"] += 1
+                if _rank(status) > _rank(event["peak"]):
+                    event["peak"] = status
+
+        if was_empty and self._pending and self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def resync(self, device_ids: Iterable[str]):
+        """After a failed write: previous status = the device's last committed row"""
+        if not self._sinks:
+            return
+        with self._lock:
+            for device_id in device_ids:
+                row = latest_store.get_row(device_id)
+                if row is not None:
+                    self._last_status[device_id] = row.get("status")
+                else:
+                    self._last_status.pop(device_id, None)
+
+    # ==================== LOOP SIDE ====================
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Debounce: pencere boyunca gelen geçişler aynı teslimata girer
+            await asyncio.sleep(settings.NOTIFY_DEBOUNCE_S)
+            self._wakeup.clear()
+            self._dispatch()
+
+    def _dispatch(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        events = []
+        for event in pending.values():
+            # HIGH -> WARN -> HIGH gibi: pencere sonunda değişiklik yok
+            if _rank(event["to"]) == _rank(event["from"]) and _rank(event["peak"]) <= _rank(event["from"]):
+                self.suppressed += 1
+                continue
+            info = device_grid.get(event["device_id"])
+            event["city"] = info.city if info else None
+            event["district"] = info.district if info else None
+            events.append(event)
+        events.sort(key=lambda e: (e["city"] or "", e["district"] or "", e["device_id"]))
+
+        self.windows += 1
+        self.events += len(events)
+        self.last_window_events = len(events)
+        size = max(settings.NOTIFY_BATCH_MAX, 1)
+        for start in range(0, len(events), size):
+            batch = events[start:start + size]
+            for sink in self._sinks:
+                sink.enqueue(batch)
+
+    # ==================== METRICS ====================
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "enabled": self.enabled,
+            "debounce_s": settings.NOTIFY_DEBOUNCE_S,
+            "pending": pending,
+            "transitions": self.transitions,
+            "coalesced": self.coalesced,
+            "suppressed": self.suppressed,
+            "events": self.events,
+            "windows": self.windows,
+            "last_window_events": self.last_window_events,
+            "sinks": [s.stats() for s in self._sinks],
+        }
+
+
+# Global dispatcher (started/stopped in main.py lifespan, fed by the ingest writer)
+notifier = NotificationDispatcher()
@@ -0,0 +1,714 @@
+"""
+Time-partitioned measurement storage.
+
+New measurements go to one table per calendar month (`measurements_YYYYMM`,
+same columns as `measurements`, only the composite and alert indexes).
+Readers ask this module for the partitions overlapping their [start, end]
+range, so a query for the last hour touches one small table no matter how
+many years of history exist. Retention drops whole partitions
+(`DROP TABLE`), which costs the same for a month of data as for a row.
+
+The original `measurements` table stays readable as the legacy partition
+(ts range read once and cached); `python init_db.py partition-migrate`
+moves its rows into monthly partitions.
+
+With COMPACT_SCHEMA (default) new partitions store the device as an
+interned integer key and ts as INTEGER epoch ms (see compact.py). Older
+text-layout partitions stay readable; a UNION over both layouts converts
+the text branches in SQL. `python init_db.py compact` rewrites them.
+
+Ids stay unique across partitions: every partition is AUTOINCREMENT and its
+sequence starts at `month_index << 32`, so ids also grow with time.
+
+The `(device_id, ts)` index of a partition is UNIQUE on
+`(device_id, ts, frame_counter)` and rows are written with INSERT OR IGNORE,
+so a frame stored twice is dropped by the index (see dedup.py). Rows without
+a frame_counter (NULL) never conflict.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+from sqlalchemy import (
+    Column, Index, MetaData, Table, select, func, text, union_all, false, insert, delete, literal, type_coerce,
+    and_, or_,
+)
+from sqlalchemy.orm import Session, aliased
+
+from .models import Measurement, MeasurementBlock, DeviceKey
+from .database import SessionLocal, begin_write
+from .config import settings
+from .compact import EpochMs, DeviceKeyType, device_keys, round_ms, epoch_ms_expr, sql_is_compact
+
+logger = logging.getLogger(__name__)
+
+
+LEGACY = Measurement.__table__
+PARTITION_PREFIX = "measurements_"
+
+_metadata = MetaData()        # compact layout
+_text_metadata = MetaData()   # eski layout (DateTime ts, String device_id)
+_tables_lock = threading.Lock()
+
+
+# ==================== KEYS ====================
+
+def month_key(ts: datetime) -> int:
+    """ts -> YYYYMM (wall-clock, same representation SQLite stores)"""
+    return ts.year * 100 + ts.month
+
+
+def month_bounds(key: int) -> tuple[datetime, datetime]:
+    """YYYYMM -> [first instant, first instant of next month)"""
+    year, month = divmod(key, 100)
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+
+def partition_name(key: int) -> str:
+    return f"{PARTITION_PREFIX}{key}"
+
+
+def _id_base(key: int) -> int:
+    year, month = divmod(key, 100)
+    return (year * 12 + month - 1) << 32
+
+
+def _naive(ts: Optional[datetime]) -> Optional[datetime]:
+    return ts.replace(tzinfo=None) if ts is not None else None
+
+
+def _column(c: Column, compact: bool) -> Column:
+    if compact and c.name == "device_id":
+        return Column(c.name, DeviceKeyType(), nullable=False)
+    if compact and c.name == "ts":
+        return Column(c.name, EpochMs(), nullable=False)
+    return Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable)
+
+
+def partition_table(key: int, compact: Optional[bool] = None) -> Table:
+    """
+    Table object of a monthly partition (same column names as `measurements`).
+    Layout defaults to the one the existing table has, COMPACT_SCHEMA for new ones.
+    """
+    if compact is None:
+        compact = partition_registry.is_compact(key)
+    name = partition_name(key)
+    metadata = _metadata if compact else _text_metadata
+    with _tables_lock:
+        t = metadata.tables.get(name)
+        if t is None:
+            t = Table(
+                name,
+                metadata,
+                *[_column(c, compact) for c in LEGACY.columns],
+                sqlite_autoincrement=True,
+            )
+            Index(f"ux_{name}_frame", t.c.device_id, t.c.ts, t.c.frame_counter, unique=True)
+            Index(f"ix_{name}_alert", t.c.device_id, t.c.ts, sqlite_where=t.c.alert == True)  # noqa: E712
+        return t
+
+
+# ==================== REGISTRY ====================
+
+class PartitionRegistry:
+    """
+    Which partitions exist, cached from sqlite_master. Refreshed every
+    PARTITION_REFRESH_S so partitions created by another process show up.
+    """
+
+    def __init__(self):
+        self._keys: set[int] = set()
+        self._text_keys: set[int] = set()     # eski (text) layout'taki partition'lar
+        self._legacy_range: Optional[tuple[datetime, datetime]] = None
+        self._legacy_loaded = False
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def refresh(self, db):
+        tables = db.execute(
+            text("SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name LIKE :p"),
+            {"p": f"{PARTITION_PREFIX}%"},
+        ).all()
+        keys, text_keys = set(), set()
+        for name, sql in tables:
+            suffix = name[len(PARTITION_PREFIX):]
+            if len(suffix) == 6 and suffix.isdigit():
+                keys.add(int(suffix))
+                if not sql_is_compact(sql):
+                    text_keys.add(int(suffix))
+
+        legacy = self._legacy_range
+        if not self._legacy_loaded:
+            # ts index'i yok: legacy tablo artık yazılmadığı için aralık bir kez okunur
+            lo, hi = db.execute(select(func.min(LEGACY.c.ts), func.max(LEGACY.c.ts))).one()
+            legacy = (_naive(lo), _naive(hi)) if lo is not None else None
+        device_keys.load(db)
+        with self._lock:
+            self._keys = keys
+            self._text_keys = text_keys
+            self._legacy_range = legacy
+            self._legacy_loaded = True
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+            self._legacy_loaded = False
+
+    def is_compact(self, key: int) -> bool:
+        with self._lock:
+            if key in self._keys:
+                return key not in self._text_keys
+        return settings.COMPACT_SCHEMA
+
+    def _fresh(self, db):
+        if db.info.get("new_partitions"):
+            return   # bu transaction'ın commit edilmemiş tabloları sqlite_master'da görünür
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > settings.PARTITION_REFRESH_S:
+            self.refresh(db)
+
+    def keys(self, db) -> list[int]:
+        self._fresh(db)
+        with self._lock:
+            return sorted(self._keys)
+
+    def add(self, keys, compact: bool = True):
+        """Partitions created by a committed transaction of this process"""
+        with self._lock:
+            self._keys.update(keys)
+            if compact:
+                self._text_keys.difference_update(keys)
+            else:
+                self._text_keys.update(keys)
+
+    def discard(self, key: int):
+        with self._lock:
+            self._keys.discard(key)
+            self._text_keys.discard(key)
+
+    def tables(self, db, start: Optional[datetime] = None, end: Optional[datetime] = None) -> list[Table]:
+        """Tables whose rows may fall in [start, end], ordered by their first timestamp"""
+        self._fresh(db)
+        start, end = _naive(start), _naive(end)
+        with self._lock:
+            keys = sorted(self._keys)
+            legacy = self._legacy_range
+
+        out = []   # (alt sınır, tablo)
+        if not settings.PARTITIONING_ENABLED:
+            out.append((datetime.min, LEGACY))   # legacy tablo hâlâ yazılıyor: aralığı güncel değil
+        elif legacy is not None and (end is None or legacy[0] <= end) and (start is None or legacy[1] >= start):
+            out.append((legacy[0], LEGACY))
+        for key in keys:
+            lo, hi = month_bounds(key)
+            if (end is None or lo <= end) and (start is None or hi > start):
+                out.append((lo, partition_table(key)))
+        out.sort(key=lambda x: x[0])
+        return [t for _, t in out]
+
+
+# ==================== WRITE PATH ====================
+
+def ensure_partitions(db: Session, keys: set[int]) -> set[int]:
+    """
+    Create missing partitions inside the caller's transaction. The new keys
+    are remembered in `db.info` and published by `publish_new_partitions`
+    after the commit, so no reader sees a table before it exists for them.
+    """
+    known = set(partition_registry.keys(db)) | db.info.get("new_partitions", set())
+    created = set()
+    for key in sorted(keys - known):
+        t = partition_table(key)
+        t.create(db.connection(), checkfirst=True)
+        db.execute(
+            text(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT :name, :seq "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"
+            ),
+            {"name": t.name, "seq": _id_base(key)},
+        )
+        created.add(key)
+    if created:
+        db.info.setdefault("new_partitions", set()).update(created)
+    return created
+
+
+def publish_new_partitions(db: Session):
+    """Call after commit: make partitions (and device keys) created in this session visible to readers"""
+    device_keys.publish(db)
+    created = db.info.pop("new_partitions", None)
+    if created:
+        partition_registry.add(created, compact=settings.COMPACT_SCHEMA)
+        logger.info(f"🗂️ New measurement partitions: {sorted(created)}")
+
+
+def discard_new_partitions(db: Session):
+    """Call after rollback: the CREATE TABLEs (and device key INSERTs) were rolled back too"""
+    device_keys.discard(db)
+    db.info.pop("new_partitions", None)
+
+
+def _encode_devices(db: Session, t: Table, rows: list[dict]) -> list[dict]:
+    """Compact partition: device_id -> interned key (created in this transaction if new)"""
+    if not isinstance(t.c.device_id.type, DeviceKeyType):
+        return rows
+    keys = device_keys.intern(db, (r["device_id"] for r in rows))
+    return [dict(r, device_id=keys[r["device_id"]]) for r in rows]
+
+
+def _sequence(db: Session, name: str) -> Optional[int]:
+    return db.execute(text("SELECT seq FROM sqlite_sequence WHERE name = :name"), {"name": name}).scalar()
+
+
+def _match_inserted(db: Session, t: Table, seq: int, part: list[dict]) -> list[Optional[int]]:
+    """
+    Some rows of `part` were ignored by the unique frame index: the inserted
+    ones are the rows with id > seq, in `part` order. None = ignored.
+    """
+    inserted = db.execute(
+        select(t.c.id, t.c.ts, t.c.frame_counter).where(t.c.id > seq).order_by(t.c.id)
+    ).all()
+    ids, k = [], 0
+    for row in part:
+        if k < len(inserted):
+            row_id, ts, fc = inserted[k]
+            if fc == row.get("frame_counter") and ts == _naive(row["ts"]):
+                ids.append(row_id)
+                k += 1
+                continue
+        ids.append(None)
+    if k != len(inserted):
+        raise RuntimeError(f"{t.name}: could not match inserted rows")
+    return ids
+
+
+def insert_rows(db: Session, rows: list[dict]) -> list[Optional[int]]:
+    """
+    Insert into the right partitions (no commit). Returns ids in `rows`
+    order, None for rows the unique frame index ignored (already stored).
+    With COMPACT_SCHEMA each row's `ts` is rounded to ms in place, so caches
+    fed from `rows` match the table.
+
+    Partitions are AUTOINCREMENT and the write lock is taken (BEGIN
+    IMMEDIATE) before the sequence is read, so no other connection can
+    insert in between and a plain executemany gets the ids seq+1 .. seq+n;
+    this avoids the row-at-a-time INSERT ... RETURNING that SQLAlchemy falls
+    back to on SQLite.
+    """
+    if not settings.PARTITIONING_ENABLED:
+        stmt = insert(LEGACY).returning(LEGACY.c.id, sort_by_parameter_order=True)
+        return list(db.execute(stmt, rows).scalars().all())
+
+    begin_write(db)
+    by_key: dict[int, list[int]] = {}
+    for i, row in enumerate(rows):
+        if settings.COMPACT_SCHEMA:
+            row["ts"] = round_ms(row["ts"])
+        by_key.setdefault(month_key(row["ts"]), []).append(i)
+    ensure_partitions(db, set(by_key))
+
+    ids: list[Optional[int]] = [None] * len(rows)
+    for key, idxs in by_key.items():
+        t = partition_table(key)
+        part = _encode_devices(db, t, [rows[i] for i in idxs])
+        seq = _sequence(db, t.name)
+        if seq is None:
+            # Dizisiz (elle oluşturulmuş) tablo: ignore edilen satır RETURNING'de görünmez
+            stmt = insert(t).returning(t.c.id, sort_by_parameter_order=True)
+            new_ids = db.execute(stmt, part).scalars().all()
+        else:
+            inserted = db.execute(insert(t).prefix_with("OR IGNORE"), part).rowcount
+            if inserted == len(part):
+                new_ids = range(seq + 1, seq + len(part) + 1)
+                if _sequence(db, t.name) != new_ids[-1]:
+                    raise RuntimeError(f"{t.name}: ids were not assigned sequentially")
+            else:
+                # Ignore edilen satırlar da sayaçtan id harcar: eşleme tablodan okunur
+                new_ids = _match_inserted(db, t, seq, part)
+        for i, row_id in zip(idxs, new_ids):
+            ids[i] = row_id
+    return ids
+
+
+_FRAME_QUERY_DEVICES = 300     # sorgu başına cihaz (3 parametre / cihaz)
+
+
+def stored_frames(db: Session, frames: list[tuple]) -> set[int]:
+    """
+    Positions in `frames` ((device_id, ts, frame_counter, server_stamped))
+    of frames that are already stored or repeat an earlier frame of the list.
+
+    Frames with a device timestamp match on (device_id, ts, frame_counter),
+    like the unique frame index. Server-stamped frames have a new ts on
+    every copy, so they match on (device_id, frame_counter) stored within
+    DEDUP_TTL_S before their ts (the LRU's rule in dedup.py). One query per
+    partition and a few hundred devices, on the frame index.
+    """
+    ttl = timedelta(seconds=settings.DEDUP_TTL_S)
+    keys: list[Optional[tuple]] = []
+    ranges: dict[str, list[datetime]] = {}     # device_id -> [en erken, en geç]
+    for device_id, ts, fc, server in frames:
+        if fc is None:
+            keys.append(None)
+            continue
+        ts = round_ms(_naive(ts))
+        keys.append((device_id, int(fc), ts, server))
+        lo = ts - ttl if server else ts
+        r = ranges.get(device_id)
+        if r is None:
+            ranges[device_id] = [lo, ts]
+        else:
+            r[0], r[1] = min(r[0], lo), max(r[1], ts)
+    if not ranges:
+        return set()
+
+    seen: dict[tuple, list[datetime]] = {}     # (device_id, frame_counter) -> kayıtlı ts'ler
+    start = min(r[0] for r in ranges.values())
+    end = max(r[1] for r in ranges.values())
+    items = list(ranges.items())
+    for t in partition_registry.tables(db, start, end):
+        for k in range(0, len(items), _FRAME_QUERY_DEVICES):
+            cond = or_(*[
+                and_(t.c.device_id == device_id, t.c.ts >= lo, t.c.ts <= hi)
+                for device_id, (lo, hi) in items[k:k + _FRAME_QUERY_DEVICES]
+            ])
+            stmt = select(t.c.device_id, t.c.ts, t.c.frame_counter).where(cond).where(t.c.frame_counter.is_not(None))
+            for device_id, ts, fc in db.execute(stmt):
+                seen.setdefault((device_id, int(fc)), []).append(round_ms(_naive(ts)))
+
+    out = set()
+    for i, key in enumerate(keys):
+        if key is None:
+            continue
+        device_id, fc, ts, server = key
+        stored = seen.setdefault((device_id, fc), [])
+        if any(ts - ttl <= s <= ts for s in stored) if server else ts in stored:
+            out.add(i)
+        else:
+            stored.append(ts)    # listede sonra gelen kopyalar
+    return out
+
+
+# ==================== READ PATH ====================
+
+def source(
+    db,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    device_id: Optional[str] = None,
+    alerts_only: bool = False,
+):
+    """
+    FROM-clause with the `measurements` columns covering [start, end]: the
+    partition table itself when only one overlaps, otherwise a UNION ALL
+    whose branches already carry the device/range (and alert) filters, so
+    every branch uses its own (device_id, ts) or partial alert index.
+    """
+    tables = partition_registry.tables(db, start, end)
+    if device_id is not None and len(tables) > 1 and device_keys.key(device_id) is None:
+        # Anahtarı olmayan cihazın compact tablolarda satırı yok: yalnızca text tabloları okunur
+        tables = [t for t in tables if not isinstance(t.c.ts.type, EpochMs)] or tables[:1]
+    if len(tables) == 1:
+        return tables[0]
+    if not tables:
+        return select(LEGACY).where(false()).subquery("measurements")
+
+    compact = any(isinstance(t.c.ts.type, EpochMs) for t in tables)
+    branches = []
+    for t in tables:
+        if compact and not isinstance(t.c.ts.type, EpochMs):
+            stmt = select(*_as_compact(t, device_id))
+        else:
+            stmt = select(*[t.c[c.name] for c in LEGACY.columns])
+        if device_id is not None:
+            stmt = stmt.where(t.c.device_id == device_id)
+        if start is not None:
+            stmt = stmt.where(t.c.ts >= start)
+        if end is not None:
+            stmt = stmt.where(t.c.ts <= end)
+        if alerts_only:
+            stmt = stmt.where(t.c.alert == True)  # noqa: E712 (partial index koşulu)
+        branches.append(stmt)
+    return union_all(*branches).subquery("measurements")
+
+
+def _as_compact(t: Table, device_id: Optional[str]) -> list:
+    """Columns of a text-layout table converted to the compact representation (mixed UNIONs)"""
+    if device_id is None:
+        dev = func.coalesce(
+            select(DeviceKey.id).where(DeviceKey.device_id == t.c.device_id).scalar_subquery(),
+            t.c.device_id,
+        )
+    else:
+        # Dış sorgudaki device_id filtresiyle aynı bind değeri (source() anahtarı olmayan cihazı buraya getirmez)
+        dev = literal(device_keys.key(device_id))
+    cols = []
+    for c in LEGACY.columns:
+        if c.name == "device_id":
+            cols.append(type_coerce(dev, DeviceKeyType()).label("device_id"))
+        elif c.name == "ts":
+            cols.append(type_coerce(epoch_ms_expr(t.c.ts), EpochMs()).label("ts"))
+        else:
+            cols.append(t.c[c.name])
+    return cols
+
+
+def entity(
+    db,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    device_id: Optional[str] = None,
+    alerts_only: bool = False,
+):
+    """ORM entity (Measurement or an alias of it) over `source(...)`"""
+    src = source(db, start, end, device_id, alerts_only)
+    if src is LEGACY:
+        return Measurement
+    return aliased(Measurement, src, adapt_on_names=True)
+
+
+def entities_newest_first(db, end: Optional[datetime] = None) -> Iterator:
+    """One ORM entity per partition up to `end`, newest partition first"""
+    for t in reversed(partition_registry.tables(db, None, end)):
+        yield Measurement if t is LEGACY else aliased(Measurement, t, adapt_on_names=True)
+
+
+def tables_chronological(db) -> list[Table]:
+    """All partitions ordered by first timestamp (for full scans and rebuilds)"""
+    return partition_registry.tables(db)
+
+
+# ==================== RETENTION ====================
+
+def drop_expired(db: Session, now: Optional[datetime] = None) -> list[int]:
+    """
+    Drop monthly partitions that ended more than PARTITION_RETENTION_MONTHS
+    ago. Rollups and alert episodes are kept. Returns dropped keys.
+    """
+    months = settings.PARTITION_RETENTION_MONTHS
+    if months <= 0:
+        return []
+
+    now = _naive(now) or datetime.utcnow()
+    total = now.year * 12 + now.month - 1 - months
+    cutoff = datetime(total // 12, total % 12 + 1, 1)
+
+    dropped = []
+    for key in partition_registry.keys(db):
+        if month_bounds(key)[1] > cutoff:
+            continue
+        # Önce registry'den çıkar: yeni sorgular bu tabloyu artık seçmesin
+        partition_registry.discard(key)
+        partition_table(key).drop(db.connection(), checkfirst=True)
+        db.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": partition_name(key)})
+        db.commit()
+        dropped.append(key)
+        logger.info(f"🗑️ Dropped measurement partition {partition_name(key)}")
+
+    # Arşivlenmiş (tablosu zaten düşmüş) aylar: bloklar ve id sayaçları
+    expired = db.execute(delete(MeasurementBlock).where(MeasurementBlock.day < cutoff)).rowcount
+    if db.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'")).first():
+        db.execute(
+            text("DELETE FROM sqlite_sequence WHERE name LIKE :prefix AND name < :name"),
+            {"prefix": PARTITION_PREFIX + "%", "name": partition_name(month_key(cutoff))},
+        )
+    db.commit()
+    if expired:
+        logger.info(f"🗑️ Dropped {expired} archived measurement blocks before {cutoff:%Y-%m}")
+    return dropped
+
+
+async def retention_loop():
+    """Background task: apply the retention policy every PARTITION_RETENTION_CHECK_S"""
+    def run():
+        db = SessionLocal()
+        try:
+            return drop_expired(db)
+        finally:
+            db.close()
+
+    while True:
+        try:
+            await asyncio.to_thread(run)
+        except Exception as e:
+            logger.error(f"❌ Partition retention failed: {e}")
+        await asyncio.sleep(settings.PARTITION_RETENTION_CHECK_S)
+
+
+def migrate_legacy(db: Session, chunk_rows: int = 50_000) -> int:
+    """
+    Move rows of the legacy `measurements` table into monthly partitions,
+    one chunk per transaction (ids are kept). Returns rows moved.
+    """
+    moved = 0
+    while True:
+        rows = [
+            dict(r)
+            for r in db.execute(select(LEGACY).order_by(LEGACY.c.id).limit(chunk_rows)).mappings()
+        ]
+        if not rows:
+            break
+
+        by_key: dict[int, list[dict]] = {}
+        for row in rows:
+            if settings.COMPACT_SCHEMA:
+                row["ts"] = round_ms(row["ts"])
+            by_key.setdefault(month_key(row["ts"]), []).append(row)
+        ensure_partitions(db, set(by_key))
+        for key, part in by_key.items():
+            t = partition_table(key)
+            db.execute(insert(t).prefix_with("OR IGNORE"), _encode_devices(db, t, part))
+
+        db.execute(delete(LEGACY).where(LEGACY.c.id <= rows[-1]["id"]))
+        db.commit()
+        publish_new_partitions(db)
+        moved += len(rows)
+
+    partition_registry.invalidate()
+    return moved
+
+
+# Tekli kolon index'leri: ix_device_ts ve PK bunları zaten karşılıyor
+REDUNDANT_LEGACY_INDEXES = ("ix_measurements_id", "ix_measurements_device_id", "ix_measurements_ts")
+
+
+def drop_redundant_indexes(db: Session) -> list[str]:
+    """Drop the single-column id/device_id/ts indexes of the legacy table"""
+    existing = set(db.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+    dropped = [name for name in REDUNDANT_LEGACY_INDEXES if name in existing]
+    for name in dropped:
+        db.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    db.commit()
+    return dropped
+
+
+def compact_partition(db: Session, key: int) -> int:
+    """
+    Rewrite a text-layout partition in the compact layout (ids kept), in
+    one transaction: copy into a new table converting in SQL, drop the old
+    one, rename. Returns rows copied.
+    """
+    old = partition_table(key, compact=False)
+    tmp_name = f"{old.name}_compact"
+    tmp = Table(tmp_name, MetaData(), *[_column(c, True) for c in LEGACY.columns], sqlite_autoincrement=True)
+
+    device_keys.intern(db, db.execute(select(old.c.device_id).distinct()).scalars().all())
+    tmp.create(db.connection())
+    cols = []
+    for c in LEGACY.columns:
+        if c.name == "device_id":
+            cols.append(DeviceKey.id)
+        elif c.name == "ts":
+            cols.append(epoch_ms_expr(old.c.ts))
+        else:
+            cols.append(old.c[c.name])
+    copied = db.execute(
+        insert(tmp).from_select(
+            [c.name for c in LEGACY.columns],
+            select(*cols).join(DeviceKey, DeviceKey.device_id == old.c.device_id),
+        )
+    ).rowcount
+
+    # id sayacı korunur (silinmiş satırların id'leri tekrar verilmesin)
+    seq = db.execute(text("SELECT seq FROM sqlite_sequence WHERE name = :name"), {"name": old.name}).scalar()
+    partition_registry.discard(key)
+    old.drop(db.connection())
+    db.execute(text(f"ALTER TABLE {tmp_name} RENAME TO {old.name}"))
+    _delete_frame_duplicates(db, old.name)
+    for index in partition_table(key, compact=True).indexes:
+        index.create(db.connection())
+    db.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": old.name})
+    db.execute(
+        text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"),
+        {"name": old.name, "seq": max(seq or 0, _id_base(key), db.execute(select(func.max(old.c.id))).scalar() or 0)},
+    )
+    db.commit()
+    publish_new_partitions(db)
+    partition_registry.add([key], compact=True)
+    logger.info(f"🗜️ Compacted {old.name}: {copied} rows")
+    return copied
+
+
+def _delete_frame_duplicates(db: Session, name: str) -> int:
+    """Keep the first stored copy of every (device_id, ts, frame_counter)"""
+    return db.execute(text(
+        f"DELETE FROM {name} WHERE frame_counter IS NOT NULL AND id NOT IN ("
+        f"SELECT min(id) FROM {name} WHERE frame_counter IS NOT NULL GROUP BY device_id, ts, frame_counter)"
+    )).rowcount
+
+
+def upgrade_frame_indexes(db: Session) -> dict[int, int]:
+    """
+    Partitions created before the unique frame index: delete stored
+    duplicate frames and swap `ix_*_device_ts` for `ux_*_frame`.
+    Returns duplicates deleted per partition.
+    """
+    existing = set(db.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+    done = {}
+    for key in partition_registry.keys(db):
+        name = partition_name(key)
+        if f"ux_{name}_frame" in existing:
+            continue
+        done[key] = _delete_frame_duplicates(db, name)
+        db.execute(text(f"DROP INDEX IF EXISTS ix_{name}_device_ts"))
+        for index in partition_table(key).indexes:
+            if index.unique:
+                index.create(db.connection())
+        db.commit()
+        logger.info(f"🔑 {name}: unique frame index, {done[key]} duplicate rows removed")
+    return done
+
+
+def add_missing_columns(db: Session) -> list[str]:
+    """
+    create_all() does not alter existing tables: columns added to
+    `measurements` later are added to it and to every partition (ALTER
+    TABLE ADD COLUMN, NULL for stored rows). Returns "table.column" added.
+    """
+    names = [LEGACY.name] + [
+        name for name in db.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :p"),
+            {"p": f"{PARTITION_PREFIX}%"},
+        ).scalars()
+        if name[len(PARTITION_PREFIX):].isdigit()
+    ]
+    added = []
+    for name in names:
+        existing = {r[1] for r in db.execute(text(f"PRAGMA table_info({name})"))}
+        for c in LEGACY.columns:
+            if c.name not in existing:
+                db.execute(text(f"ALTER TABLE {name} ADD COLUMN {c.name} {c.type.compile(dialect=db.get_bind().dialect)}"))
+                added.append(f"{name}.{c.name}")
+    db.commit()
+    if added:
+        logger.info(f"🧱 Added columns: {', '.join(added)}")
+    return added
+
+
+def compact_all(db: Session) -> dict[int, int]:
+    """Rewrite every text-layout partition in the compact layout"""
+    done = {}
+    for key in partition_registry.keys(db):
+        if not partition_registry.is_compact(key):
+            done[key] = compact_partition(db, key)
+    return done
+
+
+def partition_stats(db) -> list[dict]:
+    out = []
+    for t in tables_chronological(db):
+        n, lo, hi = db.execute(select(func.count(), func.min(t.c.ts), func.max(t.c.ts)).select_from(t)).one()
+        out.append({"table": t.name, "rows": n, "first_ts": lo, "last_ts": hi})
+    return out
+
+
+# Global registry (refreshed lazily; updated by the ingest writer after commits)
+partition_registry = PartitionRegistry()
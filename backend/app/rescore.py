@@ -0,0 +1,587 @@
+"""
+Vectorized re-scoring of stored measurements.
+
+Rows keep the status / aq_score / alert computed under the settings of the
+time they were ingested. After a change of WARN_INCREASE_PCT,
+HIGH_INCREASE_PCT, BASELINE_SECONDS, the delta thresholds or the test
+ranges, `rescore_device` recomputes them from history:
+
+- a device's rows are read in (ts, id) order as column chunks (NumPy
+  arrays) instead of ORM objects
+- baseline: mean of the samples in [ts - BASELINE_SECONDS, ts] that came
+  before the row (cumulative sums + searchsorted, window carried across
+  chunks), then percentage increase, `decide_status` and `compute_score`
+- delta: difference with the previous row
+- test ranges: every row either sets HIGH, resets to NORMAL or keeps the
+  previous state, so the hysteresis is a forward fill of the last action
+
+which are exactly the rules of `AlertStateStore.evaluate` for samples that
+arrive in order. Only rows scored by the server are rewritten (HTTP
+ingest: server_scored, or anom_eco2 IS NULL for rows stored before that
+column); rows scored by the gateway and archived blocks keep their values
+but still count for baselines, deltas and hysteresis. Changed
+rows are written with one executemany UPDATE per chunk, then the aq_score
+rollup columns of the touched buckets and the device's alert episodes are
+recomputed the same way. Enabled alert rules (rules.py) are evaluated
+over the same chunks by a fresh RuleEngine, so rule-raised statuses are
+re-derived too; the live engine's state is not touched.
+
+`rescore` pauses the ingest writer while a device is re-scored. Rollup
+buckets that have not ended and the episode the writer holds open are left
+as they are; afterwards only that device's alert state and open episode
+are reloaded.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional
+
+import numpy as np
+from sqlalchemy import select, update, delete, insert, bindparam, Table
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import AlertEpisode, AlertState
+from .alerts import DELTA_COLUMNS, _delta_thresholds
+from .alert_state import QUIET_STATUSES, alert_states
+from .rules import RuleEngine, RULE_METRICS
+from .episodes import STATUS_RANK, episode_tracker
+from .latest_cache import latest_store
+from .ingest_writer import ingest_writer
+from .versions import data_versions
+from .rollups import ROLLUP_TABLES
+from .compact import is_compact, device_keys, EPOCH
+from . import partitions, archive
+
+logger = logging.getLogger(__name__)
+
+# Okunan kolonlar (DELTA_COLUMNS baseline/test kurallarının kolonlarını da kapsar)
+VALUE_COLUMNS = DELTA_COLUMNS
+ANOM_COLUMNS = ("anom_eco2", "anom_tvoc")
+
+_US = 1_000_000
+_DAY_US = 86_400 * _US
+
+# Test aralığı aksiyonları
+_KEEP, _NORMAL, _HIGH = -1, 0, 1
+_TEST_NAMES = np.array(["NORMAL", "HIGH"], dtype=object)
+
+
+# ==================== COLUMN CHUNKS ====================
+
+class Chunk:
+    """Rows of one device in (ts, id) order as arrays"""
+
+    __slots__ = ("ts", "values", "status", "aq", "alert", "anom", "server", "ids", "table")
+
+    def __init__(self, ts, values, status, aq, alert, anom, server, ids=None, table=None):
+        self.ts: np.ndarray = ts                  # int64 epoch µs
+        self.values: dict[str, np.ndarray] = values   # float64, NULL -> nan
+        self.status: np.ndarray = status          # object
+        self.aq: np.ndarray = aq                  # float64, NULL -> nan
+        self.alert: np.ndarray = alert            # bool
+        self.anom: dict[str, np.ndarray] = anom   # anom_eco2 / anom_tvoc, float64 (NULL -> nan)
+        self.server: np.ndarray = server          # bool: sunucu puanladı (yeniden yazılır)
+        self.ids: Optional[np.ndarray] = ids      # None: arşiv bloğu (salt okunur)
+        self.table: Optional[Table] = table
+
+    def __len__(self):
+        return len(self.ts)
+
+
+def _datetimes_us(values) -> np.ndarray:
+    return np.array([v.replace(tzinfo=None) for v in values], dtype="datetime64[us]").astype(np.int64)
+
+
+def _floats(values) -> np.ndarray:
+    return np.array(values, dtype=np.float64)   # None -> nan
+
+
+def _archived_chunks(db: Session, device_id: str) -> Iterator[Chunk]:
+    for rows in archive.iter_archived(db, device_id, by_device=True):
+        if not rows:
+            continue
+        yield Chunk(
+            ts=_datetimes_us([r["ts"] for r in rows]),
+            values={c: _floats([r.get(c) for r in rows]) for c in VALUE_COLUMNS},
+            status=np.array([r.get("status") for r in rows], dtype=object),
+            aq=_floats([r.get("aq_score") for r in rows]),
+            alert=np.array([bool(r.get("alert")) for r in rows], dtype=bool),
+            anom={c: _floats([r.get(c) for r in rows]) for c in ANOM_COLUMNS},
+            server=np.zeros(len(rows), dtype=bool),
+        )
+
+
+def _live_chunks(db: Session, t: Table, device_id: str, chunk_rows: int) -> Iterator[Chunk]:
+    """
+    Keyset pagination on (ts, id) over the DBAPI cursor: plain tuples, no
+    Row objects or result processors (compact ts stays epoch ms, text ts is
+    parsed by NumPy).
+    """
+    compact = is_compact(t.c.ts)
+    device = device_keys.key(device_id) if compact else device_id
+    if device is None:
+        return   # cihazın anahtarı yok: compact tablolarda satırı da yok
+
+    cols = ", ".join(["id", "ts", *VALUE_COLUMNS, "status", "aq_score", "alert", *ANOM_COLUMNS, "server_scored"])
+    first = f"SELECT {cols} FROM {t.name} WHERE device_id = ? ORDER BY ts, id LIMIT ?"
+    after = f"SELECT {cols} FROM {t.name} WHERE device_id = ? AND (ts, id) > (?, ?) ORDER BY ts, id LIMIT ?"
+    cursor = db.connection().connection.cursor()
+    n_values = len(VALUE_COLUMNS)
+    last = None
+    try:
+        while True:
+            if last is None:
+                cursor.execute(first, (device, chunk_rows))
+            else:
+                cursor.execute(after, (device, last[1], last[0], chunk_rows))
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            last = rows[-1]
+
+            columns = list(zip(*rows))
+            anom = {c: _floats(columns[5 + n_values + i]) for i, c in enumerate(ANOM_COLUMNS)}
+            scored = _floats(columns[7 + n_values])
+            ts = np.array(columns[1], dtype=np.int64) * 1000 if compact else \
+                np.array(columns[1], dtype="datetime64[us]").astype(np.int64)
+            yield Chunk(
+                ts=ts,
+                values={c: _floats(columns[2 + i]) for i, c in enumerate(VALUE_COLUMNS)},
+                status=np.array(columns[2 + n_values], dtype=object),
+                aq=_floats(columns[3 + n_values]),
+                alert=np.array(columns[4 + n_values], dtype=bool),
+                anom=anom,
+                # server_scored öncesi HTTP satırları: anom_eco2 NULL
+                server=(scored == 1) | (np.isnan(scored) & np.isnan(anom["anom_eco2"])),
+                ids=np.array(columns[0], dtype=np.int64),
+                table=t,
+            )
+            if len(rows) < chunk_rows:
+                return
+    finally:
+        cursor.close()
+
+
+def device_chunks(db: Session, device_id: str, chunk_rows: int = 100_000) -> Iterator[Chunk]:
+    """All rows of a device in time order: archived blocks first, then every partition"""
+    yield from _archived_chunks(db, device_id)
+    for t in partitions.partition_registry.tables(db):
+        yield from _live_chunks(db, t, device_id, chunk_rows)
+
+
+# ==================== RULES (VECTORIZED) ====================
+
+class Scorer:
+    """
+    Baseline, delta and test-range rules over consecutive chunks of one
+    device. State carried between chunks: the baseline window, the previous
+    row and the hysteresis state.
+    """
+
+    def __init__(self):
+        self.window_us = settings.BASELINE_SECONDS * _US
+        self.win_ts = np.empty(0, dtype=np.int64)
+        self.win_tvoc = np.empty(0)
+        self.win_eco2 = np.empty(0)
+        self.prev: Optional[np.ndarray] = None     # son satırın DELTA_COLUMNS değerleri
+        self.test_state = _NORMAL
+        self.last_ts: Optional[int] = None
+        self.last_status: Optional[str] = None
+        self.last_delta = False
+
+    def _baselines(self, ts: np.ndarray, tvoc: np.ndarray, eco2: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Mean of the non-null values of the earlier rows in [ts - window, ts] (nan if none)"""
+        k = len(self.win_ts)
+        all_ts = np.concatenate([self.win_ts, ts])
+        out = []
+        for carried, cur in ((self.win_tvoc, tvoc), (self.win_eco2, eco2)):
+            v = np.concatenate([carried, cur])
+            present = ~np.isnan(v)
+            csum = np.concatenate([[0.0], np.cumsum(np.where(present, v, 0.0))])
+            ccnt = np.concatenate([[0], np.cumsum(present)])
+            idx = np.arange(k, k + len(ts))
+            left = np.searchsorted(all_ts, all_ts[idx] - self.window_us, side="left")
+            n = ccnt[idx] - ccnt[left]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out.append(np.where(n > 0, (csum[idx] - csum[left]) / np.maximum(n, 1), np.nan))
+
+        # Sonraki chunk için yalnızca pencerede kalabilecek satırlar
+        keep = all_ts >= all_ts[-1] - self.window_us
+        self.win_ts = all_ts[keep]
+        self.win_tvoc = np.concatenate([self.win_tvoc, tvoc])[keep]
+        self.win_eco2 = np.concatenate([self.win_eco2, eco2])[keep]
+        return out[0], out[1]
+
+    @staticmethod
+    def _pct(cur: np.ndarray, base: np.ndarray) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(base > 0, (cur - base) / base * 100.0, np.nan)
+
+    def _delta(self, chunk: Chunk) -> np.ndarray:
+        cur = np.column_stack([chunk.values[c] for c in DELTA_COLUMNS])
+        if self.prev is None:
+            prev = np.vstack([np.full((1, cur.shape[1]), np.nan), cur[:-1]])
+        else:
+            prev = np.vstack([self.prev[None, :], cur[:-1]])
+        self.prev = cur[-1]
+        with np.errstate(invalid="ignore"):
+            # nan karşılaştırmaları False: eksik değer delta tetiklemez
+            return (np.abs(cur - prev) >= np.array(_delta_thresholds())).any(axis=1)
+
+    def _test_status(self, eco2: np.ndarray, tvoc: np.ndarray, delta: np.ndarray) -> np.ndarray:
+        def action(v, lo, hi, hyst):
+            out = np.full(len(v), _KEEP, dtype=np.int8)
+            out[(lo + hyst <= v) & (v <= hi - hyst)] = _NORMAL
+            out[(v < lo) | (v > hi)] = _HIGH
+            return out
+
+        s = settings
+        with np.errstate(invalid="ignore"):
+            eco2_step = action(eco2, s.ECO2_TEST_MIN, s.ECO2_TEST_MAX, s.ECO2_HYST)
+            tvoc_step = action(tvoc, s.TVOC_TEST_MIN, s.TVOC_TEST_MAX, s.TVOC_HYST)
+        # eCO2 sonra TVOC adımı: TVOC bir karar veriyorsa o geçerli
+        step = np.where(tvoc_step != _KEEP, tvoc_step, eco2_step)
+        step[np.isnan(eco2) | np.isnan(tvoc)] = _KEEP
+        step[delta] = _HIGH
+
+        idx = np.where(step != _KEEP, np.arange(len(step)), -1)
+        np.maximum.accumulate(idx, out=idx)
+        state = np.where(idx >= 0, step[np.maximum(idx, 0)], self.test_state)
+        self.test_state = int(state[-1])
+        return _TEST_NAMES[state]
+
+    def state_row(self, device_id: str) -> dict:
+        """alert_state row after the last chunk (what the streaming store would hold)"""
+        return {
+            "device_id": device_id,
+            "ts": EPOCH + timedelta(microseconds=self.last_ts),
+            **{c: None if np.isnan(v) else float(v) for c, v in zip(DELTA_COLUMNS, self.prev)},
+            "status": self.last_status,
+            "test_status": str(_TEST_NAMES[self.test_state]),
+            "delta_alert": self.last_delta,
+            "updated_at": datetime.now(timezone.utc),
+        }
+
+    def score(self, chunk: Chunk) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(status, aq_score, alert) the server computes for every row of the chunk"""
+        tvoc, eco2 = chunk.values["tvoc_ppb"], chunk.values["eco2_ppm"]
+        tvoc_base, eco2_base = self._baselines(chunk.ts, tvoc, eco2)
+        peak = np.fmax(self._pct(tvoc, tvoc_base), self._pct(eco2, eco2_base))
+
+        high, warn = settings.HIGH_INCREASE_PCT, settings.WARN_INCREASE_PCT
+        with np.errstate(invalid="ignore"):
+            status = np.where(peak >= high, "HIGH", np.where(peak >= warn, "WARN", "OK")).astype(object)
+            if high > 0:
+                score = np.where(np.isnan(peak), 0.0, np.clip(peak / high * 80.0, 0.0, 100.0))
+            else:
+                score = np.zeros(len(peak))
+
+        delta = self._delta(chunk)
+        test_status = self._test_status(eco2, tvoc, delta)
+        if settings.ALERT_TEST_MODE:
+            status = test_status
+        alert = ~np.isin(status, QUIET_STATUSES)
+        self.last_ts, self.last_status, self.last_delta = int(chunk.ts[-1]), status[-1], bool(delta[-1])
+        return status, np.round(score), alert
+
+
+# ==================== ROLLUPS (aq_score) ====================
+
+class AqRollups:
+    """
+    Recomputes the aq_score columns of rollup buckets that contain a changed
+    row. Rows of the last (possibly incomplete) day wait for the next chunk.
+    Buckets that have not ended yet are left to the ingest writer, which
+    keeps folding new rows into them.
+    """
+
+    def __init__(self, db: Session, device_id: str, now: Optional[datetime] = None):
+        self.db = db
+        self.device_id = device_id
+        self.now_us = int(((now or datetime.utcnow()).replace(tzinfo=None) - EPOCH) / timedelta(microseconds=1))
+        self.ts = np.empty(0, dtype=np.int64)
+        self.aq = np.empty(0)
+        self.changed = np.empty(0, dtype=bool)
+        self.buckets = 0
+
+    def add(self, ts: np.ndarray, aq: np.ndarray, changed: np.ndarray):
+        ts = np.concatenate([self.ts, ts])
+        aq = np.concatenate([self.aq, aq])
+        changed = np.concatenate([self.changed, changed])
+        split = np.searchsorted(ts, ts[-1] // _DAY_US * _DAY_US, side="left")
+        self._write(ts[:split], aq[:split], changed[:split])
+        self.ts, self.aq, self.changed = ts[split:], aq[split:], changed[split:]
+
+    def finish(self):
+        self._write(self.ts, self.aq, self.changed)
+        self.ts, self.aq, self.changed = self.ts[:0], self.aq[:0], self.changed[:0]
+
+    def _write(self, ts: np.ndarray, aq: np.ndarray, changed: np.ndarray):
+        if not len(ts) or not changed.any():
+            return
+        present = ~np.isnan(aq)
+        for model, width in ROLLUP_TABLES.values():
+            width_us = int(width.total_seconds()) * _US
+            bucket = ts // width_us
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(bucket)) + 1])
+            ends = np.concatenate([starts[1:], [len(ts)]])
+            touched = np.logical_or.reduceat(changed, starts)
+            touched &= (bucket[starts] + 1) * width_us <= self.now_us
+            if not touched.any():
+                continue
+            n = np.add.reduceat(present.astype(np.int64), starts)
+            total = np.add.reduceat(np.where(present, aq, 0.0), starts)
+            with np.errstate(invalid="ignore"):
+                lo = np.fmin.reduceat(aq, starts)
+                hi = np.fmax.reduceat(aq, starts)
+            last = aq[ends - 1]
+
+            def opt(v):
+                return None if np.isnan(v) else float(v)
+
+            params = [
+                {
+                    "_device_id": self.device_id,
+                    "_bucket": EPOCH + timedelta(microseconds=int(bucket[s]) * width_us),
+                    "aq_score_n": int(n[i]),
+                    "aq_score_min": opt(lo[i]),
+                    "aq_score_max": opt(hi[i]),
+                    "aq_score_sum": float(total[i]),
+                    "aq_score_last": opt(last[i]),
+                }
+                for i, s in enumerate(starts) if touched[i]
+            ]
+            t = model.__table__
+            stmt = (
+                update(t)
+                .where(t.c.device_id == bindparam("_device_id"))
+                .where(t.c.bucket == bindparam("_bucket"))
+                .values({c: bindparam(c) for c in params[0] if not c.startswith("_")})
+            )
+            self.db.execute(stmt.execution_options(synchronize_session=False), params)
+            self.buckets += len(params)
+
+
+# ==================== EPISODES ====================
+
+class EpisodeBuilder:
+    """Same grouping as EpisodeTracker.apply, over whole chunks"""
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.gap_us = settings.ALERT_EPISODE_GAP_S * _US
+        self.prev_ts: Optional[int] = None
+        self.prev_alert = False
+        self.open: Optional[dict] = None
+        self.episodes: list[dict] = []
+
+    @staticmethod
+    def _dt(us) -> datetime:
+        return EPOCH + timedelta(microseconds=int(us))
+
+    def add(self, ts: np.ndarray, status: np.ndarray, aq: np.ndarray, alert: np.ndarray):
+        prev_alert = np.concatenate([[self.prev_alert], alert[:-1]])
+        prev_ts = np.concatenate([[ts[0] if self.prev_ts is None else self.prev_ts], ts[:-1]])
+        start = alert & (~prev_alert | (ts - prev_ts > self.gap_us))
+        self.prev_ts, self.prev_alert = int(ts[-1]), bool(alert[-1])
+
+        if self.open is not None and not (alert[0] and not start[0]):
+            self._close()
+
+        rows = np.flatnonzero(alert)
+        if not len(rows):
+            return
+        # Her alert satırı: 0 = taşınan açık bölüm, k = chunk'ta başlayan k. bölüm
+        group = np.cumsum(start)[rows]
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(group)) + 1])
+        ends = np.concatenate([starts[1:], [len(rows)]])
+
+        rank = np.zeros(len(rows), dtype=np.int8)
+        st = status[rows]
+        rank[st == "WARN"] = 1
+        rank[st == "HIGH"] = 2
+        peak_rank = np.maximum.reduceat(rank, starts)
+        with np.errstate(invalid="ignore"):
+            peak_score = np.fmax.reduceat(aq[rows], starts)
+
+        for i, (s, e) in enumerate(zip(starts, ends)):
+            status_i = st[s] if peak_rank[i] == 0 else ("WARN", "HIGH")[peak_rank[i] - 1]
+            score_i = None if np.isnan(peak_score[i]) else int(peak_score[i])
+            if group[s] == 0:
+                ep = self.open
+                if peak_rank[i] > STATUS_RANK.get(ep["peak_status"] or "", 0):
+                    ep["peak_status"] = status_i
+                if score_i is not None and (ep["peak_score"] is None or score_i > ep["peak_score"]):
+                    ep["peak_score"] = score_i
+                ep["end_ts"] = self._dt(ts[rows[e - 1]])
+                ep["samples"] += int(e - s)
+            else:
+                if self.open is not None:
+                    self._close()
+                self.open = {
+                    "device_id": self.device_id,
+                    "start_ts": self._dt(ts[rows[s]]),
+                    "end_ts": self._dt(ts[rows[e - 1]]),
+                    "peak_status": status_i,
+                    "peak_score": score_i,
+                    "samples": int(e - s),
+                    "open": True,
+                }
+        if not alert[-1]:
+            self._close()
+
+    def _close(self):
+        self.open["open"] = False
+        self.episodes.append(self.open)
+        self.open = None
+
+    def write(self, db: Session) -> int:
+        """
+        Replace the device's episodes. An episode the ingest writer still
+        holds open is kept as it is (same row and id); rebuilt episodes that
+        reach into it are dropped.
+        """
+        episodes = self.episodes + ([self.open] if self.open is not None else [])
+        E = AlertEpisode
+        keep = db.execute(
+            select(E.id, E.start_ts).where(E.device_id == self.device_id, E.open == True)  # noqa: E712
+        ).first()
+        stmt = delete(E).where(E.device_id == self.device_id)
+        if keep is not None:
+            stmt = stmt.where(E.id != keep.id)
+            start = keep.start_ts.replace(tzinfo=None)
+            episodes = [dict(ep, open=False) for ep in episodes if ep["end_ts"] < start]
+        db.execute(stmt)
+        if episodes:
+            db.execute(insert(E), episodes)
+        return len(episodes)
+
+
+# ==================== BACKFILL ====================
+
+def _update_rows(db: Session, t: Table, ids, status, aq, alert):
+    """executemany UPDATE with plain tuples (no per-row parameter processing)"""
+    db.connection().exec_driver_sql(
+        f"UPDATE {t.name} SET status = ?, aq_score = ?, alert = ? WHERE id = ?",
+        list(zip(status.tolist(), aq.astype(np.int64).tolist(), alert.astype(np.int64).tolist(), ids.tolist())),
+    )
+
+
+def _apply_rules(rules: RuleEngine, device_id: str, chunk: Chunk, status, alert):
+    """Raise status / alert where an enabled rule fires (rules.py)"""
+    values = np.column_stack([chunk.values[c] for c in RULE_METRICS])
+    sev = rules.evaluate(np.full(len(chunk), device_id, dtype=object), chunk.ts, values)
+    rank = np.zeros(len(chunk), dtype=np.int8)
+    for name, r in STATUS_RANK.items():
+        rank[status == name] = r
+    raise_to = sev > rank
+    if raise_to.any():
+        status = np.where(raise_to, np.where(sev >= STATUS_RANK["HIGH"], "HIGH", "WARN"), status).astype(object)
+    return status, alert | (sev > 0)
+
+
+def rescore_device(db: Session, device_id: str, chunk_rows: int = 100_000,
+                   rules: Optional[RuleEngine] = None) -> dict:
+    """
+    Recompute status / aq_score / alert of one device's server-scored rows
+    under the current settings and alert rules (commit per chunk). Returns
+    counters.
+    """
+    if rules is None:
+        rules = RuleEngine()
+        rules.load(db)
+    started = time.perf_counter()
+    scorer = Scorer()
+    rollups = AqRollups(db, device_id) if settings.ROLLUPS_ENABLED else None
+    episodes = EpisodeBuilder(device_id)
+    rows = archived = changed = 0
+    last_row: Optional[tuple] = None     # (id, status, aq_score, alert) son canlı satır
+
+    for chunk in device_chunks(db, device_id, chunk_rows):
+        status, aq, alert = scorer.score(chunk)
+        if rules.shapes:
+            status, alert = _apply_rules(rules, device_id, chunk, status, alert)
+        rows += len(chunk)
+
+        if chunk.ids is None:
+            archived += len(chunk)
+            episodes.add(chunk.ts, chunk.status, chunk.aq, chunk.alert)
+            continue
+
+        server = chunk.server
+        status = np.where(server, status, chunk.status)
+        aq = np.where(server, aq, chunk.aq)
+        alert = np.where(server, alert, chunk.alert)
+        diff = server & ((status != chunk.status) | (aq != chunk.aq) | (alert != chunk.alert))
+
+        idx = np.flatnonzero(diff)
+        if len(idx):
+            _update_rows(db, chunk.table, chunk.ids[idx], status[idx], aq[idx], alert[idx])
+            changed += len(idx)
+        if rollups is not None:
+            rollups.add(chunk.ts, aq, diff)
+        episodes.add(chunk.ts, status, aq, alert)
+        last_row = (int(chunk.ids[-1]), status[-1], aq[-1], bool(alert[-1]))
+        db.commit()
+
+    if rollups is not None:
+        rollups.finish()
+    n_episodes = 0
+    if rows:
+        n_episodes = episodes.write(db)
+        # Streaming durumu (hysteresis, son örnek) yeni kurallarla devam etsin
+        state = scorer.state_row(device_id)
+        stmt = sqlite_insert(AlertState)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["device_id"],
+            set_={c: stmt.excluded[c] for c in state if c != "device_id"},
+        ), [state])
+    db.commit()
+    # Yalnızca bu cihazın streaming durumu ve açık bölümü yeniden okunur
+    alert_states.reload(db, [device_id])
+    episode_tracker.reload(db, [device_id])
+
+    if changed:
+        row = latest_store.get_row(device_id)
+        if row is not None and last_row is not None and row.get("id") == last_row[0]:
+            latest_store.update([dict(
+                row,
+                status=last_row[1],
+                aq_score=None if np.isnan(last_row[2]) else int(last_row[2]),
+                alert=last_row[3],
+            )])
+        data_versions.bump_devices([device_id])
+
+    return {
+        "device_id": device_id,
+        "rows": rows,
+        "archived_rows": archived,
+        "updated": changed,
+        "rollup_buckets": rollups.buckets if rollups is not None else 0,
+        "episodes": n_episodes,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000.0, 1),
+    }
+
+
+def rescore(db: Session, device_id: Optional[str] = None, chunk_rows: int = 100_000) -> list[dict]:
+    """
+    Re-score one device, or every device with stored measurements. The
+    ingest writer is paused while a device is re-scored (one device at a
+    time), so its rows, rollups, episodes and alert state do not change
+    underneath.
+    """
+    if not latest_store.loaded:
+        latest_store.backfill(db)
+    device_ids = [device_id] if device_id else sorted(latest_store.snapshot())
+    rules = RuleEngine()     # canlı motorun durumu değişmesin
+    rules.load(db)
+    results = []
+    for d in device_ids:
+        with ingest_writer.paused():
+            results.append(rescore_device(db, d, chunk_rows, rules))
+    logger.info("🔁 Re-scored %d devices, %d rows updated", len(results), sum(r["updated"] for r in results))
+    return results
@@ -0,0 +1,270 @@
+"""
+Continuous rollups (1-minute / 1-hour / 1-day) maintained at ingest time.
+
+The ingest writer folds every committed batch into per-(device, bucket)
+partial aggregates and merges them into the rollup tables with an UPSERT in
+the same transaction. `rebuild_rollups` recomputes them from raw history.
+
+Rollups only hold what was ingested while ROLLUPS_ENABLED was on (or what a
+rebuild read). `rollup_coverage` tells readers from which day on a device's
+rollups are complete, so older ranges can be aggregated from raw rows.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, delete, func, case, bindparam, text
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Rollup1m, Rollup1h, Rollup1d, MeasurementBlock
+from . import partitions, archive
+
+
+ROLLUP_METRICS = ["temp_c", "hum_rh", "pressure_hpa", "tvoc_ppb", "eco2_ppm", "aq_score"]
+
+# metrik -> partial satırdaki kolon adları (satır başına f-string üretmemek için)
+_METRIC_KEYS = [(m, f"{m}_n", f"{m}_min", f"{m}_max", f"{m}_sum", f"{m}_last") for m in ROLLUP_METRICS]
+_EMPTY_PARTIAL = {k: v for _, n, lo, hi, sm, last in _METRIC_KEYS for k, v in ((n, 0), (lo, None), (hi, None), (sm, 0.0), (last, None))}
+
+# bucket adı -> (model, bucket süresi)
+ROLLUP_TABLES = {
+    "1m": (Rollup1m, timedelta(minutes=1)),
+    "1h": (Rollup1h, timedelta(hours=1)),
+    "1d": (Rollup1d, timedelta(days=1)),
+}
+
+
+def bucket_start(ts: datetime, resolution: str) -> datetime:
+    """Floor a (naive, wall-clock) timestamp to the start of its bucket"""
+    ts = ts.replace(tzinfo=None)
+    if resolution == "1m":
+        return ts.replace(second=0, microsecond=0)
+    if resolution == "1h":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    if resolution == "1d":
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown rollup resolution: {resolution}")
+
+
+class RollupAccumulator:
+    """Folds measurement rows into partial rollup rows, keyed by (resolution, device, bucket)"""
+
+    def __init__(self, resolutions: Optional[list[str]] = None):
+        self.resolutions = resolutions or list(ROLLUP_TABLES)
+        self.partials: dict[tuple[str, str, datetime], dict] = {}
+
+    def add(self, row: dict):
+        ts = row["ts"].replace(tzinfo=None)
+        device_id = row["device_id"]
+        values = [(keys, row.get(keys[0])) for keys in _METRIC_KEYS]
+        for res in self.resolutions:
+            key = (res, device_id, bucket_start(ts, res))
+            p = self.partials.get(key)
+            if p is None:
+                p = {"device_id": device_id, "bucket": key[2], "n": 0, "last_ts": ts, **_EMPTY_PARTIAL}
+                self.partials[key] = p
+
+            p["n"] += 1
+            newest = ts >= p["last_ts"]
+            if newest:
+                p["last_ts"] = ts
+            for (_, n, lo, hi, sm, last), v in values:
+                if newest:
+                    p[last] = v
+                if v is None:
+                    continue
+                p[n] += 1
+                p[sm] += v
+                cur = p[lo]
+                if cur is None or v < cur:
+                    p[lo] = v
+                cur = p[hi]
+                if cur is None or v > cur:
+                    p[hi] = v
+
+    def add_rows(self, rows: list[dict]):
+        for row in rows:
+            self.add(row)
+
+    def flush(self, db: Session):
+        """Merge partials into the rollup tables (no commit) and reset"""
+        by_res: dict[str, list[dict]] = {}
+        for (res, _, _), p in self.partials.items():
+            by_res.setdefault(res, []).append(p)
+        for res, partials in by_res.items():
+            _upsert(db, ROLLUP_TABLES[res][0], partials)
+        self.partials = {}
+
+
+_UPSERTS: dict = {}
+
+
+def _upsert(db: Session, model, partials: list[dict]):
+    """INSERT ... ON CONFLICT(device_id, bucket) DO UPDATE with merge semantics"""
+    stmt = _UPSERTS.get(model)
+    if stmt is None:
+        stmt = _UPSERTS[model] = _upsert_statement(model)
+    db.execute(stmt, partials)
+
+
+def _upsert_statement(model):
+    """
+    The UPSERT compiled once into a typed text() statement: SQLAlchemy does
+    not cache SQLite's insert().on_conflict_do_update(), so executing it
+    directly recompiles it on every ingest flush.
+    """
+    t = model.__table__
+    cols = ["device_id", "bucket", "n", "last_ts", *_EMPTY_PARTIAL]
+    stmt = sqlite_insert(t).values({c: bindparam(c) for c in cols})
+    ex = stmt.excluded
+    newer = ex.last_ts >= t.c.last_ts
+
+    merged = {
+        "n": t.c.n + ex.n,
+        "last_ts": case((newer, ex.last_ts), else_=t.c.last_ts),
+    }
+    for m in ROLLUP_METRICS:
+        cur_min, new_min = t.c[f"{m}_min"], ex[f"{m}_min"]
+        cur_max, new_max = t.c[f"{m}_max"], ex[f"{m}_max"]
+        # SQLite'ta çok argümanlı min/max NULL görürse NULL döner -> coalesce
+        merged[f"{m}_n"] = t.c[f"{m}_n"] + ex[f"{m}_n"]
+        merged[f"{m}_min"] = func.min(func.coalesce(cur_min, new_min), func.coalesce(new_min, cur_min))
+        merged[f"{m}_max"] = func.max(func.coalesce(cur_max, new_max), func.coalesce(new_max, cur_max))
+        merged[f"{m}_sum"] = t.c[f"{m}_sum"] + ex[f"{m}_sum"]
+        merged[f"{m}_last"] = case((newer, ex[f"{m}_last"]), else_=t.c[f"{m}_last"])
+
+    stmt = stmt.on_conflict_do_update(index_elements=["device_id", "bucket"], set_=merged)
+    sql = stmt.compile(dialect=sqlite.dialect(paramstyle="named")).string
+    return text(sql).bindparams(*[bindparam(c, type_=t.c[c].type) for c in cols])
+
+
+def apply_rollups(db: Session, rows: list[dict]):
+    """Fold freshly inserted measurement rows into all rollup tables (no commit)"""
+    if not rows:
+        return
+    acc = RollupAccumulator()
+    acc.add_rows(rows)
+    acc.flush(db)
+
+
+def rebuild_rollups(db: Session, device_id: Optional[str] = None, chunk_rows: int = 50_000) -> int:
+    """
+    Recompute rollups from raw measurements (all devices or one).
+    Streams the history in ts order and merges chunk by chunk, so memory
+    stays bounded. Returns the number of measurements processed.
+    """
+    for model, _ in ROLLUP_TABLES.values():
+        stmt = delete(model)
+        if device_id:
+            stmt = stmt.where(model.device_id == device_id)
+        db.execute(stmt)
+
+    total = 0
+    acc = RollupAccumulator()
+    pending = 0
+    # Önce arşiv blokları (en eski günler), sonra partition'lar
+    for rows in archive.iter_archived(db, device_id):
+        for row in rows:
+            acc.add(row)
+        total += len(rows)
+        pending += len(rows)
+        if pending >= chunk_rows:
+            acc.flush(db)
+            pending = 0
+    for t in partitions.tables_chronological(db):
+        cols = [t.c.device_id, t.c.ts] + [t.c[m] for m in ROLLUP_METRICS]
+        stmt = select(*cols).order_by(t.c.device_id, t.c.ts)
+        if device_id:
+            stmt = stmt.where(t.c.device_id == device_id)
+
+        for row in db.execute(stmt.execution_options(yield_per=chunk_rows)).mappings():
+            acc.add(row)
+            total += 1
+            pending += 1
+            if pending >= chunk_rows:
+                acc.flush(db)
+                pending = 0
+    acc.flush(db)
+
+    db.commit()
+    rollup_coverage.invalidate(device_id)
+    return total
+
+
+# ==================== COVERAGE ====================
+
+def _raw_before(db, device_id: str, ts: datetime) -> bool:
+    """Any raw (live or archived) row of the device older than `ts`?"""
+    B = MeasurementBlock
+    if db.execute(select(B.id).where(B.device_id == device_id, B.first_ts < ts).limit(1)).first():
+        return True
+    for t in partitions.partition_registry.tables(db, None, ts):
+        stmt = select(t.c.ts).where(t.c.device_id == device_id, t.c.ts < ts).limit(1)
+        if db.execute(stmt).first():
+            return True
+    return False
+
+
+def _raw_count(db, device_id: str, day: datetime) -> int:
+    """Raw (live + archived) rows of the device in [day, day + 1d)"""
+    B = MeasurementBlock
+    n = db.execute(select(func.sum(B.n)).where(B.device_id == device_id, B.day == day)).scalar() or 0
+    end = day + timedelta(days=1)
+    for t in partitions.partition_registry.tables(db, day, end):
+        stmt = select(func.count()).select_from(t).where(t.c.device_id == device_id, t.c.ts >= day, t.c.ts < end)
+        n += db.execute(stmt).scalar()
+    return n
+
+
+class RollupCoverage:
+    """
+    Per device: the rollups hold every raw row with ts >= `since(...)`.
+
+    Rollups maintained only at ingest (ROLLUPS_ENABLED turned on over an
+    existing history) start in the middle of the first rolled-up day, so
+    coverage begins at the next midnight, a boundary of every bucket size.
+    `datetime.min` when the first day is complete and nothing is older
+    (new device, or after a rebuild), `datetime.max` without rollups.
+    Cached for PARTITION_REFRESH_S since rebuilds may run in another process.
+    """
+
+    def __init__(self):
+        self._since: dict[str, tuple[float, datetime]] = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, device_id: Optional[str] = None):
+        with self._lock:
+            if device_id is None:
+                self._since.clear()
+            else:
+                self._since.pop(device_id, None)
+
+    def since(self, db, device_id: str) -> datetime:
+        with self._lock:
+            cached = self._since.get(device_id)
+        if cached is not None and time.monotonic() - cached[0] <= settings.PARTITION_REFRESH_S:
+            return cached[1]
+
+        D = Rollup1d
+        first = db.execute(
+            select(D.bucket, D.n).where(D.device_id == device_id).order_by(D.bucket.asc()).limit(1)
+        ).first()
+        if first is None:
+            since = datetime.max
+        else:
+            day = first.bucket.replace(tzinfo=None)
+            # İlk gün eksikse (rollup'lar gün ortasında açıldı) ya da daha eski ham veri varsa
+            partial = _raw_before(db, device_id, day) or _raw_count(db, device_id, day) != first.n
+            since = day + timedelta(days=1) if partial else datetime.min
+        with self._lock:
+            self._since[device_id] = (time.monotonic(), since)
+        return since
+
+
+rollup_coverage = RollupCoverage()
@@ -1,4 +1,8 @@
-from fastapi import APIRouter, Depends, Header, HTTPException, Query
+import json
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from typing import Optional, List
@@ -6,11 +10,26 @@ from typing import Optional, List
 from .database import get_db
 from .config import settings
 from .schemas import (
-    IngestPayload, IngestResponse, LatestResponse, MeasurementOut, 
-    HistoryResponse, AlertLatestResponse, AlertHistoryResponse, DeviceCreate, DeviceOut,
-    MapPoint, MapPointsResponse, CitiesResponse, DistrictsResponse
+    IngestPayload, IngestResponse, IngestBatchItem, IngestBatchResponse, LatestResponse,
+    HistoryResponse, AlertLatestResponse, AlertHistoryResponse, AlertEpisodeOut, AlertEpisodesResponse,
+    DeviceCreate, DeviceOut,
+    MapPoint, MapCluster, MapPointsResponse, CitiesResponse, DistrictsResponse,
+    AlertRuleIn, AlertRuleOut
 )
-from . import crud
+from . import crud, export, rescore, anomaly
+from .ingest_writer import ingest_writer, IngestQueueFull
+from .dedup import frame_dedup
+from .alert_state import alert_states
+from .rules import rule_engine
+from .forecast import forecaster
+from .mqtt_client import mqtt_subscriber
+from .codec import decode_frames, FrameError
+from .geo_index import BBox, device_grid, cluster_points
+from .episodes import get_episodes, episode_open
+from .versions import data_versions, check_not_modified
+from .stream import Subscription, stream_hub, encode_sse
+from .notify import notifier
+from .serialize import json_response, measurement_item, measurement_items
 
 
 router = APIRouter()
@@ -19,89 +38,200 @@ def require_api_key(x_api_key: str | None):
     if settings.API_KEY and x_api_key != settings.API_KEY:
         raise HTTPException(status_code=401, detail="Invalid API key")
 
+def device_not_modified(request: Request, response: Response, device_id: str = Query(...)):
+    """Conditional GET for endpoints that only depend on one device's data"""
+    check_not_modified(request, response, f"device:{device_id}", data_versions.device(device_id))
+
+def device_window_not_modified(request: Request, response: Response, device_id: str = Query(...)):
+    """Same, for endpoints with a window relative to now (rolls over every minute)"""
+    check_not_modified(
+        request, response, f"device:{device_id}", data_versions.device(device_id), time_slot_s=60
+    )
+
+def city_not_modified(request: Request, response: Response, city: Optional[str] = Query(None)):
+    """Conditional GET for map endpoints (per city, or global without a city filter)"""
+    check_not_modified(request, response, f"city:{city or '*'}", data_versions.city(city))
+
 @router.get("/health")
 def health():
     return {"ok": True, "name": settings.APP_NAME}
 
+def _ingest_via_writer(payloads: List[IngestPayload]) -> list[dict]:
+    """Queue payloads on the write-behind writer and wait for their group commit"""
+    try:
+        future = ingest_writer.submit(payloads)
+    except IngestQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    return future.result(timeout=settings.INGEST_SUBMIT_TIMEOUT_S + 30)
+
+def _ingest_frames_via_writer(rows: list[dict]) -> list[dict]:
+    """Same for ready-made rows decoded from binary frames"""
+    try:
+        future = ingest_writer.submit_frames(rows)
+    except IngestQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    return future.result(timeout=settings.INGEST_SUBMIT_TIMEOUT_S + 30)
+
 @router.post("/ingest", response_model=IngestResponse)
 def ingest(
     payload: IngestPayload,
-    db: Session = Depends(get_db),
     x_api_key: Optional[str] = Header(None),
 ):
     require_api_key(x_api_key)
-    m = crud.create_measurement(db, payload)
-    return IngestResponse(ok=True, id=m.id)
+    if not frame_dedup.accept(payload.device_id, payload.frame_counter):
+        return IngestResponse(ok=True, duplicate=True)
+    row = _ingest_via_writer([payload])[0]
+    return IngestResponse(ok=True, id=row["id"], duplicate=row["id"] is None)
 
-@router.get("/latest", response_model=LatestResponse)
-def latest(device_id: str = Query(...), db: Session = Depends(get_db)):
-    m = crud.get_latest(db, device_id)
-    if not m:
-        return LatestResponse(found=False, data=None)
+@router.post("/ingest/batch", response_model=IngestBatchResponse)
+def ingest_batch(
+    payloads: List[IngestPayload],
+    x_api_key: Optional[str] = Header(None),
+):
+    """Ingest many measurements with one transaction"""
+    require_api_key(x_api_key)
+    if len(payloads) > settings.INGEST_BATCH_MAX:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(payloads)} > {settings.INGEST_BATCH_MAX}",
+        )
 
-    # ✅ TÜM FIELD'LARI İÇEREN RESPONSE
-    out = MeasurementOut(
-        device_id=m.device_id,
-        ts=m.ts,
-        temp_c=m.temp_c,
-        hum_rh=m.hum_rh,
-        pressure_hpa=m.pressure_hpa,
-        tvoc_ppb=m.tvoc_ppb,
-        eco2_ppm=m.eco2_ppm,
-        rssi=m.rssi,
-        snr=m.snr,
-        aq_score=m.aq_score,  # ✅ score → aq_score
-        pred_eco2_60m=m.pred_eco2_60m,  # ✅ TinyML
-        pred_tvoc_60m=m.pred_tvoc_60m,  # ✅ TinyML
-        anom_eco2=m.anom_eco2,  # ✅ Anomaly
-        anom_tvoc=m.anom_tvoc,  # ✅ Anomaly
-        alert=m.alert,  # ✅ Alert
-        status=m.status,
-        sample_ms=m.sample_ms,
-        frame_counter=m.frame_counter
-    )
+    # Tekrarlanan frame'ler kuyruğa girmez; yanıtta sıraları korunur
+    fresh = [frame_dedup.accept(p.device_id, p.frame_counter) for p in payloads]
+    rows = iter(_ingest_via_writer([p for p, ok in zip(payloads, fresh) if ok]) if any(fresh) else [])
+    items = []
+    for ok in fresh:
+        if not ok:
+            items.append(IngestBatchItem(duplicate=True))
+            continue
+        r = next(rows)
+        items.append(IngestBatchItem(id=r["id"], duplicate=r["id"] is None, status=r["status"], aq_score=r["aq_score"]))
+    return IngestBatchResponse(ok=True, count=len(items), items=items)
+
+@router.post(
+    "/ingest/frames",
+    response_model=IngestBatchResponse,
+    openapi_extra={"requestBody": {"required": True, "content": {"application/octet-stream": {}}}},
+)
+async def ingest_frames(request: Request, x_api_key: Optional[str] = Header(None)):
+    """Ingest binary measurement frames (application/octet-stream, layout in app/codec.py)"""
+    require_api_key(x_api_key)
+    if request.headers.get("content-type", "").split(";")[0].strip() != "application/octet-stream":
+        raise HTTPException(status_code=415, detail="Expected application/octet-stream")
+    try:
+        rows = decode_frames(await request.body())
+    except FrameError as e:
+        raise HTTPException(status_code=400, detail=f"Bad frame: {e}")
+    if len(rows) > settings.INGEST_BATCH_MAX:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(rows)} > {settings.INGEST_BATCH_MAX}",
+        )
+
+    fresh = [frame_dedup.accept(r["device_id"], r["frame_counter"]) for r in rows]
+    accepted = [r for r, ok in zip(rows, fresh) if ok]
+    if accepted:
+        await run_in_threadpool(_ingest_frames_via_writer, accepted)
+    items = [
+        IngestBatchItem(id=r["id"], duplicate=r["id"] is None, status=r["status"], aq_score=r["aq_score"])
+        if ok else IngestBatchItem(duplicate=True)
+        for r, ok in zip(rows, fresh)
+    ]
+    return IngestBatchResponse(ok=True, count=len(items), items=items)
+
+@router.get("/ingest/stats")
+def ingest_stats():
+    """Write-behind queue depth and flush latency, duplicate frame totals"""
+    return {**ingest_writer.stats(), "dedup": frame_dedup.stats()}
+
+@router.get("/mqtt/stats")
+def mqtt_stats():
+    """MQTT consumer throughput (msgs/s) and lag (client backlog, rows awaiting commit, commit latency)"""
+    return mqtt_subscriber.stats()
 
-    return LatestResponse(found=True, data=out)
+@router.get("/ingest/dedup")
+def ingest_dedup(device_id: Optional[str] = Query(None)):
+    """Per-device frame counter stats: accepted, duplicates, lost, reboots, wraps"""
+    if device_id is None:
+        return {"totals": frame_dedup.stats(), "devices": frame_dedup.all_device_stats()}
+    stats = frame_dedup.device_stats(device_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No frames seen for this device")
+    return {"device_id": device_id, **stats}
 
+@router.get("/latest", response_model=LatestResponse, dependencies=[Depends(device_not_modified)])
+def latest(response: Response, device_id: str = Query(...), db: Session = Depends(get_db)):
+    row = crud.get_latest_row(db, device_id)
+    if row is None:
+        return json_response({"found": False, "data": None}, response)
+    # ✅ TÜM FIELD'LARI İÇEREN RESPONSE (MeasurementOut şekli, pydantic'siz)
+    return json_response({"found": True, "data": measurement_item(row)}, response)
 
-@router.get("/history", response_model=HistoryResponse)
+
+@router.get("/history", response_model=HistoryResponse, dependencies=[Depends(device_not_modified)])
 def history(
+    response: Response,
     device_id: str = Query(...),
     start: Optional[datetime] = Query(None),
     end: Optional[datetime] = Query(None),
     limit: int = Query(500, ge=1, le=5000),
+    bucket: Optional[str] = Query(None, pattern="^(1m|5m|1h|1d)$", description="Aggregate into time buckets"),
+    agg: str = Query("avg", pattern="^(avg|min|max|last)$", description="Bucket aggregate"),
+    points: Optional[int] = Query(None, ge=2, le=5000, description="Visually downsample to N points"),
+    mode: str = Query("lttb", pattern="^(lttb|minmax)$", description="Downsampling algorithm"),
+    metric: str = Query("tvoc_ppb", pattern="^(tvoc_ppb|eco2_ppm|temp_c|hum_rh|pressure_hpa|aq_score)$"),
     db: Session = Depends(get_db),
 ):
-    items = crud.get_history(db, device_id, start, end, limit)
-    
-    # ✅ TÜM FIELD'LARI İÇEREN RESPONSE
-    out_items = [
-        MeasurementOut(
-            device_id=m.device_id, 
-            ts=m.ts,
-            temp_c=m.temp_c, 
-            hum_rh=m.hum_rh, 
-            pressure_hpa=m.pressure_hpa,
-            tvoc_ppb=m.tvoc_ppb, 
-            eco2_ppm=m.eco2_ppm,
-            rssi=m.rssi, 
-            snr=m.snr,
-            aq_score=m.aq_score,  # ✅ score → aq_score
-            pred_eco2_60m=m.pred_eco2_60m,
-            pred_tvoc_60m=m.pred_tvoc_60m,
-            anom_eco2=m.anom_eco2,
-            anom_tvoc=m.anom_tvoc,
-            alert=m.alert,
-            status=m.status,
-            sample_ms=m.sample_ms,
-            frame_counter=m.frame_counter
+    if bucket:
+        rows = crud.get_history_buckets(db, device_id, start, end, bucket, agg, limit)
+        items = [measurement_item(r) for r in rows]
+        return json_response(
+            {"device_id": device_id, "count": len(items), "items": items, "bucket": bucket, "agg": agg},
+            response,
         )
-        for m in items
-    ]
-    return HistoryResponse(device_id=device_id, count=len(out_items), items=out_items)
+
+    # ✅ TÜM FIELD'LARI İÇEREN RESPONSE (Core satırları -> JSON)
+    if points:
+        rows = crud.get_history_downsampled_rows(db, device_id, start, end, points, mode, metric)
+    else:
+        rows = crud.get_history_rows(db, device_id, start, end, limit)
+    items = measurement_items(rows)
+    return json_response(
+        {"device_id": device_id, "count": len(items), "items": items, "bucket": None, "agg": None},
+        response,
+    )
+
+
+@router.get("/export")
+def export_history(
+    device_id: str = Query(...),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    cursor: Optional[str] = Query(None, description="Resume after '<ts>,<id>' of the last received row"),
+    chunk: int = Query(5000, ge=100, le=50000),
+):
+    """Stream a device's full history as NDJSON or CSV (constant memory)"""
+    try:
+        after = export.parse_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid cursor: {e}")
+
+    chunks = export.iter_rows(device_id, start, end, after, chunk)
+    if format == "csv":
+        body, media_type = export.iter_csv(chunks, header=after is None), "text/csv"
+    else:
+        body, media_type = export.iter_ndjson(chunks), "application/x-ndjson"
+
+    filename = f"{device_id}.{format}"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
-@router.get("/alerts/latest", response_model=AlertLatestResponse)
+@router.get("/alerts/latest", response_model=AlertLatestResponse, dependencies=[Depends(device_not_modified)])
 def alerts_latest(device_id: str = Query(...), db: Session = Depends(get_db)):
     m = crud.get_latest(db, device_id)
     if not m:
@@ -120,46 +250,251 @@ def alerts_latest(device_id: str = Query(...), db: Session = Depends(get_db)):
 
 
 # ✅ YENİ ENDPOINT: Alert History
-@router.get("/alerts/history", response_model=AlertHistoryResponse)
+@router.get(
+    "/alerts/history", response_model=AlertHistoryResponse, dependencies=[Depends(device_window_not_modified)]
+)
 def alerts_history(
+    response: Response,
     device_id: str = Query(...),
     hours: int = Query(24, ge=1, le=168),
     limit: int = Query(100, ge=1, le=1000),
     db: Session = Depends(get_db)
 ):
-    """Get alert history for last N hours"""
+    """Get alert history for last N hours (newest first)"""
     end = datetime.utcnow()
     start = end - timedelta(hours=hours)
     
-    # Get measurements where alert=True
-    all_measurements = crud.get_history(db, device_id, start, end, limit)
-    alert_items = [m for m in all_measurements if m.alert]
-    
-    out_items = [
-        MeasurementOut(
-            device_id=m.device_id,
-            ts=m.ts,
-            temp_c=m.temp_c,
-            hum_rh=m.hum_rh,
-            pressure_hpa=m.pressure_hpa,
-            tvoc_ppb=m.tvoc_ppb,
-            eco2_ppm=m.eco2_ppm,
-            rssi=m.rssi,
-            snr=m.snr,
-            aq_score=m.aq_score,
-            pred_eco2_60m=m.pred_eco2_60m,
-            pred_tvoc_60m=m.pred_tvoc_60m,
-            anom_eco2=m.anom_eco2,
-            anom_tvoc=m.anom_tvoc,
-            alert=m.alert,
-            status=m.status,
-            sample_ms=m.sample_ms,
-            frame_counter=m.frame_counter
+    # alert=True filtresi SQL'de (partial index)
+    items = measurement_items(crud.get_alert_history_rows(db, device_id, start, end, limit))
+    return json_response({"device_id": device_id, "count": len(items), "items": items}, response)
+
+
+@router.get(
+    "/alerts/episodes", response_model=AlertEpisodesResponse, dependencies=[Depends(device_window_not_modified)]
+)
+def alerts_episodes(
+    device_id: str = Query(...),
+    hours: int = Query(24, ge=1, le=24 * 90),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """Alert episodes that were active in the last N hours (newest first)"""
+    now = datetime.utcnow()
+    start = now - timedelta(hours=hours)
+    episodes = get_episodes(db, device_id, start, limit)
+    items = [
+        AlertEpisodeOut(
+            device_id=e.device_id,
+            start_ts=e.start_ts,
+            end_ts=e.end_ts,
+            peak_status=e.peak_status,
+            peak_score=e.peak_score,
+            samples=e.samples,
+            # Sessiz kalan cihazın bölümü bir sonraki örneğe kadar tabloda açık kalır
+            open=episode_open(e, now),
         )
-        for m in alert_items
+        for e in episodes
     ]
-    
-    return AlertHistoryResponse(device_id=device_id, count=len(out_items), items=out_items)
+    return AlertEpisodesResponse(device_id=device_id, count=len(items), items=items)
+
+
+@router.get("/alerts/state")
+def alerts_state(device_id: Optional[str] = Query(None)):
+    """Streaming alert state: last sample, status, test-range hysteresis and delta flag"""
+    if device_id is None:
+        return alert_states.stats()
+    state = alert_states.get(device_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="No samples seen for this device")
+    return {"device_id": device_id, **state}
+
+
+@router.post("/alerts/rescore")
+def alerts_rescore(
+    device_id: Optional[str] = Query(None, description="Only this device (default: all devices)"),
+    db: Session = Depends(get_db),
+    x_api_key: Optional[str] = Header(None),
+):
+    """Recompute status / aq_score / alert of stored rows under the current alert settings"""
+    require_api_key(x_api_key)
+    results = rescore.rescore(db, device_id)
+    if device_id and not results[0]["rows"]:
+        raise HTTPException(status_code=404, detail="No measurements for this device")
+    return {
+        "devices": len(results),
+        "rows": sum(r["rows"] for r in results),
+        "updated": sum(r["updated"] for r in results),
+        "results": results,
+    }
+
+
+# Sunucu tarafı anomali tespiti (anom_eco2 / anom_tvoc)
+
+@router.get("/anomalies/state")
+def anomalies_state(device_id: Optional[str] = Query(None)):
+    """EWMA mean / std per metric of a device, or detector counters"""
+    if device_id is None:
+        return anomaly.anomaly_detector.stats()
+    state = anomaly.anomaly_detector.get(device_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="No samples seen for this device")
+    return {"device_id": device_id, **state}
+
+
+@router.post("/anomalies/backfill")
+def anomalies_backfill(
+    device_id: Optional[str] = Query(None, description="Only this device (default: all devices)"),
+    db: Session = Depends(get_db),
+    x_api_key: Optional[str] = Header(None),
+):
+    """Recompute anom_eco2 / anom_tvoc of stored rows under the current anomaly settings"""
+    require_api_key(x_api_key)
+    results = anomaly.backfill(db, device_id)
+    if device_id and not results[0]["rows"]:
+        raise HTTPException(status_code=404, detail="No measurements for this device")
+    return {
+        "devices": len(results),
+        "rows": sum(r["rows"] for r in results),
+        "updated": sum(r["updated"] for r in results),
+        "results": results,
+    }
+
+
+# Sunucu tarafı tahmin (TinyML'siz cihazların pred_eco2_60m / pred_tvoc_60m değerleri)
+
+@router.get("/forecast")
+def get_forecast(device_id: Optional[str] = Query(None)):
+    """Cached 60-minute forecast of a device, or forecaster counters"""
+    if device_id is None:
+        return forecaster.stats()
+    forecast = forecaster.get(device_id)
+    if forecast is None:
+        raise HTTPException(status_code=404, detail="No forecast for this device")
+    return {"device_id": device_id, **forecast}
+
+
+# Tanımlı alert kuralları
+
+@router.get("/rules", response_model=List[AlertRuleOut])
+def list_rules(db: Session = Depends(get_db)):
+    """All alert rules (enabled and disabled)"""
+    return crud.get_rules(db)
+
+
+@router.post("/rules", response_model=AlertRuleOut)
+def create_rule(rule: AlertRuleIn, db: Session = Depends(get_db), x_api_key: Optional[str] = Header(None)):
+    """Add a rule; it applies from the next ingest batch"""
+    require_api_key(x_api_key)
+    return crud.create_rule(db, rule)
+
+
+@router.get("/rules/firing")
+def rules_firing(device_id: Optional[str] = Query(None)):
+    """Rules firing now per device, recent fired/cleared events and engine counters"""
+    events = rule_engine.recent_events()
+    if device_id is not None:
+        events = [e for e in events if e["device_id"] == device_id]
+    return {
+        "stats": rule_engine.stats(),
+        "firing": rule_engine.firing(device_id),
+        "recent": events[::-1],
+    }
+
+
+@router.put("/rules/{rule_id}", response_model=AlertRuleOut)
+def update_rule(rule_id: int, rule: AlertRuleIn, db: Session = Depends(get_db), x_api_key: Optional[str] = Header(None)):
+    require_api_key(x_api_key)
+    db_rule = crud.update_rule(db, rule_id, rule)
+    if db_rule is None:
+        raise HTTPException(status_code=404, detail=f"Rule not found: {rule_id}")
+    return db_rule
+
+
+@router.delete("/rules/{rule_id}")
+def delete_rule(rule_id: int, db: Session = Depends(get_db), x_api_key: Optional[str] = Header(None)):
+    require_api_key(x_api_key)
+    if not crud.delete_rule(db, rule_id):
+        raise HTTPException(status_code=404, detail=f"Rule not found: {rule_id}")
+    return {"ok": True, "id": rule_id}
+
+
+# Canlı akış (dashboard polling yerine)
+
+def _stream_subscription(device_id: Optional[List[str]], city: Optional[str], district: Optional[str]) -> Subscription:
+    return stream_hub.subscribe(Subscription(
+        device_ids=set(device_id) if device_id else None,
+        city=city,
+        district=district if city else None,
+    ))
+
+
+@router.get("/stream")
+async def stream_sse(
+    request: Request,
+    device_id: Optional[List[str]] = Query(None, description="Device ids to follow (repeatable)"),
+    city: Optional[str] = Query(None),
+    district: Optional[str] = Query(None),
+):
+    """Server-Sent Events: `measurement` and `status` events as ingest commits them"""
+    sub = _stream_subscription(device_id, city, district)
+
+    async def body():
+        try:
+            yield "retry: 3000\n\n"
+            while not sub.closed:
+                events = await sub.next_batch(settings.STREAM_HEARTBEAT_S)
+                if await request.is_disconnected():
+                    break
+                yield encode_sse(events) if events else ": keep-alive\n\n"
+            if sub.closed:
+                yield encode_sse([("overflow", {"dropped": sub.dropped})])
+        finally:
+            stream_hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/stream/ws")
+async def stream_ws(
+    websocket: WebSocket,
+    device_id: Optional[List[str]] = Query(None),
+    city: Optional[str] = Query(None),
+    district: Optional[str] = Query(None),
+):
+    """WebSocket variant of /stream: each message is a JSON list of {event, data}"""
+    await websocket.accept()
+    sub = _stream_subscription(device_id, city, district)
+    try:
+        while not sub.closed:
+            events = await sub.next_batch(settings.STREAM_HEARTBEAT_S)
+            if events:
+                await websocket.send_text(json.dumps(
+                    [{"event": name, "data": data} for name, data in events], separators=(",", ":")
+                ))
+            else:
+                await websocket.send_text('[{"event":"ping"}]')
+        # Yavaş tüketici: 1013 = Try Again Later
+        await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        stream_hub.unsubscribe(sub)
+
+
+@router.get("/stream/stats")
+def stream_stats():
+    """Live stream subscribers and fan-out counters"""
+    return stream_hub.stats()
+
+
+@router.get("/notifications/stats")
+def notifications_stats():
+    """Transition / coalescing counters and per-sink delivery counters"""
+    return notifier.stats()
 
 
 # ✅ YENİ ENDPOINT: List All Devices
@@ -246,28 +581,35 @@ def get_districts(city: str = Query(..., description="City name"), db: Session =
     return DistrictsResponse(city=city, districts=districts)
 
 
-@router.get("/map/points", response_model=MapPointsResponse)
+@router.get("/map/points", response_model=MapPointsResponse, dependencies=[Depends(city_not_modified)])
 def get_map_points(
     city: Optional[str] = Query(None, description="City filter"),
     district: Optional[str] = Query(None, description="District filter"),
+    bbox: Optional[str] = Query(None, description="Viewport: min_lon,min_lat,max_lon,max_lat"),
+    zoom: Optional[int] = Query(None, ge=0, le=22, description="Map zoom level"),
     db: Session = Depends(get_db)
 ):
     """
-    Get all sensor points for map with latest measurements
+    Get sensor points for map with latest measurements.
+    With `bbox`, only devices inside the viewport are returned; with a
+    `zoom` below MAP_CLUSTER_MAX_ZOOM, clusters are returned instead of points.
     """
-    # Filter devices
-    if district and city:
-        devices = crud.get_devices_by_district(db, city, district)
-    elif city:
-        devices = crud.get_devices_by_city(db, city)
-    else:
-        devices = crud.get_all_devices(db)
-    
+    try:
+        box = BBox.parse(bbox) if bbox else None
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if not device_grid.loaded:
+        device_grid.load(db)
+    devices = device_grid.query(box, city=city, district=district if city else None)
+
+    # Latest values from the in-memory store (no per-device query)
+    latest_by_device = crud.get_latest_many(db, [d.device_id for d in devices])
+
     points = []
     
     for device in devices:
-        # Get latest measurement
-        latest = crud.get_latest(db, device.device_id)
+        latest = latest_by_device.get(device.device_id)
         
         if latest:
             # ✅ FRONTEND'İN BEKLEDİĞİ FORMAT
@@ -309,5 +651,13 @@ def get_map_points(
             )
         
         points.append(point)
-    
-    return MapPointsResponse(points=points)
\ No newline at end of file
+
+    if zoom is not None and zoom < settings.MAP_CLUSTER_MAX_ZOOM:
+        clusters = cluster_points([p.model_dump() for p in points], zoom)
+        return MapPointsResponse(
+            points=[],
+            clusters=[MapCluster(**c) for c in clusters],
+            clustered=True,
+        )
+
+    return MapPointsResponse(points=points)
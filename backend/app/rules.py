@@ -0,0 +1,537 @@
+"""
+Declarative alert rules stored in `alert_rules`.
+
+A rule applies to one device, a city/district, a city or every device, and
+has one of three kinds on a sensor column:
+
+- threshold:     the value itself
+- baseline_pct:  % over the mean of the device's earlier samples in the
+                 last `window_s` seconds (0 = BASELINE_SECONDS)
+- rate:          change per minute against the device's previous sample
+
+compared `above` / `below` a value. Every rule may also have a hysteresis
+(it clears only once the signal is `hysteresis` past the value) and a
+sustain time (the condition must hold for `sustain_s` seconds before it
+fires). A firing rule raises the row's status to its severity (WARN / HIGH)
+and sets `alert`.
+
+Enabled rules are compiled into shapes: all rules with the same (kind,
+metric, op, window) become one set of arrays. A batch of rows is evaluated
+shape by shape with NumPy over every (row, matching rule) pair at once, so
+Python-level work grows with shapes (and devices in the batch), not with
+devices x rules. Per (rule, device) state (firing, condition-true-since)
+lives in sorted arrays inside each shape; it is in memory only and starts
+cleared after a restart.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import AlertRule
+from .alerts import DELTA_COLUMNS
+from .episodes import STATUS_RANK
+from .geo_index import device_grid, DeviceInfo
+
+logger = logging.getLogger(__name__)
+
+RULE_KINDS = ("threshold", "baseline_pct", "rate")
+RULE_OPS = ("above", "below")
+RULE_METRICS = DELTA_COLUMNS
+RULE_SEVERITIES = ("WARN", "HIGH")
+
+_US = 1_000_000
+_EPOCH = datetime(1970, 1, 1)
+_STATUS_BY_RANK = {STATUS_RANK[s]: s for s in RULE_SEVERITIES}
+_RECENT_EVENTS = 200
+
+
+def _naive_us(values) -> np.ndarray:
+    return np.array([v.replace(tzinfo=None) for v in values], dtype="datetime64[us]").astype(np.int64)
+
+
+def _dt(us) -> datetime:
+    return _EPOCH + timedelta(microseconds=int(us))
+
+
+def rule_scope(rule: dict) -> tuple:
+    """Most specific scope of a rule: device > district > city > everywhere"""
+    if rule["device_id"]:
+        return ("device", rule["device_id"])
+    if rule["city"] and rule["district"]:
+        return ("district", rule["city"], rule["district"])
+    if rule["city"]:
+        return ("city", rule["city"])
+    return ("all",)
+
+
+def _device_scopes(device_id: str, info: Optional[DeviceInfo]) -> list[tuple]:
+    scopes = [("device", device_id), ("all",)]
+    if info is not None:
+        scopes += [("district", info.city, info.district), ("city", info.city)]
+    return scopes
+
+
+# ==================== COMPILED SHAPE ====================
+
+class RuleShape:
+    """Enabled rules sharing (kind, metric, op, window), as parallel arrays"""
+
+    def __init__(self, key: tuple, rules: list):
+        self.kind, self.metric, self.op, self.window_s = key
+        self.col = RULE_METRICS.index(self.metric)
+        self.rule_ids = np.array([r["id"] for r in rules], dtype=np.int64)
+        self.threshold = np.array([r["value"] for r in rules], dtype=np.float64)
+        self.hysteresis = np.array([r["hysteresis"] or 0.0 for r in rules], dtype=np.float64)
+        self.sustain_us = np.array([(r["sustain_s"] or 0) * _US for r in rules], dtype=np.int64)
+        self.severity = np.array([STATUS_RANK[r["severity"]] for r in rules], dtype=np.int8)
+
+        # scope -> slot indexes
+        self.scopes: dict[tuple, list[int]] = {}
+        for slot, r in enumerate(rules):
+            self.scopes.setdefault(rule_scope(r), []).append(slot)
+
+        # (slot << 32 | device index) -> durum, anahtara göre sıralı
+        self.state_keys = np.empty(0, dtype=np.int64)
+        self.active = np.empty(0, dtype=bool)
+        self.since = np.empty(0, dtype=np.int64)       # koşulun kesintisiz doğru olduğu ilk ts (-1: değil)
+
+    @property
+    def signal_key(self) -> tuple:
+        return (self.kind, self.col, self.window_s)
+
+    def slots_for(self, device_id: str, info: Optional[DeviceInfo]) -> np.ndarray:
+        slots = [s for scope in _device_scopes(device_id, info) for s in self.scopes.get(scope, ())]
+        return np.array(sorted(slots), dtype=np.int64)
+
+    def lookup(self, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(found, active, since) for pair keys"""
+        pos = np.searchsorted(self.state_keys, keys)
+        pos_c = np.minimum(pos, max(len(self.state_keys) - 1, 0))
+        found = (pos < len(self.state_keys)) & (self.state_keys[pos_c] == keys) if len(self.state_keys) else np.zeros(len(keys), dtype=bool)
+        active = np.where(found, self.active[pos_c] if len(self.active) else False, False)
+        since = np.where(found, self.since[pos_c] if len(self.since) else -1, -1)
+        return found, active, since
+
+    def store(self, keys: np.ndarray, active: np.ndarray, since: np.ndarray):
+        """Write back the state of these pairs (new pairs are merged in key order)"""
+        found, _, _ = self.lookup(keys)
+        if found.any():
+            pos = np.searchsorted(self.state_keys, keys[found])
+            self.active[pos] = active[found]
+            self.since[pos] = since[found]
+        new = ~found
+        if new.any():
+            keys = np.concatenate([self.state_keys, keys[new]])
+            order = np.argsort(keys, kind="stable")
+            self.state_keys = keys[order]
+            self.active = np.concatenate([self.active, active[new]])[order]
+            self.since = np.concatenate([self.since, since[new]])[order]
+
+    def export_state(self) -> dict[tuple[int, int], tuple[bool, int]]:
+        slots = self.state_keys >> 32
+        devs = self.state_keys & 0xFFFFFFFF
+        return {
+            (int(self.rule_ids[s]), int(d)): (bool(a), int(t))
+            for s, d, a, t in zip(slots, devs, self.active, self.since)
+        }
+
+
+# ==================== ENGINE ====================
+
+class RuleEngine:
+    """Compiled enabled rules + per (rule, device) and per device state"""
+
+    def __init__(self):
+        self.loaded = False
+        self.shapes: list[RuleShape] = []
+        self.rules: dict[int, dict] = {}           # rule_id -> kolon dict
+        self._lock = threading.Lock()
+
+        self._device_index: dict[str, int] = {}
+        self._device_names: list[str] = []
+        self._device_slots: dict[str, tuple[Optional[DeviceInfo], list[np.ndarray]]] = {}
+        self._prev: dict[str, tuple[int, np.ndarray]] = {}             # rate: son örnek (ts, değerler)
+        self._windows: dict[str, tuple[np.ndarray, np.ndarray]] = {}   # baseline_pct: (ts, değerler)
+        self._window_us = 0
+
+        self._firing: dict[tuple[int, str], datetime] = {}    # (rule_id, device_id) -> since
+        self.recent: deque = deque(maxlen=_RECENT_EVENTS)
+
+        # metrics
+        self.batches = 0
+        self.rows = 0
+        self.pairs = 0
+        self.raised = 0
+        self.fired = 0
+        self.cleared = 0
+        self.last_eval_ms = 0.0
+
+    # ==================== COMPILE ====================
+
+    def load(self, db: Session):
+        """Compile the enabled rules; state of rules that still exist is kept"""
+        columns = [c.name for c in AlertRule.__table__.columns]
+        rules = [
+            {c: getattr(r, c) for c in columns}   # kolon dict: session kapansa da okunabilir
+            for r in db.execute(select(AlertRule).where(AlertRule.enabled == True)).scalars()  # noqa: E712
+        ]
+        groups: dict[tuple, list] = {}
+        for r in rules:
+            window = (r["window_s"] or settings.BASELINE_SECONDS) if r["kind"] == "baseline_pct" else 0
+            groups.setdefault((r["kind"], r["metric"], r["op"], window), []).append(r)
+
+        with self._lock:
+            old = {}
+            for shape in self.shapes:
+                old.update(shape.export_state())
+
+            self.shapes = [RuleShape(key, group) for key, group in sorted(groups.items())]
+            self.rules = {r["id"]: r for r in rules}
+            where = {int(rid): (shape, slot) for shape in self.shapes for slot, rid in enumerate(shape.rule_ids)}
+            restored: dict[int, list] = {}
+            for (rule_id, d), (active, since) in old.items():
+                if rule_id in where:
+                    shape, slot = where[rule_id]
+                    restored.setdefault(id(shape), []).append(((slot << 32) | d, active, since))
+            for shape in self.shapes:
+                keep = restored.get(id(shape))
+                if keep:
+                    shape.store(
+                        np.array([k for k, _, _ in keep], dtype=np.int64),
+                        np.array([a for _, a, _ in keep], dtype=bool),
+                        np.array([t for _, _, t in keep], dtype=np.int64),
+                    )
+            self._firing = {k: v for k, v in self._firing.items() if k[0] in self.rules}
+            self._device_slots = {}
+            self._window_us = max([s.window_s for s in self.shapes if s.kind == "baseline_pct"], default=0) * _US
+            self.loaded = True
+        logger.info(f"📐 Alert rules compiled: {len(rules)} rules in {len(self.shapes)} shapes")
+
+    def invalidate(self):
+        """Drop rules and state (e.g. after a failed commit); next batch reloads"""
+        with self._lock:
+            self.shapes = []
+            self._device_slots = {}
+            self._prev = {}
+            self._windows = {}
+            self._firing = {}
+            self.loaded = False
+
+    def snapshot(self, device_ids) -> tuple:
+        """
+        State touched by a batch of these devices, for `restore` after a
+        failed commit: per-device carries and firing entries, and a copy of
+        every shape's (rule, device) state arrays.
+        """
+        devices = set(device_ids)
+        with self._lock:
+            return (
+                self.loaded,
+                [(s, s.state_keys.copy(), s.active.copy(), s.since.copy()) for s in self.shapes],
+                {d: (self._prev.get(d), self._windows.get(d)) for d in devices},
+                {k: v for k, v in self._firing.items() if k[1] in devices},
+            )
+
+    def restore(self, snapshot: tuple):
+        """Put back the state of a snapshot (other devices are untouched)"""
+        loaded, shapes, carried, firing = snapshot
+        if not loaded:
+            self.invalidate()
+            return
+        with self._lock:
+            current = {id(s) for s in self.shapes}
+            for shape, keys, active, since in shapes:
+                if id(shape) in current:      # arada load() olduysa eski şekiller artık kullanılmıyor
+                    shape.state_keys, shape.active, shape.since = keys, active, since
+            for device_id, (prev, window) in carried.items():
+                for store, value in ((self._prev, prev), (self._windows, window)):
+                    if value is None:
+                        store.pop(device_id, None)
+                    else:
+                        store[device_id] = value
+            self._firing = {k: v for k, v in self._firing.items() if k[1] not in carried}
+            self._firing.update(firing)
+
+    def _slots(self, device_id: str) -> list[np.ndarray]:
+        """Matching slots per shape for a device (cached until its registration changes)"""
+        info = device_grid.get(device_id)
+        cached = self._device_slots.get(device_id)
+        if cached is None or cached[0] is not info:
+            cached = self._device_slots[device_id] = (info, [s.slots_for(device_id, info) for s in self.shapes])
+        return cached[1]
+
+    def _index(self, device_id: str) -> int:
+        idx = self._device_index.get(device_id)
+        if idx is None:
+            idx = self._device_index[device_id] = len(self._device_names)
+            self._device_names.append(device_id)
+        return idx
+
+    # ==================== SIGNALS ====================
+
+    def _rate(self, devices, starts, ts, values, col) -> np.ndarray:
+        """Change per minute against the previous sample of the same device"""
+        prev_ts = np.concatenate([[0], ts[:-1]])
+        prev_v = np.concatenate([[np.nan], values[:-1, col]])
+        for d, s in zip(devices, starts):
+            carried = self._prev.get(d)
+            prev_ts[s], prev_v[s] = (carried[0], carried[1][col]) if carried else (0, np.nan)
+        dt = (ts - prev_ts) / _US
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where((dt > 0) & (prev_ts > 0), (values[:, col] - prev_v) / dt * 60.0, np.nan)
+
+    def _baseline_pct(self, devices, starts, ends, ts, values, col, window_us) -> np.ndarray:
+        """% over the mean of the earlier samples in [ts - window, ts], carried windows first"""
+        carried = [self._windows.get(d) for d in devices]
+        c_len = np.array([len(c[0]) if c is not None else 0 for c in carried], dtype=np.int64)
+        if c_len.any():
+            c_ts = np.concatenate([c[0] for c in carried if c is not None])
+            c_v = np.concatenate([c[1][:, col] for c in carried if c is not None])
+        else:
+            c_ts, c_v = np.empty(0, dtype=np.int64), np.empty(0)
+        all_ts = np.concatenate([c_ts, ts])
+        v = np.concatenate([c_v, values[:, col]])
+        g = np.concatenate([np.repeat(np.arange(len(devices)), c_len), np.repeat(np.arange(len(devices)), ends - starts)])
+        is_row = np.concatenate([np.zeros(len(c_ts), dtype=bool), np.ones(len(ts), dtype=bool)])
+
+        # Cihazları tek sıralı eksende ayır: g * span + ts (aynı ts'de taşınan örnek önce)
+        order = np.lexsort((is_row, all_ts, g))
+        all_ts, v, g, is_row = all_ts[order], v[order], g[order], is_row[order]
+        t0 = all_ts.min()
+        span = int(all_ts.max() - t0) + window_us + 1
+        key = g.astype(np.int64) * span + (all_ts - t0)
+        present = ~np.isnan(v)
+        csum = np.concatenate([[0.0], np.cumsum(np.where(present, v, 0.0))])
+        ccnt = np.concatenate([[0], np.cumsum(present)])
+        idx = np.flatnonzero(is_row)
+        left = np.searchsorted(key, key[idx] - window_us, side="left")
+        n = ccnt[idx] - ccnt[left]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            base = np.where(n > 0, (csum[idx] - csum[left]) / np.maximum(n, 1), np.nan)
+            return np.where(base > 0, (v[idx] - base) / base * 100.0, np.nan)
+
+    # ==================== EVALUATION ====================
+
+    def evaluate(self, device_ids, ts: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """
+        Severity rank (0 / WARN / HIGH) per row for arrays of rows: device id
+        (object), ts (epoch µs), values (rows x RULE_METRICS, nan = NULL).
+        Rows older than the device's last evaluated sample are skipped.
+        """
+        started = time.perf_counter()
+        n = len(ts)
+        out = np.zeros(n, dtype=np.int8)
+        if not n or not self.shapes:
+            return out
+
+        uniq, inv = np.unique(np.asarray(device_ids, dtype=object), return_inverse=True)
+        order = np.lexsort((ts, inv))
+        dev, ts_s, val = inv[order], ts[order], values[order]
+
+        # Geç gelen örnekler: cihazın son değerlendirilen örneğinden eski
+        last = np.array([self._prev[d][0] if d in self._prev else -1 for d in uniq], dtype=np.int64)
+        keep = ts_s >= last[dev]
+        if not keep.all():
+            order, dev, ts_s, val = order[keep], dev[keep], ts_s[keep], val[keep]
+            if not len(order):
+                return out
+
+        starts = np.flatnonzero(np.concatenate([[True], dev[1:] != dev[:-1]]))
+        ends = np.concatenate([starts[1:], [len(dev)]])
+        devices = [uniq[dev[s]] for s in starts]
+        lengths = ends - starts
+        dev_index = np.array([self._index(d) for d in devices], dtype=np.int64)
+        slots = [self._slots(d) for d in devices]
+
+        sev = np.zeros(len(dev), dtype=np.int8)
+        signals: dict[tuple, np.ndarray] = {}
+        pairs = 0
+        for k, shape in enumerate(self.shapes):
+            per_device = [sl[k] for sl in slots]
+            counts = np.fromiter(map(len, per_device), dtype=np.int64, count=len(per_device))
+            if not counts.any():
+                continue
+
+            sig = signals.get(shape.signal_key)
+            if sig is None:
+                if shape.kind == "threshold":
+                    sig = val[:, shape.col]
+                elif shape.kind == "rate":
+                    sig = self._rate(devices, starts, ts_s, val, shape.col)
+                else:
+                    sig = self._baseline_pct(devices, starts, ends, ts_s, val, shape.col, shape.window_s * _US)
+                signals[shape.signal_key] = sig
+
+            # (satır, kural) çiftleri: (cihaz, kural) girdisi başına cihazın satırları, ts sıralı
+            entry_slot = np.concatenate(per_device)
+            entry_dev = np.repeat(np.arange(len(devices)), counts)
+            sizes = lengths[entry_dev]
+            pair_entry = np.repeat(np.arange(len(entry_slot)), sizes)
+            offset = np.arange(len(pair_entry)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            rows = starts[entry_dev][pair_entry] + offset
+            slot = entry_slot[pair_entry]
+            keys = (slot << 32) | dev_index[entry_dev][pair_entry]
+            pairs += len(rows)
+            sev_pairs = self._run_shape(shape, rows, slot, keys, sig, ts_s)
+            np.maximum.at(sev, rows, sev_pairs)
+
+        self._advance(devices, starts, ends, ts_s, val)
+        out[order] = sev
+
+        self.batches += 1
+        self.rows += n
+        self.pairs += pairs
+        self.last_eval_ms = (time.perf_counter() - started) * 1000.0
+        return out
+
+    def _run_shape(self, shape: RuleShape, rows, slot, keys, sig, ts) -> np.ndarray:
+        """Sustain + hysteresis over the pairs of one shape; returns severity per pair"""
+        s = sig[rows]
+        t = ts[rows]
+        thr = shape.threshold[slot]
+        with np.errstate(invalid="ignore"):
+            if shape.op == "above":
+                cond = s > thr
+                clear = s <= thr - shape.hysteresis[slot]
+            else:
+                cond = s < thr
+                clear = s >= thr + shape.hysteresis[slot]
+
+        m = len(rows)
+        first = np.concatenate([[True], keys[1:] != keys[:-1]])
+        starts = np.flatnonzero(first)
+        group = np.cumsum(first) - 1
+        _, was_active, was_since = shape.lookup(keys[starts])
+        arange = np.arange(m)
+
+        # Koşulun kesintisiz doğru olduğu başlangıç (grup başında taşınan değer)
+        prev_cond = np.concatenate([[False], cond[:-1]])
+        prev_cond[starts] = was_since >= 0
+        run_start = cond & ~prev_cond
+        carried = first & cond & prev_cond
+        since_at = np.where(run_start, t, np.where(carried, was_since[group], -1))
+        idx = np.where(run_start | carried, arange, -1)
+        np.maximum.accumulate(idx, out=idx)
+        since = np.where(cond & (idx >= 0), since_at[np.maximum(idx, 0)], -1)
+
+        fire = cond & (t - since >= shape.sustain_us[slot])
+        act = np.where(fire, 1, np.where(clear, 0, -1)).astype(np.int8)
+        keep_first = first & (act < 0)
+        act[keep_first] = was_active[group[keep_first]]
+        idx = np.where(act >= 0, arange, -1)
+        np.maximum.accumulate(idx, out=idx)
+        active = act[idx].astype(bool)
+
+        prev_active = np.concatenate([[False], active[:-1]])
+        prev_active[starts] = was_active
+        changed = np.flatnonzero(active != prev_active)
+        if len(changed):
+            self._record(shape, slot[changed], keys[changed], t[changed], active[changed])
+
+        ends = np.concatenate([starts[1:], [m]]) - 1
+        shape.store(keys[starts], active[ends], since[ends])
+        return np.where(active, shape.severity[slot], 0).astype(np.int8)
+
+    def _record(self, shape: RuleShape, slots, keys, ts, active):
+        """Firing / clearing transitions (rare): firing set + recent events"""
+        for slot, key, t, on in zip(slots, keys, ts, active):
+            rule_id = int(shape.rule_ids[slot])
+            device_id = self._device_names[int(key) & 0xFFFFFFFF]
+            at = _dt(t)
+            if on:
+                self._firing[(rule_id, device_id)] = at
+                self.fired += 1
+            else:
+                self._firing.pop((rule_id, device_id), None)
+                self.cleared += 1
+            self.recent.append({
+                "rule_id": rule_id,
+                "device_id": device_id,
+                "ts": at,
+                "event": "fired" if on else "cleared",
+                "severity": _STATUS_BY_RANK[int(shape.severity[slot])],
+            })
+
+    def _advance(self, devices, starts, ends, ts, values):
+        """Carry the last sample (rate) and the baseline window of each device"""
+        for d, s, e in zip(devices, starts, ends):
+            self._prev[d] = (int(ts[e - 1]), values[e - 1].copy())
+            if self._window_us:
+                carried = self._windows.get(d)
+                w_ts, w_v = ts[s:e], values[s:e]
+                if carried is not None:
+                    w_ts, w_v = np.concatenate([carried[0], w_ts]), np.concatenate([carried[1], w_v])
+                keep = w_ts >= w_ts[-1] - self._window_us
+                self._windows[d] = (w_ts[keep], w_v[keep])
+
+    def apply(self, db: Session, rows: list[dict]) -> int:
+        """
+        Evaluate a batch of measurement rows (before insert) and raise the
+        status / alert of rows hit by a rule. Returns rows raised.
+        """
+        if not rows:
+            return 0
+        if not self.loaded:
+            self.load(db)
+        with self._lock:
+            if not self.shapes:
+                return 0
+            sev = self.evaluate(
+                np.array([r["device_id"] for r in rows], dtype=object),
+                _naive_us([r["ts"] for r in rows]),
+                np.array([[r.get(c) for c in RULE_METRICS] for r in rows], dtype=np.float64),
+            )
+            raised = 0
+            for i in np.flatnonzero(sev):
+                row = rows[i]
+                if sev[i] > STATUS_RANK.get(row.get("status") or "", 0):
+                    row["status"] = _STATUS_BY_RANK[int(sev[i])]
+                    raised += 1
+                row["alert"] = True
+            self.raised += raised
+            return raised
+
+    # ==================== METRICS ====================
+
+    def firing(self, device_id: Optional[str] = None) -> list[dict]:
+        with self._lock:
+            items = [
+                {"rule_id": rule_id, "device_id": d, "since": since,
+                 "name": self.rules[rule_id]["name"] if rule_id in self.rules else None}
+                for (rule_id, d), since in self._firing.items()
+                if device_id is None or d == device_id
+            ]
+        return sorted(items, key=lambda x: x["since"])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rules": len(self.rules),
+                "shapes": len(self.shapes),
+                "firing": len(self._firing),
+                "batches": self.batches,
+                "rows": self.rows,
+                "pairs": self.pairs,
+                "raised": self.raised,
+                "fired": self.fired,
+                "cleared": self.cleared,
+                "last_eval_ms": round(self.last_eval_ms, 3),
+            }
+
+    def recent_events(self) -> list[dict]:
+        with self._lock:
+            return list(self.recent)
+
+
+# Global engine (used by the ingest writer; rules are reloaded after API changes)
+rule_engine = RuleEngine()
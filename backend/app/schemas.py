@@ -1,6 +1,6 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Literal
 
 class IngestPayload(BaseModel):
     device_id: str = Field(..., examples=["node-001"])
@@ -16,9 +16,23 @@ class IngestPayload(BaseModel):
     rssi: Optional[int] = None
     snr: Optional[float] = None
 
+    frame_counter: Optional[int] = Field(None, ge=0, description="LoRa frame counter; repeated frames are ignored")
+
 class IngestResponse(BaseModel):
     ok: bool
-    id: int
+    id: Optional[int] = None
+    duplicate: bool = False
+
+class IngestBatchItem(BaseModel):
+    id: Optional[int] = None
+    duplicate: bool = False
+    status: Optional[str] = None
+    aq_score: Optional[int] = None
+
+class IngestBatchResponse(BaseModel):
+    ok: bool
+    count: int
+    items: List[IngestBatchItem]
 
 class MeasurementOut(BaseModel):
     device_id: str
@@ -63,6 +77,8 @@ class HistoryResponse(BaseModel):
     device_id: str
     count: int
     items: List[MeasurementOut]
+    bucket: Optional[str] = None        # set for aggregated history (1m/5m/1h/1d)
+    agg: Optional[str] = None           # avg/min/max/last
 
 class AlertLatestResponse(BaseModel):
     found: bool
@@ -83,6 +99,56 @@ class AlertHistoryResponse(BaseModel):
     items: List[MeasurementOut]
 
 
+class AlertEpisodeOut(BaseModel):
+    device_id: str
+    start_ts: datetime
+    end_ts: datetime
+    peak_status: Optional[str] = None
+    peak_score: Optional[int] = None
+    samples: int
+    open: bool
+
+
+class AlertEpisodesResponse(BaseModel):
+    device_id: str
+    count: int
+    items: List[AlertEpisodeOut]
+
+
+# ==================== Alert Rule Schemas ====================
+
+class AlertRuleIn(BaseModel):
+    """Alert rule; scope is device_id, or city (+ district), or every device"""
+    name: str = Field(..., max_length=128)
+    device_id: Optional[str] = None
+    city: Optional[str] = None
+    district: Optional[str] = None
+
+    kind: Literal["threshold", "baseline_pct", "rate"]
+    metric: Literal["eco2_ppm", "tvoc_ppb", "temp_c", "hum_rh", "pressure_hpa"]
+    op: Literal["above", "below"] = "above"
+    value: float = Field(..., description="threshold value, % over baseline, or change per minute")
+
+    window_s: int = Field(0, ge=0, description="baseline_pct window in seconds (0 = BASELINE_SECONDS)")
+    hysteresis: float = Field(0.0, ge=0, description="clears only this far back past the value")
+    sustain_s: int = Field(0, ge=0, description="condition must hold this long before firing")
+    severity: Literal["WARN", "HIGH"] = "WARN"
+    enabled: bool = True
+
+    @model_validator(mode="after")
+    def _scope(self):
+        if self.district and not self.city:
+            raise ValueError("district needs city")
+        return self
+
+
+class AlertRuleOut(AlertRuleIn):
+    model_config = ConfigDict(from_attributes=True)   # AlertRule satırından
+
+    id: int
+    created_at: datetime
+
+
 # ==================== Map Schemas ====================
 
 class DeviceCreate(BaseModel):
@@ -125,9 +191,21 @@ class MapPoint(BaseModel):
     last_update: Optional[datetime] = None
 
 
+class MapCluster(BaseModel):
+    """Aggregated devices at low zoom"""
+    lat: float
+    lon: float
+    count: int
+    status: str                          # worst status in the cluster
+    mean_score: Optional[float] = None
+    bbox: List[float]                    # [min_lon, min_lat, max_lon, max_lat]
+
+
 class MapPointsResponse(BaseModel):
     """Map points response"""
     points: List[MapPoint]
+    clusters: List[MapCluster] = []
+    clustered: bool = False
 
 
 class CitiesResponse(BaseModel):
@@ -0,0 +1,70 @@
+"""
+Fast JSON path for measurement responses.
+
+/latest, /history and /alerts/history can return thousands of rows. Loading
+them as ORM objects, copying them into MeasurementOut and letting pydantic
+validate and serialize them again costs more than the query itself. Here
+rows are selected as plain Core tuples in MeasurementOut field order and
+encoded straight to JSON bytes with an encoder built once at import time
+(orjson when installed, the stdlib C encoder otherwise). The output is
+byte-compatible with the pydantic models declared as response_model, which
+are kept for the OpenAPI docs.
+"""
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from typing import Iterable, Optional, Sequence
+
+from fastapi import Response
+
+from .schemas import MeasurementOut
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
+
+
+# MeasurementOut alan sırası = SELECT kolon sırası
+MEASUREMENT_OUT_FIELDS: tuple[str, ...] = tuple(MeasurementOut.model_fields)
+_DEFAULTS = {f: info.default for f, info in MeasurementOut.model_fields.items()}
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+else:
+    _encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=_default).encode
+
+    def dumps(obj) -> bytes:
+        return _encode(obj).encode()
+
+
+def measurement_items(rows: Iterable[Sequence]) -> list[dict]:
+    """Row tuples (MEASUREMENT_OUT_FIELDS order) -> plain dicts, no validation"""
+    fields = MEASUREMENT_OUT_FIELDS
+    return [dict(zip(fields, r)) for r in rows]
+
+
+def measurement_item(row: dict) -> dict:
+    """Column dict (latest store, bucket rows) -> MeasurementOut-shaped dict with model defaults"""
+    return {f: row.get(f, _DEFAULTS[f]) for f in MEASUREMENT_OUT_FIELDS}
+
+
+def json_response(content, response: Optional[Response] = None) -> Response:
+    """
+    Encoded JSON response. Headers already set on the injected `response`
+    (ETag etc. from the conditional-GET dependencies) are carried over,
+    because FastAPI does not merge them into a Response returned directly.
+    """
+    out = Response(content=dumps(content), media_type="application/json")
+    if response is not None:
+        out.headers.raw.extend(response.headers.raw)
+    return out
@@ -0,0 +1,164 @@
+"""
+Live measurement stream (WebSocket + Server-Sent Events).
+
+The ingest writer hands every committed batch to the hub, which fans it out
+on the asyncio loop to the subscribed connections. Each connection has its
+own bounded buffer: when a client cannot keep up, its oldest events are
+dropped, and after STREAM_MAX_DROPS consecutive drops it is disconnected.
+Nothing on the ingest path ever waits for a client.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+from .config import settings
+from .geo_index import device_grid
+
+logger = logging.getLogger(__name__)
+
+
+# Akışa giden alanlar (MeasurementOut'un özeti)
+STREAM_FIELDS = (
+    "device_id", "ts", "temp_c", "hum_rh", "pressure_hpa", "tvoc_ppb", "eco2_ppm",
+    "aq_score", "status", "alert",
+)
+
+
+def _event_data(row: dict) -> dict:
+    data = {k: row.get(k) for k in STREAM_FIELDS}
+    if isinstance(data["ts"], datetime):
+        data["ts"] = data["ts"].replace(tzinfo=None).isoformat()
+    return data
+
+
+class Subscription:
+    def __init__(
+        self,
+        device_ids: Optional[set[str]] = None,
+        city: Optional[str] = None,
+        district: Optional[str] = None,
+        buffer_size: int = settings.STREAM_BUFFER,
+    ):
+        self.device_ids = device_ids or None
+        self.city = city
+        self.district = district
+        self.buffer: deque = deque(maxlen=buffer_size)
+        self.ready = asyncio.Event()
+        self.dropped = 0             # toplam düşürülen olay
+        self.consecutive_drops = 0   # tüketilmeden arka arkaya düşürülen olay
+        self.closed = False
+
+    def matches(self, device_id: str, city: Optional[str], district: Optional[str]) -> bool:
+        if self.device_ids is not None and device_id not in self.device_ids:
+            return False
+        if self.city is not None and city != self.city:
+            return False
+        if self.district is not None and district != self.district:
+            return False
+        return True
+
+    def push(self, event: tuple[str, dict]):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+            self.consecutive_drops += 1
+            if self.consecutive_drops >= settings.STREAM_MAX_DROPS:
+                self.closed = True
+        self.buffer.append(event)
+        self.ready.set()
+
+    async def next_batch(self, timeout: float) -> list[tuple[str, dict]]:
+        """Wait up to `timeout` seconds for events; returns [] on timeout"""
+        if not self.buffer:
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        events = list(self.buffer)
+        self.buffer.clear()
+        self.consecutive_drops = 0
+        return events
+
+
+class StreamHub:
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subs: set[Subscription] = set()
+        self._last_status: dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.disconnected_slow = 0
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def subscribe(self, sub: Subscription) -> Subscription:
+        self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self._subs.discard(sub)
+
+    def publish(self, rows: list[dict]):
+        """Called from the writer thread after a commit; never blocks"""
+        events = []
+        with self._lock:
+            for row in rows:
+                device_id = row["device_id"]
+                data = _event_data(row)
+                events.append(("measurement", data))
+                prev = self._last_status.get(device_id)
+                status = row.get("status")
+                if status != prev:
+                    self._last_status[device_id] = status
+                    if prev is not None:
+                        events.append(("status", {
+                            "device_id": device_id, "ts": data["ts"], "from": prev, "to": status,
+                        }))
+
+        if not events or not self._subs or self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._fanout, events)
+
+    def _fanout(self, events: list[tuple[str, dict]]):
+        located = {}
+        for _, data in events:
+            device_id = data["device_id"]
+            if device_id not in located:
+                info = device_grid.get(device_id)
+                located[device_id] = (info.city, info.district) if info else (None, None)
+
+        for sub in list(self._subs):
+            if sub.closed:
+                continue
+            for event in events:
+                device_id = event[1]["device_id"]
+                if sub.matches(device_id, *located[device_id]):
+                    sub.push(event)
+            if sub.closed:
+                self.disconnected_slow += 1
+                sub.ready.set()   # bekleyen handler'ı uyandır, bağlantıyı kapatsın
+        self.published += len(events)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subs),
+            "published": self.published,
+            "disconnected_slow": self.disconnected_slow,
+        }
+
+
+def encode_sse(events: list[tuple[str, dict]]) -> str:
+    return "".join(
+        f"event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n" for name, data in events
+    )
+
+
+# Global hub (loop attached in main.py lifespan, fed by the ingest writer)
+stream_hub = StreamHub()
@@ -0,0 +1,102 @@
+"""
+Data versions for conditional GET (ETag / Last-Modified).
+
+Ingest bumps a per-device, per-city and global version after every commit.
+Polling endpoints derive their ETag from the version of the data they
+depend on and answer `304 Not Modified` before running any query.
+"""
+from __future__ import annotations
+
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Iterable, Optional
+
+from fastapi import HTTPException, Request, Response
+
+from .geo_index import device_grid
+
+
+class DataVersions:
+    def __init__(self):
+        # Yeniden başlatma sonrası eski ETag'ler eşleşmesin
+        self.epoch = format(int(time.time()), "x")
+        self._device: dict[str, tuple[int, datetime]] = {}
+        self._city: dict[str, tuple[int, datetime]] = {}
+        self._global: tuple[int, datetime] = (0, datetime.now(timezone.utc))
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _next(current: Optional[tuple[int, datetime]], now: datetime) -> tuple[int, datetime]:
+        return ((current[0] if current else 0) + 1, now)
+
+    def bump_devices(self, device_ids: Iterable[str]):
+        """Data of these devices changed (new measurements, registration)"""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            cities = set()
+            for device_id in set(device_ids):
+                self._device[device_id] = self._next(self._device.get(device_id), now)
+                info = device_grid.get(device_id)
+                if info is not None:
+                    cities.add(info.city)
+            for city in cities:
+                self._city[city] = self._next(self._city.get(city), now)
+            self._global = self._next(self._global, now)
+
+    def bump_rows(self, rows: list[dict]):
+        self.bump_devices(r["device_id"] for r in rows)
+
+    def device(self, device_id: str) -> tuple[int, datetime]:
+        with self._lock:
+            return self._device.get(device_id) or (0, self._global[1])
+
+    def city(self, city: Optional[str]) -> tuple[int, datetime]:
+        with self._lock:
+            if city is None:
+                return self._global
+            return self._city.get(city) or (0, self._global[1])
+
+
+def check_not_modified(
+    request: Request,
+    response: Response,
+    scope: str,
+    version: tuple[int, datetime],
+    time_slot_s: Optional[int] = None,
+):
+    """
+    Set ETag / Last-Modified / Cache-Control on `response`, or raise a 304
+    when the client's If-None-Match still matches.
+
+    The query string is part of the ETag, so every parameter combination is
+    its own representation. `time_slot_s` is for endpoints with a window
+    relative to "now" (e.g. last 24 h): their ETag also rolls over every
+    `time_slot_s` seconds. Last-Modified is informational only: with
+    one-second resolution it cannot tell apart two commits in the same
+    second, so If-Modified-Since never produces a 304.
+    """
+    number, modified = version
+    key = zlib.crc32(f"{scope}?{request.url.query}".encode())
+    tag = f"{data_versions.epoch}-{number}-{key:x}"
+    if time_slot_s:
+        tag += f"-{int(time.time() // time_slot_s):x}"
+    etag = f'W/"{tag}"'
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(modified.replace(microsecond=0), usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        raise HTTPException(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+
+
+# Global instance (bumped by the ingest writer and device registration)
+data_versions = DataVersions()
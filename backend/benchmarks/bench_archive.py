@@ -0,0 +1,96 @@
+"""
+Cold archive benchmark: DB size and old-range read time, before and after
+`archive.archive_closed`.
+
+Seeds one closed month of data for a few devices at a 10 s sample rate
+(sensor-like values with the precision the firmware sends), VACUUMs and
+measures the file, then archives the month into daily blocks and measures
+again. Read time is the /history fast path over one day of one device.
+
+Usage (from backend/):
+    python benchmarks/bench_archive.py [devices] [days]
+"""
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DEVICES = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+DAYS = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["ROLLUPS_ENABLED"] = "false"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.database import Base, engine, SessionLocal  # noqa: E402
+from app import archive, crud, partitions  # noqa: E402
+
+T0 = datetime(2025, 3, 1)
+
+
+def seed() -> int:
+    Base.metadata.create_all(bind=engine)
+    random.seed(7)
+    db = SessionLocal()
+    total = 0
+    for d in range(DEVICES):
+        rows = []
+        for i in range(DAYS * 8640):
+            tvoc = int(150 + 80 * math.sin(i / 500) + random.gauss(0, 4))
+            rows.append(dict(
+                device_id=f"bench-{d}", ts=T0 + timedelta(seconds=10 * i),
+                temp_c=round(21 + 3 * math.sin(i / 8640 * 6.28) + random.gauss(0, 0.05), 2),
+                hum_rh=round(45 + 5 * math.sin(i / 3000) + random.gauss(0, 0.2), 1),
+                pressure_hpa=round(1013 + random.gauss(0, 0.1), 2),
+                tvoc_ppb=tvoc, eco2_ppm=400 + 2 * tvoc, rssi=-80 + random.randint(-2, 2),
+                snr=round(7 + random.gauss(0, 0.3), 1), aq_score=max(0, 100 - tvoc // 5),
+                alert=tvoc > 220, status="HIGH" if tvoc > 220 else "OK",
+                sample_ms=1000, frame_counter=i,
+            ))
+        for k in range(0, len(rows), 20_000):
+            crud.insert_measurement_rows(db, rows[k:k + 20_000])
+            db.commit()
+            partitions.publish_new_partitions(db)
+        total += len(rows)
+    db.close()
+    return total
+
+
+def db_size() -> int:
+    engine.dispose()
+    with engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+    return os.path.getsize(os.environ["DB_PATH"])
+
+
+def read_day(repeat: int = 10) -> float:
+    start = T0 + timedelta(days=DAYS // 2)
+    best = float("inf")
+    for _ in range(repeat):
+        db = SessionLocal()
+        t = time.perf_counter()
+        crud.get_history_rows(db, "bench-0", start, start + timedelta(days=1), 10_000)
+        best = min(best, time.perf_counter() - t)
+        db.close()
+    return best * 1000
+
+
+if __name__ == "__main__":
+    rows = seed()
+    size0, read0 = db_size(), read_day()
+
+    db = SessionLocal()
+    t = time.perf_counter()
+    archive.archive_closed(db, now=T0 + timedelta(days=400), months=1)
+    took = time.perf_counter() - t
+    stats = archive.archive_stats(db)
+    db.close()
+    size1, read1 = db_size(), read_day()
+
+    print(f"{rows} rows ({DEVICES} devices x {DAYS} days @ 10 s), archived in {took:.1f} s")
+    print(f"  DB size : {size0 / 1e6:8.2f} MB -> {size1 / 1e6:8.2f} MB   ({size0 / size1:.1f}x)")
+    print(f"  blocks  : {stats['blocks']} blocks, {stats['bytes_per_row']} bytes/row")
+    print(f"  1 day   : {read0:8.2f} ms -> {read1:8.2f} ms")
@@ -0,0 +1,61 @@
+"""
+Frame codec benchmark: JSON messages vs binary frames.
+
+Decodes N measurements the way the MQTT consumer receives them:
+
+- json:          one gateway JSON message per frame (json/orjson loads + key table)
+- binary x1:     one binary message per frame
+- binary xBATCH: BATCH frames of a device per message (struct.iter_unpack)
+
+and prints frames/s and bytes per frame.
+
+Usage (from backend/):
+    python benchmarks/bench_codec.py [frames] [batch]
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+FRAMES = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+BATCH = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.codec import decode_json, decode_frames, encode_frames  # noqa: E402
+from app.mqtt_client import _loads  # noqa: E402
+
+T0 = datetime(2025, 10, 1, tzinfo=timezone.utc)
+
+
+def payload(i: int) -> dict:
+    return {
+        "device_id": "bench-1", "ts_ms": 1_759_276_800_000 + i * 10_000, "temp_c": 21.5, "hum_rh": 45.2,
+        "press_hpa": 1013, "eco2_ppm": 600 + i % 400, "tvoc_ppb": 120 + i % 200, "rssi": -80, "snr": 7.25,
+        "aq_score": 80, "pred_eco2_60m": 650, "pred_tvoc_60m": 130, "anom_eco2": False, "anom_tvoc": False,
+        "delta_alert": False, "status": "NORMAL", "sample_ms": 1000, "fc": i,
+    }
+
+
+def timed(fn) -> float:
+    t = time.perf_counter()
+    fn()
+    return FRAMES / (time.perf_counter() - t)
+
+
+if __name__ == "__main__":
+    payloads = [payload(i) for i in range(FRAMES)]
+    json_msgs = [json.dumps(p).encode() for p in payloads]
+    rows = [decode_json(p) for p in payloads]
+    single = [encode_frames("bench-1", [r]) for r in rows]
+    batched = [encode_frames("bench-1", rows[k:k + BATCH]) for k in range(0, FRAMES, BATCH)]
+
+    results = [
+        ("json", timed(lambda: [decode_json(_loads(m)) for m in json_msgs]), sum(map(len, json_msgs))),
+        ("binary x1", timed(lambda: [decode_frames(m) for m in single]), sum(map(len, single))),
+        (f"binary x{BATCH}", timed(lambda: [decode_frames(m) for m in batched]), sum(map(len, batched))),
+    ]
+    print(f"{FRAMES} frames")
+    for name, rate, size in results:
+        print(f"  {name:11}: {rate:10.0f} frames/s   {size / FRAMES:6.1f} bytes/frame")
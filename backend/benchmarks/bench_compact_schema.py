@@ -0,0 +1,105 @@
+"""
+Compact schema benchmark: insert rate, DB size and history query time for
+
+- legacy:  one `measurements` table with the original index set
+           (single-column id / device_id / ts / alert / status + composite)
+- text:    monthly partitions, String device_id + DateTime ts
+- compact: monthly partitions, integer device key + epoch-ms ts
+
+Rows are inserted through crud.insert_measurement_rows in batches of 500
+(what the ingest writer does per commit). Every layout runs in its own
+process and database, since DB_PATH and the settings are read at import.
+
+Usage (from backend/):
+    python benchmarks/bench_compact_schema.py [rows] [devices]
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+DEVICES = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+BATCH = 500
+LAYOUTS = ("legacy", "text", "compact")
+
+
+def run(layout: str) -> dict:
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["PARTITIONING_ENABLED"] = "false" if layout == "legacy" else "true"
+    os.environ["COMPACT_SCHEMA"] = "true" if layout == "compact" else "false"
+    os.environ["ROLLUPS_ENABLED"] = "false"
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+    from sqlalchemy import Index
+    from app.database import Base, engine, SessionLocal
+    from app.models import Measurement
+    from app import crud, partitions
+
+    Base.metadata.create_all(bind=engine)
+    if layout == "legacy":
+        # Değişiklikten önceki index seti
+        for col in ("id", "device_id", "ts"):
+            Index(f"ix_measurements_{col}", Measurement.__table__.c[col]).create(bind=engine)
+
+    random.seed(3)
+    t0 = datetime(2025, 1, 1)
+    rows = [
+        dict(
+            device_id=f"sensor-node-{i % DEVICES:04d}", ts=t0 + timedelta(seconds=30 * (i // DEVICES), milliseconds=i % 1000),
+            temp_c=round(21 + random.gauss(0, 1), 2), hum_rh=round(45 + random.gauss(0, 3), 1),
+            pressure_hpa=round(1013 + random.gauss(0, 1), 2), tvoc_ppb=random.randint(50, 400),
+            eco2_ppm=random.randint(400, 1200), rssi=random.randint(-100, -60), snr=round(random.uniform(-5, 12), 1),
+            aq_score=random.randint(0, 100), alert=random.random() < 0.05, status="OK", sample_ms=1000, frame_counter=i,
+        )
+        for i in range(ROWS)
+    ]
+
+    db = SessionLocal()
+    t = time.perf_counter()
+    for k in range(0, ROWS, BATCH):
+        crud.insert_measurement_rows(db, rows[k:k + BATCH])
+        db.commit()
+        partitions.publish_new_partitions(db)
+    insert_s = time.perf_counter() - t
+
+    start = t0 + timedelta(seconds=30 * (ROWS // DEVICES) // 2)
+    best = float("inf")
+    for _ in range(20):
+        t = time.perf_counter()
+        crud.get_history_rows(db, "sensor-node-0001", start, start + timedelta(hours=6), 5000)
+        best = min(best, time.perf_counter() - t)
+    db.close()
+
+    engine.dispose()
+    with engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+    return {
+        "rows_per_s": ROWS / insert_s,
+        "mb": os.path.getsize(os.environ["DB_PATH"]) / 1e6,
+        "history_ms": best * 1000,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3:
+        print(json.dumps(run(sys.argv[3])))
+        sys.exit(0)
+
+    print(f"{ROWS} rows, {DEVICES} devices, {BATCH} rows per commit")
+    results = {}
+    for layout in LAYOUTS:
+        out = subprocess.run(
+            [sys.executable, __file__, str(ROWS), str(DEVICES), layout],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        results[layout] = r = json.loads(out.strip().splitlines()[-1])
+        print(f"  {layout:8}: {r['rows_per_s']:9.0f} rows/s   {r['mb']:7.2f} MB   6h history {r['history_ms']:6.2f} ms")
+    base = results["legacy"]
+    new = results["compact"]
+    print(f"  compact vs legacy: {new['rows_per_s'] / base['rows_per_s']:.2f}x insert rate, "
+          f"{base['mb'] / new['mb']:.2f}x smaller")
@@ -0,0 +1,74 @@
+"""
+Forecast tick benchmark: `Forecaster.tick` over many devices.
+
+Seeds 1-minute rollups for N devices (one sample per device and minute)
+over WARMUP minutes, then times the warm-up tick (all WARMUP minutes) and
+the steady-state tick that folds in one newly closed minute for every
+device. The steady tick is what runs every FORECAST_INTERVAL_S.
+
+Usage (from backend/):
+    python benchmarks/bench_forecast.py [devices] [warmup_minutes]
+"""
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DEVICES = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+WARMUP = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.database import Base, engine, SessionLocal  # noqa: E402
+from app import rollups  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.forecast import forecaster  # noqa: E402
+
+T0 = datetime(2025, 3, 1)
+
+
+def seed_minute(db, minute: int):
+    rows = []
+    for d in range(DEVICES):
+        tvoc = int(150 + 80 * math.sin((minute + d) / 40) + random.gauss(0, 4))
+        rows.append(dict(
+            device_id=f"bench-{d}", ts=T0 + timedelta(minutes=minute, seconds=30),
+            tvoc_ppb=tvoc, eco2_ppm=400 + 2 * tvoc,
+        ))
+    rollups.apply_rollups(db, rows)
+    db.commit()
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    random.seed(7)
+    settings.FORECAST_WARMUP_MIN = WARMUP
+
+    db = SessionLocal()
+    t = time.perf_counter()
+    for m in range(WARMUP + 1):
+        seed_minute(db, m)
+    print(f"seeded {DEVICES} devices x {WARMUP + 1} minutes of rollups in {time.perf_counter() - t:.1f} s")
+
+    # İlk tur: son WARMUP dakika (WARMUP. dakika henüz açık)
+    result = forecaster.tick(db, now=T0 + timedelta(minutes=WARMUP, seconds=30))
+    print(f"warm-up tick: {result['buckets']:,} buckets in {result['elapsed_ms']:.0f} ms")
+
+    # Kararlı durum: her cihaz için kapanan tek dakika
+    steady = []
+    for k in range(5):
+        seed_minute(db, WARMUP + 1 + k)
+        result = forecaster.tick(db, now=T0 + timedelta(minutes=WARMUP + 1 + k, seconds=30))
+        steady.append(result["elapsed_ms"])
+    db.close()
+    print(f"steady tick ({DEVICES:,} devices, 1 minute): "
+          f"median {sorted(steady)[len(steady) // 2]:.1f} ms, max {max(steady):.1f} ms")
+    print(forecaster.get("bench-0"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+MQTT consumer throughput: messages/s from decode to committed row.
+
+Feeds N gateway JSON messages (distinct devices and frame counters) to the
+subscriber the way aiomqtt delivers them: an async iterator over a queue
+whose length is the client backlog. Compares
+
+- per message: `process_message` for every message (one submit each)
+- batched:     `consume`, which decodes the waiting messages into one
+               submit of up to MQTT_BATCH_ROWS rows
+
+Both run against the real write-behind writer and a throwaway SQLite DB, and
+the clock stops when the last row is committed. No broker is involved, so
+this is the ceiling of the consumer, not of the network.
+
+Usage (from backend/):
+    python benchmarks/bench_mqtt_consumer.py [messages] [devices]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+DEVICES = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.database import Base, engine  # noqa: E402
+from app.ingest_writer import ingest_writer  # noqa: E402
+from app.mqtt_client import mqtt_subscriber  # noqa: E402
+
+
+class Message:
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class Backlog:
+    """Async iterator over already-received messages (like aiomqtt's client.messages)"""
+
+    def __init__(self, messages):
+        self._messages = messages
+        self._i = 0
+
+    def __len__(self):
+        return len(self._messages) - self._i
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._i >= len(self._messages):
+            raise StopAsyncIteration
+        self._i += 1
+        return self._messages[self._i - 1]
+
+
+def messages(offset: int) -> list[Message]:
+    t0 = 1_760_000_000_000
+    out = []
+    for i in range(MESSAGES):
+        device = f"bench-{i % DEVICES}"
+        fc = offset + i // DEVICES
+        payload = {
+            "id": device, "ts_ms": t0 + fc * 10_000, "t": 215 + i % 30, "h": 450 + i % 50, "p": 1013,
+            "v": 120 + i % 200, "e": 600 + i % 400, "s": 80, "pe": 650, "pv": 130, "ae": False, "av": False,
+            "da": False, "st": "NORMAL", "fc": fc, "rssi": -80, "snr": 7.5, "sample_ms": 1000,
+        }
+        out.append(Message(f"kayseri/air_quality/{device}/data", json.dumps(payload).encode()))
+    return out
+
+
+async def per_message(msgs) -> float:
+    t = time.perf_counter()
+    for m in msgs:
+        await mqtt_subscriber.process_message(m)
+    await mqtt_subscriber.drain()
+    return time.perf_counter() - t
+
+
+async def batched(msgs) -> float:
+    t = time.perf_counter()
+    await mqtt_subscriber.consume(Backlog(msgs))
+    await mqtt_subscriber.drain()
+    return time.perf_counter() - t
+
+
+async def main():
+    Base.metadata.create_all(bind=engine)
+    ingest_writer.start()
+    mqtt_subscriber.running = True
+
+    old = await per_message(messages(0))
+    new = await batched(messages(MESSAGES))
+    stats = mqtt_subscriber.stats()
+    ingest_writer.stop()
+
+    print(f"{MESSAGES} messages, {DEVICES} devices")
+    print(f"  per message: {MESSAGES / old:9.0f} msgs/s")
+    print(f"  batched    : {MESSAGES / new:9.0f} msgs/s   ({old / new:.1f}x)")
+    print(f"  committed {stats['committed']}, failed {stats['failed']}, avg commit lag {stats['avg_commit_lag_ms']} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""
+Re-scoring benchmark: vectorized `rescore.rescore_device` vs per-row
+`AlertStateStore.evaluate` (the ingest rules called once per stored row).
+
+Seeds one device at 1 Hz for a number of days (HTTP-scored rows), changes
+WARN_INCREASE_PCT / HIGH_INCREASE_PCT so that most statuses flip, and
+times a full re-score including the UPDATEs, rollups and episodes. The
+per-row path is timed on its first PER_ROW_SAMPLE rows (evaluation only, no
+writes) and extrapolated. Both are projected to a year of 1 Hz data.
+
+Usage (from backend/):
+    python benchmarks/bench_rescore.py [days]
+"""
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DAYS = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+PER_ROW_SAMPLE = 50_000
+YEAR_ROWS = 365 * 86_400
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import select  # noqa: E402
+
+from app.database import Base, engine, SessionLocal  # noqa: E402
+from app import crud, partitions, rescore, rollups  # noqa: E402
+from app.alert_state import AlertStateStore  # noqa: E402
+from app.baseline import baseline_store  # noqa: E402
+from app.config import settings  # noqa: E402
+
+T0 = datetime(2025, 3, 1)
+DEVICE = "bench-0"
+
+
+def seed() -> int:
+    Base.metadata.create_all(bind=engine)
+    random.seed(7)
+    db = SessionLocal()
+    n = DAYS * 86_400
+    for k in range(0, n, 50_000):
+        rows = []
+        for i in range(k, min(k + 50_000, n)):
+            tvoc = int(150 + 80 * math.sin(i / 500) + random.gauss(0, 4))
+            rows.append(dict(
+                device_id=DEVICE, ts=T0 + timedelta(seconds=i),
+                temp_c=round(21 + 3 * math.sin(i / 86_400 * 6.28) + random.gauss(0, 0.05), 2),
+                hum_rh=round(45 + 5 * math.sin(i / 3000) + random.gauss(0, 0.2), 1),
+                pressure_hpa=round(1013 + random.gauss(0, 0.1), 2),
+                tvoc_ppb=tvoc, eco2_ppm=400 + 2 * tvoc, aq_score=0,
+                alert=False, status="OK", sample_ms=1000, frame_counter=i,
+            ))
+        inserted = crud.insert_measurement_rows(db, rows)
+        rollups.apply_rollups(db, inserted)
+        db.commit()
+        partitions.publish_new_partitions(db)
+    db.close()
+    return n
+
+
+def per_row(limit: int) -> float:
+    """Seconds per row of the streaming rules over the stored rows"""
+    db = SessionLocal()
+    baseline_store._windows = {}
+    baseline_store.hydrated = True
+    store = AlertStateStore()
+    store.loaded = True
+    rows = []
+    for t in partitions.partition_registry.tables(db):
+        cols = [t.c.ts, t.c.tvoc_ppb, t.c.eco2_ppm, t.c.temp_c, t.c.hum_rh, t.c.pressure_hpa]
+        rows += db.execute(select(*cols).where(t.c.device_id == DEVICE).order_by(t.c.ts).limit(limit - len(rows))).all()
+        if len(rows) >= limit:
+            break
+    t0 = time.perf_counter()
+    for r in rows:
+        store.evaluate(db, DEVICE, *r)
+    elapsed = time.perf_counter() - t0
+    db.close()
+    return elapsed / len(rows)
+
+
+def main():
+    t = time.perf_counter()
+    n = seed()
+    print(f"seeded {n} rows ({DAYS} days at 1 Hz) in {time.perf_counter() - t:.1f} s")
+
+    settings.WARN_INCREASE_PCT = 10.0
+    settings.HIGH_INCREASE_PCT = 25.0
+
+    db = SessionLocal()
+    t = time.perf_counter()
+    result = rescore.rescore_device(db, DEVICE)
+    vectorized = time.perf_counter() - t
+    db.close()
+    print(f"vectorized: {vectorized:.2f} s, {n / vectorized:,.0f} rows/s, "
+          f"{result['updated']} rows updated, {result['rollup_buckets']} rollup buckets, "
+          f"{result['episodes']} episodes")
+
+    row_s = per_row(min(PER_ROW_SAMPLE, n))
+    print(f"per-row evaluate: {1 / row_s:,.0f} rows/s (evaluation only)")
+    print(f"1 year at 1 Hz ({YEAR_ROWS:,} rows): vectorized ~{YEAR_ROWS / n * vectorized:.0f} s, "
+          f"per-row ~{YEAR_ROWS * row_s / 60:.0f} min + one UPDATE per row")
+
+
+if __name__ == "__main__":
+    main()
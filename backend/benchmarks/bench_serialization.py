@@ -0,0 +1,79 @@
+"""
+Serialization benchmark: ORM + pydantic vs Core rows + precompiled encoder.
+
+Builds a throwaway SQLite database with one device and N rows, then times
+the old /history path (ORM objects -> MeasurementOut -> HistoryResponse
+JSON) against the fast path used by the routes now (Core tuples ->
+serialize.dumps). Query time is included in both, since skipping the ORM
+identity map is part of the win.
+
+Usage (from backend/):
+    python benchmarks/bench_serialization.py [rows] [repeat]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+REPEAT = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import insert  # noqa: E402
+
+from app.database import Base, engine, SessionLocal  # noqa: E402
+from app.models import Measurement  # noqa: E402
+from app.schemas import MeasurementOut, HistoryResponse  # noqa: E402
+from app import crud, serialize  # noqa: E402
+
+
+def seed():
+    Base.metadata.create_all(bind=engine)
+    t0 = datetime(2025, 1, 1)
+    rows = [
+        dict(
+            device_id="bench-1", ts=t0 + timedelta(seconds=10 * i),
+            temp_c=21.0 + (i % 50) / 10, hum_rh=40.0 + (i % 30) / 3, pressure_hpa=1013.25,
+            tvoc_ppb=100 + i % 400, eco2_ppm=400 + i % 900, rssi=-80, snr=7.5,
+            aq_score=i % 100, alert=i % 7 == 0, status="HIGH" if i % 7 == 0 else "OK",
+            sample_ms=1000, frame_counter=i,
+        )
+        for i in range(ROWS)
+    ]
+    with engine.begin() as conn:
+        conn.execute(insert(Measurement), rows)
+
+
+def orm_pydantic(db):
+    items = db.execute(crud._history_stmt(db, "bench-1", None, None, ROWS)).scalars().all()
+    out = [MeasurementOut.model_validate(m, from_attributes=True) for m in items]
+    return HistoryResponse(device_id="bench-1", count=len(out), items=out).model_dump_json().encode()
+
+
+def core_fast(db):
+    items = serialize.measurement_items(crud.get_history_rows(db, "bench-1", None, None, ROWS))
+    return serialize.dumps({"device_id": "bench-1", "count": len(items), "items": items, "bucket": None, "agg": None})
+
+
+def bench(fn) -> float:
+    best = float("inf")
+    for _ in range(REPEAT):
+        db = SessionLocal()
+        t = time.perf_counter()
+        fn(db)
+        best = min(best, time.perf_counter() - t)
+        db.close()
+    return best * 1000
+
+
+if __name__ == "__main__":
+    seed()
+    encoder = "orjson" if serialize.orjson is not None else "stdlib json"
+    print(f"{ROWS} rows, best of {REPEAT} (encoder: {encoder})")
+    old = bench(orm_pydantic)
+    new = bench(core_fast)
+    print(f"  ORM + pydantic : {old:8.2f} ms")
+    print(f"  Core + encoder : {new:8.2f} ms   ({old / new:.1f}x)")
@@ -3,9 +3,10 @@ Initialize database and add sample devices
 Usage: python init_db.py
 """
 
+import os
 import sys
 from sqlalchemy.orm import Session
-from app.database import engine, SessionLocal
+from app.database import engine, SessionLocal, create_missing_indexes
 from app.models import Base, Device
 from datetime import datetime, timezone
 
@@ -14,9 +15,23 @@ def init_database():
     """Create all tables with latest schema"""
     print("🔧 Creating database tables...")
     Base.metadata.create_all(bind=engine)
+    create_missing_indexes()
+    from app.partitions import add_missing_columns
+    db = SessionLocal()
+    try:
+        add_missing_columns(db)
+    finally:
+        db.close()
     print("✅ Tables created successfully!")
     print("   - devices")
-    print("   - measurements")
+    print("   - measurements (+ monthly measurements_YYYYMM partitions)")
+    print("   - rollup_1m / rollup_1h / rollup_1d")
+    print("   - alert_episodes")
+    print("   - measurement_blocks (compressed archive)")
+    print("   - device_keys")
+    print("   - alert_state")
+    print("   - anomaly_state")
+    print("   - alert_rules")
 
 
 def add_sample_devices():
@@ -191,6 +206,191 @@ def delete_all_devices():
         db.close()
 
 
+def rebuild_rollups():
+    """Recompute 1m/1h/1d rollup tables from raw measurements"""
+    from app.rollups import rebuild_rollups as _rebuild
+
+    db: Session = SessionLocal()
+
+    try:
+        device_id = sys.argv[2] if len(sys.argv) > 2 else None
+        target = device_id or "all devices"
+        print(f"\n🔄 Rebuilding rollups for {target}...")
+        count = _rebuild(db, device_id)
+        print(f"✅ Rollups rebuilt from {count} measurements!")
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def rebuild_episodes():
+    """Recompute alert episodes from raw measurements"""
+    from app.episodes import rebuild_episodes as _rebuild
+
+    db: Session = SessionLocal()
+
+    try:
+        device_id = sys.argv[2] if len(sys.argv) > 2 else None
+        target = device_id or "all devices"
+        print(f"\n🔄 Rebuilding alert episodes for {target}...")
+        count = _rebuild(db, device_id)
+        print(f"✅ Alert episodes rebuilt from {count} measurements!")
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def rescore_history():
+    """Recompute status / aq_score / alert of stored rows under the current settings"""
+    from app.rescore import rescore
+
+    db: Session = SessionLocal()
+
+    try:
+        device_id = sys.argv[2] if len(sys.argv) > 2 else None
+        target = device_id or "all devices"
+        print(f"\n🔁 Re-scoring measurements of {target}...")
+        results = rescore(db, device_id)
+        for r in results:
+            print(f"   {r['device_id']:15} | {r['rows']:>10} rows | {r['updated']:>8} updated | "
+                  f"{r['episodes']:>6} episodes | {r['elapsed_ms'] / 1000:.2f} s")
+        print(f"✅ {sum(r['updated'] for r in results)} measurements re-scored!")
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def backfill_anomalies():
+    """Recompute anom_eco2 / anom_tvoc of stored rows with the server-side detector"""
+    from app.anomaly import backfill
+
+    db: Session = SessionLocal()
+
+    try:
+        device_id = sys.argv[2] if len(sys.argv) > 2 else None
+        target = device_id or "all devices"
+        print(f"\n🔎 Backfilling anomaly flags of {target}...")
+        results = backfill(db, device_id)
+        for r in results:
+            print(f"   {r['device_id']:15} | {r['rows']:>10} rows | {r['updated']:>8} updated | "
+                  f"{r['anomalies']:>6} anomalies | {r['elapsed_ms'] / 1000:.2f} s")
+        print(f"✅ {sum(r['updated'] for r in results)} measurements updated!")
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def show_partitions():
+    """List measurement partitions with row counts and ts ranges"""
+    from app.partitions import partition_stats
+
+    db: Session = SessionLocal()
+    try:
+        print("\n🗂️  Measurement partitions:")
+        print("=" * 90)
+        for p in partition_stats(db):
+            print(f"{p['table']:24} | {p['rows']:>10} rows | {p['first_ts']} → {p['last_ts']}")
+        print("=" * 90)
+    finally:
+        db.close()
+
+
+def migrate_partitions():
+    """Move rows of the legacy measurements table into monthly partitions"""
+    from app.partitions import migrate_legacy
+
+    db: Session = SessionLocal()
+
+    try:
+        print("\n🔄 Moving legacy measurements into monthly partitions...")
+        count = migrate_legacy(db)
+        print(f"✅ {count} measurements moved!")
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def apply_retention():
+    """Drop partitions older than PARTITION_RETENTION_MONTHS"""
+    from app.partitions import drop_expired
+
+    db: Session = SessionLocal()
+    try:
+        dropped = drop_expired(db)
+        print(f"\n✅ Dropped {len(dropped)} partitions: {dropped}")
+    finally:
+        db.close()
+
+
+def compact_storage():
+    """Compact schema: drop redundant indexes, rewrite text partitions, move legacy rows, VACUUM"""
+    from app.partitions import drop_redundant_indexes, compact_all, migrate_legacy, upgrade_frame_indexes
+
+    db_path = engine.url.database
+    before = os.path.getsize(db_path)
+    db: Session = SessionLocal()
+    try:
+        print("\n🗜️  Converting measurements to the compact schema...")
+        print(f"   Dropped indexes: {drop_redundant_indexes(db)}")
+        done = compact_all(db)
+        print(f"   Rewrote {len(done)} partitions ({sum(done.values())} rows): {sorted(done)}")
+        print(f"   Moved {migrate_legacy(db)} legacy rows into partitions")
+        removed = upgrade_frame_indexes(db)
+        print(f"   Unique frame index added to {len(removed)} partitions ({sum(removed.values())} duplicate rows removed)")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    engine.dispose()
+    with engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+    after = os.path.getsize(db_path)
+    print(f"✅ Database size: {before / 1e6:.2f} MB -> {after / 1e6:.2f} MB")
+
+
+def archive_partitions(months: int | None = None):
+    """Compress partitions older than `months` (ARCHIVE_AFTER_MONTHS) into daily blocks"""
+    from app.archive import archive_closed, archive_stats
+
+    db: Session = SessionLocal()
+    try:
+        print("\n🧊 Archiving closed measurement partitions...")
+        done = archive_closed(db, months=months)
+        print(f"✅ Archived {len(done)} partitions ({sum(done.values())} measurements): {sorted(done)}")
+        stats = archive_stats(db)
+        print(f"   {stats['blocks']} blocks, {stats['rows']} rows, {stats['bytes']} bytes "
+              f"({stats['bytes_per_row']} bytes/row)")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
 def main():
     print("\n" + "=" * 90)
     print("Know The Air You Breeze In - Database Initialization")
@@ -205,6 +405,35 @@ def main():
             add_sample_devices()
         elif command == "delete":
             delete_all_devices()
+        elif command == "rollups":
+            init_database()
+            rebuild_rollups()
+        elif command == "episodes":
+            init_database()
+            rebuild_episodes()
+        elif command == "rescore":
+            init_database()
+            rescore_history()
+        elif command == "anomalies":
+            init_database()
+            backfill_anomalies()
+        elif command == "partitions":
+            show_partitions()
+        elif command == "partition-migrate":
+            init_database()
+            migrate_partitions()
+            show_partitions()
+        elif command == "retention":
+            apply_retention()
+            show_partitions()
+        elif command == "compact":
+            init_database()
+            compact_storage()
+            show_partitions()
+        elif command == "archive":
+            init_database()
+            archive_partitions(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+            show_partitions()
         elif command == "reset":
             delete_all_devices()
             init_database()
@@ -218,6 +447,15 @@ def main():
             print("  python init_db.py add      - Add sample devices")
             print("  python init_db.py delete   - Delete all devices")
             print("  python init_db.py reset    - Reset and reinitialize")
+            print("  python init_db.py rollups [device_id] - Rebuild rollup tables")
+            print("  python init_db.py episodes [device_id] - Rebuild alert episodes")
+            print("  python init_db.py rescore [device_id] - Re-score alert status with the current settings")
+            print("  python init_db.py anomalies [device_id] - Backfill anom_eco2 / anom_tvoc with the server-side detector")
+            print("  python init_db.py partitions - List measurement partitions")
+            print("  python init_db.py partition-migrate - Move legacy rows into monthly partitions")
+            print("  python init_db.py retention - Drop partitions past PARTITION_RETENTION_MONTHS")
+            print("  python init_db.py archive [months] - Compress partitions past ARCHIVE_AFTER_MONTHS")
+            print("  python init_db.py compact - Convert measurements to the compact schema")
     else:
         # Default: Full initialization
         init_database()
@@ -0,0 +1,40 @@
+"""
+Shared test setup (run from backend/: python -m pytest -q).
+
+The app reads DB_PATH when it is imported, so every run gets a fresh SQLite
+file before `app` is imported. Tests compare the vectorized / streaming
+code paths against straightforward scalar references.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "test.db")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app import crud, partitions  # noqa: E402  (partitions tüm modelleri kaydeder)
+from app.database import Base, engine, SessionLocal, create_missing_indexes  # noqa: E402
+
+Base.metadata.create_all(bind=engine)
+create_missing_indexes()
+
+
+def store_rows(db, rows: list[dict]) -> list[dict]:
+    """Insert and commit measurement rows, publishing new partitions (like the ingest writer)"""
+    inserted = crud.insert_measurement_rows(db, rows)
+    db.commit()
+    partitions.publish_new_partitions(db)
+    return inserted
+
+
+@pytest.fixture
+def db():
+    """Session on the test database; uncommitted changes are rolled back"""
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
@@ -0,0 +1,123 @@
+"""EWMA anomaly flags: streaming score, NumPy scan and backfill against a scalar loop"""
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+from app import partitions
+from app.anomaly import AnomalyDetector, ANOMALY_METRICS, backfill_device, scan_metric
+from app.config import settings
+from conftest import store_rows
+
+FLOORS = (10.0, 5.0)
+
+
+@pytest.fixture(autouse=True)
+def _settings(monkeypatch):
+    # Kısa yarı ömür: scan blokları (8 yarı ömür) birkaç yüz örnekte birçok kez dolar
+    monkeypatch.setattr(settings, "ANOMALY_HALFLIFE", 10)
+    monkeypatch.setattr(settings, "ANOMALY_WARMUP", 20)
+    monkeypatch.setattr(settings, "ANOMALY_Z", 3.0)
+    monkeypatch.setattr(settings, "ANOMALY_MIN_STD_ECO2", FLOORS[0])
+    monkeypatch.setattr(settings, "ANOMALY_MIN_STD_TVOC", FLOORS[1])
+
+
+def _reference(xs, floor, state=(0, 0.0, 0.0), late=None):
+    """The module docstring's recursion, one sample at a time"""
+    a = 1.0 - 0.5 ** (1.0 / settings.ANOMALY_HALFLIFE)
+    n, mean, var = state
+    flags = []
+    for i, x in enumerate(xs):
+        if x is None or (isinstance(x, float) and math.isnan(x)):
+            flags.append(None)
+            continue
+        d = x - mean
+        flags.append(n >= settings.ANOMALY_WARMUP and abs(d) > settings.ANOMALY_Z * max(math.sqrt(var), floor))
+        if late is not None and late[i]:
+            continue
+        if n == 0:
+            mean, var = float(x), 0.0
+        else:
+            mean, var = mean + a * d, (1.0 - a) * (var + a * d * d)
+        n += 1
+    return flags, (n, mean, var)
+
+
+def _signal(rng, n, base, noise, spike):
+    x = base + np.cumsum(rng.normal(0, noise / 4, n)) + rng.normal(0, noise, n)
+    hits = rng.random(n) < 0.03
+    x[hits] += rng.choice([-1, 1], hits.sum()) * spike
+    x[rng.random(n) < 0.05] = np.nan
+    return x
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_scan_matches_scalar_loop(seed):
+    rng = np.random.default_rng(seed)
+    x = _signal(rng, 1500, 800.0, 15.0, 200.0)
+    want, want_state = _reference(x.tolist(), FLOORS[0])
+
+    # Parça parça tarama: durum parçalar arasında taşınır
+    got, state = [], (0, 0.0, 0.0)
+    for chunk in np.array_split(x, [7, 300, 301, 900]):
+        f, state = scan_metric(chunk, state, FLOORS[0])
+        got += [None if np.isnan(v) else bool(v) for v in f]
+    assert got == want
+    assert sum(filter(None, want)) > 10
+    assert state[0] == want_state[0]
+    assert state[1:] == pytest.approx(want_state[1:], rel=1e-9)
+
+
+def test_score_matches_scalar_loop_with_late_samples():
+    rng = np.random.default_rng(3)
+    detector = AnomalyDetector()
+    t0 = datetime(2026, 1, 1)
+    for device, (eco2, tvoc) in {"an-1": (600.0, 150.0), "an-2": (900.0, 40.0)}.items():
+        n = 800
+        cols = [_signal(rng, n, eco2, 20.0, 250.0), _signal(rng, n, tvoc, 8.0, 90.0)]
+        offsets = np.arange(n, dtype=float)
+        late = rng.random(n) < 0.05
+        offsets[late] -= rng.integers(1, 30, late.sum())
+        # Geç örnek: en son görülen örnekten eski olan (ilk örnek hiçbir zaman geç değil)
+        late = offsets < np.maximum.accumulate(np.concatenate([[-1.0], offsets[:-1]]))
+
+        got = [[], []]
+        for k in range(n):
+            values = [None if np.isnan(c[k]) else float(c[k]) for c in cols]
+            for i, flag in enumerate(detector.score(device, t0 + timedelta(seconds=offsets[k]), *values)):
+                got[i].append(flag)
+        for i, c in enumerate(cols):
+            want, state = _reference(c.tolist(), FLOORS[i], late=late.tolist())
+            assert got[i] == want
+            st = detector._states[device]
+            assert st.n[i] == state[0]
+            assert (st.mean[i], st.var[i]) == pytest.approx(state[1:], rel=1e-12)
+    assert detector.late > 0 and detector.flagged > 0
+
+
+def test_backfill_matches_scalar_loop(db):
+    rng = np.random.default_rng(4)
+    n = 700
+    t0 = datetime(2026, 10, 31, 23, 50)     # iki partition, birkaç parça
+    cols = [_signal(rng, n, 700.0, 15.0, 200.0), _signal(rng, n, 120.0, 6.0, 80.0)]
+    rows = []
+    for k in range(n):
+        row = dict(device_id="an-bf", ts=t0 + timedelta(seconds=2 * k), server_scored=True)
+        for metric, c in zip(ANOMALY_METRICS, cols):
+            row[metric] = None if np.isnan(c[k]) else float(c[k])
+        rows.append(row)
+    store_rows(db, rows)
+
+    result = backfill_device(db, "an-bf", chunk_rows=97)
+    assert result["rows"] == n
+
+    M = partitions.entity(db)
+    stored = db.execute(
+        select(M.anom_eco2, M.anom_tvoc).where(M.device_id == "an-bf").order_by(M.ts)
+    ).all()
+    for i, c in enumerate(cols):
+        want, _ = _reference(c.tolist(), FLOORS[i])
+        assert [r[i] for r in stored] == want
+    assert result["updated"] == n - sum(1 for r in stored if r == (None, None))
@@ -0,0 +1,189 @@
+"""Table-driven JSON / binary codecs against hand-written field-by-field decoders"""
+import random
+import struct
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.codec import SERVER_TS, FrameError, decode_frames, decode_json, encode_frames
+
+NOW = datetime(2026, 4, 2, 12, 0, tzinfo=timezone.utc)
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _first(payload, *keys):
+    for k in keys:
+        if payload.get(k) is not None:
+            return payload[k]
+    return None
+
+
+def _json_reference(p: dict) -> dict:
+    """One column at a time: short node key first, then the gateway's long keys"""
+    t, h = _first(p, "t"), _first(p, "h")
+    row = {
+        "device_id": p.get("id") or p.get("device_id", "unknown"),
+        "temp_c": t / 10 if t is not None else _first(p, "temp_c"),
+        "hum_rh": h / 10 if h is not None else _first(p, "hum_rh"),
+        "pressure_hpa": _first(p, "p", "pressure_hpa", "press_hpa"),
+        "tvoc_ppb": _first(p, "v", "tvoc_ppb"),
+        "eco2_ppm": _first(p, "e", "eco2_ppm"),
+        "rssi": p.get("rssi"),
+        "snr": p.get("snr"),
+        "aq_score": _first(p, "s", "aq_score"),
+        "pred_eco2_60m": _first(p, "pe", "pred_eco2_60m"),
+        "pred_tvoc_60m": _first(p, "pv", "pred_tvoc_60m"),
+        "sample_ms": _first(p, "sample_ms", "sm"),
+        "frame_counter": _first(p, "fc", "frame_counter"),
+        "anom_eco2": bool(p.get("ae") or p.get("anom_eco2")),
+        "anom_tvoc": bool(p.get("av") or p.get("anom_tvoc")),
+        "alert": bool(p.get("da") or p.get("alert") or p.get("delta_alert")),
+        "status": p.get("st") or p.get("status") or "NORMAL",
+    }
+    if p.get("ts_ms"):
+        row["ts"] = EPOCH + timedelta(milliseconds=p["ts_ms"])
+    else:
+        row["ts"], row[SERVER_TS] = NOW, True
+    return row
+
+
+def _matches(got: list[dict], want: list[dict]):
+    assert len(got) == len(want)
+    for g, w in zip(got, want):
+        assert {k: v for k, v in g.items() if k in w} == w
+        assert all(g[k] is None for k in g if k not in w)
+
+
+_JSON_KEYS = {
+    "t": lambda r: r.randint(-400, 850), "temp_c": lambda r: r.uniform(-40, 85),
+    "h": lambda r: r.randint(0, 1000), "hum_rh": lambda r: r.uniform(0, 100),
+    "p": lambda r: r.choice([0, 1013.2]), "pressure_hpa": lambda r: 990.5, "press_hpa": lambda r: 1001.0,
+    "v": lambda r: r.randint(0, 600), "tvoc_ppb": lambda r: r.randint(0, 600),
+    "e": lambda r: r.randint(400, 2000), "eco2_ppm": lambda r: r.randint(400, 2000),
+    "rssi": lambda r: r.randint(-120, -30), "snr": lambda r: r.uniform(-20, 10),
+    "s": lambda r: r.randint(0, 100), "aq_score": lambda r: r.randint(0, 100),
+    "pe": lambda r: r.randint(400, 2000), "pred_eco2_60m": lambda r: r.randint(400, 2000),
+    "pv": lambda r: r.randint(0, 600), "pred_tvoc_60m": lambda r: r.randint(0, 600),
+    "sample_ms": lambda r: r.randint(1, 60_000), "sm": lambda r: r.randint(1, 60_000),
+    "fc": lambda r: r.randint(0, 2**32 - 1), "frame_counter": lambda r: r.randint(0, 2**32 - 1),
+    "ae": lambda r: r.choice([0, 1, False, True]), "anom_eco2": lambda r: r.choice([False, True]),
+    "av": lambda r: r.choice([0, 1]), "anom_tvoc": lambda r: r.choice([False, True]),
+    "da": lambda r: r.choice([0, 1]), "alert": lambda r: r.choice([False, True]),
+    "delta_alert": lambda r: r.choice([False, True]),
+    "st": lambda r: r.choice(["", "OK", "WARN", "HIGH"]), "status": lambda r: r.choice(["", "NORMAL", "HIGH"]),
+    "ts_ms": lambda r: r.choice([0, 1_775_000_000_000 + r.randint(0, 10**9)]),
+    "id": lambda r: r.choice(["", "node-1"]), "device_id": lambda r: "gw-node-2",
+}
+
+
+def test_decode_json_matches_field_by_field_reference():
+    rng = random.Random(19)
+    for _ in range(2000):
+        payload = {k: (None if rng.random() < 0.1 else gen(rng)) for k, gen in _JSON_KEYS.items() if rng.random() < 0.4}
+        _matches([decode_json(payload, now=NOW)], [_json_reference(payload)])
+
+
+# ==================== BINARY ====================
+
+_V1 = struct.Struct("<IHIhHHHHHHBbbBI")
+_STATUS = {1: "NORMAL", 2: "OK", 3: "WARN", 4: "HIGH"}
+
+
+def _bin_reference(data: bytes, topic_device=None) -> list[dict]:
+    """Layout v1 decoded field by field, one record at a time"""
+    rows, pos = [], 0
+    while pos < len(data):
+        assert data[pos:pos + 2] == b"AQ" and data[pos + 2] == 1
+        id_len = data[pos + 3]
+        device_id = data[pos + 4:pos + 4 + id_len].decode() or topic_device
+        (count,) = struct.unpack_from("<H", data, pos + 4 + id_len)
+        pos += 6 + id_len
+        for _ in range(count):
+            ts_s, ts_ms, fc, t, h, p, v, e, pv, pe, s, rssi, snr, flags, sample_ms = _V1.unpack_from(data, pos)
+            pos += _V1.size
+            row = {
+                "device_id": device_id,
+                "frame_counter": fc,
+                "temp_c": None if t == -0x8000 else t / 10,
+                "hum_rh": None if h == 0xFFFF else h / 10,
+                "pressure_hpa": None if p == 0xFFFF else p / 10,
+                "tvoc_ppb": None if v == 0xFFFF else v,
+                "eco2_ppm": None if e == 0xFFFF else e,
+                "pred_tvoc_60m": None if pv == 0xFFFF else pv,
+                "pred_eco2_60m": None if pe == 0xFFFF else pe,
+                "aq_score": None if s == 0xFF else s,
+                "rssi": None if rssi == -0x80 else rssi,
+                "snr": None if snr == -0x80 else snr / 4,
+                "sample_ms": sample_ms or None,
+                "anom_eco2": bool(flags & 1),
+                "anom_tvoc": bool(flags & 2),
+                "alert": bool(flags & 4),
+                "status": _STATUS.get((flags >> 4) & 7, "NORMAL"),
+            }
+            if ts_s:
+                row["ts"] = EPOCH + timedelta(seconds=ts_s, milliseconds=ts_ms)
+            else:
+                row["ts"], row[SERVER_TS] = NOW, True
+            rows.append(row)
+    return rows
+
+
+def _random_row(rng: random.Random) -> dict:
+    def opt(v):
+        return None if rng.random() < 0.1 else v
+
+    return {
+        "ts": opt(datetime(2026, 4, 1, tzinfo=timezone.utc) + timedelta(microseconds=rng.randrange(10**11))),
+        "frame_counter": rng.randrange(2**32),
+        "temp_c": opt(rng.uniform(-40, 85)), "hum_rh": opt(rng.uniform(0, 100)),
+        "pressure_hpa": opt(rng.uniform(900, 1100)),
+        "tvoc_ppb": opt(rng.randrange(0xFFFF)), "eco2_ppm": opt(rng.randrange(400, 0xFFFF)),
+        "pred_tvoc_60m": opt(rng.randrange(600)), "pred_eco2_60m": opt(rng.randrange(400, 2000)),
+        "aq_score": opt(rng.randrange(101)), "rssi": opt(rng.randrange(-127, 0)),
+        "snr": opt(rng.uniform(-20, 10)), "sample_ms": opt(rng.randrange(1, 60_000)),
+        "anom_eco2": rng.random() < 0.2, "anom_tvoc": rng.random() < 0.2, "alert": rng.random() < 0.2,
+        "status": rng.choice([None, "NORMAL", "OK", "WARN", "HIGH"]),
+    }
+
+
+def test_decode_frames_matches_field_by_field_reference():
+    rng = random.Random(7)
+    sections = []
+    for k in range(5):
+        device_id = "" if k == 2 else f"bin-{k}"        # boş id: cihaz topic'ten
+        sections.append(encode_frames(device_id, [_random_row(rng) for _ in range(rng.randrange(0, 300))]))
+    data = b"".join(sections)
+    _matches(decode_frames(data, topic="aq/bin-topic/bin", now=NOW), _bin_reference(data, "bin-topic"))
+
+
+def test_binary_roundtrip_keeps_values_to_the_field_scale():
+    rng = random.Random(8)
+    rows = [_random_row(rng) for _ in range(500)]
+    got = decode_frames(encode_frames("rt-1", rows), now=NOW)
+    assert len(got) == len(rows)
+    for g, r in zip(got, rows):
+        if r["ts"] is None:
+            assert g["ts"] == NOW and g[SERVER_TS]
+        else:
+            assert g["ts"] == r["ts"].replace(microsecond=r["ts"].microsecond // 1000 * 1000)
+            assert SERVER_TS not in g
+        for col, scale in (("temp_c", 10), ("hum_rh", 10), ("pressure_hpa", 10), ("snr", 4)):
+            assert (g[col] is None) == (r[col] is None)
+            if r[col] is not None:
+                assert g[col] == pytest.approx(r[col], abs=0.5 / scale + 1e-9)
+        for col in ("frame_counter", "tvoc_ppb", "eco2_ppm", "aq_score", "rssi", "sample_ms"):
+            assert g[col] == r[col]
+        assert (g["anom_eco2"], g["anom_tvoc"], g["alert"]) == (r["anom_eco2"], r["anom_tvoc"], r["alert"])
+        assert g["status"] == (r["status"] or "NORMAL")
+
+
+@pytest.mark.parametrize("data, message", [
+    (b"XX\x01\x00\x00\x00", "bad magic"),
+    (b"AQ\x09\x00\x00\x00", "unsupported frame version"),
+    (b"AQ\x01\x00\x01\x00", "without device_id"),
+    (b"AQ\x01\x01n\x02\x00" + b"\x00" * 40, "need 64 bytes"),
+    (b"AQ\x01", "truncated header"),
+])
+def test_malformed_frames_raise(data, message):
+    with pytest.raises(FrameError, match=message):
+        decode_frames(data)
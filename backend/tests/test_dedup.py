@@ -0,0 +1,154 @@
+"""Frame-counter dedup: LRU rules, wrap-around, reboots and the stored-frame backstop"""
+import random
+from datetime import datetime, timedelta
+
+from app import partitions
+from conftest import store_rows
+from app.compact import round_ms
+from app.dedup import FrameDeduper
+
+
+def _deduper(**kw) -> FrameDeduper:
+    return FrameDeduper(**{"window": 64, "ttl_s": 600, "max_gap": 1000, "bits": 32, "max_devices": 100, **kw})
+
+
+def _ingest(d: FrameDeduper, fc: int, now: float, device_id: str = "n") -> bool:
+    """Arrival, then the writer's sequence step for a committed frame"""
+    ok = d.accept(device_id, fc, now=now)
+    if ok:
+        d.advance([{"device_id": device_id, "frame_counter": fc}])
+    return ok
+
+
+def test_duplicates_within_ttl_only():
+    d = _deduper()
+    assert _ingest(d, 10, now=0.0)
+    assert not _ingest(d, 10, now=100.0)
+    # TTL dolunca aynı sayaç yeni bir frame (cihaz yeniden başlamış)
+    assert _ingest(d, 10, now=701.0)
+    st = d.device_stats("n")
+    assert (st["accepted"], st["duplicates"], st["reboots"]) == (2, 1, 1)
+
+
+def test_wrap_around_is_a_small_step():
+    d = _deduper(bits=16)
+    for fc in (65533, 65534, 65535, 0, 1, 3):
+        assert _ingest(d, fc, now=1.0)
+    assert not _ingest(d, 0, now=2.0)
+    st = d.device_stats("n")
+    assert (st["wraps"], st["lost"], st["reboots"], st["resyncs"]) == (1, 1, 0, 0)
+
+
+def test_reboot_restarts_the_sequence():
+    d = _deduper()
+    for fc in range(5000, 5010):
+        _ingest(d, fc, now=1.0)
+    # Sayaç başa döndü: kayıp sayılmaz, eski sayaçlar unutulur
+    for fc in range(0, 5):
+        assert _ingest(d, fc, now=2.0)
+    st = d.device_stats("n")
+    assert (st["reboots"], st["lost"], st["last_frame_counter"]) == (1, 0, 4)
+    assert _ingest(d, 5005, now=3.0)     # reboot öncesi sayaç artık duplicate değil
+
+
+def test_late_frame_fills_a_counted_gap():
+    d = _deduper()
+    for fc in (1, 2, 5):
+        _ingest(d, fc, now=1.0)
+    assert d.device_stats("n")["lost"] == 2
+    assert _ingest(d, 3, now=2.0)
+    st = d.device_stats("n")
+    assert (st["late"], st["lost"]) == (1, 1)
+
+
+def test_forget_lets_a_failed_frame_through_again():
+    d = _deduper()
+    assert _ingest(d, 7, now=0.0)
+    d.forget([("n", 7)])
+    assert d.accept("n", 7, now=1.0)
+
+
+def test_failed_commit_leaves_no_trace_in_sequence_stats():
+    ok, failed = _deduper(), _deduper()
+    for d in (ok, failed):
+        for fc in range(1, 6):
+            _ingest(d, fc, now=1.0)
+
+    # Başarısız yazım: writer durumu geri alır, frame'ler unutulur, yeniden denenir
+    frames = [{"device_id": "n", "frame_counter": fc} for fc in (10, 8, 200, 0)]
+    for r in frames:
+        assert failed.accept("n", r["frame_counter"], now=2.0)
+    snapshot = failed.snapshot({"n"})
+    failed.advance(frames)
+    failed.restore(snapshot)
+    failed.forget([("n", r["frame_counter"]) for r in frames])
+
+    for d in (ok, failed):
+        for r in frames:
+            assert _ingest(d, r["frame_counter"], now=3.0)
+    assert failed.device_stats("n") == ok.device_stats("n")
+    st = ok.device_stats("n")
+    assert (st["late"], st["reboots"], st["accepted"]) == (1, 1, 9)
+
+
+def _frame(device_id, ts, fc, server=False):
+    return (device_id, ts, fc, server)
+
+
+def test_stored_frames_device_and_server_stamped(db, monkeypatch):
+    monkeypatch.setattr("app.config.settings.DEDUP_TTL_S", 60)
+    t0 = datetime(2026, 5, 10, 12, 0, 0, 123456)
+    rows = [dict(device_id="sf-1", ts=t0 + timedelta(seconds=i), frame_counter=100 + i, tvoc_ppb=1) for i in range(10)]
+    store_rows(db, rows)
+
+    frames = [
+        _frame("sf-1", t0 + timedelta(seconds=3), 103),                      # 0: aynı ts + sayaç -> kayıtlı
+        _frame("sf-1", t0 + timedelta(seconds=3, milliseconds=5), 103),      # 1: farklı ts -> yeni
+        _frame("sf-1", t0 + timedelta(seconds=40), 105, server=True),        # 2: sunucu damgalı, TTL içinde
+        _frame("sf-1", t0 + timedelta(seconds=120), 106, server=True),       # 3: TTL dışında -> yeni
+        _frame("sf-1", t0 + timedelta(seconds=50), 999, server=True),        # 4: bilinmeyen sayaç
+        _frame("sf-1", t0 + timedelta(seconds=51), 999, server=True),        # 5: batch içi kopya
+        _frame("sf-2", t0 + timedelta(seconds=3), 103),                      # 6: başka cihaz
+        _frame("sf-1", t0, None),                                            # 7: sayaçsız
+    ]
+    assert partitions.stored_frames(db, frames) == {0, 2, 5}
+
+
+def test_stored_frames_matches_brute_force(db, monkeypatch):
+    monkeypatch.setattr("app.config.settings.DEDUP_TTL_S", 30)
+    rng = random.Random(3)
+    t0 = datetime(2026, 6, 30, 23, 59)       # ay sınırı: iki partition
+    stored = []
+    for i in range(400):
+        stored.append(dict(
+            device_id=f"sb-{rng.randrange(5)}", ts=t0 + timedelta(milliseconds=rng.randrange(0, 120_000)),
+            frame_counter=rng.randrange(50), tvoc_ppb=1,
+        ))
+    store_rows(db, stored)
+    kept = [r for r in stored if r["id"] is not None]
+
+    frames = []
+    for _ in range(300):
+        if rng.random() < 0.5:
+            r = rng.choice(kept)
+            frames.append(_frame(r["device_id"], r["ts"], r["frame_counter"]))
+        else:
+            frames.append(_frame(
+                f"sb-{rng.randrange(6)}", t0 + timedelta(milliseconds=rng.randrange(0, 150_000)),
+                rng.randrange(50), server=rng.random() < 0.5,
+            ))
+
+    ttl = timedelta(seconds=30)
+    known = [(r["device_id"], r["frame_counter"], r["ts"].replace(tzinfo=None)) for r in kept]
+    want = set()
+    for i, (device_id, ts, fc, server) in enumerate(frames):
+        ts = round_ms(ts)
+        if server:
+            hit = any(k[0] == device_id and k[1] == fc and ts - ttl <= k[2] <= ts for k in known)
+        else:
+            hit = (device_id, fc, ts) in known
+        if hit:
+            want.add(i)
+        else:
+            known.append((device_id, fc, ts))
+    assert partitions.stored_frames(db, frames) == want
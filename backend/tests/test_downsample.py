@@ -0,0 +1,114 @@
+"""LTTB / min-max downsampling against textbook loops"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app import archive, crud
+from app.config import settings
+from app.downsample import downsample_indices
+from app.serialize import MEASUREMENT_OUT_FIELDS
+from conftest import store_rows
+
+
+def _lttb(x, y, n_out):
+    """Steinarsson's LTTB, one bucket and one point at a time"""
+    n = len(x)
+    if n_out >= n:
+        return list(range(n))
+    # Bucket sınırları tam sayı aritmetiğiyle: float `every` son sınırı bir eksik bulabilir
+    edge = [i * (n - 2) // (n_out - 2) + 1 for i in range(n_out - 1)] + [n]
+    out, a = [0], 0
+    for i in range(n_out - 2):
+        lo, hi = edge[i], edge[i + 1]
+        nlo, nhi = hi, edge[i + 2]
+        cx = sum(x[nlo:nhi]) / (nhi - nlo)
+        cy = sum(y[nlo:nhi]) / (nhi - nlo)
+        best, best_area = lo, -1.0
+        for j in range(lo, hi):
+            area = abs((x[a] - cx) * (y[j] - y[a]) - (x[a] - x[j]) * (cy - y[a]))
+            if area > best_area:
+                best, best_area = j, area
+        out.append(best)
+        a = best
+    out.append(n - 1)
+    return out
+
+
+def _minmax(y, n_out):
+    """First minimum and last maximum of every equal-width column"""
+    n = len(y)
+    if n <= n_out:
+        return list(range(n))
+    n_cols = max(n_out // 2, 1)
+    picked = set()
+    for c in range(n_cols):
+        rows = [i for i in range(n) if i * n_cols // n == c]
+        lo = min(y[i] for i in rows)
+        hi = max(y[i] for i in rows)
+        picked.add(next(i for i in rows if y[i] == lo))
+        picked.add(max(i for i in rows if y[i] == hi))
+    return sorted(picked)
+
+
+def _series(rng, n):
+    """Integer seconds and values (exact sums): ties, plateaus, spikes and irregular gaps"""
+    x = 1_700_000_000 + np.cumsum(rng.choice([1, 1, 2, 5, 60], n))
+    y = 600 + np.cumsum(rng.integers(-3, 4, n))
+    y[rng.random(n) < 0.2] = 600
+    spikes = rng.random(n) < 0.01
+    y[spikes] += rng.integers(200, 2000, spikes.sum())
+    return x.astype(np.float64), y.astype(np.float64)
+
+
+@pytest.mark.parametrize("n, n_out", [(5000, 300), (1001, 1000), (37, 3), (2000, 1999), (10, 20)])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_lttb_matches_textbook(seed, n, n_out):
+    x, y = _series(np.random.default_rng(seed), n)
+    got = downsample_indices(x, y, n_out, "lttb")
+    assert got.tolist() == _lttb(x.tolist(), y.tolist(), n_out)
+
+
+@pytest.mark.parametrize("n, n_out", [(5000, 300), (1001, 1000), (37, 3), (500, 500), (10, 20)])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_minmax_matches_column_loop(seed, n, n_out):
+    x, y = _series(np.random.default_rng(seed), n)
+    got = downsample_indices(x, y, n_out, "minmax")
+    assert got.tolist() == _minmax(y.tolist(), n_out)
+    assert len(got) <= max(n_out, 2)
+
+
+def test_long_ranges_keep_the_extremes_of_every_time_slice(db, monkeypatch):
+    """Over HISTORY_DOWNSAMPLE_MAX_ROWS: min and max of each slice of the whole range, archived days included"""
+    monkeypatch.setattr(settings, "HISTORY_DOWNSAMPLE_MAX_ROWS", 200)
+    rng = np.random.default_rng(8)
+    t0 = datetime(2025, 1, 31, 12, 0)       # Ocak arşivlenir, Şubat canlı
+    ts = [t0 + timedelta(seconds=int(s)) for s in np.cumsum(rng.integers(1, 90, 3000))]
+    rows = [
+        {"device_id": "ds-1", "ts": t, "frame_counter": i,
+         "tvoc_ppb": None if rng.random() < 0.05 else int(v)}
+        for i, (t, v) in enumerate(zip(ts, 300 + np.cumsum(rng.integers(-5, 6, len(ts)))))
+    ]
+    rows[-3]["tvoc_ppb"] = 5000     # en yeni satırlarda bir tepe
+    store_rows(db, rows)
+    archive.archive_partition(db, 202501)
+
+    start, end = ts[2], ts[-1]
+    got = crud.get_history_downsampled_rows(db, "ds-1", start, end, 1000, "minmax", "tvoc_ppb")
+
+    # Dilim başına (min, max) referansı, crud ile aynı ızgara
+    slices = 200 // 2 - 1
+    scale = slices / (end - start).total_seconds()
+    want: dict[int, set] = {}
+    for r in rows:
+        if start <= r["ts"] <= end and r["tvoc_ppb"] is not None:
+            want.setdefault(int((r["ts"] - start).total_seconds() * scale), []).append(r["tvoc_ppb"])
+    want = {g: {min(v), max(v)} for g, v in want.items()}
+
+    ts_i, v_i = MEASUREMENT_OUT_FIELDS.index("ts"), MEASUREMENT_OUT_FIELDS.index("tvoc_ppb")
+    picked: dict[int, set] = {}
+    for r in got:
+        picked.setdefault(int((r[ts_i] - start).total_seconds() * scale), set()).add(r[v_i])
+    assert picked == want
+    assert [r[ts_i] for r in got] == sorted(r[ts_i] for r in got)
+    assert 5000 in {r[v_i] for r in got} and {r[ts_i].month for r in got} == {1, 2}
@@ -0,0 +1,71 @@
+"""Alert episodes: incremental tracker against a scalar run-length pass"""
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.episodes import EpisodeTracker, STATUS_RANK, episode_open, get_episodes
+from app.models import AlertEpisode
+
+T0 = datetime(2026, 7, 1)
+
+
+def _reference(batches: list[list[dict]]) -> list[dict]:
+    """Consecutive alert samples of one device, split by non-alert samples and long gaps"""
+    gap = timedelta(seconds=settings.ALERT_EPISODE_GAP_S)
+    episodes, ep = [], None
+    # Batch içinde ts sırası; önceki batch'lerden eski örnekler atlanır
+    for r in (r for batch in batches for r in sorted(batch, key=lambda r: r["ts"])):
+        if ep is not None and r["ts"] < ep["end_ts"]:
+            continue
+        if ep is not None and (not r["alert"] or r["ts"] - ep["end_ts"] > gap):
+            ep["open"] = False
+            ep = None
+        if not r["alert"]:
+            continue
+        if ep is None:
+            ep = {"start_ts": r["ts"], "end_ts": r["ts"], "peak_status": r["status"],
+                  "peak_score": r["aq_score"], "samples": 0, "open": True}
+            episodes.append(ep)
+        else:
+            ep["end_ts"] = r["ts"]
+        ep["samples"] += 1
+        if STATUS_RANK[r["status"]] > STATUS_RANK[ep["peak_status"]]:
+            ep["peak_status"] = r["status"]
+        ep["peak_score"] = max(ep["peak_score"], r["aq_score"])
+    return episodes
+
+
+def test_tracker_matches_run_length_pass(db):
+    rng = random.Random(10)
+    clock = T0
+    rows = []
+    for _ in range(3000):
+        clock += timedelta(seconds=rng.choice([1, 5, 30, 120, 400]))
+        ts = clock - timedelta(seconds=rng.randint(1, 60)) if rng.random() < 0.03 else clock
+        alert = rng.random() < 0.6
+        status = rng.choice(["WARN", "HIGH"]) if alert else "OK"
+        rows.append({"device_id": "ep-1", "ts": ts, "alert": alert, "status": status, "aq_score": rng.randint(0, 100)})
+
+    batches = [rows[s:s + 97] for s in range(0, len(rows), 97)]
+    tracker = EpisodeTracker()
+    for batch in batches:
+        tracker.apply(db, batch)
+
+    got = db.execute(select(AlertEpisode).where(AlertEpisode.device_id == "ep-1").order_by(AlertEpisode.start_ts)).scalars()
+    cols = ("start_ts", "end_ts", "peak_status", "peak_score", "samples", "open")
+    assert [{c: getattr(e, c) for c in cols} for e in got] == _reference(batches)
+
+
+def test_silent_device_episode_reads_as_closed(db):
+    tracker = EpisodeTracker()
+    tracker.apply(db, [
+        {"device_id": "ep-2", "ts": T0 + timedelta(seconds=i), "alert": True, "status": "HIGH", "aq_score": 90}
+        for i in range(3)
+    ])
+    (ep,) = get_episodes(db, "ep-2", T0, 10)
+    gap = timedelta(seconds=settings.ALERT_EPISODE_GAP_S)
+    assert ep.open
+    assert episode_open(ep, ep.end_ts + gap)
+    assert not episode_open(ep, ep.end_ts + gap + timedelta(seconds=1))
@@ -0,0 +1,100 @@
+"""Holt forecasts: ticks over 1m rollups against a per-device, per-minute loop"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.forecast import Forecaster, FORECAST_METRICS, PRED_COLUMNS
+from app.models import Rollup1m
+
+M0 = datetime(2026, 2, 1)
+MINUTES = 300
+
+
+def _holt(series: list[tuple[int, float]]) -> dict:
+    """One Holt model, one bucket mean at a time (the module docstring's recursion)"""
+    a, b = settings.FORECAST_ALPHA, settings.FORECAST_BETA
+    level = trend = 0.0
+    last, count = None, 0
+    for t, x in series:
+        if count == 0:
+            level, trend = x, 0.0
+        else:
+            dt = max(t - last, 1)
+            new_level = a * x + (1.0 - a) * (level + trend * dt)
+            trend = b * (new_level - level) / dt + (1.0 - b) * trend
+            level = new_level
+        last, count = t, count + 1
+    return {"level": level, "trend": trend, "last": last, "count": count,
+            "pred": max(level + trend * settings.FORECAST_HORIZON_MIN, 0.0)}
+
+
+def _rollups(db, rng) -> dict[str, list[list[tuple[int, float]]]]:
+    """Random 1m buckets (gaps, empty metrics); returns each device's (minute, mean) series per metric"""
+    series = {}
+    for k in range(6):
+        device_id = f"fc-{k}"
+        per_metric = series[device_id] = [[] for _ in FORECAST_METRICS]
+        level = [rng.uniform(500, 900), rng.uniform(50, 300)]
+        slope = [rng.normal(0, 2), rng.normal(0, 0.5)]
+        for m in range(MINUTES):
+            if rng.random() < 0.3:
+                continue
+            row = {"device_id": device_id, "bucket": M0 + timedelta(minutes=m), "n": 0, "last_ts": M0}
+            for j, metric in enumerate(FORECAST_METRICS):
+                n = 0 if rng.random() < 0.1 else int(rng.integers(1, 13))
+                s = float(sum(level[j] + slope[j] * m + rng.normal(0, 10) for _ in range(n)))
+                row[f"{metric}_n"], row[f"{metric}_sum"] = n, s
+                if n:
+                    per_metric[j].append((m, s / n))
+            db.add(Rollup1m(**row))
+    db.flush()
+    return series
+
+
+def _minute(m: int) -> int:
+    return int((M0 - datetime(1970, 1, 1)).total_seconds() // 60) + m
+
+
+def test_ticks_match_scalar_holt(db):
+    rng = np.random.default_rng(5)
+    series = _rollups(db, rng)
+
+    f = Forecaster()
+    # İlk tur ısınma penceresini okur, sonrakiler düzensiz aralıklarla kapanan dakikaları
+    now = M0 + timedelta(minutes=settings.FORECAST_WARMUP_MIN, seconds=30)
+    total = 0
+    while now < M0 + timedelta(minutes=MINUTES + 1):
+        total += f.tick(db, now)["buckets"]
+        now += timedelta(minutes=int(rng.integers(1, 15)))
+    total += f.tick(db, M0 + timedelta(minutes=MINUTES + 1))["buckets"]
+    assert total == sum(1 for r in db.query(Rollup1m).filter(Rollup1m.device_id.like("fc-%")))
+
+    for device_id, per_metric in series.items():
+        idx = f._index[device_id]
+        for j, s in enumerate(per_metric):
+            want = _holt([(_minute(m), x) for m, x in s])
+            assert f.count[idx, j] == want["count"]
+            assert f.last[idx, j] == want["last"]
+            assert (f.level[idx, j], f.trend[idx, j], f.pred[idx, j]) == pytest.approx(
+                (want["level"], want["trend"], want["pred"]), rel=1e-9, abs=1e-9)
+
+
+def test_fill_respects_own_predictions_and_max_age():
+    f = Forecaster()
+    idx = f._indexes(np.array(["fc-a"], dtype=object))
+    f._advance(idx, np.array([_minute(0)]), np.array([[800.0, 100.0]]))
+    f._advance(idx, np.array([_minute(1)]), np.array([[820.0, np.nan]]))
+    want = _holt([(_minute(0), 800.0), (_minute(1), 820.0)])
+
+    fresh = {"device_id": "fc-a", "ts": M0 + timedelta(minutes=5)}
+    own = {"device_id": "fc-a", "ts": M0 + timedelta(minutes=5), PRED_COLUMNS[0]: 1}
+    stale = {"device_id": "fc-a", "ts": M0 + timedelta(minutes=settings.FORECAST_MAX_AGE_MIN + 2)}
+    other = {"device_id": "fc-b", "ts": M0}
+    f.fill([fresh, own, stale, other])
+
+    assert fresh[PRED_COLUMNS[0]] == int(round(want["pred"]))
+    assert fresh[PRED_COLUMNS[1]] == 100
+    assert own[PRED_COLUMNS[0]] == 1
+    assert PRED_COLUMNS[0] not in stale and PRED_COLUMNS[0] not in other
@@ -0,0 +1,85 @@
+"""Notification coalescing against a per-device transition log"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.config import settings
+from app.episodes import STATUS_RANK
+from app.notify import NotificationDispatcher, Sink
+
+STATUSES = ("OK", "NORMAL", "WARN", "HIGH")
+T0 = datetime(2026, 5, 1)
+
+
+class RecordingSink(Sink):
+    name = "recording"
+
+    def __init__(self):
+        super().__init__()
+        self.batches: list[list[dict]] = []
+
+    def enqueue(self, batch: list[dict]):
+        self.batches.append(batch)
+
+
+def _window_events(log: dict[str, list[tuple]]) -> list[dict]:
+    """Events of one window from each device's transitions (prev, status, ts) in order"""
+    events = []
+    for device_id, steps in log.items():
+        first, last = steps[0], steps[-1]
+        peak = first[0]
+        for _, status, _ in steps:
+            if STATUS_RANK[status] > STATUS_RANK[peak]:
+                peak = status
+        if STATUS_RANK[last[1]] == STATUS_RANK[first[0]] and STATUS_RANK[peak] <= STATUS_RANK[first[0]]:
+            continue    # başladığı yere döndü
+        events.append({
+            "device_id": device_id, "from": first[0], "to": last[1], "peak": peak,
+            "transitions": len(steps), "first_ts": first[2].isoformat(), "ts": last[2].isoformat(),
+        })
+    return sorted(events, key=lambda e: e["device_id"])
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_windows_match_transition_log(monkeypatch, seed):
+    monkeypatch.setattr(settings, "NOTIFY_BATCH_MAX", 7)
+    rng = random.Random(seed)
+    sink = RecordingSink()
+    notifier = NotificationDispatcher()
+    notifier._sinks = [sink]
+
+    last: dict[str, str] = {}
+    want_batches = []
+    clock = T0
+    for _ in range(20):
+        log: dict[str, list[tuple]] = {}
+        for _ in range(rng.randrange(0, 200)):
+            rows = []
+            for _ in range(rng.randrange(1, 30)):
+                clock += timedelta(milliseconds=rng.randrange(1, 5000))
+                device_id = f"nt-{rng.randrange(40)}"
+                status = rng.choices(STATUSES, weights=(5, 2, 2, 1))[0]
+                inserted = rng.random() < 0.9
+                rows.append({"id": 1 if inserted else None, "device_id": device_id, "ts": clock, "status": status})
+                if not inserted:
+                    continue    # duplicate / yazılmamış satır
+                prev = last.get(device_id)
+                last[device_id] = status
+                if prev is not None and STATUS_RANK[prev] != STATUS_RANK[status]:
+                    log.setdefault(device_id, []).append((prev, status, clock))
+            notifier.observe(rows)
+            if rng.random() < 0.05:
+                # Başarısız yazım: son kayıtlı satırı olmayan cihazın önceki durumu unutulur
+                failed = {r["device_id"] for r in rows}
+                notifier.resync(failed)
+                for device_id in failed:
+                    last.pop(device_id, None)
+        notifier._dispatch()
+        events = _window_events(log)
+        want_batches += [events[i:i + 7] for i in range(0, len(events), 7)]
+
+    got = [[{k: e[k] for k in ("device_id", "from", "to", "peak", "transitions", "first_ts", "ts")} for e in b]
+           for b in sink.batches]
+    assert got == want_batches
+    assert notifier.coalesced > 0 and notifier.suppressed > 0
@@ -0,0 +1,76 @@
+"""Partition inserts: returned ids against a row-at-a-time INSERT OR IGNORE reference"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app import crud, partitions
+from app.compact import round_ms
+from conftest import store_rows
+
+T0 = datetime(2026, 8, 31, 23, 59, 30)     # ay sınırı: Ağustos / Eylül partition'ları
+
+
+def _rows(rng: random.Random, n: int, prefix: str) -> list[dict]:
+    return [
+        dict(
+            device_id=f"{prefix}-{rng.randrange(4)}",
+            ts=T0 + timedelta(microseconds=rng.randrange(0, 60_000_000)),
+            frame_counter=None if rng.random() < 0.1 else rng.randrange(1000),
+            tvoc_ppb=rng.randrange(600),
+        )
+        for _ in range(n)
+    ]
+
+
+def _stored(db, ids: list[int]) -> dict[int, tuple]:
+    M = partitions.entity(db)
+    stmt = select(M.id, M.device_id, M.ts, M.frame_counter, M.tvoc_ppb).where(M.id.in_(ids))
+    return {r[0]: tuple(r[1:]) for r in db.execute(stmt)}
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_ids_match_row_at_a_time_reference(db, seed):
+    rng = random.Random(seed)
+    prefix = f"pt{seed}"
+    first = _rows(rng, 300, prefix)
+    store_rows(db, first)
+    # Hızlı yol: kopya yok, id'ler seq+1 .. seq+n
+    assert all(r["id"] is not None for r in first)
+
+    # İkinci batch: kayıtlı frame'ler, batch içi kopyalar ve yeni satırlar karışık
+    batch = []
+    for r in _rows(rng, 300, prefix):
+        if rng.random() < 0.3:
+            copy = rng.choice(first)
+            r = dict(r, device_id=copy["device_id"], ts=copy["ts"], frame_counter=copy["frame_counter"])
+        batch.append(r)
+        if rng.random() < 0.1:
+            batch.append(dict(r))
+
+    known = {(r["device_id"], r["ts"], r["frame_counter"]) for r in first if r["frame_counter"] is not None}
+    want = []
+    for r in batch:
+        key = (r["device_id"], round_ms(r["ts"]), r["frame_counter"])
+        if r["frame_counter"] is not None and key in known:
+            want.append(False)
+            continue
+        known.add(key)
+        want.append(True)
+
+    store_rows(db, batch)
+    assert [r["id"] is not None for r in batch] == want
+    assert False in want and len({partitions.month_key(r["ts"]) for r in batch}) == 2
+
+    inserted = [r for r in batch if r["id"] is not None]
+    stored = _stored(db, [r["id"] for r in first + inserted])
+    for r in first + inserted:
+        assert stored[r["id"]] == (r["device_id"], r["ts"], r["frame_counter"], r["tvoc_ppb"])
+
+
+def test_unknown_device_history_is_empty_across_partitions(db):
+    store_rows(db, _rows(random.Random(5), 20, "pk"))
+    start, end = T0, T0 + timedelta(minutes=1)
+    assert len(partitions.partition_registry.tables(db, start, end)) == 2
+    assert crud.get_history_rows(db, "never-seen", start, end, 100) == []
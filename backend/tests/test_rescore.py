@@ -0,0 +1,142 @@
+"""Vectorized re-scoring (rescore.Scorer) against the per-sample alert rules"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+from app import partitions, rescore
+from app.alert_state import QUIET_STATUSES, DeviceAlertState, alert_states
+from app.alerts import DELTA_COLUMNS, compute_score, decide_status, delta_triggered, evaluate_test_ranges
+from app.config import settings
+from app.episodes import episode_tracker
+from app.ingest_writer import ingest_writer
+from app.models import AlertEpisode
+from app.rescore import Chunk, Scorer
+from app.rollups import ROLLUP_TABLES, apply_rollups
+from conftest import store_rows
+
+_US = 1_000_000
+
+
+def _pct(cur: Optional[float], base: Optional[float]) -> Optional[float]:
+    if cur is None or base is None or base <= 0:
+        return None
+    return (cur - base) / base * 100.0
+
+
+def _scalar(ts: list[int], rows: list[tuple]) -> list[tuple[str, float, bool]]:
+    """One sample at a time, like AlertStateStore.evaluate for in-order samples"""
+    window = settings.BASELINE_SECONDS * _US
+    out = []
+    prev, test_status = None, "NORMAL"
+    for i, values in enumerate(rows):
+        eco2, tvoc = values[0], values[1]
+        earlier = [j for j in range(i) if ts[j] >= ts[i] - window]
+        bases = []
+        for col in (1, 0):
+            xs = [rows[j][col] for j in earlier if rows[j][col] is not None]
+            bases.append(sum(xs) / len(xs) if xs else None)
+        tvoc_pct, eco2_pct = _pct(tvoc, bases[0]), _pct(eco2, bases[1])
+        status = decide_status(tvoc_pct, eco2_pct)
+        score = compute_score(tvoc_pct, eco2_pct)
+
+        delta = prev is not None and delta_triggered(values, prev)
+        if delta or (eco2 is not None and tvoc is not None):
+            test_status = evaluate_test_ranges(eco2, tvoc, test_status, delta).status
+        if settings.ALERT_TEST_MODE:
+            status = test_status
+        prev = values
+        out.append((status, round(score), status not in QUIET_STATUSES))
+    return out
+
+
+def _series(seed: int, n: int = 1500):
+    """Integer / binary-exact values (exact sums and deltas), NULLs, repeated ts, spikes and jumps"""
+    rng = np.random.default_rng(seed)
+    ts = 1_700_000_000 * _US + np.cumsum(rng.choice([0, 1, 2, 5, 20, 45], n)) * _US
+    rows = []
+    eco2, tvoc, temp, hum, press = 450, 60, 21.0, 45.0, 1010.0
+    for _ in range(n):
+        eco2 = int(np.clip(eco2 + rng.integers(-25, 26), 300, 700))
+        tvoc = int(np.clip(tvoc + rng.integers(-12, 13), 0, 160))
+        temp += rng.choice([-0.25, 0, 0.25, 0.5])
+        hum += rng.choice([-2.0, -1.0, 0.0, 1.0])
+        press += rng.choice([-0.5, 0.0, 0.5, 1.0])
+        spike = rng.random() < 0.03
+        row = [eco2 * (3 if spike else 1), tvoc + (200 if spike else 0), temp, hum, press]
+        rows.append(tuple(None if rng.random() < 0.05 else v for v in row))
+    return [int(t) for t in ts], rows
+
+
+def _chunks(ts: list[int], rows: list[tuple], splits: list[int]):
+    for idx in np.array_split(np.arange(len(ts)), splits):
+        values = {c: np.array([rows[i][k] for i in idx], dtype=np.float64) for k, c in enumerate(DELTA_COLUMNS)}
+        n = len(idx)
+        yield Chunk(
+            np.array([ts[i] for i in idx], dtype=np.int64), values,
+            np.full(n, None, dtype=object), np.full(n, np.nan), np.zeros(n, dtype=bool),
+            {}, np.ones(n, dtype=bool),
+        )
+
+
+@pytest.mark.parametrize("test_mode", [False, True])
+@pytest.mark.parametrize("seed", [1, 2])
+def test_scorer_matches_per_sample_rules(monkeypatch, seed, test_mode):
+    monkeypatch.setattr(settings, "ALERT_TEST_MODE", test_mode)
+    ts, rows = _series(seed)
+    want = _scalar(ts, rows)
+
+    scorer = Scorer()
+    got = []
+    for chunk in _chunks(ts, rows, [1, 200, 201, 777]):
+        status, aq, alert = scorer.score(chunk)
+        got += list(zip(status.tolist(), aq.tolist(), alert.tolist()))
+    assert got == want
+    assert {s for s, _, _ in want} == ({"NORMAL", "HIGH"} if test_mode else {"OK", "WARN", "HIGH"})
+
+
+def test_rescore_pauses_the_writer_and_leaves_live_state_alone(db, monkeypatch):
+    """Other devices' state, the open episode and still-open rollup buckets are not rewritten"""
+    now = datetime.utcnow().replace(microsecond=0)
+    rows = [
+        {"device_id": "rs-1", "ts": now - timedelta(seconds=190 - 3 * i), "frame_counter": i,
+         "tvoc_ppb": 60, "eco2_ppm": 450, "server_scored": True,
+         "status": "HIGH" if i >= 55 else "OK", "aq_score": 99, "alert": i >= 55}
+        for i in range(60)
+    ]
+    inserted = store_rows(db, rows)
+    apply_rollups(db, inserted)
+    episode_tracker.apply(db, inserted)
+    db.commit()
+    open_ep = dict(episode_tracker._open["rs-1"])
+
+    alert_states.load(db)
+    other = alert_states._states.setdefault("rs-2", DeviceAlertState())
+    other.ts, other.test_status, other.dirty = now, "HIGH", True     # kaydedilmemiş hysteresis
+
+    paused = []
+    real = rescore.rescore_device
+    monkeypatch.setattr(rescore, "rescore_device", lambda *a: paused.append(ingest_writer._write_lock.locked()) or real(*a))
+    result, = rescore.rescore(db, "rs-1")
+    assert paused == [True] and result["updated"] == 60
+
+    assert alert_states._states["rs-2"] is other and other.test_status == "HIGH"
+    assert alert_states.get("rs-1")["status"] == "OK"
+    E = AlertEpisode
+    stored = db.execute(select(E).where(E.device_id == "rs-1")).scalars().all()
+    assert [(e.id, e.open, e.samples) for e in stored] == [(open_ep["id"], True, 5)]
+    assert episode_tracker._open["rs-1"]["id"] == open_ep["id"]
+
+    aq = {r["id"]: r for r in inserted}
+    M = partitions.entity(db)
+    new_aq = dict(db.execute(select(M.id, M.aq_score).where(M.id.in_(aq))).all())
+    for res, (model, width) in ROLLUP_TABLES.items():
+        for b in db.execute(select(model).where(model.device_id == "rs-1")).scalars():
+            start = b.bucket.replace(tzinfo=None)
+            members = [i for i, r in aq.items() if start <= r["ts"] < start + width]
+            if start + width <= now:
+                assert b.aq_score_sum == sum(new_aq[i] for i in members), (res, start)
+            else:
+                assert b.aq_score_sum == 99 * len(members), (res, start)
@@ -0,0 +1,129 @@
+"""Incremental rollups (accumulator + UPSERT) and rebuild_rollups against a GROUP BY over raw rows"""
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app import crud
+from app.config import settings
+from app.crud import HISTORY_AGGS
+from app.rollups import ROLLUP_METRICS, ROLLUP_TABLES, apply_rollups, bucket_start, rebuild_rollups, rollup_coverage
+from conftest import store_rows
+
+T0 = datetime(2026, 8, 9, 23, 10)      # saat ve gün sınırları
+
+
+def _group_by(rows: list[dict], res: str) -> dict[tuple, dict]:
+    """One pass per bucket over the raw rows; `last` = values of the newest row (latest arrival on ties)"""
+    groups: dict[tuple, list[dict]] = {}
+    for r in rows:
+        groups.setdefault((r["device_id"], bucket_start(r["ts"], res)), []).append(r)
+    out = {}
+    for key, members in groups.items():
+        newest = max(range(len(members)), key=lambda i: (members[i]["ts"], i))
+        agg = {"n": len(members), "last_ts": members[newest]["ts"]}
+        for m in ROLLUP_METRICS:
+            vs = [r[m] for r in members if r[m] is not None]
+            agg[f"{m}_n"] = len(vs)
+            agg[f"{m}_min"] = min(vs) if vs else None
+            agg[f"{m}_max"] = max(vs) if vs else None
+            agg[f"{m}_sum"] = float(sum(vs))
+            agg[f"{m}_last"] = members[newest][m]
+        out[key] = agg
+    return out
+
+
+def _stored(db, res: str, prefix: str) -> dict[tuple, dict]:
+    model = ROLLUP_TABLES[res][0]
+    out = {}
+    for r in db.execute(select(model).where(model.device_id.like(f"{prefix}%"))).scalars():
+        agg = {"n": r.n, "last_ts": r.last_ts.replace(tzinfo=None)}
+        for m in ROLLUP_METRICS:
+            for suffix in ("n", "min", "max", "sum", "last"):
+                agg[f"{m}_{suffix}"] = getattr(r, f"{m}_{suffix}")
+        out[(r.device_id, r.bucket.replace(tzinfo=None))] = agg
+    return out
+
+
+def _rows(rng: random.Random, prefix: str) -> list[dict]:
+    """Arrival order: mostly forward in time, some late rows, NULLs; values exact in binary"""
+    clock = {f"{prefix}-{k}": T0 for k in range(3)}
+    rows = []
+    for _ in range(1500):
+        device_id = rng.choice(sorted(clock))
+        clock[device_id] += timedelta(seconds=rng.choice([1, 7, 30, 90]), milliseconds=rng.randrange(1000))
+        ts = clock[device_id]
+        if rng.random() < 0.05:
+            ts -= timedelta(minutes=rng.randint(1, 90))     # geç satır (önceki bucket'lara)
+        row = {"device_id": device_id, "ts": ts}
+        for m in ROLLUP_METRICS:
+            row[m] = None if rng.random() < 0.1 else rng.randrange(0, 4000) / 4
+        rows.append(row)
+    return rows
+
+
+def _assert_equal(got: dict, want: dict):
+    # Değerler 1/4'ün katları: toplamlar sıradan bağımsız olarak tam
+    assert got.keys() == want.keys()
+    for key, agg in want.items():
+        assert got[key] == agg, key
+
+
+def test_incremental_rollups_match_group_by(db):
+    rng = random.Random(6)
+    rows = _rows(rng, "ru")
+
+    # Writer gibi: her batch tek accumulator + UPSERT, batch'ler bucket sınırlarını aşıyor
+    pos = 0
+    while pos < len(rows):
+        size = rng.choice([1, 13, 64, 250])
+        apply_rollups(db, rows[pos:pos + size])
+        pos += size
+    for res in ROLLUP_TABLES:
+        _assert_equal(_stored(db, res, "ru"), _group_by(rows, res))
+
+
+def test_rebuild_matches_group_by(db):
+    rng = random.Random(7)
+    rows = _rows(rng, "rb")
+    inserted = store_rows(db, rows)
+    for device_id in sorted({r["device_id"] for r in rows}):
+        rebuild_rollups(db, device_id, chunk_rows=111)
+    for res in ROLLUP_TABLES:
+        _assert_equal(_stored(db, res, "rb"), _group_by(inserted, res))
+
+
+def test_buckets_fall_back_to_raw_rows_before_rollup_coverage(db, monkeypatch):
+    rng = random.Random(8)
+    ts, rows = T0 - timedelta(days=2), []
+    for _ in range(900):
+        ts += timedelta(seconds=rng.randrange(60, 600))
+        row = {"device_id": "rc-1", "ts": ts}
+        for m in ROLLUP_METRICS:
+            row[m] = None if rng.random() < 0.1 else rng.randrange(0, 4000) / 4
+        rows.append(row)
+    store_rows(db, rows)
+    # Rollup'lar gün ortasında açılmış gibi: yalnızca sonraki satırlar rollup'a girer
+    enabled = T0 - timedelta(hours=13)
+    apply_rollups(db, [r for r in rows if r["ts"] >= enabled])
+    db.commit()
+    rollup_coverage.invalidate()
+    assert rollup_coverage.since(db, "rc-1") == bucket_start(enabled, "1d") + timedelta(days=1)
+
+    def buckets(bucket, agg, start=None, end=None, limit=10_000):
+        return crud.get_history_buckets(db, "rc-1", start, end, bucket, agg, limit)
+
+    # Sınırlar bucket başında: rollup'lar bucket'ı bütün olarak okur
+    hour = bucket_start(enabled, "1h")
+    cases = [("1h", agg, None, None, 10_000) for agg in HISTORY_AGGS]
+    cases += [("1d", "avg", None, None, 10_000), ("5m", "max", hour - timedelta(days=1), hour, 10_000),
+              ("1h", "min", hour - timedelta(hours=5), None, 30), ("1m", "last", None, hour - timedelta(microseconds=1), 10_000)]
+    monkeypatch.setattr(settings, "ROLLUPS_ENABLED", False)
+    want = [buckets(*c) for c in cases]
+    monkeypatch.setattr(settings, "ROLLUPS_ENABLED", True)
+    assert [buckets(*c) for c in cases] == want
+
+    # rebuild sonrası tüm geçmiş rollup'lardan
+    rebuild_rollups(db, "rc-1")
+    assert rollup_coverage.since(db, "rc-1") == datetime.min
+    assert [buckets(*c) for c in cases] == want
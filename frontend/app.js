@@ -702,7 +702,8 @@ async function loadChartForLocation(deviceId) {
     debugLog("📊 Loading chart for:", deviceId);
     
     const device = encodeURIComponent(deviceId);
-    const history = await apiGet(`/history?device_id=${device}&limit=120`);
+    // LTTB: aralığın görsel özeti (ani TVOC sıçramaları korunur)
+    const history = await apiGet(`/history?device_id=${device}&points=120`);
     
     debugLog("📊 Chart data received:", history.items?.length || 0, "items");
     
@@ -775,6 +776,7 @@ $("ilceSelect").addEventListener("change", (e) => {
 $("filterBtn").addEventListener("click", () => {
   debugLog("Filter button clicked");
   loadMapData();
+  openLiveStream();
 });
 
 $("refreshBtn").addEventListener("click", () => {
@@ -833,6 +835,39 @@ async function autoRefresh() {
   }
 }
 
+// ✅ LIVE STREAM (SSE) - açıkken polling durur, yeni ölçüm gelince tek refresh
+let liveStream = null;
+let liveRefreshTimer = null;
+
+function openLiveStream() {
+  if (liveStream) liveStream.close();
+  if (typeof EventSource === "undefined") return;
+
+  const params = new URLSearchParams();
+  if (currentFilter.city) params.set("city", currentFilter.city);
+  if (currentFilter.district) params.set("district", currentFilter.district);
+  liveStream = new EventSource(`${CONFIG.API_BASE}/stream?${params}`);
+
+  const scheduleRefresh = () => {
+    // Aynı anda gelen olayları tek refresh'e topla
+    clearTimeout(liveRefreshTimer);
+    liveRefreshTimer = setTimeout(autoRefresh, 1000);
+  };
+  liveStream.addEventListener("measurement", scheduleRefresh);
+  liveStream.addEventListener("status", (e) => {
+    debugLog("Status change:", e.data);
+    scheduleRefresh();
+  });
+  liveStream.onopen = () => debugLog("Live stream open");
+  liveStream.onerror = () => debugLog("Live stream error, polling until reconnect");
+}
+
+function pollIfStreamDown() {
+  if (!liveStream || liveStream.readyState !== EventSource.OPEN) {
+    autoRefresh();
+  }
+}
+
 // INITIALIZATION
 async function init() {
   console.log("🚀 COMPLETE WORKING DASHBOARD INITIALIZING...");
@@ -847,8 +882,9 @@ async function init() {
   await loadCities();
   await loadMapData();
   
-  // ✅ Auto refresh başlat
-  setInterval(autoRefresh, CONFIG.POLL_MS);
+  // ✅ Canlı akış + stream kapalıyken auto refresh
+  openLiveStream();
+  setInterval(pollIfStreamDown, CONFIG.POLL_MS);
   
   console.log("✅ DASHBOARD INITIALIZED");
   console.log("---");